@@ -0,0 +1,176 @@
+"""eichi_utils.block_offload の単体テスト"""
+
+import os
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "block_offload", os.path.join(ROOT, "webui", "eichi_utils", "block_offload.py")
+)
+block_offload = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(block_offload)
+
+
+class FakeBlock:
+    """1 ブロック分の重み (bound が現在参照しているテンソル)"""
+
+    def __init__(self, index, layout="L"):
+        self.host = {"weight": f"host{index}"}
+        self.bound = self.host
+        self.placement = "host"
+        self.spec = block_offload.BlockSpec(self, self.host, layout)
+
+
+class FakeOps:
+    """転送を記録するだけのデバイス"""
+
+    def __init__(self):
+        self.log = []
+        self.allocations = 0
+
+    def allocate(self, layout):
+        self.allocations += 1
+        return {"weight": f"buf{self.allocations}"}
+
+    def copy_in(self, slot, host):
+        self.log.append(("copy", slot.owner))
+        slot.buffers["weight"] = "dev:" + host["weight"]
+
+    def wait_ready(self, slot):
+        self.log.append(("wait", slot.owner))
+
+    def mark_free(self, slot):
+        self.log.append(("free", slot.owner))
+
+    def bind(self, block, tensors):
+        block.bound = tensors
+        if tensors is block.host:
+            block.placement = "host"
+
+    def placement(self, spec):
+        return spec.refs.placement
+
+
+def make_engine(n, depth=1, layouts=None):
+    blocks = [FakeBlock(i, layouts[i] if layouts else "L") for i in range(n)]
+    ops = FakeOps()
+    engine = block_offload.BlockOffloadEngine([b.spec for b in blocks], ops, depth=depth)
+    return engine, blocks, ops
+
+
+def run_step(engine, blocks, seen=None):
+    for i, block in enumerate(blocks):
+        engine.before_block(i)
+        if seen is not None:
+            seen.append(block.bound["weight"])
+        engine.after_block(i)
+
+
+class TestOrder:
+    def test_double_then_single_blocks(self):
+        class Model:
+            transformer_blocks = ["d0", "d1"]
+            single_transformer_blocks = ["s0"]
+
+        assert block_offload.hunyuan_block_order(Model()) == ["d0", "d1", "s0"]
+        assert block_offload.hunyuan_block_order(object()) == []
+
+    def test_next_blocks_wrap_around(self):
+        assert block_offload.next_blocks(0, 4, 1) == [1]
+        assert block_offload.next_blocks(3, 4, 2) == [0, 1]
+        assert block_offload.next_blocks(0, 1, 2) == []
+
+
+class TestBufferPool:
+    def test_reuse_and_limit(self):
+        made = []
+        pool = block_offload.BufferPool(lambda layout: made.append(layout) or {}, slots_per_layout=2)
+        a = pool.acquire("L")
+        b = pool.acquire("L")
+        assert pool.acquire("L") is None
+        assert pool.acquire("M") is not None
+        pool.release(a)
+        assert pool.acquire("L") is a
+        assert b is not a and made == ["L", "L", "M"] and pool.allocated == 3
+
+
+class TestEngine:
+    def test_prefetches_next_block_and_binds_device_copy(self):
+        engine, blocks, ops = make_engine(4)
+        seen = []
+        engine.prefetch(0)
+        run_step(engine, blocks, seen)
+        assert seen == ["dev:host0", "dev:host1", "dev:host2", "dev:host3"]
+        # ブロック i の実行前にブロック i+1 の転送が始まる
+        copies = [owner for kind, owner in ops.log if kind == "copy"]
+        assert copies == [0, 1, 2, 3, 0]
+        assert engine.stats()["prefetched"] == 4 and engine.stats()["loaded"] == 0
+        # 実行後はホスト側の重みに戻る
+        assert all(b.bound is b.host for b in blocks)
+
+    def test_buffers_are_reused_across_steps(self):
+        engine, blocks, ops = make_engine(6, depth=2)
+        for _ in range(3):
+            run_step(engine, blocks)
+        assert ops.allocations == 3
+        assert engine.stats()["loaded"] == 1  # 最初のブロックだけ
+
+    def test_miss_loads_synchronously(self):
+        engine, blocks, ops = make_engine(3)
+        engine.before_block(0)
+        assert ops.log[:2] == [("copy", 0), ("wait", 0)]
+        assert blocks[0].bound["weight"] == "dev:host0"
+        assert engine.stats()["loaded"] == 1
+
+    def test_resident_blocks_are_not_copied(self):
+        engine, blocks, ops = make_engine(3)
+        blocks[1].placement = "device"
+        engine.prefetch(0)
+        run_step(engine, blocks)
+        copies = [owner for kind, owner in ops.log if kind == "copy"]
+        assert 1 not in copies
+        assert engine.stats()["resident"] == 1
+
+    def test_offloaded_copy_is_rebound_to_host(self):
+        engine, blocks, ops = make_engine(2)
+        blocks[0].bound = {"weight": "pageable"}
+        blocks[0].placement = "other"
+        engine.before_block(0)
+        assert blocks[0].bound["weight"] == "dev:host0"
+        engine.after_block(0)
+        assert blocks[0].bound is blocks[0].host
+
+    def test_mixed_layouts_use_separate_buffers(self):
+        engine, blocks, ops = make_engine(4, layouts=["D", "D", "S", "S"])
+        run_step(engine, blocks)
+        run_step(engine, blocks)
+        assert ops.allocations == 4
+
+    def test_free_is_marked_before_reuse(self):
+        engine, blocks, ops = make_engine(3)
+        run_step(engine, blocks)
+        free0 = ops.log.index(("free", 0))
+        # ブロック 0 のバッファは解放後にブロック 2 の転送に使われる
+        assert ops.log.index(("copy", 2)) > free0
+
+    def test_reset_rebinds_host(self):
+        engine, blocks, ops = make_engine(3)
+        engine.before_block(0)
+        engine.reset()
+        assert all(b.bound is b.host for b in blocks)
+        assert engine.pool.allocated == 0
+
+
+class TestEnv:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("EICHI_BLOCK_OFFLOAD", raising=False)
+        assert not block_offload.block_offload_enabled()
+        monkeypatch.setenv("EICHI_BLOCK_OFFLOAD", "1")
+        assert block_offload.block_offload_enabled()
+
+    @pytest.mark.parametrize("value,expected", [("3", 3), ("0", 1), ("x", 1)])
+    def test_depth(self, monkeypatch, value, expected):
+        monkeypatch.setenv("EICHI_BLOCK_OFFLOAD_DEPTH", value)
+        assert block_offload.block_offload_depth() == expected
@@ -0,0 +1,92 @@
+"""eichi_utils.conditioning_memo の単体テスト"""
+
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "conditioning_memo", os.path.join(ROOT, "webui", "eichi_utils", "conditioning_memo.py")
+)
+conditioning_memo = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(conditioning_memo)
+ConditioningMemo = conditioning_memo.ConditioningMemo
+
+
+class FakeArray:
+    dtype = "uint8"
+
+    def __init__(self, data, shape):
+        self.data = bytes(data)
+        self.shape = shape
+
+    def tobytes(self):
+        return self.data
+
+
+class TestConditioningMemo:
+    def test_compute_once_per_key(self):
+        memo = ConditioningMemo()
+        calls = []
+        for _ in range(3):
+            value = memo.get_or_compute(("text", "a cat"), lambda: calls.append(1) or "cond")
+        assert value == "cond"
+        assert len(calls) == 1
+        assert (memo.hits, memo.misses) == (2, 1)
+
+    def test_clear_releases_values(self):
+        memo = ConditioningMemo()
+        memo.put("k", object())
+        memo.clear()
+        assert len(memo) == 0 and "k" not in memo
+        assert memo.get("k") is None
+
+    def test_start_batch_keeps_only_recent_values(self):
+        memo = ConditioningMemo()
+        # イメージキュー: バッチごとに画像が変わり、プロンプトは共通
+        for image in ["a", "b", "c"]:
+            memo.start_batch()
+            memo.get_or_compute(("text", "p"), lambda: "cond")
+            memo.get_or_compute(("pixels", image), lambda: image)
+        assert ("pixels", "a") not in memo
+        assert ("pixels", "b") in memo and ("pixels", "c") in memo
+        memo.start_batch()
+        assert len(memo) == 2 and ("text", "p") in memo
+
+    def test_none_key_is_not_stored(self):
+        memo = ConditioningMemo()
+        calls = []
+        for _ in range(2):
+            conditioning_memo.memoized(memo, None, lambda: calls.append(1))
+        assert len(calls) == 2 and len(memo) == 0
+        assert conditioning_memo.memo_key("pixels", None) is None
+        assert conditioning_memo.memo_key("pixels", ("none", 640)) == ("pixels", ("none", 640))
+
+    def test_memoized_without_memo(self):
+        calls = []
+        conditioning_memo.memoized(None, "k", lambda: calls.append(1))
+        conditioning_memo.memoized(None, "k", lambda: calls.append(1))
+        assert len(calls) == 2
+
+
+class TestImageSourceKey:
+    def test_path_key_tracks_modification(self, tmp_path):
+        path = tmp_path / "a.png"
+        path.write_bytes(b"1")
+        key = conditioning_memo.image_source_key(str(path), 640)
+        assert key == conditioning_memo.image_source_key(str(path), 640)
+        assert key != conditioning_memo.image_source_key(str(path), 512)
+        path.write_bytes(b"22")
+        assert key != conditioning_memo.image_source_key(str(path), 640)
+
+    def test_array_key_uses_content(self):
+        a = conditioning_memo.image_source_key(FakeArray([1, 2, 3], (1, 1, 3)), 640)
+        assert a == conditioning_memo.image_source_key(FakeArray([1, 2, 3], (1, 1, 3)), 640)
+        assert a != conditioning_memo.image_source_key(FakeArray([1, 2, 4], (1, 1, 3)), 640)
+
+    def test_none(self):
+        assert conditioning_memo.image_source_key(None, 640) == ("none", 640)
+
+    def test_unhashable_object_has_no_key(self):
+        assert conditioning_memo.image_source_key(object(), 640) is None
@@ -0,0 +1,135 @@
+"""eichi_utils.config_queue_manager の準備/GPU 2段キュー実行の単体テスト"""
+
+import os
+import sys
+import json
+import time
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "config_queue_manager", os.path.join(ROOT, "webui", "eichi_utils", "config_queue_manager.py")
+)
+config_queue_manager = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(config_queue_manager)
+ConfigQueueManager = config_queue_manager.ConfigQueueManager
+
+
+def make_manager(tmp_path, names):
+    manager = ConfigQueueManager(str(tmp_path))
+    for i, name in enumerate(names):
+        path = os.path.join(manager.queue_dir, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"config_name": name}, f)
+        # キューは mtime の古い順に処理される
+        os.utime(path, (1000 + i, 1000 + i))
+    return manager
+
+
+def run(manager, process, prepare):
+    ok, _ = manager.start_queue_processing(process, prepare_function=prepare)
+    assert ok
+    manager.queue_thread.join(timeout=10)
+    assert not manager.queue_thread.is_alive()
+    assert not manager.is_processing
+
+
+def listed(directory):
+    return sorted(f[:-5] for f in os.listdir(directory) if f.endswith(".json"))
+
+
+class TestPipelinedQueue:
+    def test_next_item_is_prepared_during_generation(self, tmp_path):
+        manager = make_manager(tmp_path, ["a", "b", "c"])
+        prepared = set()
+        processed = []
+
+        def prepare(config_data):
+            name = config_data["config_name"]
+            prepared.add(name)
+            return {"name": name}
+
+        def process(bundle):
+            # 生成中に次の項目の準備が終わる
+            name = bundle["name"]
+            nxt = {"a": "b", "b": "c"}.get(name)
+            if nxt is not None:
+                deadline = time.time() + 5
+                while nxt not in prepared and time.time() < deadline:
+                    time.sleep(0.01)
+                assert nxt in prepared
+            processed.append(name)
+            return True
+
+        run(manager, process, prepare)
+        assert processed == ["a", "b", "c"]
+        assert listed(manager.completed_dir) == ["a", "b", "c"]
+        assert listed(manager.queue_dir) == []
+
+    def test_prepare_error_moves_item_to_error(self, tmp_path):
+        manager = make_manager(tmp_path, ["a", "b", "c"])
+        processed = []
+
+        def prepare(config_data):
+            if config_data["config_name"] == "b":
+                raise ValueError("broken image")
+            return config_data["config_name"]
+
+        run(manager, lambda name: processed.append(name) or True, prepare)
+        assert processed == ["a", "c"]
+        assert listed(manager.error_dir) == ["b"]
+        with open(os.path.join(manager.error_dir, "b.json"), encoding="utf-8") as f:
+            assert "broken image" in json.load(f)["error"]["message"]
+
+    def test_process_failure_and_none_bundle(self, tmp_path):
+        manager = make_manager(tmp_path, ["a", "b"])
+        run(manager, lambda bundle: False, lambda config_data: None if config_data["config_name"] == "a" else 1)
+        assert listed(manager.error_dir) == ["a", "b"]
+
+    def test_stop_keeps_prepared_item_in_queue(self, tmp_path):
+        manager = make_manager(tmp_path, ["a", "b"])
+        prepared = []
+
+        def prepare(config_data):
+            prepared.append(config_data["config_name"])
+            return config_data["config_name"]
+
+        def process(name):
+            manager.stop_processing = True
+            return True
+
+        run(manager, process, prepare)
+        assert listed(manager.completed_dir) == ["a"]
+        assert listed(manager.queue_dir) == ["b"]
+
+    def test_replaced_queue_file_is_prepared_again(self, tmp_path):
+        manager = make_manager(tmp_path, ["a", "b"])
+        seen = []
+
+        def prepare(config_data):
+            return (config_data["config_name"], config_data.get("rev", 0))
+
+        def process(bundle):
+            if bundle[0] == "a":
+                # 準備済みの b を生成中に差し替える
+                deadline = time.time() + 5
+                while manager._get_next_queue_item(exclude="a") != "b" and time.time() < deadline:
+                    time.sleep(0.01)
+                time.sleep(0.05)
+                path = os.path.join(manager.queue_dir, "b.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({"config_name": "b", "rev": 2}, f)
+            seen.append(bundle)
+            return True
+
+        run(manager, process, prepare)
+        assert seen == [("a", 0), ("b", 2)]
+
+    def test_without_prepare_uses_config_data(self, tmp_path):
+        manager = make_manager(tmp_path, ["a"])
+        seen = []
+        ok, _ = manager.start_queue_processing(lambda config_data: seen.append(config_data) or True)
+        assert ok
+        manager.queue_thread.join(timeout=10)
+        assert seen == [{"config_name": "a"}]
@@ -0,0 +1,124 @@
+"""eichi_utils.config_queue_manager のスケジューリング方針の単体テスト"""
+
+import os
+import sys
+import json
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "config_queue_manager", os.path.join(ROOT, "webui", "eichi_utils", "config_queue_manager.py")
+)
+cqm = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cqm)
+
+
+def config(name, loras=None, scales="0.8,0.8,0.8", priority=None, fp8=False):
+    data = {
+        "config_name": name,
+        "lora_settings": {"use_lora": bool(loras), "lora_files": loras or [], "lora_scales": scales},
+        "other_params": {"fp8_optimization": fp8},
+    }
+    if priority is not None:
+        data["priority"] = priority
+    return data
+
+
+def make_manager(tmp_path, configs):
+    manager = cqm.ConfigQueueManager(str(tmp_path))
+    manager.set_scheduling_policy(cqm.SCHEDULING_GROUP_BY_TRANSFORMER)
+    for i, data in enumerate(configs):
+        path = os.path.join(manager.queue_dir, f"{data['config_name']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.utime(path, (1000 + i, 1000 + i))
+    return manager
+
+
+def run(manager, prepare=None):
+    order = []
+
+    def process(payload):
+        order.append(payload["config_name"] if isinstance(payload, dict) else payload)
+        return True
+
+    ok, _ = manager.start_queue_processing(process, prepare_function=prepare)
+    assert ok
+    manager.queue_thread.join(timeout=10)
+    return order
+
+
+class TestTransformerSignature:
+    def test_lora_order_and_unused_slots_are_ignored(self):
+        a = cqm.transformer_signature(config("a", ["x.safetensors", None, "y.safetensors"], "0.5,0.8,1.0"))
+        b = cqm.transformer_signature(config("b", ["y.safetensors", "x.safetensors"], "1.0,0.5"))
+        assert a == b
+
+    def test_scale_and_disabled_lora(self):
+        base = cqm.transformer_signature(config("a", ["x.safetensors"], "0.8"))
+        assert base != cqm.transformer_signature(config("b", ["x.safetensors"], "0.7"))
+        off = config("d", ["x.safetensors"])
+        off["lora_settings"]["use_lora"] = False
+        assert cqm.transformer_signature(off) == cqm.transformer_signature(config("e"))
+
+    def test_f1_config_groups_by_lora(self):
+        # F1 は other_params=None で保存し、FP8 などはキュー実行時の UI 設定から取る
+        def f1_config(name, loras=None, scales="0.8,0.8,0.8"):
+            return {
+                "config_name": name,
+                "image_path": f"{name}.png",
+                "prompt": "p",
+                "lora_settings": {"use_lora": bool(loras), "lora_files": loras or [], "lora_scales": scales},
+                "other_params": None,
+            }
+
+        a = cqm.transformer_signature(f1_config("a", ["x.safetensors"]))
+        assert a == cqm.transformer_signature(f1_config("b", ["x.safetensors"]))
+        assert a != cqm.transformer_signature(f1_config("c", ["y.safetensors"]))
+        assert cqm.transformer_signature(f1_config("d")) == ()
+        # other_params の値はキーに影響しない
+        assert a == cqm.transformer_signature(config("e", ["x.safetensors"], "0.8", fp8=True))
+
+
+class TestPlanQueueOrder:
+    def test_groups_keep_fifo_and_priority_wins(self):
+        entries = [("a", 0, "A"), ("b", 0, "B"), ("c", 0, "A"), ("d", 5, "B"), ("e", 0, "B")]
+        assert cqm.plan_queue_order(entries) == ["d", "a", "c", "b", "e"]
+        # 読み込み済みの構成のグループを先にする
+        assert cqm.plan_queue_order(entries, active_signature="B") == ["d", "b", "e", "a", "c"]
+
+    def test_count_transformer_loads(self):
+        assert cqm.count_transformer_loads(["A", "B", "A", "B"]) == 4
+        assert cqm.count_transformer_loads(["A", "A", "B", "B"], initial="A") == 1
+
+
+class TestGroupedQueue:
+    def test_one_reload_per_group(self, tmp_path):
+        configs = [config(n, [lora]) for n, lora in
+                   [("a", "x.safetensors"), ("b", "y.safetensors"), ("c", "x.safetensors"), ("d", "y.safetensors")]]
+        manager = make_manager(tmp_path, configs)
+        assert run(manager) == ["a", "c", "b", "d"]
+        signatures = [signature for _, signature in manager._dispatched]
+        assert cqm.count_transformer_loads(signatures) == 2
+
+    def test_pipelined_with_priority(self, tmp_path):
+        configs = [config("a", ["x.safetensors"]), config("b", ["y.safetensors"]),
+                   config("c", ["x.safetensors"]), config("d", ["y.safetensors"])]
+        manager = make_manager(tmp_path, configs)
+        ok, _ = manager.set_queue_priority("d", 1)
+        assert ok
+        assert run(manager, prepare=lambda data: data) == ["d", "b", "a", "c"]
+
+    def test_set_priority_keeps_fifo_position(self, tmp_path):
+        manager = make_manager(tmp_path, [config("a"), config("b")])
+        before = os.path.getmtime(os.path.join(manager.queue_dir, "a.json"))
+        manager.set_queue_priority("a", 3)
+        assert os.path.getmtime(os.path.join(manager.queue_dir, "a.json")) == before
+        assert manager.set_queue_priority("missing", 1)[0] is False
+
+    def test_fifo_policy_is_default(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("EICHI_QUEUE_SCHEDULING", raising=False)
+        manager = cqm.ConfigQueueManager(str(tmp_path))
+        assert manager.scheduling_policy == cqm.SCHEDULING_FIFO
+        assert manager.set_scheduling_policy("random")[0] is False
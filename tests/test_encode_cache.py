@@ -0,0 +1,271 @@
+"""eichi_utils.encode_cache の単体テスト"""
+
+import os
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "encode_cache", os.path.join(ROOT, "webui", "eichi_utils", "encode_cache.py")
+)
+encode_cache = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(encode_cache)
+TensorCache = encode_cache.TensorCache
+
+
+class FakeTensor:
+    def __init__(self, value, nbytes=4):
+        self.value = value
+        self._nbytes = nbytes
+        self.device = "cpu"
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return self._nbytes
+
+    def to(self, device=None, copy=False):
+        t = FakeTensor(self.value, self._nbytes)
+        t.device = device
+        return t
+
+
+class FakeArray:
+    """numpy 配列の代わり (shape / dtype / tobytes のみ)"""
+
+    dtype = "uint8"
+
+    def __init__(self, data, shape):
+        self.data = bytes(data)
+        self.shape = shape
+
+    def tobytes(self):
+        return self.data
+
+
+class FakeParam:
+    """パラメータの代わり (dtype / shape / 値)"""
+
+    dtype = "float16"
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.shape = (len(self.values),)
+        self._version = 0
+
+
+class FakeVAE:
+    device = "cuda"
+    config = {"latent_channels": 16}
+
+    def __init__(self, weights=((1, 2), (3, 4))):
+        self.params = [FakeParam(w) for w in weights]
+
+    def named_parameters(self):
+        return iter((f"p{i}", p) for i, p in enumerate(self.params))
+
+
+@pytest.fixture(autouse=True)
+def fake_ops(monkeypatch):
+    monkeypatch.setattr(encode_cache, "_to_cpu", lambda t: FakeTensor(t.value, t._nbytes))
+    sampled = []
+
+    def weight_samples(params):
+        sampled.append(len(params))
+        return repr([p.values for p in params]).encode("utf-8")
+
+    monkeypatch.setattr(encode_cache, "_weight_samples", weight_samples)
+    return sampled
+    monkeypatch.delenv("EICHI_ENCODE_CACHE_DISK", raising=False)
+
+
+class TestContentHash:
+    def test_shape_and_content_change_key(self):
+        a = encode_cache.content_hash("vae", FakeArray([1, 2, 3, 4], (2, 2)))
+        assert a == encode_cache.content_hash("vae", FakeArray([1, 2, 3, 4], (2, 2)))
+        assert a != encode_cache.content_hash("vae", FakeArray([1, 2, 3, 4], (1, 4)))
+        assert a != encode_cache.content_hash("vae", FakeArray([1, 2, 3, 5], (2, 2)))
+        assert a != encode_cache.content_hash("clip", FakeArray([1, 2, 3, 4], (2, 2)))
+
+    def test_model_fingerprint_tracks_config_and_weights(self):
+        vae = FakeVAE()
+        fp = encode_cache.model_fingerprint(vae)
+        assert fp == encode_cache.model_fingerprint(FakeVAE())
+        other = FakeVAE()
+        other.config = {"latent_channels": 32}
+        assert encode_cache.model_fingerprint(other) != fp
+        # 先頭パラメータが同じでも後ろのパラメータが違えば別の指紋
+        assert encode_cache.model_fingerprint(FakeVAE(((1, 2), (3, 5)))) != fp
+
+    def test_model_fingerprint_is_computed_once_per_weight_state(self, fake_ops):
+        vae = FakeVAE()
+        fp = encode_cache.model_fingerprint(vae)
+        assert encode_cache.model_fingerprint(vae) == fp
+        assert len(fake_ops) == 1
+        # LoRA マージや load_state_dict などのインプレース書き換え (_version が進む)
+        vae.params[1].values[0] = 9
+        vae.params[1]._version += 1
+        patched = encode_cache.model_fingerprint(vae)
+        assert patched != fp and len(fake_ops) == 2
+        # FP8 化などでパラメータ自体を差し替え
+        vae.params[1] = FakeParam((3, 4))
+        vae.params[1].dtype = "float8_e4m3fn"
+        assert encode_cache.model_fingerprint(vae) not in (fp, patched)
+        assert len(fake_ops) == 3
+
+
+class TestTensorCache:
+    def test_lru_entry_limit(self):
+        cache = TensorCache("t", max_entries=2, max_bytes=1000)
+        cache.put("a", {"x": FakeTensor(1)})
+        cache.put("b", {"x": FakeTensor(2)})
+        assert cache.get("a")["x"].value == 1   # a が最新になる
+        cache.put("c", {"x": FakeTensor(3)})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_byte_limit(self):
+        cache = TensorCache("t", max_entries=10, max_bytes=10)
+        cache.put("a", {"x": FakeTensor(1, nbytes=6)})
+        cache.put("b", {"x": FakeTensor(2, nbytes=6)})
+        assert cache.get("a") is None
+        assert cache.nbytes == 6
+        cache.put("huge", {"x": FakeTensor(3, nbytes=100)})
+        assert cache.get("huge") is None and len(cache) == 1
+
+    def test_disk_tier(self, tmp_path, monkeypatch):
+        store = {}
+
+        def save(data, path):
+            store[os.path.basename(path).replace(".tmp", "")] = data
+            open(path, "wb").close()
+
+        monkeypatch.setattr(encode_cache, "_save_file", save)
+        monkeypatch.setattr(encode_cache, "_load_file", lambda path: store[os.path.basename(path)])
+        cache = TensorCache("t", disk_dir=str(tmp_path))
+        cache.put("k", {"x": FakeTensor(7)})
+        assert os.path.exists(tmp_path / "k.safetensors")
+
+        fresh = TensorCache("t", disk_dir=str(tmp_path))
+        assert fresh.get("k")["x"].value == 7
+        assert len(fresh) == 1
+
+    def test_disk_disabled_by_default(self):
+        assert TensorCache("t").disk_dir() is None
+
+
+class TestCachedVaeEncode:
+    def test_second_call_skips_encoder(self):
+        calls = []
+
+        def encode(image_pt, vae):
+            calls.append(image_pt)
+            return FakeTensor("latent")
+
+        cache = TensorCache("t")
+        vae = FakeVAE()
+        image = FakeArray([1, 2, 3], (1, 1, 3))
+        first = encode_cache.cached_vae_encode(image, "pt", vae, encode, cache=cache)
+        second = encode_cache.cached_vae_encode(FakeArray([1, 2, 3], (1, 1, 3)), "pt", vae, encode, cache=cache)
+        assert len(calls) == 1
+        assert first.value == second.value == "latent"
+        assert second.device == "cuda"
+
+        encode_cache.cached_vae_encode(FakeArray([9, 9, 9], (1, 1, 3)), "pt", vae, encode, cache=cache)
+        assert len(calls) == 2
+
+
+class FakeOutput:
+    def __init__(self, hidden):
+        self.last_hidden_state = hidden
+
+
+class TestCachedClipVisionEncode:
+    def test_hit_skips_encoder_load(self):
+        loads, encodes = [], []
+
+        def encode(image_np, feature_extractor, image_encoder):
+            encodes.append(image_np)
+            return FakeOutput(FakeTensor("hidden"))
+
+        cache = TensorCache("t")
+        encoder = FakeVAE()
+        image = FakeArray([5, 6, 7], (1, 1, 3))
+        kwargs = dict(device="cuda", load_fn=lambda: loads.append(1), cache=cache)
+        first = encode_cache.cached_clip_vision_encode(image, {"size": 384}, encoder, encode, **kwargs)
+        second = encode_cache.cached_clip_vision_encode(image, {"size": 384}, encoder, encode, **kwargs)
+        assert first.value == second.value == "hidden"
+        assert second.device == "cuda"
+        assert len(loads) == 1 and len(encodes) == 1
+
+    def test_feature_extractor_config_is_part_of_key(self):
+        encoder = FakeVAE()
+        image = FakeArray([5, 6, 7], (1, 1, 3))
+        assert encode_cache.clip_vision_key(image, {"size": 384}, encoder) != \
+            encode_cache.clip_vision_key(image, {"size": 224}, encoder)
+
+
+class FakeBatch:
+    """バッチ次元 (dim=0) だけを持つ latent"""
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.device = "cuda"
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return len(self.values)
+
+
+class TestCachedVaeEncodeBatch:
+    @pytest.fixture(autouse=True)
+    def batch_ops(self, monkeypatch):
+        monkeypatch.setattr(encode_cache, "_cat_batch", lambda ts: sum(ts, []))
+        monkeypatch.setattr(encode_cache, "_split_batch", lambda x: [FakeTensor(v) for v in x.values])
+        monkeypatch.setattr(encode_cache, "_to_cpu", lambda t: FakeTensor(t.value))
+        monkeypatch.delenv("EICHI_VAE_ENCODE_BATCH", raising=False)
+
+    def _run(self, items, free_bytes, cache):
+        calls = []
+
+        def encode(batch_pt, vae):
+            batch = batch_pt if isinstance(batch_pt, list) else [batch_pt]
+            calls.append(len(batch))
+            return FakeBatch(f"lat-{p}" for p in batch)
+
+        result = encode_cache.cached_vae_encode_batch(items, FakeVAE(), encode, free_bytes=free_bytes, cache=cache)
+        return result, calls
+
+    def test_groups_by_bucket_and_chunks(self):
+        items = [(i, FakeArray([i], (4, 4, 3)), [f"p{i}"]) for i in range(5)]
+        items.append((9, FakeArray([9], (8, 4, 3)), ["p9"]))
+        # 予備 2 GB を除いて 4x4 の画像 3 枚ぶんの空き → 3 枚ずつ
+        free_bytes = 3 * 4 * 4 * encode_cache._VAE_ENCODE_BYTES_PER_PIXEL + 2 * 1024 ** 3
+        result, calls = self._run(items, free_bytes, TensorCache("t"))
+        assert calls == [3, 2, 1]
+        assert [r.value for r in result.values()] == ["lat-p0", "lat-p1", "lat-p2", "lat-p3", "lat-p4", "lat-p9"]
+        assert list(result) == [0, 1, 2, 3, 4, 9]
+
+    def test_duplicates_and_cache_hits_are_not_encoded(self):
+        cache = TensorCache("t")
+        same = FakeArray([1], (4, 4, 3))
+        items = [(1, same, ["a"]), (2, FakeArray([1], (4, 4, 3)), ["a"]), (3, FakeArray([2], (4, 4, 3)), ["b"])]
+        result, calls = self._run(items, None, cache)
+        assert calls == [1, 1]
+        assert result[1].value == result[2].value == "lat-a"
+
+        result, calls = self._run(items, None, cache)
+        assert calls == []
+        assert result[3].value == "lat-b"
+
+    def test_batch_size_env_override(self, monkeypatch):
+        monkeypatch.setenv("EICHI_VAE_ENCODE_BATCH", "4")
+        assert encode_cache.vae_encode_batch_size(640, 640, free_bytes=0) == 4
+        monkeypatch.delenv("EICHI_VAE_ENCODE_BATCH")
+        assert encode_cache.vae_encode_batch_size(640, 640, free_bytes=None) == 1
+        assert encode_cache.vae_encode_batch_size(640, 640, free_bytes=0) == 1
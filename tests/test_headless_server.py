@@ -0,0 +1,281 @@
+"""eichi_utils.headless_server の単体テスト"""
+
+import os
+import sys
+import json
+import socket
+import threading
+import http.client
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "headless_server", os.path.join(ROOT, "webui", "eichi_utils", "headless_server.py")
+)
+headless_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(headless_server)
+
+
+class FakeGenerator:
+    """process() の代わり。release されるまでジョブを止めておける"""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.server = None
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.cancelled = threading.Event()
+        self.ran = []
+
+    def run(self, params):
+        self.ran.append(params["prompt"])
+        self.started.set()
+        publish = self.server.publish
+        publish(('seed', params.get("seed", 1)))
+        publish(('progress', ("/tmp/preview.png", "step 1/2", "<div>50%</div>")))
+        if params.get("fail"):
+            raise RuntimeError("out of memory")
+        self.release.wait(5)
+        if self.cancelled.is_set():
+            publish(('end', None))
+            return
+        path = self.tmp_path / f"{params['prompt']}.png"
+        path.write_bytes(b"PNG" + params["prompt"].encode())
+        publish(('file', str(path)))
+        publish(('end', None))
+
+    def cancel(self):
+        self.cancelled.set()
+        self.release.set()
+
+
+@pytest.fixture
+def fake(tmp_path):
+    fake = FakeGenerator(tmp_path)
+    fake.server = headless_server.HeadlessJobServer(fake.run, cancel_job=fake.cancel)
+    yield fake
+    fake.release.set()
+    fake.server.shutdown(timeout=5)
+
+
+def events_of(job):
+    sub = job.bus.subscribe()
+    items = []
+    while True:
+        item = sub.get(timeout=5)
+        if item == headless_server.BUS_END_SENTINEL:
+            return items
+        items.append(headless_server.event_to_dict(item))
+
+
+class TestJobServer:
+    def test_runs_jobs_in_order_and_records_outputs(self, fake):
+        fake.release.set()
+        first = fake.server.submit({"prompt": "a"})
+        second = fake.server.submit({"prompt": "b", "seed": 7})
+        events = events_of(second)
+        assert fake.ran == ["a", "b"]
+        assert first.status == "done" and second.status == "done"
+        assert [e["type"] for e in events] == ["seed", "progress", "file", "end", "done"]
+        assert events[0]["seed"] == 7
+        # 履歴からの再生ではプレビューは落ちる
+        assert events[1]["desc"] == "step 1/2"
+        assert second.outputs == [str(fake.tmp_path / "b.png")]
+        assert events[-1]["outputs"] == second.outputs
+
+    def test_error_is_reported(self, fake):
+        job = fake.server.submit({"prompt": "x", "fail": True})
+        events = events_of(job)
+        assert job.status == "error" and "out of memory" in job.error
+        assert events[-1] == {"type": "done", "status": "error", "error": job.error, "outputs": []}
+
+    def test_cancel_queued_and_running(self, fake):
+        running = fake.server.submit({"prompt": "a"})
+        queued = fake.server.submit({"prompt": "b"})
+        assert fake.started.wait(5)
+        assert fake.server.cancel(queued.id)
+        assert queued.status == "cancelled" and events_of(queued)[-1]["status"] == "cancelled"
+        assert fake.server.cancel(running.id)
+        assert not fake.server.cancel(running.id)  # 二重の停止要求
+        events_of(running)
+        assert running.status == "cancelled" and running.outputs == []
+        assert fake.ran == ["a"]
+        assert not fake.server.cancel("missing")
+
+    def test_validate_and_bus_events_outside_jobs(self, fake):
+        def validate(params):
+            if "prompt" not in params:
+                raise ValueError("missing parameter: prompt")
+            return params
+
+        server = headless_server.HeadlessJobServer(fake.run, validate=validate)
+        with pytest.raises(ValueError):
+            server.submit({"seed": 1})
+        with pytest.raises(ValueError):
+            server.submit(["not", "an", "object"])
+        # 実行中のジョブが無ければ転送先が無いので捨てる
+        server.publish(('file', '/tmp/x.png'))
+        assert server.jobs() == []
+
+    def test_returned_status_is_reported(self):
+        results = iter([("error", "rejected: not enough memory"), ("cancelled", None), ("bogus", None)])
+        server = headless_server.HeadlessJobServer(lambda params: next(results))
+        try:
+            jobs = [server.submit({"prompt": p}) for p in "abc"]
+            for job in jobs:
+                events_of(job)
+            assert [(j.status, j.error) for j in jobs[:2]] == [("error", "rejected: not enough memory"),
+                                                              ("cancelled", None)]
+            assert jobs[2].status == "error" and "bogus" in jobs[2].error
+        finally:
+            server.shutdown(timeout=5)
+
+    def test_finished_jobs_are_evicted(self):
+        server = headless_server.HeadlessJobServer(lambda params: None, max_finished=2)
+        try:
+            jobs = [server.submit({"prompt": p}) for p in "abc"]
+            events_of(jobs[-1])
+            assert [j.id for j in server.jobs()] == [j.id for j in jobs[1:]]
+            # TTL を過ぎたものは次の投入で忘れる
+            jobs[1].finished_at -= headless_server.FINISHED_JOB_TTL + 1
+            events_of(server.submit({"prompt": "d"}))
+            assert jobs[1].id not in {j.id for j in server.jobs()} and server.get(jobs[2].id) is jobs[2]
+        finally:
+            server.shutdown(timeout=5)
+
+    def test_event_to_dict(self):
+        assert headless_server.event_to_dict(('progress', (object(), "d", None))) == {
+            "type": "progress", "preview": None, "desc": "d", "bar": None}
+        assert headless_server.event_to_dict(('custom', object()))["type"] == "custom"
+        assert headless_server.event_to_dict("broken")["type"] == "unknown"
+
+
+@pytest.fixture
+def http_server(fake):
+    httpd = headless_server.create_server(fake.server, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(httpd, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=5)
+    data = json.dumps(body).encode() if body is not None else None
+    conn.request(method, path, body=data, headers=dict({"Content-Type": "application/json"}, **(headers or {})))
+    resp = conn.getresponse()
+    payload = resp.read()
+    conn.close()
+    if resp.getheader("Content-Type", "").startswith("application/json"):
+        payload = json.loads(payload)
+    return resp.status, resp.getheader("Content-Type"), payload
+
+
+class TestHttpApi:
+    def test_submit_stream_and_fetch_output(self, fake, http_server):
+        status, _, job = request(http_server, "POST", "/jobs", {"prompt": "cat"})
+        assert status == 201 and job["status"] in ("queued", "running")
+        assert fake.started.wait(5)
+        fake.release.set()
+
+        status, ctype, body = request(http_server, "GET", f"/jobs/{job['id']}/events")
+        assert status == 200 and ctype.startswith("application/x-ndjson")
+        events = [json.loads(line) for line in body.decode().splitlines()]
+        assert [e["type"] for e in events] == ["seed", "progress", "file", "end", "done"]
+
+        status, _, info = request(http_server, "GET", f"/jobs/{job['id']}")
+        assert info["status"] == "done"
+        status, _, outputs = request(http_server, "GET", f"/jobs/{job['id']}/outputs")
+        assert [o["name"] for o in outputs["outputs"]] == ["cat.png"]
+        status, ctype, data = request(http_server, "GET", f"/jobs/{job['id']}/outputs/cat.png")
+        assert status == 200 and ctype == "image/png" and data == b"PNGcat"
+
+    def test_only_recorded_outputs_are_served(self, fake, http_server, tmp_path):
+        fake.release.set()
+        (tmp_path / "secret.txt").write_text("x")
+        _, _, job = request(http_server, "POST", "/jobs", {"prompt": "a"})
+        request(http_server, "GET", f"/jobs/{job['id']}/events")
+        for name in ("secret.txt", "..%2Fsecret.txt"):
+            status, _, _ = request(http_server, "GET", f"/jobs/{job['id']}/outputs/{name}")
+            assert status == 404
+
+    def test_cancel_health_and_errors(self, fake, http_server):
+        _, _, job = request(http_server, "POST", "/jobs", {"prompt": "a"})
+        assert fake.started.wait(5)
+        status, _, health = request(http_server, "GET", "/health")
+        assert health["running"] == job["id"]
+        status, _, body = request(http_server, "POST", f"/jobs/{job['id']}/cancel")
+        assert status == 200 and body["cancelled"]
+        request(http_server, "GET", f"/jobs/{job['id']}/events")
+        status, _, body = request(http_server, "POST", f"/jobs/{job['id']}/cancel")
+        assert status == 409 and body["status"] == "cancelled"
+
+        assert request(http_server, "GET", "/jobs/missing")[0] == 404
+        assert request(http_server, "GET", "/nothing")[0] == 404
+        conn = http.client.HTTPConnection("127.0.0.1", http_server.server_address[1], timeout=5)
+        conn.request("POST", "/jobs", body=b"{broken", headers={"Content-Type": "application/json"})
+        assert conn.getresponse().status == 400
+        conn.close()
+        _, _, listing = request(http_server, "GET", "/jobs")
+        assert [j["id"] for j in listing["jobs"]] == [job["id"]]
+
+
+class TestHttpGuards:
+    def test_rejects_non_json_post_and_foreign_host(self, fake, http_server):
+        # ブラウザが確認なしに送れるクロスオリジンの text/plain POST
+        status, _, body = request(http_server, "POST", "/jobs", {"prompt": "a"},
+                                  headers={"Content-Type": "text/plain"})
+        assert status == 415 and "application/json" in body["error"]
+        # DNS リバインディング: 攻撃者のドメイン名で届いたリクエスト
+        status, _, _ = request(http_server, "GET", "/jobs", headers={"Host": "evil.example:8001"})
+        assert status == 403
+        status, _, _ = request(http_server, "GET", "/health", headers={"Host": "localhost:8001"})
+        assert status == 200
+        assert fake.server.jobs() == []
+
+    def test_token_is_required_when_set(self, fake):
+        fake.release.set()
+        httpd = headless_server.create_server(fake.server, port=0, token="s3cret")
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            assert request(httpd, "GET", "/health")[0] == 401
+            assert request(httpd, "POST", "/jobs", {"prompt": "a"},
+                           headers={"Authorization": "Bearer wrong"})[0] == 401
+            status, _, job = request(httpd, "POST", "/jobs", {"prompt": "a"},
+                                     headers={"Authorization": "Bearer s3cret"})
+            assert status == 201 and fake.server.get(job["id"]) is not None
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_host_name(self):
+        assert headless_server._host_name("LocalHost:8001") == "localhost"
+        assert headless_server._host_name("[::1]:8001") == "::1"
+        assert headless_server._host_name("::1") == "::1"
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="UNIX ソケットが無い環境")
+def test_unix_socket(fake, tmp_path):
+    path = str(tmp_path / "eichi.sock")
+    httpd = headless_server.create_server(fake.server, socket_path=path)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(path)
+        sock.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+        data = b""
+        while chunk := sock.recv(4096):
+            data += chunk
+        sock.close()
+        head, _, body = data.partition(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.0 200") and json.loads(body)["status"] == "ok"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
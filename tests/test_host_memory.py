@@ -56,3 +56,20 @@ class TestHostMemSnapshot:
         snap = host_memory.host_mem_snapshot()
         if snap["avail_gb"] is not None and snap["total_gb"] is not None:
             assert snap["total_gb"] >= snap["avail_gb"]
+
+
+class TestHostMemUnderPressure:
+    def test_compares_with_reserve(self, monkeypatch):
+        monkeypatch.setattr(host_memory, "host_mem_available_gb", lambda: 3.0)
+        assert host_memory.host_mem_under_pressure(4.0) is True
+        assert host_memory.host_mem_under_pressure(2.0) is False
+
+    def test_unknown_is_not_pressure(self, monkeypatch):
+        monkeypatch.setattr(host_memory, "host_mem_available_gb", lambda: None)
+        assert host_memory.host_mem_under_pressure(4.0) is False
+
+    def test_reserve_from_env(self, monkeypatch):
+        monkeypatch.setenv("EICHI_HOST_RAM_RESERVE_GB", "6.5")
+        assert host_memory.host_mem_reserve_gb() == 6.5
+        monkeypatch.setenv("EICHI_HOST_RAM_RESERVE_GB", "bad")
+        assert host_memory.host_mem_reserve_gb() == host_memory.DEFAULT_RESERVE_GB
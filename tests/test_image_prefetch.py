@@ -0,0 +1,132 @@
+"""eichi_utils.image_prefetch の単体テスト"""
+
+import os
+import sys
+import threading
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "image_prefetch", os.path.join(ROOT, "webui", "eichi_utils", "image_prefetch.py")
+)
+image_prefetch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(image_prefetch)
+ImagePrefetcher = image_prefetch.ImagePrefetcher
+
+from eichi_utils import encode_cache  # noqa: E402
+
+
+class FakeArray:
+    dtype = "uint8"
+
+    def __init__(self, data, shape):
+        self.data = bytes(data)
+        self.shape = shape
+
+    def tobytes(self):
+        return self.data
+
+
+class RecordingLoader:
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+        self.lock = threading.Lock()
+
+    def __call__(self, path, resolution):
+        with self.lock:
+            self.calls.append(path)
+        if self.gate is not None:
+            self.gate.wait(1.0)
+        if path == "broken.png":
+            raise OSError("cannot identify image file")
+        return image_prefetch.PrefetchedImage(path, f"img:{path}", resolution, resolution, f"digest:{path}")
+
+
+class TestImagePrefetcher:
+    def test_prefetches_ahead_and_keeps_window(self):
+        loader = RecordingLoader()
+        paths = [f"{i}.png" for i in range(10)]
+        with ImagePrefetcher(paths, 640, depth=3, workers=2, load_fn=loader) as prefetcher:
+            assert prefetcher.get("0.png").image == "img:0.png"
+            item = prefetcher.get("1.png")
+            assert item.height == 640 and item.digest == "digest:1.png"
+            # 先読みは get した位置から depth 枚先まで
+            assert max(int(p.split(".")[0]) for p in loader.calls) <= 4
+        assert prefetcher.missed == 0
+
+    def test_out_of_order_and_repeat(self):
+        loader = RecordingLoader()
+        paths = [f"{i}.png" for i in range(6)]
+        with ImagePrefetcher(paths, 640, depth=2, load_fn=loader) as prefetcher:
+            assert prefetcher.get("5.png").path == "5.png"
+            assert prefetcher.get("5.png").path == "5.png"   # 同じ画像の繰り返しは読み直さない
+            assert prefetcher.get("0.png").path == "0.png"
+            assert loader.calls.count("5.png") == 1
+
+    def test_not_in_queue_or_other_resolution(self):
+        with ImagePrefetcher(["a.png"], 640, depth=2, load_fn=RecordingLoader()) as prefetcher:
+            assert prefetcher.get("other.png") is None
+            assert prefetcher.get("a.png", resolution=512) is None
+            assert prefetcher.get("a.png", resolution=640) is not None
+
+    def test_disabled_by_env(self, monkeypatch):
+        monkeypatch.setenv("EICHI_IMAGE_PREFETCH", "0")
+        loader = RecordingLoader()
+        prefetcher = ImagePrefetcher(["a.png"], 640, load_fn=loader)
+        assert not prefetcher.enabled
+        assert prefetcher.get("a.png") is None
+        assert loader.calls == []
+
+    def test_load_error_returns_none(self):
+        with ImagePrefetcher(["broken.png", "ok.png"], 640, depth=2, load_fn=RecordingLoader()) as prefetcher:
+            assert prefetcher.get("broken.png") is None
+            assert prefetcher.get("ok.png").path == "ok.png"
+            assert prefetcher._error_reported
+
+    def test_close_is_idempotent(self):
+        gate = threading.Event()
+        prefetcher = ImagePrefetcher(["a.png", "b.png"], 640, depth=2, load_fn=RecordingLoader(gate))
+        prefetcher.close()
+        prefetcher.close()
+        gate.set()
+        assert prefetcher.get("a.png") is None
+
+
+class TestPreparedImage:
+    def test_prepared_image_is_returned_until_file_changes(self, tmp_path):
+        path = tmp_path / "next.png"
+        path.write_bytes(b"1")
+        item = image_prefetch.prepare_image(str(path), 640, load_fn=RecordingLoader())
+        assert image_prefetch.get_prepared_image(str(path), 640) is item
+        assert image_prefetch.get_prepared_image(str(path), 512) is None
+        path.write_bytes(b"22")
+        assert image_prefetch.get_prepared_image(str(path), 640) is None
+
+    def test_keeps_only_recent_images(self, tmp_path):
+        paths = []
+        for i in range(image_prefetch._MAX_PREPARED + 1):
+            path = tmp_path / f"{i}.png"
+            path.write_bytes(b"x")
+            image_prefetch.prepare_image(str(path), 640, load_fn=RecordingLoader())
+            paths.append(str(path))
+        assert image_prefetch.get_prepared_image(paths[0], 640) is None
+        assert image_prefetch.get_prepared_image(paths[-1], 640) is not None
+
+
+class TestPixelDigest:
+    def test_remembered_digest_is_reused(self):
+        image = FakeArray([1, 2, 3], (1, 1, 3))
+        assert encode_cache.pixel_digest(image) == encode_cache.content_hash(image)
+        encode_cache.remember_pixel_digest(image, "precomputed")
+        assert encode_cache.pixel_digest(image) == "precomputed"
+        # 別の配列 (同じ内容) には引き継がれない
+        assert encode_cache.pixel_digest(FakeArray([1, 2, 3], (1, 1, 3))) == encode_cache.content_hash(image)
+
+    def test_forgotten_when_array_is_released(self):
+        image = FakeArray([4, 5, 6], (1, 1, 3))
+        encode_cache.remember_pixel_digest(image, "precomputed")
+        key = id(image)
+        del image
+        assert key not in encode_cache._pixel_digests
@@ -0,0 +1,224 @@
+"""eichi_utils.latent_history / history_spill の単体テスト
+
+torch を使わずに検証するため、時間軸だけを持つ簡易テンソルを使う。
+"""
+
+import json
+import os
+import sys
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+
+
+def _load(name):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(ROOT, "webui", "eichi_utils", f"{name}.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+latent_history = _load("latent_history")
+history_spill = _load("history_spill")
+LatentHistory = latent_history.LatentHistory
+
+
+class FakeBCTHW:
+    """時間軸 (dim=2) のみを持つ BCTHW 風テンソル"""
+
+    dtype = "float32"
+    device = "cpu"
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    @property
+    def shape(self):
+        return (1, 16, len(self.frames), 4, 4)
+
+    def __getitem__(self, key):
+        return FakeBCTHW(self.frames[key[2]])
+
+    def __setitem__(self, key, value):
+        self.frames[key[2]] = value.frames
+
+    def to(self, device=None, dtype=None):
+        return self
+
+    def element_size(self):
+        return 4
+
+
+class FakeSpill:
+    def __init__(self):
+        self.allocated = []
+
+    def allocate(self, shape, dtype):
+        self.allocated.append(shape)
+        return FakeBCTHW([None] * shape[2])
+
+
+@pytest.fixture(autouse=True)
+def fake_ops(monkeypatch):
+    monkeypatch.setattr(latent_history, "_empty", lambda shape, like: FakeBCTHW([None] * shape[2]))
+
+
+def _initial():
+    return FakeBCTHW(["z"] * 19)
+
+
+class TestPrependHistory:
+    def test_context_before_generation_is_initial(self):
+        h = LatentHistory(_initial(), direction="prepend", capacity=18)
+        assert h.context().frames == ["z"] * 19
+        assert h.num_frames == 0
+        assert h.shape == (1, 16, 0, 4, 4)
+
+    def test_write_context_sets_end_frame(self):
+        h = LatentHistory(_initial(), direction="prepend", capacity=18)
+        h.write_context(0, FakeBCTHW(["end"]))
+        assert h.context().frames[0] == "end"
+
+    def test_matches_torch_cat_reference(self):
+        h = LatentHistory(_initial(), direction="prepend", context_frames=19, capacity=54)
+        reference = ["z"] * 19
+        for sec in range(6):
+            gen = [f"s{sec}_{i}" for i in range(9)]
+            h.add(FakeBCTHW(gen))
+            reference = gen + reference
+            assert h.context(19).frames == reference[:19]
+            assert h.real().frames == reference[:h.num_frames]
+            assert h.real(9).frames == gen
+        assert h.num_frames == 54
+        assert h.reallocations == 0
+
+    def test_grows_when_capacity_exceeded(self):
+        h = LatentHistory(_initial(), direction="prepend", capacity=9)
+        reference = ["z"] * 19
+        for sec in range(5):
+            gen = [f"s{sec}_{i}" for i in range(9)]
+            h.add(FakeBCTHW(gen))
+            reference = gen + reference
+            assert h.context(19).frames == reference[:19]
+            assert h.real().frames == reference[:h.num_frames]
+        # 9 → 18 → 36 → 72 の倍々で再確保
+        assert h.reallocations == 3
+        assert h.capacity == 72
+
+    def test_buffer_allocated_on_spill(self):
+        spill = FakeSpill()
+        h = LatentHistory(_initial(), direction="prepend", capacity=36, spill=spill)
+        for sec in range(4):
+            h.add(FakeBCTHW([f"s{sec}_{i}" for i in range(9)]))
+        assert spill.allocated == [(1, 16, 36 + 19, 4, 4)]
+        assert h.real().frames[:9] == [f"s3_{i}" for i in range(9)]
+
+
+class TestAppendHistory:
+    def test_matches_torch_cat_reference(self):
+        h = LatentHistory(_initial(), direction="append", context_frames=19, capacity=45)
+        reference = ["z"] * 19
+        for sec in range(5):
+            gen = [f"s{sec}_{i}" for i in range(9)]
+            h.add(FakeBCTHW(gen))
+            reference = reference + gen
+            assert h.context(19).frames == reference[-19:]
+            assert h.real().frames == reference[19:]
+            assert h.real(9).frames == gen
+        assert h.reallocations == 0
+
+    def test_grows_without_initial_capacity(self):
+        h = LatentHistory(_initial(), direction="append")
+        reference = ["z"] * 19
+        for sec in range(3):
+            gen = [f"s{sec}_{i}" for i in range(4)]
+            h.add(FakeBCTHW(gen))
+            reference = reference + gen
+        assert h.context(19).frames == reference[-19:]
+        assert h.real().frames == reference[19:]
+
+    def test_invalid_direction(self):
+        with pytest.raises(ValueError):
+            LatentHistory(_initial(), direction="sideways")
+
+
+class TestShouldSpill:
+    def test_modes(self):
+        assert history_spill.should_spill(1, available_bytes=10 ** 12, mode="on") is True
+        assert history_spill.should_spill(10 ** 15, available_bytes=1, mode="off") is False
+
+    def test_auto_threshold(self):
+        assert history_spill.should_spill(60, available_bytes=100, mode="auto") is True
+        assert history_spill.should_spill(40, available_bytes=100, mode="auto") is False
+
+    def test_env_var(self, monkeypatch):
+        monkeypatch.setenv("EICHI_HISTORY_SPILL", "off")
+        assert history_spill.should_spill(10 ** 15, available_bytes=1) is False
+
+
+class FakeChunk:
+    """(B, C, T) のバイト列を持つチャンク"""
+
+    dtype = "torch.float32"
+
+    def __init__(self, b, c, t, tag):
+        self.shape = (b, c, t, 1, 1)
+        self.tag = tag
+
+    def __getitem__(self, key):
+        bi, ci = key
+        # 1 要素 4 バイト: "a01_" のように (タグ, b, c) が読めるようにする
+        return f"{self.tag}{bi}{ci}_".encode() * self.shape[2]
+
+    def element_size(self):
+        return 4
+
+    def nelement(self):
+        b, c, t, h, w = self.shape
+        return b * c * t * h * w
+
+
+class FakeMeta:
+    dtype = "torch.int32"
+    shape = (3,)
+    payload = b"\x01\x00\x00\x00" * 3
+
+    def element_size(self):
+        return 4
+
+    def nelement(self):
+        return 3
+
+
+class TestSaveSafetensorsChunks:
+    def test_header_and_layout(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(history_spill, "_tensor_bytes", lambda x: x.payload if isinstance(x, FakeMeta) else x)
+        chunks = [FakeChunk(1, 2, 2, "a"), FakeChunk(1, 2, 3, "b")]
+        path = tmp_path / "out.safetensors"
+        history_spill.save_safetensors_chunks(str(path), "history_latents", chunks, {"metadata": FakeMeta()})
+
+        raw = path.read_bytes()
+        header_len = int.from_bytes(raw[:8], "little")
+        assert header_len % 8 == 0
+        header = json.loads(raw[8:8 + header_len])
+        assert header["history_latents"]["shape"] == [1, 2, 5, 1, 1]
+        assert header["history_latents"]["dtype"] == "F32"
+        assert header["history_latents"]["data_offsets"] == [0, 40]
+        assert header["metadata"]["data_offsets"] == [40, 52]
+
+        data = raw[8 + header_len:]
+        assert len(data) == 52
+        # (b, c) ごとに全チャンクの時間方向が連続している
+        assert data[:40] == chunks[0][0, 0] + chunks[1][0, 0] + chunks[0][0, 1] + chunks[1][0, 1]
+        assert not os.path.exists(str(path) + ".tmp")
+
+    def test_mismatched_chunks_rejected(self, tmp_path):
+        with pytest.raises(ValueError):
+            history_spill.save_safetensors_chunks(
+                str(tmp_path / "x.safetensors"), "h", [FakeChunk(1, 2, 1, "a"), FakeChunk(1, 3, 1, "b")]
+            )
@@ -0,0 +1,186 @@
+"""eichi_utils.memory_estimator の単体テスト"""
+
+import os
+import json
+import struct
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "memory_estimator", os.path.join(ROOT, "webui", "eichi_utils", "memory_estimator.py")
+)
+memory_estimator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(memory_estimator)
+
+JobProfile = memory_estimator.JobProfile
+FEATURES = memory_estimator.FEATURES
+
+
+def feature(profile, name):
+    return memory_estimator.job_features(profile)[FEATURES.index(name)]
+
+
+def calibrated(estimator, count=memory_estimator.MIN_RECORDS_TO_REJECT):
+    estimator.records = count
+    return estimator
+
+
+class TestFeatures:
+    def test_low_vram_resident_weights_follow_preservation(self):
+        profile = JobProfile(640, 640, vram_total_gb=24.0, preserved_gb=6.0)
+        assert feature(profile, "resident_weights_gb") == 18.0
+        assert feature(profile._replace(vram_total_gb=None), "resident_weights_gb") == 0.0
+
+    def test_high_vram_and_fp8(self):
+        bf16 = JobProfile(640, 640, high_vram=True)
+        fp8 = bf16._replace(fp8=True)
+        assert feature(bf16, "resident_weights_gb") > feature(fp8, "resident_weights_gb")
+        assert feature(fp8, "host_weights_gb") == memory_estimator.TRANSFORMER_GB["fp8"]
+
+    def test_frames_window_and_tiling(self):
+        profile = JobProfile(1000, 1000, latent_window_size=9, total_frames=150, vae_tiling=False, batch_size=2)
+        assert abs(feature(profile, "mp_window") - 18.0) < 1e-9
+        assert abs(feature(profile, "mp_frames") - 38.0) < 1e-9
+        assert abs(feature(profile, "mp_frames_untiled") - 38.0) < 1e-9
+        assert feature(profile._replace(vae_tiling=True), "mp_frames_untiled") == 0.0
+        assert feature(profile._replace(vae_cache=True), "mp_frames_untiled") == 0.0
+
+    def test_lora_features(self):
+        profile = JobProfile(640, 640, lora_ranks=(32, 0, 64), lora_cache=True)
+        assert feature(profile, "lora_count") == 3
+        assert abs(feature(profile, "lora_rank_k") - 0.096) < 1e-9
+        assert feature(profile, "lora_cache_gb") == memory_estimator.TRANSFORMER_GB["bf16"]
+        assert feature(profile._replace(lora_ranks=()), "lora_cache_gb") == 0.0
+
+
+class TestPreflight:
+    def test_ok_when_within_budget(self):
+        estimator = memory_estimator.MemoryEstimator()
+        result = estimator.preflight(JobProfile(640, 640), vram_budget_gb=80, ram_budget_gb=200)
+        assert result.action == "ok" and result.changes == ()
+
+    def test_disables_lora_cache_when_ram_is_short(self):
+        estimator = calibrated(memory_estimator.MemoryEstimator())
+        profile = JobProfile(640, 640, fp8=True, lora_ranks=(32,), lora_cache=True)
+        without_cache = estimator.predict(profile._replace(lora_cache=False)).ram_gb
+        result = estimator.preflight(profile, ram_budget_gb=without_cache + 2)
+        assert result.action == "adapt"
+        assert result.changes == ("lora_cache",) and not result.profile.lora_cache
+
+    def test_enables_tiling_when_vram_is_short(self):
+        estimator = calibrated(memory_estimator.MemoryEstimator())
+        profile = JobProfile(960, 960, total_frames=300, high_vram=True, vae_tiling=False)
+        tiled = estimator.predict(profile._replace(vae_tiling=True)).vram_gb
+        result = estimator.preflight(profile, vram_budget_gb=tiled + 2)
+        assert result.action == "adapt" and result.profile.vae_tiling
+
+    def test_rejects_when_adaptation_is_not_enough(self):
+        estimator = calibrated(memory_estimator.MemoryEstimator())
+        result = estimator.preflight(JobProfile(640, 640), ram_budget_gb=4)
+        assert result.action == "reject" and "RAM" in result.reason
+        assert estimator.preflight(JobProfile(640, 640), ram_budget_gb=4, allow_reject=False).action == "ok"
+
+    def test_uncalibrated_model_does_not_reject(self):
+        estimator = memory_estimator.MemoryEstimator()
+        assert estimator.preflight(JobProfile(640, 640), ram_budget_gb=4).action == "ok"
+
+    def test_unknown_budget_is_not_checked(self):
+        estimator = calibrated(memory_estimator.MemoryEstimator())
+        assert estimator.preflight(JobProfile(640, 640)).action == "ok"
+
+
+class TestFit:
+    def test_recovers_weights_from_enough_records(self):
+        true_ram = dict(memory_estimator.DEFAULT_RAM_WEIGHTS, bias=12.0, host_weights_gb=1.3, lora_cache_gb=0.8)
+        records = []
+        for res in (512, 640, 768, 960):
+            for fp8 in (False, True):
+                for cache in (False, True):
+                    profile = JobProfile(res, res, fp8=fp8, lora_ranks=(32,), lora_cache=cache,
+                                         total_frames=res // 8, vram_total_gb=24.0)
+                    x = memory_estimator.job_features(profile)
+                    ram = sum(true_ram[name] * v for name, v in zip(FEATURES, x))
+                    records.append({"features": dict(zip(FEATURES, x)), "actual": {"ram_gb": ram, "vram_gb": None}})
+        estimator = memory_estimator.MemoryEstimator()
+        before = estimator.predict(JobProfile(640, 640, lora_ranks=(32,), lora_cache=True)).ram_gb
+        assert estimator.refit(records) == len(records)
+        profile = JobProfile(640, 640, lora_ranks=(32,), lora_cache=True, total_frames=80, vram_total_gb=24.0)
+        expected = sum(true_ram[name] * v for name, v in zip(FEATURES, memory_estimator.job_features(profile)))
+        after = estimator.predict(profile).ram_gb
+        assert abs(after - expected) < abs(before - expected)
+        assert abs(after - expected) < 1.0
+        # VRAM の実測がない記録では VRAM の係数は既定値のまま
+        assert estimator.weights["vram"] == [memory_estimator.DEFAULT_VRAM_WEIGHTS[n] for n in FEATURES]
+
+    def test_no_records_keeps_prior(self):
+        estimator = memory_estimator.MemoryEstimator()
+        assert estimator.refit([]) == 0
+        assert estimator.margin["ram"] == memory_estimator.BASE_MARGIN_GB
+
+
+class TestLog:
+    def test_record_and_refit_from_file(self, tmp_path):
+        path = str(tmp_path / "settings" / "log.jsonl")
+        estimator = memory_estimator.MemoryEstimator(path)
+        profile = JobProfile(640, 640, lora_ranks=(16,))
+        estimate = estimator.predict(profile)
+        entry = estimator.record(profile, estimate, vram_gb=7.5, ram_gb=30.0)
+        assert entry["predicted"]["ram_gb"] == round(estimate.ram_gb, 3)
+        with open(path, encoding="utf-8") as f:
+            saved = json.loads(f.readline())
+        assert saved["actual"] == {"vram_gb": 7.5, "ram_gb": 30.0}
+        assert saved["profile"]["lora_ranks"] == [16]
+
+        fresh = memory_estimator.MemoryEstimator(path)
+        assert fresh.refit() == 1
+
+    def test_log_is_trimmed(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(memory_estimator, "MAX_RECORDS", 3)
+        path = str(tmp_path / "log.jsonl")
+        estimator = memory_estimator.MemoryEstimator(path)
+        profile = JobProfile(640, 640)
+        for i in range(7):
+            estimator.record(profile, estimator.predict(profile), ram_gb=float(i))
+        with open(path, encoding="utf-8") as f:
+            values = [json.loads(line)["actual"]["ram_gb"] for line in f]
+        assert values == [4.0, 5.0, 6.0]
+
+
+class TestLoraRank:
+    def test_reads_safetensors_header(self, tmp_path):
+        header = {
+            "__metadata__": {"format": "pt"},
+            "a.lora_down.weight": {"dtype": "BF16", "shape": [32, 3072], "data_offsets": [0, 0]},
+            "b.lora_A.weight": {"dtype": "BF16", "shape": [64, 3072], "data_offsets": [0, 0]},
+            "a.lora_up.weight": {"dtype": "BF16", "shape": [3072, 32], "data_offsets": [0, 0]},
+        }
+        data = json.dumps(header).encode("utf-8")
+        path = tmp_path / "lora.safetensors"
+        path.write_bytes(struct.pack("<Q", len(data)) + data)
+        assert memory_estimator.lora_rank(str(path)) == 64
+
+    def test_unknown_file(self, tmp_path):
+        path = tmp_path / "lora.pt"
+        path.write_bytes(b"\x00" * 4)
+        assert memory_estimator.lora_rank(str(path)) is None
+        assert memory_estimator.lora_rank(str(tmp_path / "missing")) is None
+
+
+class TestMonitor:
+    def test_peak_rss(self):
+        values = iter([1.0, 5.0, 3.0, 2.0, 2.0, 2.0])
+        monitor = memory_estimator.JobMemoryMonitor(interval=60, rss_fn=lambda: next(values, 2.0))
+        monitor.start()
+        monitor._sample()
+        monitor._sample()
+        vram, ram = monitor.stop()
+        assert vram is None and ram == 5.0
+
+
+class TestMode:
+    @pytest.mark.parametrize("value,expected", [("", "on"), ("warn", "warn"), ("OFF", "off"), ("x", "on")])
+    def test_preflight_mode(self, monkeypatch, value, expected):
+        monkeypatch.setenv("EICHI_PREFLIGHT", value)
+        assert memory_estimator.preflight_mode() == expected
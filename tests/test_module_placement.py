@@ -0,0 +1,140 @@
+"""eichi_utils.module_placement の単体テスト"""
+
+import os
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "module_placement", os.path.join(ROOT, "webui", "eichi_utils", "module_placement.py")
+)
+module_placement = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module_placement)
+
+PlacementUnit = module_placement.PlacementUnit
+
+
+class FakeTensor:
+    def __init__(self, numel, element_size=2, dtype="bf16"):
+        self._numel = numel
+        self._element_size = element_size
+        self.dtype = dtype
+
+    def numel(self):
+        return self._numel
+
+    def element_size(self):
+        return self._element_size
+
+
+class FakeModule:
+    def __init__(self, params=None, buffers=None, children=None):
+        self._parameters = dict(params or {})
+        self._buffers = dict(buffers or {})
+        self._children = dict(children or {})
+
+    def named_modules(self, prefix=""):
+        yield prefix, self
+        for name, child in self._children.items():
+            yield from child.named_modules(f"{prefix}.{name}" if prefix else name)
+
+
+class FakeTransformer(FakeModule):
+    pass
+
+
+def linear(numel, element_size=2, dtype="bf16", scale=False):
+    buffers = {"scale_weight": FakeTensor(1, 4, "f32")} if scale else {}
+    return FakeModule({"weight": FakeTensor(numel, element_size, dtype), "bias": FakeTensor(4)}, buffers)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    module_placement.clear_placement_cache()
+    yield
+    module_placement.clear_placement_cache()
+
+
+class TestPlacementUnits:
+    def test_units_in_module_order_with_subtree_bytes(self):
+        model = FakeTransformer(
+            {"scale_shift_table": FakeTensor(10)},
+            children={
+                "embed": linear(100),
+                "block": FakeModule(children={"q": linear(50), "k": linear(60)}),
+                "norm": FakeModule({"weight": FakeTensor(8)}, children={"inner": linear(20)}),
+            },
+        )
+        units, rest = module_placement.placement_units(model)
+        assert units == [
+            PlacementUnit("embed", 208),
+            PlacementUnit("block.q", 108),
+            PlacementUnit("block.k", 128),
+            # norm を動かすと inner も一緒に動く
+            PlacementUnit("norm", 16 + 48),
+            PlacementUnit("norm.inner", 0),
+        ]
+        assert rest == 20
+
+    def test_fp8_sizes_include_scale(self):
+        model = FakeTransformer(children={"a": linear(100, 1, "f8", scale=True)})
+        units, _ = module_placement.placement_units(model)
+        assert units == [PlacementUnit("a", 100 + 8 + 4)]
+
+    def test_cached_per_class_and_dtype(self):
+        calls = []
+        original = module_placement._has_weight
+
+        def counting(module):
+            calls.append(module)
+            return original(module)
+
+        module_placement._has_weight = counting
+        try:
+            first = module_placement.placement_units(FakeTransformer(children={"a": linear(100)}))
+            n = len(calls)
+            second = module_placement.placement_units(FakeTransformer(children={"a": linear(100)}))
+            assert second is first and len(calls) == n
+            # dtype 構成が違えば計算し直す
+            fp8 = module_placement.placement_units(FakeTransformer(children={"a": linear(100, 1, "f8")}))
+            assert fp8 is not first and len(calls) > n
+            # クラスが違っても計算し直す
+            other = module_placement.placement_units(FakeModule(children={"a": linear(100)}))
+            assert other is not first
+        finally:
+            module_placement._has_weight = original
+
+
+def sizes(*nbytes):
+    return [PlacementUnit(f"m{i}", n) for i, n in enumerate(nbytes)]
+
+
+class TestPlanMove:
+    def test_stops_at_preserved_memory(self):
+        # 空き 100、予約 40: 30 + 30 を動かした時点で 40 になり止まる
+        assert module_placement.plan_move(sizes(30, 30, 30, 30), 100, 40) == ([0, 1], False)
+
+    def test_overshoot_matches_original(self):
+        # 動かす前の空きで判定するので、最後の 1 つは予約を超えて動かす
+        assert module_placement.plan_move(sizes(50, 50), 60, 40) == ([0], False)
+
+    def test_everything_fits(self):
+        assert module_placement.plan_move(sizes(10, 10), 100, 40) == ([0, 1], True)
+
+    def test_resident_units_are_skipped(self):
+        assert module_placement.plan_move(sizes(30, 30, 30), 70, 40, [True, False, False]) == ([1], False)
+
+    def test_no_room(self):
+        assert module_placement.plan_move(sizes(10), 40, 40) == ([], False)
+
+
+class TestPlanOffload:
+    def test_offloads_until_preserved(self):
+        assert module_placement.plan_offload(sizes(30, 30, 30), 20, 70) == ([0, 1], False)
+
+    def test_offloaded_units_are_skipped(self):
+        assert module_placement.plan_offload(sizes(30, 30, 30), 20, 70, [False, True, True]) == ([1, 2], True)
+
+    def test_already_enough(self):
+        assert module_placement.plan_offload(sizes(30), 80, 70) == ([], False)
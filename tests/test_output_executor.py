@@ -0,0 +1,120 @@
+"""eichi_utils.output_executor の単体テスト"""
+
+import os
+import threading
+import time
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "output_executor", os.path.join(ROOT, "webui", "eichi_utils", "output_executor.py")
+)
+output_executor = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(output_executor)
+OutputExecutor = output_executor.OutputExecutor
+
+
+class TestSubmit:
+    def test_file_events_in_submit_order(self):
+        events = []
+        ex = OutputExecutor(publish=events.append, png_processes=0)
+
+        def write(path, delay):
+            time.sleep(delay)
+            return path
+
+        ex.submit(write, "a.mp4", 0.05, file_event="a.mp4")
+        ex.submit(write, "b.mp4", 0.0, file_event="b.mp4")
+        ex.submit(write, "c.mp4", 0.01, file_event="c.mp4")
+        ex.shutdown()
+        assert events == [('file', 'a.mp4'), ('file', 'b.mp4'), ('file', 'c.mp4')]
+
+    def test_on_done_receives_result(self):
+        results = []
+        ex = OutputExecutor(png_processes=0)
+        ex.submit(lambda x: x * 2, 21, on_done=results.append)
+        ex.drain()
+        assert results == [42]
+        ex.shutdown()
+
+    def test_submit_does_not_block_caller(self):
+        gate = threading.Event()
+        ex = OutputExecutor(png_processes=0)
+        t0 = time.monotonic()
+        ex.submit(gate.wait)
+        assert time.monotonic() - t0 < 0.5
+        assert ex.pending_count() == 1
+        gate.set()
+        ex.shutdown()
+        assert ex.pending_count() == 0
+
+    def test_submit_after_shutdown_raises(self):
+        ex = OutputExecutor(png_processes=0)
+        ex.shutdown()
+        try:
+            ex.submit(lambda: None)
+            assert False, "RuntimeError expected"
+        except RuntimeError:
+            pass
+
+
+class TestBackpressure:
+    def test_blocks_when_backlog_full(self):
+        gate = threading.Event()
+        ex = OutputExecutor(max_pending=1, png_processes=0)
+        ex.submit(gate.wait)
+
+        submitted = threading.Event()
+
+        def producer():
+            ex.submit(lambda: None)
+            submitted.set()
+
+        t = threading.Thread(target=producer, daemon=True)
+        t.start()
+        assert not submitted.wait(0.2)
+        gate.set()
+        assert submitted.wait(2.0)
+        ex.shutdown()
+
+
+class TestErrors:
+    def test_failed_job_reported_by_drain_and_no_file_event(self):
+        events = []
+        ex = OutputExecutor(publish=events.append, png_processes=0)
+
+        def boom():
+            raise IOError("disk full")
+
+        ex.submit(boom, file_event="x.mp4", label="x.mp4")
+        ex.submit(lambda: None, file_event="y.mp4")
+        errors = ex.drain()
+        assert [label for label, _ in errors] == ["x.mp4"]
+        assert events == [('file', 'y.mp4')]
+        # 取得後はクリアされる
+        assert ex.drain() == []
+        ex.shutdown()
+
+    def test_publish_failure_does_not_break_executor(self):
+        def bad_publish(item):
+            raise RuntimeError("closed")
+
+        ex = OutputExecutor(publish=bad_publish, png_processes=0)
+        ex.submit(lambda: None, file_event="a.mp4")
+        assert ex.drain() == []
+        assert ex.pending_count() == 0
+        ex.shutdown()
+
+
+class TestShutdown:
+    def test_shutdown_idempotent(self):
+        ex = OutputExecutor(png_processes=0)
+        ex.submit(lambda: None)
+        ex.shutdown()
+        assert ex.shutdown() == []
+
+    def test_context_manager_drains(self):
+        done = []
+        with OutputExecutor(png_processes=0) as ex:
+            ex.submit(lambda: (time.sleep(0.02), done.append(1)))
+        assert done == [1]
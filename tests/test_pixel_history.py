@@ -0,0 +1,136 @@
+"""eichi_utils.pixel_history の単体テスト
+
+torch を使わずに窓管理のロジックを検証するため、時間軸だけを持つ
+簡易テンソルとテンソル操作の差し替えを使う。
+"""
+
+import os
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "pixel_history", os.path.join(ROOT, "webui", "eichi_utils", "pixel_history.py")
+)
+pixel_history = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pixel_history)
+PixelHistory = pixel_history.PixelHistory
+
+
+class FakeBCTHW:
+    """時間軸 (dim=2) のみを持つ BCTHW 風テンソル"""
+
+    def __init__(self, frames, kind="f"):
+        self.frames = list(frames)
+        self.kind = kind
+
+    @property
+    def shape(self):
+        return (1, 1, len(self.frames), 1, 1)
+
+    @property
+    def dtype(self):
+        return "float16" if self.kind == "f" else "uint8"
+
+    def __getitem__(self, key):
+        t = key[2]
+        if isinstance(t, int):
+            return self.frames[t]
+        return FakeBCTHW(self.frames[t], self.kind)
+
+
+def _fake_soft_append(history, current, overlap):
+    # ブレンド部分は (h, c) のタプルにして、どのフレーム同士が混ざったか検証できるようにする
+    if overlap <= 0:
+        return FakeBCTHW(history.frames + current.frames)
+    blended = list(zip(history.frames[-overlap:], current.frames[:overlap]))
+    return FakeBCTHW(history.frames[:-overlap] + blended + current.frames[overlap:])
+
+
+@pytest.fixture(autouse=True)
+def fake_ops(monkeypatch):
+    monkeypatch.setattr(pixel_history, "_soft_append", _fake_soft_append)
+    monkeypatch.setattr(pixel_history, "_cat", lambda ts: FakeBCTHW(sum((t.frames for t in ts), []), ts[0].kind))
+    monkeypatch.setattr(pixel_history, "_copy", lambda x: FakeBCTHW(x.frames, x.kind))
+    monkeypatch.setattr(pixel_history, "_to_uint8", lambda x: FakeBCTHW(x.frames, "u"))
+    monkeypatch.setattr(pixel_history, "_from_uint8", lambda x, dtype: FakeBCTHW(x.frames, "f"))
+
+
+def _reference(direction, sections, overlap):
+    """従来どおり全履歴を float のまま soft_append した結果"""
+    history = None
+    for sec in sections:
+        cur = FakeBCTHW(sec)
+        if history is None:
+            history = cur
+        else:
+            ov = min(overlap, len(history.frames))
+            history = _fake_soft_append(cur, history, ov) if direction == "prepend" else _fake_soft_append(history, cur, ov)
+    return history.frames
+
+
+class TestPrepend:
+    def test_matches_full_float_history(self):
+        sections = [list(range(100, 110)), list(range(200, 208)), list(range(300, 308))]
+        ph = PixelHistory(direction="prepend", blend_frames=3)
+        for sec in sections:
+            ph.add_section(FakeBCTHW(sec), 3)
+        assert ph.to_uint8().frames == _reference("prepend", sections, 3)
+        assert ph.num_frames == len(_reference("prepend", sections, 3))
+
+    def test_only_blend_window_stays_float(self):
+        ph = PixelHistory(direction="prepend", blend_frames=3)
+        ph.add_section(FakeBCTHW(range(10)), 3)
+        ph.add_section(FakeBCTHW(range(10, 18)), 3)
+        segs = ph.segments()
+        assert segs[0][1] is False and len(segs[0][0].frames) == 3
+        assert all(is_u8 for _, is_u8 in segs[1:])
+
+    def test_frame_access_across_segments(self):
+        ph = PixelHistory(direction="prepend", blend_frames=2)
+        ph.add_section(FakeBCTHW([0, 1, 2, 3, 4]))
+        assert [ph.frame_uint8(i) for i in range(5)] == [0, 1, 2, 3, 4]
+        assert ph.frame_uint8(-1) == 4
+        with pytest.raises(IndexError):
+            ph.frame_uint8(5)
+
+
+class TestAppend:
+    def test_matches_full_float_history(self):
+        sections = [list(range(100, 109)), list(range(200, 206)), list(range(300, 306))]
+        ph = PixelHistory(direction="append", blend_frames=2)
+        for sec in sections:
+            ph.add_section(FakeBCTHW(sec), 2)
+        assert ph.to_uint8().frames == _reference("append", sections, 2)
+        segs = ph.segments()
+        assert segs[-1][1] is False and len(segs[-1][0].frames) == 2
+
+
+class TestSnapshot:
+    def test_snapshot_unaffected_by_later_sections(self):
+        ph = PixelHistory(direction="prepend", blend_frames=2)
+        ph.add_section(FakeBCTHW([1, 2, 3, 4]))
+        snap = ph.snapshot()
+        before = snap.to_uint8().frames
+        ph.add_section(FakeBCTHW([5, 6, 7]), 2)
+        assert snap.to_uint8().frames == before
+        assert ph.num_frames == 5
+
+    def test_shape_and_materialize(self):
+        ph = PixelHistory(direction="append", blend_frames=1)
+        ph.add_section(FakeBCTHW([1, 2, 3]))
+        assert ph.shape == (1, 1, 3, 1, 1)
+        full = ph.materialize()
+        assert full.frames == [1, 2, 3] and full.kind == "f"
+
+
+class TestValidation:
+    def test_invalid_direction(self):
+        with pytest.raises(ValueError):
+            PixelHistory(direction="sideways")
+
+    def test_empty_history(self):
+        ph = PixelHistory()
+        assert ph.num_frames == 0
+        assert ph.shape == (0, 0, 0, 0, 0)
@@ -0,0 +1,105 @@
+"""eichi_utils.preview_service の単体テスト"""
+
+import os
+import threading
+import time
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "preview_service", os.path.join(ROOT, "webui", "eichi_utils", "preview_service.py")
+)
+preview_service = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(preview_service)
+PreviewService = preview_service.PreviewService
+
+
+def _slow_render(delay):
+    def render(latents):
+        time.sleep(delay)
+        return f"img{latents}"
+    return render
+
+
+class TestPreviewService:
+    def test_submit_never_waits_on_render(self):
+        published = []
+        service = PreviewService(_slow_render(0.05), lambda p, step: published.append((p, step)), max_fps=0)
+        start = time.monotonic()
+        for i in range(200):
+            service.submit(i, i)
+        elapsed = time.monotonic() - start
+        service.close()
+        # 描画 200 回ぶん (10 秒) 待たずに返る
+        assert elapsed < 0.5
+        assert service.skipped > 0
+        assert published[-1] == ("img199", 199)
+
+    def test_latest_wins(self):
+        published = []
+        gate = threading.Event()
+
+        def render(latents):
+            gate.wait(1.0)
+            return latents
+
+        service = PreviewService(render, lambda p: published.append(p), max_fps=0)
+        service.submit("first")
+        time.sleep(0.05)
+        for name in ("stale1", "stale2", "latest"):
+            service.submit(name)
+        gate.set()
+        assert service.flush(1.0)
+        service.close()
+        assert published == ["first", "latest"]
+        assert service.skipped == 2
+
+    def test_rate_limit(self):
+        published = []
+        service = PreviewService(lambda x: x, lambda p: published.append(p), max_fps=10)
+        end = time.monotonic() + 0.35
+        i = 0
+        while time.monotonic() < end:
+            service.submit(i)
+            i += 1
+            time.sleep(0.001)
+        count_before_flush = len(published)
+        service.close()
+        # 0.35 秒 / 10 fps → 高々 4 回 (初回は即時)
+        assert count_before_flush <= 5
+        assert published[-1] == i - 1
+
+    def test_close_without_flush_drops_pending(self):
+        published = []
+        service = PreviewService(lambda x: x, lambda p: published.append(p), max_fps=0.5)
+        service.submit(1)
+        service.flush(1.0)
+        service.submit(2)
+        service.close(flush=False)
+        assert published == [1]
+        service.submit(3)
+        assert service.submitted == 2
+
+    def test_render_error_does_not_stop_service(self):
+        published = []
+
+        def render(x):
+            if x == "bad":
+                raise RuntimeError("boom")
+            return x
+
+        service = PreviewService(render, lambda p: published.append(p), max_fps=0)
+        service.submit("bad")
+        service.flush(1.0)
+        service.submit("good")
+        service.close()
+        assert published == ["good"]
+        assert service._error_reported
+
+    def test_env_max_fps(self, monkeypatch):
+        monkeypatch.setenv("EICHI_PREVIEW_MAX_FPS", "2")
+        service = PreviewService(lambda x: x, lambda p: None)
+        try:
+            assert service._interval == 0.5
+        finally:
+            service.close()
@@ -37,3 +37,14 @@ def test_save_and_load(tmp_path, monkeypatch):
 def test_load_missing(tmp_path, monkeypatch):
     monkeypatch.setattr(prompt_cache, 'get_cache_dir', lambda: tmp_path)
     assert prompt_cache.load_from_cache('a', 'b') is None
+
+
+def test_preload_is_used_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt_cache, 'get_cache_dir', lambda: tmp_path)
+    assert prompt_cache.preload('q', 'n') is False
+    prompt_cache.save_to_cache('q', 'n', {'x': 2})
+    assert prompt_cache.preload('q', 'n') is True
+    # 先読み後にディスクから消えても、先読み分が使われる
+    (tmp_path / (prompt_cache.prompt_hash('q', 'n') + '.pt')).unlink()
+    assert prompt_cache.load_from_cache('q', 'n') == {'x': 2}
+    assert prompt_cache.load_from_cache('q', 'n') is None
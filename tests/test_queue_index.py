@@ -0,0 +1,158 @@
+"""eichi_utils.queue_index (キュー状態の SQLite インデックス) の単体テスト"""
+
+import os
+import sys
+import json
+import time
+import random
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+
+from eichi_utils import queue_index  # noqa: E402
+from eichi_utils.config_queue_manager import (  # noqa: E402
+    ConfigQueueManager, SCHEDULING_GROUP_BY_TRANSFORMER, plan_queue_order,
+)
+
+
+def config(name, lora=None, priority=None):
+    data = {
+        "config_name": name,
+        "lora_settings": {"use_lora": bool(lora), "lora_files": [lora] if lora else [], "lora_scales": "0.8"},
+        "other_params": {},
+    }
+    if priority is not None:
+        data["priority"] = priority
+    return data
+
+
+def write(directory, data, mtime=None):
+    path = os.path.join(directory, f"{data['config_name']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def settle(*directories):
+    # ディレクトリの mtime を過去にして、直後の変更として扱われないようにする
+    past = time.time() - 60
+    for directory in directories:
+        os.utime(directory, (past, past))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return ConfigQueueManager(str(tmp_path))
+
+
+class TestRefresh:
+    def test_picks_up_files_and_skips_unchanged_directories(self, manager, monkeypatch):
+        for i, name in enumerate(["b", "a", "c"]):
+            write(manager.queue_dir, config(name), mtime=1000 + i)
+        settle(manager.queue_dir)
+        assert manager.index.refresh([queue_index.STATE_QUEUED]) == [queue_index.STATE_QUEUED]
+        assert manager.index.refresh([queue_index.STATE_QUEUED]) == []
+
+        def no_listdir(path):
+            raise AssertionError(f"directory scanned: {path}")
+
+        # 変更が無ければ状態の問い合わせでディレクトリを走査しない
+        settle(manager.processing_dir, manager.completed_dir)
+        manager.get_queue_status()
+        monkeypatch.setattr(queue_index.os, "listdir", no_listdir)
+        status = manager.get_queue_status(queued_limit=2)
+        assert status["queued"] == ["a", "b"] and status["queue_count"] == 3
+        assert manager._get_queued_names_fifo() == ["b", "a", "c"]
+
+    def test_recent_change_is_rescanned(self, manager):
+        write(manager.queue_dir, config("a"))
+        manager.get_queue_status()
+        # 同じ mtime のまま次のファイルが増えても、2 秒以内の変更は信用せずに読み直す
+        stamp = os.stat(manager.queue_dir).st_mtime_ns
+        write(manager.queue_dir, config("b"))
+        os.utime(manager.queue_dir, ns=(stamp, stamp))
+        assert manager.get_queue_status()["queue_count"] == 2
+
+    def test_rebuilds_from_directories(self, tmp_path):
+        first = ConfigQueueManager(str(tmp_path))
+        write(first.completed_dir, config("old"), mtime=1000)
+        write(first.completed_dir, config("new"), mtime=2000)
+        write(first.error_dir, dict(config("bad"), error={"message": "boom"}))
+        os.remove(os.path.join(tmp_path, "queue_index.db"))
+        second = ConfigQueueManager(str(tmp_path))
+        assert second.get_queue_status()["completed"] == ["new", "old"]
+        second.index.refresh([queue_index.STATE_ERROR])
+        assert second.index.get(queue_index.STATE_ERROR, "bad")["error"] == "boom"
+
+
+class TestTransitions:
+    def test_counts_timestamps_and_error_text(self, manager):
+        for name in "abc":
+            write(manager.queue_dir, config(name))
+        assert manager._has_queued_items()
+        assert manager._move_to_processing("a") and manager._move_to_processing("b")
+        status = manager.get_queue_status()
+        assert status["queue_count"] == 1 and status["processing"] == "a"
+        assert manager.index.count(queue_index.STATE_PROCESSING) == 2
+
+        manager._move_to_completed("a")
+        manager._move_to_error("b", "CUDA out of memory")
+        row = manager.index.get(queue_index.STATE_ERROR, "b")
+        assert row["error"] == "CUDA out of memory" and row["started_at"] <= row["finished_at"]
+        assert manager.index.get(queue_index.STATE_COMPLETED, "a")["finished_at"] is not None
+        assert [manager.index.count(s) for s in (queue_index.STATE_QUEUED, queue_index.STATE_PROCESSING,
+                                                 queue_index.STATE_COMPLETED, queue_index.STATE_ERROR)] == [1, 0, 1, 1]
+
+    def test_failed_claim_leaves_index_untouched(self, manager):
+        write(manager.queue_dir, config("a"))
+        manager._has_queued_items()
+        os.remove(os.path.join(manager.queue_dir, "a.json"))
+        assert not manager.claim_queue_item("a")
+        # ファイルが消えたのはディレクトリの走査で反映される
+        assert manager.index.get(queue_index.STATE_PROCESSING, "a") is None
+        assert not manager._has_queued_items()
+
+    def test_claim_and_requeue_keep_fifo_position(self, manager):
+        write(manager.queue_dir, config("a"), mtime=1000)
+        write(manager.queue_dir, config("b"), mtime=2000)
+        assert manager.claim_queue_item("a", {"slot": 1})
+        assert json.loads(manager.index.get(queue_index.STATE_PROCESSING, "a")["owner"])["slot"] == 1
+        assert manager._get_queued_names_fifo() == ["b"]
+        assert manager.requeue_processing_item("a", {"device": "cuda:0", "error": "boom"})
+        assert manager._get_queued_names_fifo() == ["a", "b"]
+        assert manager.index.get(queue_index.STATE_QUEUED, "a")["error"] == "boom"
+
+    def test_priority_is_indexed(self, manager):
+        write(manager.queue_dir, config("a"), mtime=1000)
+        write(manager.queue_dir, config("b"), mtime=2000)
+        manager.set_queue_priority("b", 3)
+        assert manager._get_next_queue_item() == "a"  # FIFO は優先度を見ない
+        manager.set_scheduling_policy(SCHEDULING_GROUP_BY_TRANSFORMER)
+        assert manager._get_next_queue_item() == "b"
+
+
+def test_next_grouped_matches_plan_queue_order(manager):
+    rng = random.Random(7)
+    for i in range(60):
+        data = config(f"item{i:02d}", rng.choice([None, "x", "y", "z"]), rng.choice([None, 0, 1, 2]))
+        write(manager.queue_dir, data, mtime=1000 + rng.randrange(100000))
+    entries = manager._get_queued_entries_fifo()
+    signatures = sorted({sig for _, _, sig in entries}, key=str) + [None]
+    for active in signatures:
+        for exclude in (None, entries[0][0]):
+            expected = plan_queue_order([e for e in entries if e[0] != exclude], active)[0]
+            assert manager.index.next_grouped(active, exclude) == expected
+
+
+def test_available_configs(manager):
+    write(manager.configs_dir, config("b"))
+    write(manager.configs_dir, config("a"))
+    with open(os.path.join(manager.configs_dir, "broken.json"), "w", encoding="utf-8") as f:
+        f.write("{")
+    assert manager.get_available_configs() == ["a", "b"]
+    os.remove(os.path.join(manager.configs_dir, "b.json"))
+    assert manager.get_available_configs() == ["a"]
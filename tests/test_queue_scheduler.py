@@ -0,0 +1,217 @@
+"""eichi_utils.queue_scheduler (複数デバイスのキュー処理) の単体テスト"""
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, "webui"))
+spec = importlib.util.spec_from_file_location(
+    "queue_scheduler", os.path.join(ROOT, "webui", "eichi_utils", "queue_scheduler.py")
+)
+queue_scheduler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(queue_scheduler)
+
+from eichi_utils.config_queue_manager import ConfigQueueManager  # noqa: E402
+
+
+def config(name, lora=None):
+    return {
+        "config_name": name,
+        "lora_settings": {"use_lora": bool(lora), "lora_files": [lora] if lora else [], "lora_scales": "0.8"},
+        "other_params": {},
+    }
+
+
+def make_manager(tmp_path, configs):
+    manager = ConfigQueueManager(str(tmp_path))
+    for i, data in enumerate(configs):
+        path = os.path.join(manager.queue_dir, f"{data['config_name']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.utime(path, (1000 + i, 1000 + i))
+    return manager
+
+
+def listed(directory, suffix=".json"):
+    return sorted(f[:-len(suffix)] for f in os.listdir(directory) if f.endswith(suffix))
+
+
+class FakeDevice:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeManager:
+    """TransformerManager の代わり。構成が変わった回数を数える"""
+
+    def __init__(self, device):
+        self.device = device
+        self.loaded = None
+        self.loads = 0
+
+    def ensure(self, lora):
+        if lora != self.loaded:
+            self.loaded = lora
+            self.loads += 1
+
+
+class Recorder:
+    def __init__(self, fail=None, delay=0.02):
+        self.fail = fail or (lambda name, device: False)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.runs = []
+        self.managers = []
+
+    def factory(self, device):
+        manager = FakeManager(device)
+        with self.lock:
+            self.managers.append(manager)
+        return manager
+
+    def __call__(self, config_data, slot):
+        name = config_data["config_name"]
+        assert slot.manager.device is slot.device
+        slot.manager.ensure(tuple(config_data["lora_settings"]["lora_files"]))
+        with self.lock:
+            self.runs.append((name, str(slot.device)))
+        time.sleep(self.delay)
+        if self.fail(name, str(slot.device)):
+            raise RuntimeError(f"CUDA error on {slot.device}")
+        return True
+
+
+def run_scheduler(manager, recorder, devices=("cuda:0", "cuda:1"), **options):
+    scheduler = queue_scheduler.MultiDeviceScheduler(
+        manager, [FakeDevice(d) for d in devices], recorder,
+        manager_factory=recorder.factory, idle_poll=0.05, **options)
+    done = threading.Thread(target=scheduler.run, daemon=True)
+    done.start()
+    done.join(timeout=20)
+    assert not done.is_alive()
+    return scheduler
+
+
+class TestPickQueueItem:
+    entries = [("a", 0, "X"), ("b", 0, "Y"), ("c", 0, "X"), ("d", 0, "Z")]
+
+    def test_prefers_loaded_signature(self):
+        assert queue_scheduler.pick_queue_item(self.entries, "Y") == "b"
+        assert queue_scheduler.pick_queue_item(self.entries, None) == "a"
+
+    def test_leaves_groups_loaded_on_other_slots(self):
+        assert queue_scheduler.pick_queue_item(self.entries, None, other_signatures=["X"]) == "b"
+        # 全部他のスロットの構成なら先頭を取る (空けて待たない)
+        assert queue_scheduler.pick_queue_item(self.entries, None, other_signatures=["X", "Y", "Z"]) == "a"
+
+    def test_priority_and_exclusion(self):
+        entries = self.entries + [("e", 5, "X")]
+        assert queue_scheduler.pick_queue_item(entries, "Y", other_signatures=["X"]) == "e"
+        assert queue_scheduler.pick_queue_item(entries, "Y", ["X"], excluded={"e", "b"}) == "d"
+        assert queue_scheduler.pick_queue_item(entries, None, excluded={n for n, _, _ in entries}) is None
+
+
+class TestMultiDeviceScheduler:
+    def test_items_spread_over_devices_with_lora_affinity(self, tmp_path):
+        names = [("a", "x"), ("b", "y"), ("c", "x"), ("d", "y"), ("e", "x"), ("f", "y")]
+        manager = make_manager(tmp_path, [config(n, lora) for n, lora in names])
+        recorder = Recorder()
+        scheduler = run_scheduler(manager, recorder)
+        assert sorted(n for n, _ in recorder.runs) == ["a", "b", "c", "d", "e", "f"]
+        assert listed(manager.completed_dir) == ["a", "b", "c", "d", "e", "f"]
+        assert listed(manager.processing_dir) == [] and listed(manager.processing_dir, ".claim") == []
+        # 各デバイスが 1 つの LoRA だけを読み込み、項目を分け合う
+        devices = {n: d for n, d in recorder.runs}
+        assert {devices[n] for n in "ace"} != {devices[n] for n in "bdf"}
+        assert all(m.loads == 1 for m in recorder.managers)
+        assert scheduler.processed == 6 and scheduler.errors == 0
+
+    def test_failed_item_is_rerun_on_another_device(self, tmp_path):
+        manager = make_manager(tmp_path, [config("a"), config("b")])
+        recorder = Recorder(fail=lambda name, device: name == "a" and device == "cuda:0", delay=0.05)
+        scheduler = run_scheduler(manager, recorder)
+        assert [d for n, d in recorder.runs if n == "a"] == ["cuda:0", "cuda:1"]
+        assert listed(manager.completed_dir) == ["a", "b"]
+        with open(os.path.join(manager.completed_dir, "a.json"), encoding="utf-8") as f:
+            attempts = json.load(f)["queue_attempts"]
+        assert attempts[0]["device"] == "cuda:0" and "CUDA error" in attempts[0]["error"]
+        assert scheduler.errors == 0
+
+    def test_error_after_every_device_failed(self, tmp_path):
+        manager = make_manager(tmp_path, [config("a")])
+        recorder = Recorder(fail=lambda name, device: True)
+        scheduler = run_scheduler(manager, recorder, max_attempts=5)
+        assert sorted(d for _, d in recorder.runs) == ["cuda:0", "cuda:1"]
+        assert listed(manager.error_dir) == ["a"]
+        assert scheduler.errors == 1
+
+    def test_broken_slot_is_disabled(self, tmp_path):
+        manager = make_manager(tmp_path, [config(n) for n in "abcdef"])
+        recorder = Recorder(fail=lambda name, device: device == "cuda:1")
+        scheduler = run_scheduler(manager, recorder, max_slot_failures=2)
+        assert listed(manager.completed_dir) == list("abcdef")
+        assert sum(d == "cuda:1" for _, d in recorder.runs) == 2
+        assert [s["disabled"] for s in scheduler.status()] == [False, True]
+
+    def test_processes_sharing_a_queue_never_run_an_item_twice(self, tmp_path):
+        names = [f"item{i:02d}" for i in range(24)]
+        make_manager(tmp_path, [config(n) for n in names])
+        recorder = Recorder(delay=0.005)
+        # 同じディレクトリを別プロセスの ConfigQueueManager として 2 つ開く
+        threads = [
+            threading.Thread(target=run_scheduler, args=(ConfigQueueManager(str(tmp_path)), recorder, devices))
+            for devices in (("cuda:0", "cuda:1"), ("cuda:2", "cuda:3"))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=30)
+        assert sorted(n for n, _ in recorder.runs) == names
+        assert listed(os.path.join(tmp_path, "completed")) == names
+
+
+class TestClaims:
+    def test_claim_is_exclusive(self, tmp_path):
+        first = make_manager(tmp_path, [config("a")])
+        second = ConfigQueueManager(str(tmp_path))
+        assert first.claim_queue_item("a", {"slot": 0})
+        assert not second.claim_queue_item("a", {"slot": 1})
+        with open(os.path.join(first.processing_dir, "a.claim"), encoding="utf-8") as f:
+            claim = json.load(f)
+        assert claim["pid"] == os.getpid() and claim["slot"] == 0
+
+    def test_stale_claim_of_dead_process_is_recovered(self, tmp_path):
+        manager = make_manager(tmp_path, [config("a"), config("b")])
+        mtime = os.path.getmtime(os.path.join(manager.queue_dir, "a.json"))
+        assert manager.claim_queue_item("a") and manager.claim_queue_item("b")
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        claim_path = os.path.join(manager.processing_dir, "a.claim")
+        with open(claim_path, encoding="utf-8") as f:
+            claim = json.load(f)
+        claim["pid"] = dead.pid
+        with open(claim_path, "w", encoding="utf-8") as f:
+            json.dump(claim, f)
+        # b はこのプロセスが持っているので戻さない
+        assert manager.recover_stale_claims() == ["a"]
+        assert listed(manager.queue_dir) == ["a"] and listed(manager.processing_dir) == ["b"]
+        assert os.path.getmtime(os.path.join(manager.queue_dir, "a.json")) == mtime
+
+
+def test_start_multi_device_processing(tmp_path):
+    manager = make_manager(tmp_path, [config("a"), config("b", "x")])
+    recorder = Recorder()
+    ok, _ = manager.start_multi_device_processing(recorder, ["cpu:0", "cpu:1"], manager_factory=recorder.factory)
+    assert ok and manager.is_processing
+    assert manager.start_multi_device_processing(recorder, ["cpu:0"])[0] is False
+    manager.queue_thread.join(timeout=10)
+    assert not manager.is_processing and manager.current_config is None
+    assert listed(manager.completed_dir) == ["a", "b"]
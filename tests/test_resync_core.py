@@ -216,3 +216,196 @@ class TestBugFixes:
         """_DEFAULT_GET_TIMEOUT が定義されている"""
         assert hasattr(rc, '_DEFAULT_GET_TIMEOUT')
         assert rc._DEFAULT_GET_TIMEOUT > 0
+
+
+def drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+    return items
+
+
+def progress(preview, desc):
+    return ("progress", (preview, desc, ""))
+
+
+class TestCoalescing:
+    def test_progress_flood_keeps_file_and_seed(self):
+        fq = FanoutQueue(maxlen=5, maxsize=5)
+        q = fq.subscribe()
+        fq.publish(("seed", 1))
+        for i in range(1000):
+            fq.publish(progress(f"img{i}", f"step {i}"))
+        fq.publish(("file", "a.png"))
+        fq.close()
+        assert drain(q) == [("seed", 1), progress("img999", "step 999"), ("file", "a.png"), BUS_END_SENTINEL]
+
+    def test_progress_is_delivered_in_publish_order(self):
+        fq = FanoutQueue()
+        q = fq.subscribe()
+        fq.publish(progress(None, "p1"))
+        fq.publish(("file", "a.png"))
+        fq.publish(("end", None))
+        assert drain(q) == [progress(None, "p1"), ("file", "a.png"), ("end", None)]
+
+        fq.publish(progress(None, "p2"))
+        fq.publish(("file", "b.png"))
+        fq.publish(progress(None, "p3"))
+        assert drain(q) == [("file", "b.png"), progress(None, "p3")]
+
+    def test_newer_progress_inherits_pending_preview(self):
+        fq = FanoutQueue()
+        q = fq.subscribe()
+        fq.publish(progress("img", "sampling"))
+        fq.publish(progress(None, "decoding"))
+        assert drain(q) == [progress("img", "decoding")]
+
+    def test_get_blocks_until_publish(self):
+        fq = FanoutQueue()
+        q = fq.subscribe()
+        timer = threading.Timer(0.05, fq.publish, (("seed", 7),))
+        timer.start()
+        assert q.get(timeout=5) == ("seed", 7)
+        assert q.qsize() == 0
+
+    def test_preview_encoded_once_and_shared(self):
+        calls = []
+
+        def encoder(preview):
+            calls.append(preview)
+            return object()
+
+        fq = FanoutQueue(preview_encoder=encoder)
+        subs = [fq.subscribe() for _ in range(3)]
+        fq.publish(progress("raw", "step"))
+        fq.publish(progress(None, "text only"))
+        assert calls == ["raw"]
+        previews = [q.get_nowait()[1][0] for q in subs]
+        assert previews[0] is previews[1] is previews[2]
+
+    def test_encoder_failure_falls_back_to_original(self):
+        def encoder(preview):
+            raise RuntimeError("encode failed")
+
+        fq = FanoutQueue(preview_encoder=encoder)
+        q = fq.subscribe()
+        fq.publish(progress("raw", "step"))
+        assert q.get_nowait() == progress("raw", "step")
+
+
+class FakeImage:
+    def save(self, path, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+
+class TestPreviewFileEncoder:
+    def test_writes_png_and_keeps_recent_files(self, tmp_path):
+        encoder = rc.PreviewFileEncoder(str(tmp_path), keep=2)
+        paths = [encoder(FakeImage()) for _ in range(4)]
+        assert len(set(paths)) == 4
+        assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths[-2:])
+
+    def test_passes_through_non_images(self, tmp_path):
+        encoder = rc.PreviewFileEncoder(str(tmp_path))
+        assert encoder(None) is None
+        assert encoder("already.png") == "already.png"
+        assert os.listdir(tmp_path) == []
+
+    def test_held_files_survive_until_released(self, tmp_path):
+        encoder = rc.PreviewFileEncoder(str(tmp_path), keep=2)
+        first = encoder(FakeImage())
+        encoder.hold("last_preview_image", first)
+        for _ in range(3):
+            encoder(FakeImage())
+        assert os.path.exists(first)
+        encoder.hold("last_preview_image", None)
+        assert not os.path.exists(first)
+
+    def test_undelivered_slot_keeps_its_preview(self, tmp_path):
+        encoder = rc.PreviewFileEncoder(str(tmp_path), keep=2)
+        fq = FanoutQueue(preview_encoder=encoder)
+        slow = fq.subscribe()
+        fq.publish(("progress", (FakeImage(), "d0", "b0")))
+        pending = slow._latest[1][1][0]
+        for i in range(3):
+            fq.publish(("progress", (None, f"d{i + 1}", "b")))
+            encoder(FakeImage())   # 他のジョブ・タブのプレビューで keep 件を超える
+        item = slow.get_nowait()
+        assert item[1][0] == pending and os.path.exists(pending)
+        # 配信済みのプレビューは次のプレビューを渡すまで残る
+        fq.publish(("progress", (FakeImage(), "d9", "b9")))
+        assert os.path.exists(pending)
+        slow.get_nowait()
+        assert not os.path.exists(pending)
+        fq.unsubscribe(slow)
+        assert len(os.listdir(tmp_path)) == 2
+
+
+class FakeLoop:
+    """call_soon_threadsafe の呼び出しを記録するだけのループ"""
+
+    def __init__(self, closed=False):
+        self.callbacks = []
+        self.closed = closed
+
+    def call_soon_threadsafe(self, callback, *args):
+        if self.closed:
+            raise RuntimeError("Event loop is closed")
+        self.callbacks.append(callback)
+
+    def time(self):
+        return time.monotonic()
+
+
+class TestAsyncSubscription:
+    def test_history_live_and_sentinel(self):
+        import asyncio
+
+        fq = FanoutQueue()
+        fq.publish(("seed", 1))
+
+        async def follow():
+            items = []
+            async with fq.subscribe_async() as sub:
+                threading.Timer(0.05, lambda: (fq.publish(("file", "a.png")), fq.close())).start()
+                async for item in sub:
+                    items.append(item)
+            return items
+
+        assert asyncio.run(follow()) == [("seed", 1), ("file", "a.png"), BUS_END_SENTINEL]
+        assert not fq._subs
+
+    def test_get_timeout(self):
+        import asyncio
+        import queue
+
+        async def wait():
+            sub = FanoutQueue().subscribe_async()
+            try:
+                await sub.get(timeout=0.05)
+            except queue.Empty:
+                return True
+            return False
+
+        assert asyncio.run(wait())
+
+    def test_one_pending_wakeup_per_subscriber(self):
+        loop = FakeLoop()
+        fq = FanoutQueue()
+        sub = fq.subscribe_async(loop=loop)
+        for i in range(100):
+            fq.publish(progress(None, f"step {i}"))
+        fq.publish(("file", "a.png"))
+        assert len(loop.callbacks) == 1
+        assert sub.qsize() == 2
+        # 起床を処理した後の publish は再び予約する
+        loop.callbacks.pop()()
+        fq.publish(("seed", 3))
+        assert len(loop.callbacks) == 1
+
+    def test_closed_loop_detaches_subscription(self):
+        fq = FanoutQueue()
+        sub = fq.subscribe_async(loop=FakeLoop(closed=True))
+        fq.publish(("seed", 1))
+        assert sub not in fq._subs
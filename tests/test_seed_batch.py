@@ -0,0 +1,80 @@
+"""eichi_utils.seed_batch の単体テスト"""
+
+import os
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "seed_batch", os.path.join(ROOT, "webui", "eichi_utils", "seed_batch.py")
+)
+seed_batch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(seed_batch)
+
+
+class FakeTensor:
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.expanded = False
+
+    def expand(self, *shape):
+        t = FakeTensor(shape)
+        t.expanded = True
+        return t
+
+
+@pytest.fixture(autouse=True)
+def no_env(monkeypatch):
+    monkeypatch.delenv("EICHI_SEED_BATCH", raising=False)
+
+
+class TestChooseSeedBatchSize:
+    def test_disabled_by_default(self):
+        assert seed_batch.choose_seed_batch_size(640 * 640, 80 * 1024 ** 3) == 1
+
+    def test_auto_uses_free_vram(self, monkeypatch):
+        monkeypatch.setenv("EICHI_SEED_BATCH", "auto")
+        per_sample = 640 * 640 * seed_batch._SAMPLE_BYTES_PER_PIXEL
+        assert seed_batch.choose_seed_batch_size(640 * 640, 3 * per_sample + 1) == 3
+        assert seed_batch.choose_seed_batch_size(640 * 640, per_sample // 2) == 1
+        assert seed_batch.choose_seed_batch_size(640 * 640, 1000 * per_sample) == seed_batch.AUTO_MAX_SEED_BATCH
+        assert seed_batch.choose_seed_batch_size(640 * 640, None) == 1
+
+    def test_env_limit(self, monkeypatch):
+        monkeypatch.setenv("EICHI_SEED_BATCH", "2")
+        assert seed_batch.choose_seed_batch_size(64 * 64, 80 * 1024 ** 3) == 2
+        monkeypatch.setenv("EICHI_SEED_BATCH", "invalid")
+        assert seed_batch.seed_batch_limit() == 1
+
+
+class TestPlanSampleBatches:
+    def test_batches_do_not_cross_reference_groups(self):
+        # batch_count=5, 参照画像 2 枚 → 10 回。K=3 でも参照画像の区切りはまたがない
+        keys = [i // 5 for i in range(10)]
+        assert seed_batch.plan_sample_batches(keys, 3) == [[0, 1, 2], [3, 4], [5, 6, 7], [8, 9]]
+
+    def test_input_by_reference_product(self):
+        # 入力画像 3 枚 × 参照画像 2 枚 (参照画像ごとに入力画像を一巡する順序)
+        keys = [("a", "p"), ("b", "p"), ("c", "p")] * 2
+        assert seed_batch.plan_sample_batches(keys, 4) == [[0, 3], [1, 4], [2, 5]]
+
+    def test_chunks_by_k_in_order(self):
+        keys = ["same"] * 5
+        assert seed_batch.plan_sample_batches(keys, 2) == [[0, 1], [2, 3], [4]]
+
+    def test_prompt_and_none_keys_are_not_merged(self):
+        keys = [("a", "p1"), ("a", "p2"), None, None, ("a", "p1")]
+        assert seed_batch.plan_sample_batches(keys, 8) == [[0, 4], [1], [2], [3]]
+
+    def test_k1_is_one_per_batch(self):
+        assert seed_batch.plan_sample_batches(["x"] * 3, 1) == [[0], [1], [2]]
+
+
+class TestExpandToBatch:
+    def test_expand_only_single_batch(self):
+        t = seed_batch.expand_to_batch(FakeTensor((1, 16, 1, 8, 8)), 4)
+        assert t.shape == (4, 16, 1, 8, 8) and t.expanded
+        batched = FakeTensor((4, 16))
+        assert seed_batch.expand_to_batch(batched, 4) is batched
+        assert seed_batch.expand_to_batch(None, 4) is None
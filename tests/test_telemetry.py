@@ -0,0 +1,179 @@
+"""eichi_utils.telemetry の単体テスト"""
+
+import os
+import json
+import time
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "telemetry", os.path.join(ROOT, "webui", "eichi_utils", "telemetry.py")
+)
+telemetry = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(telemetry)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def make_job(clock, values=None):
+    samples = iter(values or [])
+    return telemetry.JobTelemetry(
+        "job1", interval=0, clock=clock,
+        sample_fn=lambda: next(samples, {"host_rss_gb": 1.0, "cuda_allocated_gb": None}),
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_current_job():
+    telemetry.finish_job()
+    yield
+    telemetry.finish_job()
+
+
+class TestJobTelemetry:
+    def test_spans_and_laps(self):
+        clock = FakeClock()
+        job = make_job(clock).start()
+        with job.span("text encode"):
+            clock.advance(2)
+        job.lap("sampling step", step=1)
+        clock.advance(1)
+        job.lap("sampling step", step=2)
+        clock.advance(3)
+        job.end_lap("sampling step")
+        job.stop()
+        assert [(s[0], s[1], s[2], s[4]) for s in job.spans] == [
+            ("text encode", 0.0, 2.0, {}),
+            ("sampling step", 2.0, 3.0, {"step": 1}),
+            ("sampling step", 3.0, 6.0, {"step": 2}),
+        ]
+        summary = job.summary()["spans"]["sampling step"]
+        assert summary["count"] == 2 and abs(summary["total_s"] - 4.0) < 1e-9 and summary["max_s"] == 3.0
+        assert job.duration == 6.0
+
+    def test_open_spans_are_closed_on_stop(self):
+        clock = FakeClock()
+        job = make_job(clock).start()
+        job.begin("VAE decode")
+        job.lap("sampling step", step=5)
+        clock.advance(1)
+        job.stop()
+        assert sorted(s[0] for s in job.spans) == ["VAE decode", "sampling step"]
+        assert all(s[4]["unfinished"] for s in job.spans)
+
+    def test_peaks_ignore_missing_values(self):
+        clock = FakeClock()
+        job = make_job(clock, [
+            {"host_rss_gb": 3.0, "cuda_allocated_gb": None},
+            {"host_rss_gb": 5.0, "cuda_allocated_gb": 2.0},
+            {"host_rss_gb": 4.0, "cuda_allocated_gb": 1.0},
+        ]).start()
+        job.sample()
+        job.stop()
+        assert job.summary()["peaks"] == {"host_rss_gb": 5.0, "cuda_allocated_gb": 2.0}
+
+    def test_chrome_trace_events(self):
+        clock = FakeClock()
+        job = make_job(clock, [{"host_rss_gb": 2.0, "cuda_allocated_gb": 1.5}]).start()
+        clock.advance(0.5)
+        with job.span("encode MP4", section=0):
+            clock.advance(0.25)
+        job.instant("seed", value=1)
+        job.stop()
+        events = job.to_chrome_trace()["traceEvents"]
+        span = next(e for e in events if e["ph"] == "X")
+        assert span["name"] == "encode MP4" and span["ts"] == 500000.0 and span["dur"] == 250000.0
+        assert span["args"] == {"section": 0}
+        counters = [e for e in events if e["ph"] == "C"]
+        assert counters[0]["name"] == "host memory (GB)" and counters[0]["args"] == {"host_rss_gb": 2.0}
+        assert counters[1]["args"] == {"cuda_allocated_gb": 1.5}
+        assert any(e["ph"] == "i" and e["name"] == "seed" for e in events)
+
+    def test_sampler_thread(self):
+        calls = []
+        job = telemetry.JobTelemetry("job1", interval=0.01, sample_fn=lambda: calls.append(1) or {})
+        job.start()
+        deadline = time.monotonic() + 5
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        job.stop()
+        assert job._thread is None
+        n = len(calls)
+        assert len(job.samples) == n
+
+
+class TestModuleLevel:
+    def test_disabled_is_a_no_op(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("EICHI_TELEMETRY", "off")
+        assert telemetry.start_job("job1", str(tmp_path)) is None
+        with telemetry.span("text encode"):
+            pass
+        telemetry.end(telemetry.begin("VAE decode"))
+        telemetry.lap("sampling step")
+        assert telemetry.finish_job() is None
+        assert os.listdir(tmp_path) == []
+
+    @pytest.mark.parametrize("mode,suffix", [("json", "_telemetry.json"), ("chrome", "_trace.json")])
+    def test_writes_next_to_outputs(self, tmp_path, mode, suffix):
+        clock = FakeClock()
+        job = telemetry.start_job("job1", str(tmp_path), mode=mode, interval=0, clock=clock,
+                                  sample_fn=lambda: {"host_rss_gb": 1.0})
+        assert telemetry.current() is job
+        with telemetry.span("text encode"):
+            clock.advance(1)
+        handle = telemetry.begin("sampling", steps=2)
+        telemetry.lap("sampling step", step=1)
+        clock.advance(1)
+        telemetry.end_lap("sampling step")
+        clock.advance(0.5)
+        telemetry.end(handle)
+        path = telemetry.finish_job()
+        assert path == str(tmp_path / f"job1{suffix}")
+        assert telemetry.current() is None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if mode == "json":
+            assert [s["name"] for s in data["spans"]] == ["text encode", "sampling", "sampling step"]
+            assert data["summary"]["spans"]["sampling"]["total_s"] == 1.5
+        else:
+            assert sum(e["ph"] == "X" for e in data["traceEvents"]) == 3
+
+    def test_traced_records_on_the_calling_job(self, tmp_path):
+        def save(path, fps=30):
+            return (path, fps)
+
+        assert telemetry.traced("encode MP4", save) is save   # 記録していなければそのまま
+        job = telemetry.start_job("job1", str(tmp_path), mode="json", interval=0)
+        wrapped = telemetry.traced("encode MP4", save, section=2)
+        assert wrapped.__name__ == "save"
+        assert wrapped("a.mp4", fps=24) == ("a.mp4", 24)
+        telemetry.finish_job()
+        assert [(s[0], s[4]) for s in job.spans] == [("encode MP4", {"section": 2})]
+
+    def test_new_job_discards_unfinished_one(self, tmp_path):
+        first = telemetry.start_job("a", str(tmp_path), mode="json", interval=0)
+        second = telemetry.start_job("b", str(tmp_path), mode="json", interval=0)
+        assert telemetry.current() is second and first.duration is not None
+        assert telemetry.finish_job().endswith("b_telemetry.json")
+        assert os.listdir(tmp_path) == ["b_telemetry.json"]
+
+    @pytest.mark.parametrize("value,expected", [("", "off"), ("JSON", "json"), ("chrome", "chrome"), ("x", "off")])
+    def test_mode(self, monkeypatch, value, expected):
+        monkeypatch.setenv("EICHI_TELEMETRY", value)
+        assert telemetry.telemetry_mode() == expected
+
+
+def test_memory_sample_without_torch():
+    sample = telemetry.memory_sample()
+    assert set(sample) == {"host_rss_gb", "host_avail_gb", "cuda_allocated_gb", "cuda_reserved_gb"}
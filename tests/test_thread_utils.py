@@ -0,0 +1,141 @@
+"""diffusers_helper.thread_utils の単体テスト"""
+
+import os
+import sys
+import time
+import threading
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture
+def thread_utils():
+    # Listener はクラス変数で状態を持つので、テストごとに読み込み直す
+    spec = importlib.util.spec_from_file_location(
+        "thread_utils", os.path.join(ROOT, "webui", "diffusers_helper", "thread_utils.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.Listener.shutdown(timeout=5)
+
+
+def later(delay, func, *args):
+    timer = threading.Timer(delay, func, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class TestFIFOQueue:
+    def test_order_pop_top(self, thread_utils):
+        q = thread_utils.FIFOQueue()
+        assert q.pop() is None and q.top() is None
+        for i in range(3):
+            q.push(i)
+        assert q.top() == 0 and len(q) == 3
+        assert [q.pop(), q.next(), q.pop()] == [0, 1, 2]
+        q.push('end')
+        q.clear()
+        assert q.top() is None
+
+    def test_next_blocks_until_push(self, thread_utils):
+        q = thread_utils.FIFOQueue()
+        later(0.05, q.push, ('file', 'a.mp4'))
+        start = time.monotonic()
+        assert q.next() == ('file', 'a.mp4')
+        assert time.monotonic() - start >= 0.04
+
+    def test_next_timeout(self, thread_utils):
+        q = thread_utils.FIFOQueue()
+        start = time.monotonic()
+        assert q.next(timeout=0.05) is None
+        assert time.monotonic() - start >= 0.04
+        q.push(1)
+        assert q.next(timeout=0) == 1
+
+    def test_close_wakes_waiter_after_drain(self, thread_utils):
+        q = thread_utils.FIFOQueue()
+        q.push(1)
+        q.close()
+        q.push(2)
+        assert q.next() == 1
+        assert q.next() is None
+
+        blocked = thread_utils.FIFOQueue()
+        later(0.05, blocked.close)
+        assert blocked.next() is None
+
+
+class TestBroadcastQueue:
+    def test_duplicates_to_subscribers(self, thread_utils):
+        b = thread_utils.BroadcastQueue()
+        q1, q2 = b.subscribe(), b.subscribe()
+        b.push(('progress', 1))
+        assert q1.next(timeout=1) == ('progress', 1) and q2.next(timeout=1) == ('progress', 1)
+        b.unsubscribe(q2)
+        b.push(('end', None))
+        assert q1.pop() == ('end', None) and q2.pop() is None
+
+    def test_close(self, thread_utils):
+        b = thread_utils.BroadcastQueue()
+        q = b.subscribe()
+        later(0.05, b.close)
+        assert q.next() is None
+        assert b.subscribe().next() is None
+
+
+class TestListener:
+    def test_runs_tasks_in_order_and_survives_errors(self, thread_utils):
+        done = threading.Event()
+        results = []
+
+        def fail():
+            raise ValueError("boom")
+
+        thread_utils.async_run(results.append, 1)
+        thread_utils.async_run(fail)
+        thread_utils.async_run(results.append, 2)
+        thread_utils.async_run(done.set)
+        assert done.wait(5)
+        assert results == [1, 2]
+
+    def test_shutdown_drains_and_restarts(self, thread_utils):
+        results = []
+        for i in range(5):
+            thread_utils.async_run(results.append, i)
+        thread = thread_utils.Listener.thread
+        assert thread_utils.Listener.shutdown(timeout=5)
+        assert results == [0, 1, 2, 3, 4]
+        assert not thread.is_alive() and thread_utils.Listener.thread is None
+
+        done = threading.Event()
+        thread_utils.async_run(done.set)
+        assert done.wait(5)
+        assert thread_utils.Listener.thread is not thread
+
+    def test_idle_thread_waits_without_polling(self, thread_utils):
+        done = threading.Event()
+        thread_utils.async_run(done.set)
+        assert done.wait(5)
+        # 空の間はスリープループではなく Condition.wait で止まっている
+        thread = thread_utils.Listener.thread
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread.ident)
+            if frame is not None and frame.f_code.co_name == "wait":
+                break
+            time.sleep(0.01)
+        assert frame.f_code.co_name == "wait"
+        assert frame.f_back.f_code.co_name == "_process_tasks"
+
+
+def test_async_stream(thread_utils):
+    stream = thread_utils.AsyncStream()
+    q = stream.output_queue.subscribe()
+    stream.output_queue.push(('end', None))
+    stream.input_queue.push('end')
+    assert q.next() == ('end', None) and stream.input_queue.top() == 'end'
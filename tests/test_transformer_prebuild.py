@@ -0,0 +1,97 @@
+"""eichi_utils.transformer_prebuild の単体テスト"""
+
+import os
+import threading
+import importlib.util
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+spec = importlib.util.spec_from_file_location(
+    "transformer_prebuild", os.path.join(ROOT, "webui", "eichi_utils", "transformer_prebuild.py")
+)
+transformer_prebuild = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(transformer_prebuild)
+StatePrebuilder = transformer_prebuild.StatePrebuilder
+
+
+class Memory:
+    def __init__(self, avail):
+        self.avail = avail
+
+    def __call__(self):
+        return self.avail
+
+
+def make(avail=64.0, **kwargs):
+    kwargs.setdefault("throttle_ms", 0)
+    kwargs.setdefault("pressure_wait", 2)
+    kwargs.setdefault("check_every", 1)
+    return StatePrebuilder(reserve_gb=4.0, mem_available_fn=Memory(avail), sleep_fn=lambda s: None, **kwargs)
+
+
+def build_tensors(n, gate=None):
+    def build(throttle):
+        state = {}
+        for i in range(n):
+            if gate is not None and i == 1:
+                gate.wait(5)
+            throttle()
+            state[f"w{i}"] = i
+        return state
+    return build
+
+
+class TestStatePrebuilder:
+    def test_build_and_take(self):
+        prebuilder = make()
+        assert prebuilder.start("a", build_tensors(3), estimate_gb=10)
+        assert prebuilder.pending_key == "a"
+        assert prebuilder.take("a", timeout=5) == {"w0": 0, "w1": 1, "w2": 2}
+        # 取り出した後は残らない
+        assert prebuilder.pending_key is None
+        assert prebuilder.take("a") is None
+
+    def test_other_key_is_not_used(self):
+        prebuilder = make()
+        prebuilder.start("a", build_tensors(1), estimate_gb=1)
+        assert prebuilder.take("b") is None
+        assert prebuilder.take("a", timeout=5) == {"w0": 0}
+
+    def test_skips_without_room(self):
+        prebuilder = make(avail=12.0)
+        assert not prebuilder.start("a", build_tensors(1), estimate_gb=10)
+        assert prebuilder.pending_key is None
+        assert not make(avail=None).start("a", build_tensors(1))
+
+    def test_backs_off_under_pressure(self):
+        memory = Memory(64.0)
+        prebuilder = StatePrebuilder(reserve_gb=4.0, throttle_ms=0, pressure_wait=3, check_every=1,
+                                     mem_available_fn=memory, sleep_fn=lambda s: None)
+        gate = threading.Event()
+        assert prebuilder.start("a", build_tensors(3, gate), estimate_gb=10)
+        memory.avail = 1.0
+        gate.set()
+        assert prebuilder.take("a", timeout=5) is None
+
+    def test_cancel_stops_build(self):
+        prebuilder = make()
+        gate = threading.Event()
+        prebuilder.start("a", build_tensors(3, gate), estimate_gb=1)
+        assert prebuilder.cancel()
+        gate.set()
+        assert prebuilder.take("a") is None
+        assert not prebuilder.cancel()
+
+    def test_waits_for_reload_unless_taken(self):
+        prebuilder = make()
+        calls = []
+        assert prebuilder.start("a", build_tensors(1), estimate_gb=1, wait_until=lambda: calls.append(1) and False)
+        # take() で待たれると wait_until を待たずに構築する
+        assert prebuilder.take("a", timeout=5) == {"w0": 0}
+
+
+@pytest.mark.parametrize("value, expected", [("0", False), ("off", False), ("1", True)])
+def test_prebuild_enabled(monkeypatch, value, expected):
+    monkeypatch.setenv("EICHI_PREBUILD", value)
+    assert transformer_prebuild.prebuild_enabled() is expected
@@ -0,0 +1,119 @@
+# tools/bench_thread_utils.py
+# -*- coding: utf-8 -*-
+"""
+diffusers_helper.thread_utils のマイクロベンチマーク
+- 起床レイテンシ: next() で待っている消費側が push から戻るまでの時間 (p50 / p99 / max)
+- アイドル CPU: 消費側と Listener が何もせず待っている間のプロセス CPU 時間
+- 比較用に、以前の time.sleep(0.001) でポーリングする実装も同じ条件で測る
+
+使用例:
+    python tools/bench_thread_utils.py
+    python tools/bench_thread_utils.py --iterations 5000 --idle-seconds 5
+"""
+
+from __future__ import annotations
+import argparse, os, sys, threading, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "webui"))
+
+from diffusers_helper import thread_utils  # noqa: E402
+
+
+class PollingFIFOQueue:
+    """以前の実装 (list + 1ms のスリープでポーリング)"""
+
+    def __init__(self):
+        self.queue = []
+        self.lock = threading.Lock()
+
+    def push(self, item):
+        with self.lock:
+            self.queue.append(item)
+
+    def next(self):
+        while True:
+            with self.lock:
+                if self.queue:
+                    return self.queue.pop(0)
+            time.sleep(0.001)
+
+
+def measure_wake_latency(queue_class, iterations):
+    q = queue_class()
+    ready = threading.Event()
+    latencies = []
+
+    def consumer():
+        for _ in range(iterations):
+            ready.set()
+            sent = q.next()
+            latencies.append(time.perf_counter() - sent)
+
+    t = threading.Thread(target=consumer, daemon=True)
+    t.start()
+    for _ in range(iterations):
+        ready.wait()
+        ready.clear()
+        # 消費側が待ちに入るまで少し置いてから push する
+        time.sleep(0.0005)
+        q.push(time.perf_counter())
+    t.join()
+    latencies.sort()
+    return {
+        "p50_us": latencies[len(latencies) // 2] * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99)] * 1e6,
+        "max_us": latencies[-1] * 1e6,
+    }
+
+
+def measure_idle_cpu(queue_class, seconds, waiters=4):
+    """waiters 本のスレッドが空のキューで待つ間の CPU 使用率 (1 コア = 100%)"""
+    queues = [queue_class() for _ in range(waiters)]
+    threads = [threading.Thread(target=q.next, daemon=True) for q in queues]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    for q in queues:
+        q.push(None)
+    for t in threads:
+        t.join()
+    return cpu / wall * 100.0
+
+
+def measure_listener_idle_cpu(seconds):
+    done = threading.Event()
+    thread_utils.async_run(done.set)
+    done.wait()
+    time.sleep(0.1)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    thread_utils.Listener.shutdown(timeout=5)
+    return cpu / wall * 100.0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--idle-seconds", type=float, default=2.0)
+    ap.add_argument("--waiters", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    print(f"python {sys.version.split()[0]} / pid {os.getpid()}")
+    for label, cls in (("Condition (current)", thread_utils.FIFOQueue), ("polling (previous)", PollingFIFOQueue)):
+        lat = measure_wake_latency(cls, args.iterations)
+        idle = measure_idle_cpu(cls, args.idle_seconds, args.waiters)
+        print(f"{label:22s} wake p50={lat['p50_us']:8.1f}us p99={lat['p99_us']:8.1f}us "
+              f"max={lat['max_us']:8.1f}us | idle CPU ({args.waiters} waiters) {idle:5.2f}%")
+    print(f"{'Listener idle':22s} idle CPU {measure_listener_idle_cpu(args.idle_seconds):5.2f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,35 @@
 import time
-from threading import Thread, Lock
+from collections import deque
+from threading import Thread, Lock, Condition, current_thread
 
 
 class Listener:
-    task_queue = []
+    """Runs async_run() tasks one by one on a single daemon thread.
+
+    The worker thread sleeps on a condition variable while there is nothing to do,
+    so an idle server does not poll. shutdown() lets already queued tasks finish and
+    stops the thread; a later add_task() starts a new one.
+    """
+
+    task_queue = deque()
     lock = Lock()
+    condition = Condition(lock)
     thread = None
+    stopping = False
 
     @classmethod
     def _process_tasks(cls):
         while True:
-            task = None
-            with cls.lock:
-                if cls.task_queue:
-                    task = cls.task_queue.pop(0)
-
-            if task is None:
-                time.sleep(0.001)
-                continue
+            with cls.condition:
+                while not cls.task_queue and not cls.stopping:
+                    cls.condition.wait()
+                if not cls.task_queue:
+                    # stopping and drained
+                    if cls.thread is current_thread():
+                        cls.thread = None
+                    cls.condition.notify_all()
+                    return
+                task = cls.task_queue.popleft()
 
             func, args, kwargs = task
             try:
@@ -27,12 +39,31 @@ class Listener:
 
     @classmethod
     def add_task(cls, func, *args, **kwargs):
-        with cls.lock:
+        with cls.condition:
             cls.task_queue.append((func, args, kwargs))
+            if cls.thread is None:
+                cls.stopping = False
+                cls.thread = Thread(target=cls._process_tasks, daemon=True)
+                cls.thread.start()
+            cls.condition.notify()
 
-        if cls.thread is None:
-            cls.thread = Thread(target=cls._process_tasks, daemon=True)
-            cls.thread.start()
+    @classmethod
+    def shutdown(cls, timeout=None):
+        """Stop the worker thread after the queued tasks have run.
+
+        Returns True when the thread has exited (or was not running).
+        """
+        with cls.condition:
+            thread = cls.thread
+            if thread is None:
+                return True
+            cls.stopping = True
+            cls.condition.notify_all()
+        if thread is current_thread():
+            # called from a task: the thread exits once this task returns
+            return False
+        thread.join(timeout)
+        return not thread.is_alive()
 
 
 def async_run(func, *args, **kwargs):
@@ -40,18 +71,29 @@ def async_run(func, *args, **kwargs):
 
 
 class FIFOQueue:
+    """Thread-safe FIFO with a blocking next().
+
+    next() waits on a condition variable instead of polling. It returns None when
+    the timeout expires or the queue has been closed and drained.
+    """
+
     def __init__(self):
-        self.queue = []
+        self.queue = deque()
         self.lock = Lock()
+        self.condition = Condition(self.lock)
+        self.closed = False
 
     def push(self, item):
-        with self.lock:
+        with self.condition:
+            if self.closed:
+                return
             self.queue.append(item)
+            self.condition.notify()
 
     def pop(self):
         with self.lock:
             if self.queue:
-                return self.queue.pop(0)
+                return self.queue.popleft()
             return None
 
     def top(self):
@@ -60,17 +102,36 @@ class FIFOQueue:
                 return self.queue[0]
             return None
 
-    def next(self):
-        while True:
-            with self.lock:
-                if self.queue:
-                    return self.queue.pop(0)
-            time.sleep(0.001)
+    def next(self, timeout=None):
+        with self.condition:
+            if timeout is None:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self.queue and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+            if self.queue:
+                return self.queue.popleft()
+            return None
 
     def clear(self):
         with self.lock:
             self.queue.clear()
 
+    def close(self):
+        """Refuse further pushes and wake every waiter; queued items can still be read."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.queue)
+
 
 class BroadcastQueue:
     """A simple broadcast queue that duplicates items to all subscribers."""
@@ -78,13 +139,22 @@ class BroadcastQueue:
     def __init__(self):
         self.subscribers = []
         self.lock = Lock()
+        self.closed = False
 
     def subscribe(self):
         q = FIFOQueue()
         with self.lock:
-            self.subscribers.append(q)
+            if self.closed:
+                q.close()
+            else:
+                self.subscribers.append(q)
         return q
 
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
     def push(self, item):
         with self.lock:
             for q in self.subscribers:
@@ -95,6 +165,14 @@ class BroadcastQueue:
             for q in self.subscribers:
                 q.clear()
 
+    def close(self):
+        """Close every subscriber so that blocked next() calls return once drained."""
+        with self.lock:
+            self.closed = True
+            subscribers, self.subscribers = self.subscribers, []
+        for q in subscribers:
+            q.close()
+
 
 class AsyncStream:
     def __init__(self):
@@ -0,0 +1,350 @@
+"""
+transformer ブロック単位の重みプリフェッチ (低VRAMモード)
+
+DynamicSwapInstaller はパラメータを参照するたびに p.to(device) を同期的に実行するため、
+各ブロックの重みはページング可能なホストメモリから必要になった時点で PCIe を渡り、計算と直列になる。
+BlockOffloadEngine は
+
+- ブロックの重みを一度だけピン留めしたホストメモリへ置き、
+- HunyuanVideoTransformer3DModelPacked のブロック実行順 (transformer_blocks → single_transformer_blocks)
+  に従って、ブロック i の計算中にブロック i+1 の重みを別ストリームでデバイスへ転送し、
+- 転送先は同じ形のブロック用に少数のデバイスバッファを使い回す。
+
+ブロック以外 (埋め込み・出力層など) は小さいのでデバイスに常駐させる。
+move_model_to_device_with_memory_preservation でデバイスへ移されたブロックはそのまま使う (転送しない)。
+
+- EICHI_BLOCK_OFFLOAD=1 で TransformerManager が DynamicSwapInstaller の代わりに使う (既定は無効)
+- EICHI_BLOCK_OFFLOAD_DEPTH: 何ブロック先まで転送しておくか (既定 1)
+
+スケジューリング・バッファプール・実行順の部分は torch に依存しない (ops を差し替えてテストできる)。
+
+使い方:
+    from eichi_utils.block_offload import install_block_offload
+    engine = install_block_offload(transformer, device=gpu)   # 使えない環境では None
+    ...
+    uninstall_block_offload(transformer)
+"""
+
+import os
+from collections import namedtuple
+
+# 1 ブロック分の重み: refs は ops が差し替えに使う参照、host は名前 -> ホスト側テンソル
+BlockSpec = namedtuple("BlockSpec", ["refs", "host", "layout"])
+
+
+def block_offload_enabled():
+    """EICHI_BLOCK_OFFLOAD で有効にされていれば True"""
+    return os.environ.get("EICHI_BLOCK_OFFLOAD", "").strip().lower() in ("1", "true", "on")
+
+
+def block_offload_depth():
+    try:
+        return max(1, int(os.environ.get("EICHI_BLOCK_OFFLOAD_DEPTH", 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def hunyuan_block_order(model):
+    """HunyuanVideoTransformer3DModelPacked の forward でブロックが実行される順のリスト"""
+    blocks = []
+    for attr in ("transformer_blocks", "single_transformer_blocks"):
+        blocks.extend(list(getattr(model, attr, None) or []))
+    return blocks
+
+
+def tensor_layout(tensors):
+    """名前 -> テンソルの辞書から、同じバッファを使い回せるかを判定するキーを作る"""
+    return tuple((name, tuple(t.shape), str(t.dtype)) for name, t in tensors.items())
+
+
+def next_blocks(index, count, depth):
+    """ブロック index の実行中に転送しておくブロック (末尾の次は次のステップの先頭)"""
+    return [(index + k) % count for k in range(1, min(depth, count - 1) + 1)]
+
+
+class _Slot:
+    def __init__(self, layout, buffers):
+        self.layout = layout
+        self.buffers = buffers
+        self.owner = None  # 転送済み・転送中のブロック番号
+        self.ready_event = None  # 転送完了
+        self.free_event = None  # 前の使用者の計算完了
+
+
+class BufferPool:
+    """レイアウトごとに最大 slots_per_layout 個のデバイスバッファを確保して使い回す"""
+
+    def __init__(self, allocate, slots_per_layout=2):
+        self._allocate = allocate
+        self.slots_per_layout = max(1, int(slots_per_layout))
+        self._free = {}
+        self._count = {}
+        self.allocated = 0
+
+    def acquire(self, layout):
+        """空いているバッファを返す。上限まで確保済みで空きがなければ None"""
+        free = self._free.get(layout)
+        if free:
+            return free.pop()
+        if self._count.get(layout, 0) >= self.slots_per_layout:
+            return None
+        self._count[layout] = self._count.get(layout, 0) + 1
+        self.allocated += 1
+        return _Slot(layout, self._allocate(layout))
+
+    def release(self, slot):
+        slot.owner = None
+        self._free.setdefault(slot.layout, []).append(slot)
+
+    def clear(self):
+        self._free.clear()
+        self._count.clear()
+        self.allocated = 0
+
+
+class BlockOffloadEngine:
+    """ブロックの実行前後に呼ばれ、重みの転送と差し替えを行う
+
+    ops は次のメソッドを持つ (torch 用は _TorchOps):
+        allocate(layout) -> buffers, copy_in(slot, host), wait_ready(slot), mark_free(slot),
+        bind(refs, tensors), placement(spec) -> "host" | "device" | "other"
+    """
+
+    def __init__(self, blocks, ops, depth=1):
+        self.blocks = list(blocks)
+        self.ops = ops
+        self.depth = max(1, int(depth))
+        self.pool = BufferPool(ops.allocate, slots_per_layout=self.depth + 1)
+        self._slots = {}  # ブロック番号 -> 転送済み・転送中のスロット
+        self._active = None
+        self.prefetched = 0  # 先に転送してあった
+        self.loaded = 0  # 実行時に転送した
+        self.resident = 0  # デバイスに常駐していた
+
+    def _is_resident(self, index):
+        spec = self.blocks[index]
+        placement = self.ops.placement(spec)
+        if placement == "other":
+            # 他の処理でホストへ戻された (ピン留めしていない) コピーはホスト側の重みに戻す
+            self.ops.bind(spec.refs, spec.host)
+            return False
+        return placement == "device"
+
+    def _acquire(self, index):
+        layout = self.blocks[index].layout
+        slot = self.pool.acquire(layout)
+        if slot is None:
+            # 同じ形のバッファが全て使用中なら、実行中でない転送済みブロックから取り上げる
+            for owner, candidate in list(self._slots.items()):
+                if owner != self._active and candidate.layout == layout:
+                    del self._slots[owner]
+                    slot = candidate
+                    break
+        return slot
+
+    def prefetch(self, index):
+        """ブロック index の重みの転送を始める (常駐・転送済み・バッファがない場合は何もしない)"""
+        if index in self._slots or self._is_resident(index):
+            return False
+        slot = self._acquire(index)
+        if slot is None:
+            return False
+        slot.owner = index
+        self.ops.copy_in(slot, self.blocks[index].host)
+        self._slots[index] = slot
+        return True
+
+    def before_block(self, index):
+        """ブロック index の実行直前: 重みをデバイスバッファへ差し替え、次のブロックの転送を始める"""
+        self._active = index
+        if self._is_resident(index):
+            self.resident += 1
+            slot = self._slots.pop(index, None)
+            if slot is not None:
+                self.pool.release(slot)
+        else:
+            if index in self._slots:
+                self.prefetched += 1
+            else:
+                self.loaded += 1
+                self.prefetch(index)
+            slot = self._slots.get(index)
+            if slot is None:
+                raise RuntimeError(f"block {index}: no device buffer available")
+            self.ops.wait_ready(slot)
+            self.ops.bind(self.blocks[index].refs, slot.buffers)
+        for following in next_blocks(index, len(self.blocks), self.depth):
+            self.prefetch(following)
+
+    def after_block(self, index):
+        """ブロック index の実行直後: 重みをホスト側に戻し、バッファを解放する"""
+        if self._active == index:
+            self._active = None
+        slot = self._slots.pop(index, None)
+        if slot is None:
+            return
+        self.ops.bind(self.blocks[index].refs, self.blocks[index].host)
+        self.ops.mark_free(slot)
+        self.pool.release(slot)
+
+    def reset(self):
+        """転送済みのバッファを全て捨てる (ホスト側の重みに戻す)"""
+        for index, slot in list(self._slots.items()):
+            self.ops.bind(self.blocks[index].refs, self.blocks[index].host)
+        self._slots.clear()
+        self._active = None
+        self.pool.clear()
+
+    def stats(self):
+        return {
+            "prefetched": self.prefetched,
+            "loaded": self.loaded,
+            "resident": self.resident,
+            "buffers": self.pool.allocated,
+        }
+
+
+# ==============================================================================
+# torch 実装
+# ==============================================================================
+class _TorchOps:
+    """CUDA の別ストリームで転送し、イベントで計算ストリームと同期する"""
+
+    def __init__(self, device):
+        import torch
+        self.torch = torch
+        self.device = torch.device(device)
+        self.copy_stream = torch.cuda.Stream(device=self.device)
+
+    def allocate(self, layout):
+        torch = self.torch
+        names = ("float32", "float16", "bfloat16", "float8_e4m3fn", "float8_e5m2",
+                 "int8", "uint8", "int32", "int64", "bool")
+        dtypes = {str(getattr(torch, n)): getattr(torch, n) for n in names if hasattr(torch, n)}
+        return {name: torch.empty(shape, dtype=dtypes[dtype], device=self.device) for name, shape, dtype in layout}
+
+    def copy_in(self, slot, host):
+        torch = self.torch
+        with torch.cuda.stream(self.copy_stream):
+            if slot.free_event is not None:
+                # 前にこのバッファを使ったブロックの計算が終わってから上書きする
+                self.copy_stream.wait_event(slot.free_event)
+            for name, buffer in slot.buffers.items():
+                buffer.copy_(host[name], non_blocking=True)
+            slot.ready_event = torch.cuda.Event()
+            slot.ready_event.record(self.copy_stream)
+
+    def wait_ready(self, slot):
+        if slot.ready_event is not None:
+            self.torch.cuda.current_stream(self.device).wait_event(slot.ready_event)
+
+    def mark_free(self, slot):
+        event = self.torch.cuda.Event()
+        event.record(self.torch.cuda.current_stream(self.device))
+        slot.free_event = event
+
+    @staticmethod
+    def bind(refs, tensors):
+        for module, kind, attr, name in refs:
+            if kind == "param":
+                module._parameters[attr].data = tensors[name]
+            else:
+                module._buffers[attr] = tensors[name]
+
+    def placement(self, spec):
+        on_device = True
+        on_host = True
+        for module, kind, attr, name in spec.refs:
+            tensor = module._parameters[attr] if kind == "param" else module._buffers[attr]
+            if tensor.device.type != self.device.type:
+                on_device = False
+            if tensor.data_ptr() != spec.host[name].data_ptr():
+                on_host = False
+        if on_host:
+            return "host"
+        return "device" if on_device else "other"
+
+
+def _block_tensors(block):
+    refs = []
+    tensors = {}
+    for prefix, module in block.named_modules():
+        for kind, table in (("param", module._parameters), ("buffer", module._buffers)):
+            for attr, tensor in table.items():
+                if tensor is None:
+                    continue
+                name = f"{prefix}.{attr}" if prefix else attr
+                refs.append((module, kind, attr, name))
+                tensors[name] = tensor.data if kind == "param" else tensor
+    return refs, tensors
+
+
+def _pin(tensor):
+    host = tensor.detach().to("cpu")
+    try:
+        return host.pin_memory()
+    except Exception:
+        # ピン留めできない環境でも動作はする (転送が非同期にならないだけ)
+        return host
+
+
+def install_block_offload(model, device, depth=None):
+    """model にブロック単位のプリフェッチを組み込む。使えない場合は None を返す"""
+    import torch
+
+    if not torch.cuda.is_available():
+        return None
+    blocks = hunyuan_block_order(model)
+    if not blocks:
+        return None
+    device = torch.device(device)
+    ops = _TorchOps(device)
+
+    specs = []
+    block_modules = set()
+    for block in blocks:
+        refs, tensors = _block_tensors(block)
+        host = {name: _pin(tensor) for name, tensor in tensors.items()}
+        ops.bind(refs, host)
+        specs.append(BlockSpec(refs, host, tensor_layout(host)))
+        block_modules.update(id(m) for m in block.modules())
+
+    # ブロック以外は常駐させる (module.to は子のブロックまで動かすので、自身のテンソルだけを移す)
+    others = [m for m in model.modules() if id(m) not in block_modules]
+
+    def ensure_others_on_device():
+        for module in others:
+            for attr, param in module._parameters.items():
+                if param is not None and param.device != device:
+                    param.data = param.data.to(device)
+            for attr, buffer in module._buffers.items():
+                if buffer is not None and buffer.device != device:
+                    module._buffers[attr] = buffer.to(device)
+
+    ensure_others_on_device()
+
+    engine = BlockOffloadEngine(specs, ops, depth=block_offload_depth() if depth is None else depth)
+
+    def root_pre_hook(module, args):
+        ensure_others_on_device()
+        engine.prefetch(0)
+
+    handles = [model.register_forward_pre_hook(root_pre_hook)]
+    for index, block in enumerate(blocks):
+        handles.append(block.register_forward_pre_hook(lambda m, args, i=index: engine.before_block(i)))
+        handles.append(block.register_forward_hook(lambda m, args, out, i=index: engine.after_block(i)))
+    engine.handles = handles
+    model.__dict__["_eichi_block_offload"] = engine
+    print(f"ブロック単位のプリフェッチを有効にしました ({len(specs)} ブロック, 先読み {engine.depth})")
+    return engine
+
+
+def uninstall_block_offload(model):
+    """install_block_offload で組み込んだフックを外す (重みはホスト側に残る)"""
+    engine = model.__dict__.pop("_eichi_block_offload", None)
+    if engine is None:
+        return False
+    for handle in getattr(engine, "handles", []):
+        handle.remove()
+    engine.reset()
+    return True
@@ -0,0 +1,119 @@
+"""
+ジョブ単位の条件付けメモ
+
+process() の batch_count ループでは、シード以外が同じ worker() がバッチごとに呼ばれ、
+画像のリサイズ・VAE エンコード・CLIP Vision エンコード・プロンプトのエンコードが毎回繰り返される。
+ConditioningMemo は process() の開始時に作成して各 worker() に渡し、
+1 回目のバッチで準備した値を 2 回目以降で再利用する。ジョブ終了時に clear() で解放する。
+
+キーは入力の内容 (画像のパス+更新日時 / 配列のハッシュ、プロンプト文字列など) から作るため、
+イメージキュー・プロンプトキューでバッチごとに入力が変わる場合はそのバッチだけ再計算される。
+各バッチの開始時に start_batch() を呼ぶと、直前のバッチで使われなかった値を捨てるので、
+入力が毎回変わってもメモが保持するのは直前と現在のバッチの分だけになる。
+内容から安定したキーを作れない入力 (キーが None) はメモせずに毎回計算する。
+
+使い方:
+    from eichi_utils.conditioning_memo import ConditioningMemo, image_source_key, memo_key, memoized
+    memo = ConditioningMemo()
+    for batch_index in range(batch_count):
+        memo.start_batch()
+        key = memo_key("pixels", image_source_key(img, 640))
+        img_np, img_pt, height, width = memoized(memo, key, lambda: preprocess_image(img, resolution=640))
+    memo.clear()
+"""
+
+import os
+import threading
+
+
+def image_source_key(image, resolution=None):
+    """画像入力 (パス / numpy 配列 / None) からメモのキーを作る"""
+    if image is None:
+        return ("none", resolution)
+    if isinstance(image, (str, os.PathLike)):
+        path = os.path.abspath(os.fspath(image))
+        try:
+            st = os.stat(path)
+            return ("path", path, st.st_mtime_ns, st.st_size, resolution)
+        except OSError:
+            return ("path", path, None, None, resolution)
+    if hasattr(image, "tobytes") and hasattr(image, "shape"):
+        from eichi_utils.encode_cache import content_hash
+        return ("array", content_hash(image), resolution)
+    # 内容をハッシュできない入力は id() が再利用されると別の画像と衝突するのでメモしない
+    return None
+
+
+def memo_key(kind, *parts):
+    """kind と入力のキーからメモのキーを作る。None (安定したキーが無い入力) を含めば None"""
+    if any(part is None for part in parts):
+        return None
+    return (kind,) + parts
+
+
+class ConditioningMemo:
+    """ジョブの間だけ保持する {キー: 値} のメモ (直前と現在のバッチで使った値だけを残す)"""
+
+    def __init__(self):
+        self._values = {}
+        self._used = set()  # 現在のバッチで参照・保存したキー
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                self._used.add(key)
+                return self._values[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if key is None:
+            return value
+        with self._lock:
+            self._values[key] = value
+            self._used.add(key)
+        return value
+
+    def get_or_compute(self, key, compute):
+        """メモ済みなら値を返し、なければ compute() の結果を保存して返す (key が None なら保存しない)"""
+        if key is None:
+            return compute()
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                self._used.add(key)
+                return self._values[key]
+            self.misses += 1
+        return self.put(key, compute())
+
+    def start_batch(self):
+        """次のバッチを始める。直前のバッチで参照も保存もされなかった値を解放する"""
+        with self._lock:
+            for key in [k for k in self._values if k not in self._used]:
+                del self._values[key]
+            self._used = set()
+
+    def clear(self):
+        """保持している値をすべて解放する"""
+        with self._lock:
+            self._values.clear()
+            self._used.clear()
+
+
+def memoized(memo, key, compute):
+    """memo が None なら compute() をそのまま実行する"""
+    if memo is None:
+        return compute()
+    return memo.get_or_compute(key, compute)
@@ -8,6 +8,9 @@ import time
 import shutil
 import threading
 import hashlib
+import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import traceback
@@ -15,6 +18,118 @@ import traceback
 # Load translations from JSON files
 from locales.i18n_extended import (set_lang, translate)
 
+from eichi_utils.queue_index import (
+    QueueIndex, signature_key,
+    STATE_CONFIGS, STATE_QUEUED, STATE_PROCESSING, STATE_COMPLETED, STATE_ERROR,
+)
+
+# ==============================================================================
+# QUEUE SCHEDULING POLICY
+# ==============================================================================
+# "fifo": 追加順 (キューファイルの mtime の古い順) に処理する (既定)
+# "group_by_transformer": transformer の構成 (LoRA とスケールの組) が
+#   同じ項目を続けて処理し、TransformerManager のリロードを構成ごとに 1 回にする。
+#   グループ内は FIFO 順で、priority の大きい項目はグループに関係なく先に処理する。
+# 既定の方針は環境変数 EICHI_QUEUE_SCHEDULING でも指定できる
+SCHEDULING_FIFO = "fifo"
+SCHEDULING_GROUP_BY_TRANSFORMER = "group_by_transformer"
+SCHEDULING_POLICIES = (SCHEDULING_FIFO, SCHEDULING_GROUP_BY_TRANSFORMER)
+
+
+def _parse_lora_scales(scales_text, count: int) -> List[float]:
+    # TransformerManager.set_next_settings と同じく足りない分は 0.8 で埋める
+    scales = []
+    for part in str(scales_text or "").split(","):
+        try:
+            scales.append(round(float(part.strip()), 4))
+        except ValueError:
+            continue
+    return scales[:count] + [0.8] * max(0, count - len(scales))
+
+
+def transformer_signature(config_data: Dict) -> Tuple:
+    """設定から transformer の構成を表すキーを作る (キーが同じ項目同士はリロード不要)
+
+    キュー項目ごとに変わるのは LoRA の組 (パスとスケール) だけなので、それだけをキーにする。
+    FP8 最適化・辞書分割・モデルの種類はキューの実行時に UI の設定 (queue_ui_settings) から
+    全項目共通で決まり、設定ファイルの other_params は参照されない (F1 は None で保存する)。
+    """
+    lora_settings = config_data.get('lora_settings') or {}
+    if not lora_settings.get('use_lora', False):
+        return ()
+    lora_files = list(lora_settings.get('lora_files') or [])
+    scales = _parse_lora_scales(lora_settings.get('lora_scales'), len(lora_files))
+    # 適用順はリロード判定 (_needs_reload) と同じく区別しない
+    return tuple(sorted(
+        (os.path.normcase(os.path.normpath(path)), scale)
+        for path, scale in zip(lora_files, scales) if path
+    ))
+
+
+def queue_priority(config_data: Dict) -> int:
+    """キュー項目の優先度 (大きいほど先。未指定は 0)"""
+    try:
+        return int(config_data.get('priority', 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def plan_queue_order(entries, active_signature=None) -> List[str]:
+    """FIFO 順の (name, priority, signature) を処理順に並べた name のリストを返す
+
+    priority の大きい順に処理し、同じ priority の中では signature ごとにまとめる。
+    active_signature (読み込み済みの構成) のグループを最初にし、他のグループは
+    先頭項目の FIFO 順に並べる。グループ内は FIFO 順のまま。
+    """
+    tiers = {}
+    for name, priority, signature in entries:
+        tiers.setdefault(priority, OrderedDict()).setdefault(signature, []).append(name)
+    order = []
+    for priority in sorted(tiers, reverse=True):
+        groups = tiers[priority]
+        if active_signature in groups:
+            groups.move_to_end(active_signature, last=False)
+        for names in groups.values():
+            order.extend(names)
+    return order
+
+
+def count_transformer_loads(signatures, initial=None) -> int:
+    """signatures の順に処理したときに構成が切り替わる回数"""
+    loads = 0
+    previous = initial
+    for signature in signatures:
+        if signature != previous:
+            loads += 1
+        previous = signature
+    return loads
+
+
+def _pid_alive(pid) -> bool:
+    """このホストのプロセスが生きているか (判定できないときは生きているとみなす)"""
+    try:
+        pid = int(pid)
+    except (TypeError, ValueError):
+        return True
+    if pid == os.getpid():
+        return True
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == 'nt':
+        # Windows の os.kill はシグナル 0 でもプロセスを終了させるので使わない
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
 class ConfigQueueManager:
 
     def __init__(self, base_path: str):
@@ -31,9 +146,29 @@ class ConfigQueueManager:
         self.current_config = None
         self.queue_thread = None
         self.stop_processing = False
+
+        # Scheduling policy state
+        policy = os.environ.get("EICHI_QUEUE_SCHEDULING", SCHEDULING_FIFO).strip().lower()
+        self.scheduling_policy = policy if policy in SCHEDULING_POLICIES else SCHEDULING_FIFO
+        self._active_signature = None  # 最後に GPU ステージへ渡した項目の構成 (signature_key)
+        self._dispatched = []  # 今回の処理で実行した項目の (stamp, signature)
+        self.scheduler = None  # start_multi_device_processing で使う MultiDeviceScheduler
         
         # Initialize directories
         self._init_directories()
+
+        # 状態・優先度・時刻・エラー文のインデックス (ファイルはペイロードとしてそのまま使う)
+        self.index = QueueIndex(
+            os.path.join(base_path, 'queue_index.db'),
+            {
+                STATE_CONFIGS: self.configs_dir,
+                STATE_QUEUED: self.queue_dir,
+                STATE_PROCESSING: self.processing_dir,
+                STATE_COMPLETED: self.completed_dir,
+                STATE_ERROR: self.error_dir,
+            },
+            reader=self._read_index_fields,
+        )
     
     # ==============================================================================
     # IMAGE MANAGEMENT SYSTEM
@@ -54,45 +189,28 @@ class ConfigQueueManager:
         
         return any(pattern in normalized_path for pattern in temp_patterns)
 
-    def get_queue_status(self) -> Dict:
+    def get_queue_status(self, queued_limit: Optional[int] = None) -> Dict:
+        # インデックスから返す (ディレクトリは変更があったときだけ走査する)
+        # queued_limit を渡すと queued は名前順の先頭だけ。件数は queue_count を使う
 
         try:
-            # Get queued configs
-            queued_configs = []
-            if os.path.exists(self.queue_dir):
-                for file in sorted(os.listdir(self.queue_dir)):
-                    if file.endswith('.json'):
-                        config_name = file[:-5]
-                        queued_configs.append(config_name)
-                        
-            # Get processing config
-            processing_config = None
-            if os.path.exists(self.processing_dir):
-                for file in os.listdir(self.processing_dir):
-                    if file.endswith('.json'):
-                        processing_config = file[:-5]
-                        break
-                        
-            # Get completed configs - FIXED: Sort by completion time (newest first)
-            completed_configs = []
-            if os.path.exists(self.completed_dir):
-                json_files = [f for f in os.listdir(self.completed_dir) if f.endswith('.json')]
-                # Sort by modification time (newest first)
-                json_files.sort(key=lambda x: os.path.getmtime(os.path.join(self.completed_dir, x)), reverse=True)
-                
-                for file in json_files:
-                    config_name = file[:-5]  # Remove .json extension
-                    completed_configs.append(config_name)
+            self.index.refresh([STATE_QUEUED, STATE_PROCESSING, STATE_COMPLETED])
+            queued_configs = self.index.names(STATE_QUEUED, queued_limit)
+            processing = self.index.names(STATE_PROCESSING, 1)
+            processing_config = processing[0] if processing else None
+            # Completed configs, newest first
+            completed_configs = self.index.recent(STATE_COMPLETED, 10)
+            queue_count = self.index.count(STATE_QUEUED)
             
             # FIX: Calculate configs_remaining for accurate display
-            configs_remaining = len(queued_configs)
+            configs_remaining = queue_count
                     
             return {
                 "is_processing": self.is_processing,
                 "queued": queued_configs,
                 "processing": processing_config,
-                "completed": completed_configs[:10],  # Show first 10 (newest first)
-                "queue_count": len(queued_configs),
+                "completed": completed_configs,  # Show first 10 (newest first)
+                "queue_count": queue_count,
                 "current_config": self.current_config,
                 "configs_remaining": configs_remaining
             }
@@ -121,6 +239,7 @@ class ConfigQueueManager:
                     if file.endswith('.json'):
                         os.remove(os.path.join(self.queue_dir, file))
                         cleared_count += 1
+            self.index.refresh([STATE_QUEUED])
                         
             return True, translate("Cleared {0} items from queue").format(cleared_count)
             
@@ -261,7 +380,9 @@ class ConfigQueueManager:
     # QUEUE PROCESSING ENGINE
     # ==============================================================================
 
-    def start_queue_processing(self, process_function) -> Tuple[bool, str]:
+    def start_queue_processing(self, process_function, prepare_function=None) -> Tuple[bool, str]:
+        # prepare_function を渡すと準備ステージと GPU ステージの 2 段で処理する
+        # (process_function には config_data ではなく prepare_function の戻り値が渡る)
 
         if self.is_processing:
             return False, translate("Queue processing is already running")
@@ -271,11 +392,16 @@ class ConfigQueueManager:
             
         self.is_processing = True
         self.stop_processing = False
+        self._dispatched = []
         
         # Start processing thread
+        if prepare_function is None:
+            target, args = self._process_queue_worker_simple, (process_function,)
+        else:
+            target, args = self._process_queue_worker_pipelined, (prepare_function, process_function)
         self.queue_thread = threading.Thread(
-            target=self._process_queue_worker_simple, 
-            args=(process_function,),
+            target=target,
+            args=args,
             daemon=True
         )
         self.queue_thread.start()
@@ -293,30 +419,119 @@ class ConfigQueueManager:
     def _has_queued_items(self) -> bool:
 
         try:
-            if not os.path.exists(self.queue_dir):
-                return False
-            return any(f.endswith('.json') for f in os.listdir(self.queue_dir))
-        except:
+            self.index.refresh([STATE_QUEUED])
+            return self.index.count(STATE_QUEUED) > 0
+        except Exception:
             return False
 
-    def _get_next_queue_item(self) -> Optional[str]:
+    def _get_queued_entries_fifo(self, exclude: Optional[str] = None) -> List[Tuple]:
+        # (name, priority, signature) を追加順 (キューファイルの mtime の古い順) で返す
+
+        self.index.refresh([STATE_QUEUED])
+        return self.index.queued_fifo(exclude)
+
+    def _get_queued_names_fifo(self, exclude: Optional[str] = None) -> List[str]:
+
+        return [entry[0] for entry in self._get_queued_entries_fifo(exclude)]
+
+    def _get_next_queue_item(self, exclude: Optional[str] = None) -> Optional[str]:
 
         try:
-            if not os.path.exists(self.queue_dir):
-                return None
-                
-            json_files = [f for f in os.listdir(self.queue_dir) if f.endswith('.json')]
-            if not json_files:
-                return None
-                
-            # Sort by modification time (oldest first)
-            json_files.sort(key=lambda x: os.path.getmtime(os.path.join(self.queue_dir, x)))
-            return json_files[0][:-5]  # Remove .json extension
+            self.index.refresh([STATE_QUEUED])
+            if self.scheduling_policy == SCHEDULING_GROUP_BY_TRANSFORMER:
+                # plan_queue_order(...)[0] と同じ項目をインデックスで引く
+                return self.index.next_grouped(self._active_signature, exclude)
+
+            return self.index.first_fifo(exclude)
             
         except Exception as e:
             print(translate("Error getting next queue item: {0}").format(e))
             return None
         
+    # ==============================================================================
+    # QUEUE SCHEDULING
+    # ==============================================================================
+
+    def set_scheduling_policy(self, policy: str) -> Tuple[bool, str]:
+
+        policy = str(policy or "").strip().lower()
+        if policy not in SCHEDULING_POLICIES:
+            return False, translate("Unknown scheduling policy: {0}").format(policy)
+        self.scheduling_policy = policy
+        return True, translate("Scheduling policy set: {0}").format(policy)
+
+    def set_queue_priority(self, config_name: str, priority: int) -> Tuple[bool, str]:
+
+        try:
+            queue_file = os.path.join(self.queue_dir, f"{config_name}.json")
+            if not os.path.exists(queue_file):
+                return False, translate("Config file not found in queue: {0}").format(config_name)
+            st = os.stat(queue_file)
+            with open(queue_file, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
+            config_data['priority'] = int(priority)
+            with open(queue_file, 'w', encoding='utf-8') as f:
+                json.dump(config_data, f, indent=2, ensure_ascii=False)
+            # mtime は FIFO 順に使うので元に戻す
+            os.utime(queue_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.index.put(STATE_QUEUED, config_name, path=queue_file)
+            return True, translate("Queue priority set: {0} = {1}").format(config_name, int(priority))
+        except Exception as e:
+            return False, translate("Error setting queue priority: {0}").format(str(e))
+
+    def _get_queue_entry(self, config_name: str) -> Tuple:
+        # キュー項目の (stamp, priority, signature)。インデックスから引く
+
+        row = self.index.get(STATE_QUEUED, config_name)
+        if row is None:
+            return None, 0, None
+        return (row['enqueued_ns'], row['size']), row['priority'], row['signature']
+
+    def _read_index_fields(self, state: str, path: str) -> Dict:
+        # インデックスへ取り込むファイルの中身 (completed / processing は読まない)
+
+        if state not in (STATE_CONFIGS, STATE_QUEUED, STATE_ERROR):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            config_data = json.load(f)
+        if state == STATE_QUEUED:
+            return {
+                'priority': queue_priority(config_data),
+                'signature': signature_key(transformer_signature(config_data)),
+            }
+        if state == STATE_ERROR:
+            error = config_data.get('error') if isinstance(config_data, dict) else None
+            return {'error': error.get('message') if isinstance(error, dict) else None}
+        return {}
+
+    def _note_dispatch(self, config_name: str):
+        # GPU ステージへ渡す項目を記録し、FIFO 順と違う場合はログに残す
+
+        if self.scheduling_policy != SCHEDULING_GROUP_BY_TRANSFORMER:
+            return
+        stamp, _, signature = self._get_queue_entry(config_name)
+        first = self.index.first_fifo()
+        if first is not None and first != config_name:
+            if signature == self._active_signature:
+                reason = translate("same transformer setup as the loaded one")
+            else:
+                reason = translate("priority or transformer setup grouping")
+            print(translate("🔀 Queue reordered: {0} runs before {1} ({2})").format(config_name, first, reason))
+        self._dispatched.append((stamp, signature))
+        self._active_signature = signature
+
+    def _report_scheduling(self):
+        # 今回の処理で構成を切り替えた回数と、FIFO 順の場合との差をログに残す
+
+        if self.scheduling_policy != SCHEDULING_GROUP_BY_TRANSFORMER or not self._dispatched:
+            return
+        actual = count_transformer_loads(signature for _, signature in self._dispatched)
+        fifo = count_transformer_loads(
+            signature for _, signature in sorted(self._dispatched, key=lambda d: d[0] or (0, 0))
+        )
+        print(translate("🔁 Transformer setup changes: {0} (FIFO order: {1}, reloads saved: {2})").format(
+            actual, fifo, max(0, fifo - actual)))
+
     def _move_to_processing(self, config_name: str) -> bool:
 
         try:
@@ -324,7 +539,9 @@ class ConfigQueueManager:
             dest = os.path.join(self.processing_dir, f"{config_name}.json")
             
             if os.path.exists(source):
-                shutil.move(source, dest)
+                with self.index.transaction() as conn:
+                    shutil.move(source, dest)
+                    self.index.move(conn, config_name, STATE_QUEUED, STATE_PROCESSING, started_at=time.time())
                 return True
             return False
         except Exception as e:
@@ -338,7 +555,10 @@ class ConfigQueueManager:
             dest = os.path.join(self.completed_dir, f"{config_name}.json")
             
             if os.path.exists(source):
-                shutil.move(source, dest)
+                with self.index.transaction() as conn:
+                    shutil.move(source, dest)
+                    self.index.move(conn, config_name, STATE_PROCESSING, STATE_COMPLETED,
+                                    finished_at=time.time(), error=None, owner=None)
                 return True
             return False
         except Exception as e:
@@ -361,12 +581,15 @@ class ConfigQueueManager:
                     'timestamp': datetime.now().isoformat()
                 }
                 
-                # Save with error info
-                with open(dest, 'w', encoding='utf-8') as f:
-                    json.dump(config_data, f, indent=2, ensure_ascii=False)
-                    
-                # Remove from processing
-                os.remove(source)
+                with self.index.transaction() as conn:
+                    # Save with error info
+                    with open(dest, 'w', encoding='utf-8') as f:
+                        json.dump(config_data, f, indent=2, ensure_ascii=False)
+                        
+                    # Remove from processing
+                    os.remove(source)
+                    self.index.move(conn, config_name, STATE_PROCESSING, STATE_ERROR,
+                                    finished_at=time.time(), error=error_msg, owner=None)
                 return True
             return False
         except Exception as e:
@@ -388,6 +611,7 @@ class ConfigQueueManager:
                     print(translate("📭 No more items in queue"))
                     break
                     
+                self._note_dispatch(config_name)
                 print(translate("🎬 Processing config: {0}").format(config_name))
                 self.current_config = config_name
                 
@@ -396,44 +620,176 @@ class ConfigQueueManager:
                     print(translate("❌ Failed to move {0} to processing").format(config_name))
                     continue
                     
-                try:
-                    # Load config
-                    success, config_data, message = self.load_config_from_processing(config_name)
-                    if not success:
-                        print(translate("❌ Failed to load config {0}: {1}").format(config_name, message))
-                        self._move_to_error(config_name, message)
-                        total_errors += 1
-                        continue
-                        
-                    # Process the config
-                    print(translate("🎯 Starting generation for: {0}").format(config_name))
-                    result = process_function(config_data)
+                # Load config
+                success, config_data, message = self.load_config_from_processing(config_name)
+                if not success:
+                    print(translate("❌ Failed to load config {0}: {1}").format(config_name, message))
+                    self._move_to_error(config_name, message)
+                    total_errors += 1
+                    continue
+
+                if self._run_process_stage(config_name, process_function, config_data):
+                    total_processed += 1
+                else:
+                    total_errors += 1
                     
-                    if result:
-                        # Success - move to completed
-                        self._move_to_completed(config_name)
-                        total_processed += 1
-                        print(translate("✅ Completed processing: {0}").format(config_name))
-                    else:
-                        # Failed - move to error
-                        self._move_to_error(config_name, translate("Processing failed"))
-                        total_errors += 1
-                        print(translate("❌ Failed processing: {0}").format(config_name))
-                        
-                except Exception as e:
-                    # Error during processing
-                    error_msg = translate("Processing error: {0}").format(str(e))
+        except Exception as e:
+            print(translate("❌ Queue worker error: {0}").format(e))
+            import traceback
+            traceback.print_exc()
+        finally:
+            self._report_scheduling()
+            # Always reset processing state
+            print(translate("🏁 Queue worker finishing - resetting processing state"))
+            self.is_processing = False
+            self.current_config = None
+            self.stop_processing = False
+            print(translate("✅ Queue processing stopped - Processed: {0}, Errors: {1}").format(total_processed, total_errors))
+
+    def _run_process_stage(self, config_name: str, process_function, payload) -> bool:
+        # processing へ移した項目を生成し、結果に応じて completed / error へ移す
+
+        try:
+            # Process the config
+            print(translate("🎯 Starting generation for: {0}").format(config_name))
+            result = process_function(payload)
+            
+            if result:
+                # Success - move to completed
+                self._move_to_completed(config_name)
+                print(translate("✅ Completed processing: {0}").format(config_name))
+                return True
+
+            # Failed - move to error
+            self._move_to_error(config_name, translate("Processing failed"))
+            print(translate("❌ Failed processing: {0}").format(config_name))
+            return False
+                
+        except Exception as e:
+            # Error during processing
+            error_msg = translate("Processing error: {0}").format(str(e))
+            self._move_to_error(config_name, error_msg)
+            print(translate("❌ Error processing {0}: {1}").format(config_name, e))
+            traceback.print_exc()
+            return False
+
+    # ==============================================================================
+    # PIPELINED QUEUE EXECUTOR (prep stage + GPU stage)
+    # ==============================================================================
+    # 準備ステージ: 設定の読み込み・パス解決・画像のデコード・プロンプトキャッシュの読み込みなど
+    # GPU を使わない処理 (prepare_function) を次の 1 件について先に済ませ、ジョブバンドルを作る。
+    # GPU ステージ: 現在の項目を processing へ移し、バンドルを process_function に渡して生成する。
+    # 準備中の項目は queue ディレクトリに置いたままなので、停止した場合はキューに残る。
+
+    def _queue_item_stamp(self, config_name: str):
+        # キューファイルが準備後に差し替えられていないかを見るための (mtime, size)
+
+        try:
+            st = os.stat(os.path.join(self.queue_dir, f"{config_name}.json"))
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def load_config_from_queue(self, config_name: str) -> Tuple[bool, Dict, str]:
+
+        try:
+            config_file = os.path.join(self.queue_dir, f"{config_name}.json")
+            if not os.path.exists(config_file):
+                return False, {}, translate("Config file not found in queue: {0}").format(config_name)
+                
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
+                
+            return True, config_data, translate("Config loaded successfully")
+            
+        except Exception as e:
+            return False, {}, translate("Error loading config from queue: {0}").format(str(e))
+
+    def _prepare_queue_item(self, config_name: str, prepare_function):
+        # 準備ステージ (準備用スレッドで実行): (bundle, error_msg) を返す
+
+        success, config_data, message = self.load_config_from_queue(config_name)
+        if not success:
+            return None, message
+        try:
+            bundle = prepare_function(config_data)
+        except Exception as e:
+            traceback.print_exc()
+            return None, translate("Preparation error: {0}").format(str(e))
+        if bundle is None:
+            return None, translate("Preparation failed")
+        return bundle, None
+
+    def _submit_prepare(self, executor, prepare_function, config_name: str):
+        # (config_name, stamp, future) を返す
+
+        stamp = self._queue_item_stamp(config_name)
+        print(translate("📦 Preparing next config: {0}").format(config_name))
+        return config_name, stamp, executor.submit(self._prepare_queue_item, config_name, prepare_function)
+
+    def _process_queue_worker_pipelined(self, prepare_function, process_function):
+
+        total_processed = 0
+        total_errors = 0
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eichi-queue-prep")
+        pending = None
+        try:
+            print(translate("🔄 Queue worker thread started (prep + GPU pipeline)"))
+            
+            while not self.stop_processing:
+                # Get next item (FIFO 順は単純ワーカーと同じ)
+                config_name = self._get_next_queue_item()
+                if not config_name:
+                    print(translate("📭 No more items in queue"))
+                    break
+
+                # 先に準備した項目が先頭でない、またはキューファイルが差し替えられた場合は準備し直す
+                if pending is None or pending[0] != config_name or pending[1] != self._queue_item_stamp(config_name):
+                    if pending is not None:
+                        pending[2].cancel()
+                    pending = self._submit_prepare(executor, prepare_function, config_name)
+
+                bundle, error_msg = pending[2].result()
+                pending = None
+                if self.stop_processing:
+                    # 準備だけ済んだ項目はキューに残す
+                    break
+
+                # この項目の生成中に次の項目を準備する (次の項目の選択には今の項目の構成を使う)
+                # 準備ステージから生成中の項目が分かるよう current_config を先に更新する
+                print(translate("🎬 Processing config: {0}").format(config_name))
+                self.current_config = config_name
+                self._note_dispatch(config_name)
+                next_name = self._get_next_queue_item(exclude=config_name)
+                if next_name:
+                    pending = self._submit_prepare(executor, prepare_function, next_name)
+                
+                # Move to processing
+                if not self._move_to_processing(config_name):
+                    print(translate("❌ Failed to move {0} to processing").format(config_name))
+                    continue
+
+                if error_msg is not None:
+                    # 準備ステージのエラーは処理エラーと同じく error へ移す
+                    print(translate("❌ Failed to prepare config {0}: {1}").format(config_name, error_msg))
                     self._move_to_error(config_name, error_msg)
                     total_errors += 1
-                    print(translate("❌ Error processing {0}: {1}").format(config_name, e))
-                    import traceback
-                    traceback.print_exc()
+                    continue
+
+                if self._run_process_stage(config_name, process_function, bundle):
+                    total_processed += 1
+                else:
+                    total_errors += 1
                     
         except Exception as e:
             print(translate("❌ Queue worker error: {0}").format(e))
-            import traceback
             traceback.print_exc()
         finally:
+            self._report_scheduling()
+            # 先行して準備中の項目は捨てる (キューファイルはそのまま残る)
+            if pending is not None:
+                pending[2].cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
             # Always reset processing state
             print(translate("🏁 Queue worker finishing - resetting processing state"))
             self.is_processing = False
@@ -441,6 +797,136 @@ class ConfigQueueManager:
             self.stop_processing = False
             print(translate("✅ Queue processing stopped - Processed: {0}, Errors: {1}").format(total_processed, total_errors))
 
+    # ==============================================================================
+    # SHARED QUEUE CLAIMS (multi-device / multi-process)
+    # ==============================================================================
+    # queue → processing の移動を os.rename 1 回で行い、成功したプロセス・スロットだけが
+    # その項目を処理する (同じファイルシステム上なら rename はアトミック)。
+    # 誰が処理中かは processing/<name>.claim に残し、落ちたプロセスの項目は
+    # recover_stale_claims() でキューへ戻す。
+
+    def claim_queue_item(self, config_name: str, owner: Optional[Dict] = None) -> bool:
+
+        source = os.path.join(self.queue_dir, f"{config_name}.json")
+        dest = os.path.join(self.processing_dir, f"{config_name}.json")
+        claim = {"host": socket.gethostname(), "pid": os.getpid(), "claimed_at": time.time()}
+        claim.update(owner or {})
+        # rename とインデックスの更新を 1 つのトランザクションにする (他プロセスの遷移とも直列)
+        with self.index.transaction() as conn:
+            if os.path.exists(dest):
+                # 別のスロットが同じ名前の項目を処理中
+                return False
+            try:
+                os.rename(source, dest)
+            except OSError:
+                # 他のプロセス・スロットが先に取った
+                return False
+            self.index.move(conn, config_name, STATE_QUEUED, STATE_PROCESSING,
+                            started_at=claim["claimed_at"], owner=json.dumps(claim, ensure_ascii=False))
+        try:
+            with open(self._claim_path(config_name), 'w', encoding='utf-8') as f:
+                json.dump(claim, f, ensure_ascii=False)
+        except Exception as e:
+            print(translate("Error writing queue claim: {0}").format(e))
+        return True
+
+    def release_claim(self, config_name: str):
+
+        try:
+            os.remove(self._claim_path(config_name))
+        except OSError:
+            pass
+
+    def _claim_path(self, config_name: str) -> str:
+
+        return os.path.join(self.processing_dir, f"{config_name}.claim")
+
+    def requeue_processing_item(self, config_name: str, attempt: Optional[Dict] = None) -> bool:
+        # processing の項目をキューへ戻す。attempt は queue_attempts に追記する
+        # (rename で移した processing のファイルは元の mtime のままなので FIFO の位置も戻る)
+
+        try:
+            source = os.path.join(self.processing_dir, f"{config_name}.json")
+            dest = os.path.join(self.queue_dir, f"{config_name}.json")
+            if not os.path.exists(source):
+                return False
+            st = os.stat(source)
+            with self.index.transaction() as conn:
+                if attempt is not None:
+                    with open(source, 'r', encoding='utf-8') as f:
+                        config_data = json.load(f)
+                    config_data.setdefault('queue_attempts', []).append(attempt)
+                    with open(source, 'w', encoding='utf-8') as f:
+                        json.dump(config_data, f, indent=2, ensure_ascii=False)
+                    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns))
+                os.rename(source, dest)
+                self.index.move(conn, config_name, STATE_PROCESSING, STATE_QUEUED,
+                                started_at=None, owner=None, error=attempt.get('error') if attempt else None)
+                self.index.put(STATE_QUEUED, config_name, path=dest, conn=conn)
+            self.release_claim(config_name)
+            return True
+        except Exception as e:
+            print(translate("Error moving back to queue: {0}").format(e))
+            return False
+
+    def recover_stale_claims(self) -> List[str]:
+        # このホストで終了したプロセスが持っていた項目をキューへ戻す
+
+        recovered = []
+        if not os.path.exists(self.processing_dir):
+            return recovered
+        host = socket.gethostname()
+        for file in os.listdir(self.processing_dir):
+            if not file.endswith('.claim'):
+                continue
+            config_name = file[:-6]
+            try:
+                with open(self._claim_path(config_name), 'r', encoding='utf-8') as f:
+                    claim = json.load(f)
+            except Exception:
+                continue
+            if claim.get('host') != host or _pid_alive(claim.get('pid')):
+                continue
+            if self.requeue_processing_item(config_name):
+                print(translate("♻️ Recovered queue item from stopped worker: {0}").format(config_name))
+                recovered.append(config_name)
+            else:
+                self.release_claim(config_name)
+        return recovered
+
+    def start_multi_device_processing(self, process_function, devices, manager_factory=None,
+                                      **scheduler_options) -> Tuple[bool, str]:
+        # デバイスごとのワーカースロットでキューを並列に処理する (queue_scheduler.py を参照)
+        # process_function(config_data, slot) は slot.device / slot.manager を使って生成する
+
+        if self.is_processing:
+            return False, translate("Queue processing is already running")
+
+        if not self._has_queued_items():
+            return False, translate("No items in queue")
+
+        from eichi_utils.queue_scheduler import MultiDeviceScheduler
+        self.scheduler = MultiDeviceScheduler(self, devices, process_function,
+                                              manager_factory=manager_factory, **scheduler_options)
+        self.is_processing = True
+        self.stop_processing = False
+        self.queue_thread = threading.Thread(target=self._process_queue_worker_multi, daemon=True)
+        self.queue_thread.start()
+        return True, translate("Queue processing started")
+
+    def _process_queue_worker_multi(self):
+
+        try:
+            self.scheduler.run()
+        except Exception as e:
+            print(translate("❌ Queue worker error: {0}").format(e))
+            traceback.print_exc()
+        finally:
+            print(translate("🏁 Queue worker finishing - resetting processing state"))
+            self.is_processing = False
+            self.current_config = None
+            self.stop_processing = False
+
     def load_config_from_processing(self, config_name: str) -> Tuple[bool, Dict, str]:
 
         try:
@@ -587,6 +1073,9 @@ class ConfigQueueManager:
                             print(translate("⚠️ File system preserved different casing: {0} (requested: {1})").format(actual[:-5], final_config_name))
                         break
             
+            # 上書き保存ではディレクトリの mtime が変わらないので、次の一覧で読み直させる
+            self.index.invalidate(STATE_CONFIGS)
+
             # CRITICAL FIX: Return ONLY the clean config name
             return True, translate("Config saved: {0}").format(final_config_name)
             
@@ -754,33 +1243,25 @@ class ConfigQueueManager:
             return False, translate("Error deleting config: {0}").format(str(e))
 
     def get_available_configs(self) -> List[str]:
+        # インデックスから返す。configs/ に変更があったときだけ走査し、警告もそのときに出す
 
         try:
-            configs = []
-            seen_lowercase = {}  # Track lowercase versions for duplicate detection
-            
-            if os.path.exists(self.configs_dir):
-                # Always do a fresh directory scan
-                for file in sorted(os.listdir(self.configs_dir)):
-                    if file.endswith('.json'):
-                        config_name = file[:-5]  # Remove .json extension
-                        # Verify file is readable
-                        config_file = os.path.join(self.configs_dir, file)
-                        try:
-                            with open(config_file, 'r', encoding='utf-8') as f:
-                                json.load(f)  # Basic JSON validation
-                            
-                            # Check for case-insensitive duplicates on Windows
-                            lowercase_name = config_name.lower()
-                            if lowercase_name in seen_lowercase:
-                                print(translate("⚠️ Warning: Case-sensitive duplicate found: '{0}' vs '{1}'").format(config_name, seen_lowercase[lowercase_name]))
-                            else:
-                                seen_lowercase[lowercase_name] = config_name
-                            
-                            configs.append(config_name)
-                        except:
-                            # Skip corrupted files
-                            print(translate("Warning: Skipping corrupted config file: {0}").format(file))
+            scanned = self.index.refresh([STATE_CONFIGS])
+            broken = dict(self.index.errors(STATE_CONFIGS))
+            configs = sorted((name for name in self.index.names(STATE_CONFIGS) if name not in broken),
+                             key=lambda name: f"{name}.json")
+            if scanned:
+                for name in broken:
+                    # Skip corrupted files
+                    print(translate("Warning: Skipping corrupted config file: {0}").format(f"{name}.json"))
+                seen_lowercase = {}  # Track lowercase versions for duplicate detection
+                for config_name in configs:
+                    # Check for case-insensitive duplicates on Windows
+                    lowercase_name = config_name.lower()
+                    if lowercase_name in seen_lowercase:
+                        print(translate("⚠️ Warning: Case-sensitive duplicate found: '{0}' vs '{1}'").format(config_name, seen_lowercase[lowercase_name]))
+                    else:
+                        seen_lowercase[lowercase_name] = config_name
             return configs
         except Exception as e:
             print(translate("Error getting available configs: {0}").format(e))
@@ -803,6 +1284,7 @@ class ConfigQueueManager:
             self._remove_file_case_insensitive(self.queue_dir, config_name)
                 
             shutil.copy2(source_file, dest_file)
+            self.index.put(STATE_QUEUED, config_name, path=dest_file)
             return True, translate("Config queued: {0}").format(config_name)
             
         except Exception as e:
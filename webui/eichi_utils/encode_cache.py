@@ -0,0 +1,485 @@
+"""
+エンコード結果のコンテンツアドレス型キャッシュ
+
+バッチ実行 (batch_count > 1) や画像キューで同じ画像が繰り返し使われる場合に、
+VAE エンコード / CLIP Vision エンコードを再実行しないためのキャッシュ。
+CLIP Vision はヒット時に画像エンコーダの GPU ロード自体を省略できる。
+セクションキーフレームはバケットごとにまとめて 1 回の VAE エンコードで処理する。
+
+キーは「リサイズ済みピクセルバッファ (形状 = バケットを含む) のハッシュ + モデルの指紋」。
+同じ画像でもバケット・モデル・dtype が変われば別エントリになる。
+
+- メモリ層: LRU (エントリ数・合計バイト数で上限)
+- ディスク層: EICHI_ENCODE_CACHE_DISK=1 のときのみ webui/encode_cache/<name>/ に safetensors で保存
+
+vae_encode は latent_dist.sample() を使うため、キャッシュヒット時は前回と同じサンプルが返る
+(分布の標準偏差はごく小さく、出力への影響はない)。
+
+使い方:
+    from eichi_utils.encode_cache import cached_vae_encode, cached_clip_vision_encode
+    start_latent = cached_vae_encode(input_image_np, input_image_pt, vae, vae_encode)
+    hidden = cached_clip_vision_encode(input_image_np, feature_extractor, image_encoder,
+                                       hf_clip_vision_encode, device=gpu,
+                                       load_fn=lambda: load_model_as_complete(image_encoder, target_device=gpu))
+"""
+
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+
+# メモリ層の既定上限
+_DEFAULT_MAX_ENTRIES = 64
+_DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+# ディスク層のエントリ数上限 (超過分は古い順に削除)
+_MAX_DISK_ENTRIES = 256
+
+
+def _env_int(name: str, default: int) -> int:
+    """環境変数を int で読む。不正値は default。"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _disk_enabled() -> bool:
+    return os.environ.get("EICHI_ENCODE_CACHE_DISK", "0").strip().lower() in ("1", "on", "true", "yes")
+
+
+# ====================================================================
+# キー生成
+# ====================================================================
+def content_hash(*parts) -> str:
+    """文字列・数値・配列 (numpy 等の tobytes を持つもの) からキーを作る"""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if hasattr(part, "tobytes"):
+            h.update(f"array:{tuple(part.shape)}:{part.dtype}:".encode("utf-8"))
+            h.update(part.tobytes())
+        else:
+            h.update(f"{type(part).__name__}:{part!r}".encode("utf-8"))
+        h.update(b"|")
+    return h.hexdigest()
+
+
+# 先読み (image_prefetch) で計算済みの画像ハッシュ {id(配列): (弱参照, ハッシュ)}
+_pixel_digests = {}
+_pixel_digests_lock = threading.Lock()
+
+
+def remember_pixel_digest(image_np, digest):
+    """image_np の内容ハッシュを登録し、キー生成時の再計算を省く (配列が解放されると消える)"""
+    key = id(image_np)
+
+    def _forget(_ref, key=key):
+        with _pixel_digests_lock:
+            entry = _pixel_digests.get(key)
+            if entry is not None and entry[0] is _ref:
+                del _pixel_digests[key]
+
+    try:
+        ref = weakref.ref(image_np, _forget)
+    except TypeError:
+        return
+    with _pixel_digests_lock:
+        _pixel_digests[key] = (ref, digest)
+
+
+def pixel_digest(image_np) -> str:
+    """リサイズ済み画像の内容ハッシュ。登録済み (remember_pixel_digest) なら再計算しない"""
+    with _pixel_digests_lock:
+        entry = _pixel_digests.get(id(image_np))
+    if entry is not None and entry[0]() is image_np:
+        return entry[1]
+    return content_hash(image_np)
+
+
+def _config_repr(config):
+    try:
+        if hasattr(config, "to_dict"):
+            config = config.to_dict()
+        return repr(sorted(dict(config).items()))
+    except Exception:
+        return repr(config)
+
+
+# 指紋に使う 1 パラメータあたりのサンプル数 (テンソル全体から等間隔に取る)
+_FINGERPRINT_SAMPLES = 16
+
+
+def _weight_samples(params) -> bytes:
+    """各パラメータから等間隔に値を取り出し、1 回の転送で CPU のバイト列にする"""
+    import torch
+    samples = []
+    for param in params:
+        flat = param.detach().reshape(-1)
+        step = max(1, flat.numel() // _FINGERPRINT_SAMPLES)
+        samples.append(flat[::step][:_FINGERPRINT_SAMPLES].float())
+    if not samples:
+        return b""
+    return torch.cat([t.to(samples[0].device) for t in samples]).cpu().numpy().tobytes()
+
+
+# 計算済みの指紋 {モデル: (重みの状態トークン, 指紋)}。モデルが解放されると消える
+_fingerprints = weakref.WeakKeyDictionary()
+_fingerprints_lock = threading.Lock()
+
+
+def _weight_state_token(params):
+    """重みの差し替え・インプレース書き換えを検出するための安価なトークン (GPU 同期なし)。
+
+    パラメータの差し替え (FP8 化・別モジュールへの再ロード) で id が、
+    load_state_dict や LoRA マージなどのインプレース更新で _version が変わる。
+    デバイス間の移動 (.to()) では変わらない。
+    """
+    return tuple((id(p), getattr(p, "_version", 0)) for p in params)
+
+
+def model_fingerprint(model) -> str:
+    """モデルの指紋 (クラス名・設定 (_name_or_path を含む)・全パラメータの名前/dtype/形状/値の標本)。
+
+    重み全体はハッシュしないが、標本は全パラメータから取る。
+    結果はモデルごとに保持し、重みの状態トークンが変わったとき (再ロード・load_state_dict・
+    重みの差し替え) だけ計算し直す。
+    """
+    try:
+        named = list(model.named_parameters())
+    except Exception:
+        named = []
+    token = _weight_state_token(p for _, p in named)
+    with _fingerprints_lock:
+        try:
+            cached = _fingerprints.get(model)
+        except TypeError:
+            cached = None
+    if cached is not None and cached[0] == token:
+        return cached[1]
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(type(model).__qualname__.encode("utf-8"))
+    config = getattr(model, "config", None)
+    if config is not None:
+        h.update(_config_repr(config).encode("utf-8"))
+    h.update(str(getattr(model, "name_or_path", "")).encode("utf-8"))
+    try:
+        for name, param in named:
+            h.update(f"{name}:{param.dtype}:{tuple(param.shape)}|".encode("utf-8"))
+        h.update(_weight_samples([p for _, p in named]))
+    except Exception:
+        pass
+    fingerprint = h.hexdigest()
+    with _fingerprints_lock:
+        try:
+            _fingerprints[model] = (token, fingerprint)
+        except TypeError:
+            pass
+    return fingerprint
+
+
+# ====================================================================
+# テンソル操作 (torch / safetensors は遅延インポート)
+# ====================================================================
+def _nbytes(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+def _to_cpu(tensor):
+    """キャッシュ保存用に呼び出し側と共有しない CPU コピーを作る"""
+    return tensor.detach().to("cpu", copy=True)
+
+
+def _save_file(data, path):
+    import safetensors.torch as sf
+    sf.save_file(data, path)
+
+
+def _load_file(path):
+    import safetensors.torch as sf
+    return sf.load_file(path, device="cpu")
+
+
+# ====================================================================
+# TensorCache
+# ====================================================================
+class TensorCache:
+    """{name: tensor} を値に持つ LRU キャッシュ (任意でディスク層)。
+
+    Args:
+        name: キャッシュ名 (ディスク層のサブフォルダ名)
+        max_entries: メモリ層のエントリ数上限
+        max_bytes: メモリ層の合計バイト数上限
+        disk_dir: ディスク層の保存先。None なら EICHI_ENCODE_CACHE_DISK=1 のとき既定の場所
+    """
+
+    def __init__(self, name, max_entries=None, max_bytes=None, disk_dir=None):
+        self.name = name
+        self.max_entries = max_entries if max_entries is not None else _env_int(
+            "EICHI_ENCODE_CACHE_ENTRIES", _DEFAULT_MAX_ENTRIES)
+        self.max_bytes = max_bytes if max_bytes is not None else _env_int(
+            "EICHI_ENCODE_CACHE_BYTES", _DEFAULT_MAX_BYTES)
+        self._disk_dir = disk_dir
+        self._entries = OrderedDict()   # key -> (tensors, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def disk_dir(self):
+        """ディスク層の保存先 (無効なら None)"""
+        if self._disk_dir is not None:
+            return self._disk_dir
+        if not _disk_enabled():
+            return None
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return os.path.join(base_dir, "encode_cache", self.name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def get(self, key):
+        """キャッシュ済みの {name: tensor} を返す。なければ None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        tensors = self._load_disk(key)
+        with self._lock:
+            if tensors is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, tensors)
+        return tensors
+
+    def put(self, key, tensors):
+        """{name: tensor} を保存する。テンソルは CPU にコピーして保持する"""
+        tensors = {k: _to_cpu(v) for k, v in tensors.items()}
+        self._put_memory(key, tensors)
+        self._save_disk(key, tensors)
+        return tensors
+
+    def clear(self):
+        """メモリ層を空にする (ディスク層は残す)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _put_memory(self, key, tensors):
+        size = sum(_nbytes(t) for t in tensors.values())
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (tensors, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    # ------------------------------------------------------------------
+    # ディスク層
+    # ------------------------------------------------------------------
+    def _load_disk(self, key):
+        disk_dir = self.disk_dir()
+        if disk_dir is None:
+            return None
+        path = os.path.join(disk_dir, f"{key}.safetensors")
+        if not os.path.exists(path):
+            return None
+        try:
+            tensors = _load_file(path)
+            os.utime(path)  # LRU 用に更新日時を進める
+            return tensors
+        except Exception as e:
+            print(f"{self.name} キャッシュの読み込みに失敗しました: {e}")
+            return None
+
+    def _save_disk(self, key, tensors):
+        disk_dir = self.disk_dir()
+        if disk_dir is None:
+            return
+        try:
+            os.makedirs(disk_dir, exist_ok=True)
+            path = os.path.join(disk_dir, f"{key}.safetensors")
+            tmp_path = f"{path}.tmp"
+            _save_file(tensors, tmp_path)
+            os.replace(tmp_path, path)
+            self._evict_disk(disk_dir)
+        except Exception as e:
+            print(f"{self.name} キャッシュの保存に失敗しました: {e}")
+
+    @staticmethod
+    def _evict_disk(disk_dir, max_entries=_MAX_DISK_ENTRIES):
+        files = []
+        for f in os.listdir(disk_dir):
+            if f.endswith(".safetensors"):
+                full = os.path.join(disk_dir, f)
+                files.append((os.path.getmtime(full), full))
+        files.sort()  # 古い順
+        while len(files) > max_entries:
+            _, old_path = files.pop(0)
+            try:
+                os.remove(old_path)
+            except Exception:
+                pass
+
+
+# ====================================================================
+# VAE エンコード
+# ====================================================================
+vae_latent_cache = TensorCache("vae_latents")
+
+
+def vae_encode_key(image_np, vae):
+    """リサイズ済み画像 (HWC uint8) と VAE からキャッシュキーを作る"""
+    return content_hash("vae_encode", model_fingerprint(vae), pixel_digest(image_np))
+
+
+def cached_vae_encode(image_np, image_pt, vae, encode_fn, cache=None):
+    """vae_encode をキャッシュ付きで実行する。
+
+    Args:
+        image_np: リサイズ済みの画像 (HWC uint8)。キーに使う
+        image_pt: image_np から作った VAE 入力 (B, C, 1, H, W)
+        vae: VAE モデル
+        encode_fn: diffusers_helper.hunyuan.vae_encode
+        cache: 使用する TensorCache (既定は vae_latent_cache)
+    """
+    cache = vae_latent_cache if cache is None else cache
+    key = vae_encode_key(image_np, vae)
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"VAE latent cache hit: {key[:16]}")
+        return cached["latent"].to(device=vae.device, copy=True)
+    latent = encode_fn(image_pt, vae)
+    cache.put(key, {"latent": latent})
+    return latent
+
+
+# キーフレーム一括エンコード時の 1 枚あたりの VRAM 使用量の目安 (バイト / 画素)
+_VAE_ENCODE_BYTES_PER_PIXEL = 2048
+
+
+def _cat_batch(tensors):
+    import torch
+    return torch.cat(tensors, dim=0)
+
+
+def _split_batch(x):
+    return x.split(1, dim=0)
+
+
+def vae_encode_batch_size(height, width, free_bytes=None, reserve_bytes=2 * 1024 ** 3):
+    """1 回の VAE エンコードにまとめる枚数を決める。
+
+    EICHI_VAE_ENCODE_BATCH が指定されていればそれを使う。
+    free_bytes (空き VRAM) が分からない場合は 1 枚ずつ処理する。
+    """
+    fixed = _env_int("EICHI_VAE_ENCODE_BATCH", 0)
+    if fixed > 0:
+        return fixed
+    if free_bytes is None:
+        return 1
+    per_image = max(1, int(height) * int(width) * _VAE_ENCODE_BYTES_PER_PIXEL)
+    return max(1, int((free_bytes - reserve_bytes) // per_image))
+
+
+def cached_vae_encode_batch(items, vae, encode_fn, free_bytes=None, cache=None):
+    """複数画像 (セクションキーフレーム等) をまとめて VAE エンコードする。
+
+    同じバケット (画像サイズ) の画像をバッチにまとめ、VRAM に収まる枚数ずつ
+    1 回の encode_fn で処理し、結果を各キーへ振り分ける。
+    キャッシュ済みの画像と、同じ内容の画像の 2 回目以降はエンコードしない。
+
+    Args:
+        items: (キー, image_np, image_pt) の列。image_pt は (1, C, 1, H, W)
+        vae: VAE モデル
+        encode_fn: diffusers_helper.hunyuan.vae_encode
+        free_bytes: 空き VRAM (バイト)。バッチ枚数の決定に使う
+        cache: 使用する TensorCache (既定は vae_latent_cache)
+
+    Returns:
+        {キー: latent (1, C, 1, h, w)}
+    """
+    cache = vae_latent_cache if cache is None else cache
+    results = {}
+    pending = {}    # content key -> [(item key, image_pt)]
+    buckets = {}    # image shape -> [content key]
+    for item_key, image_np, image_pt in items:
+        key = vae_encode_key(image_np, vae)
+        if key in pending:
+            pending[key].append(item_key)
+            continue
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"VAE latent cache hit: {key[:16]}")
+            results[item_key] = cached["latent"].to(device=vae.device, copy=True)
+            continue
+        pending[key] = [item_key, image_pt]
+        buckets.setdefault(tuple(image_np.shape), []).append(key)
+
+    for shape, keys in buckets.items():
+        batch_size = vae_encode_batch_size(shape[0], shape[1], free_bytes)
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            batch_pt = [pending[key][1] for key in chunk]
+            latents = encode_fn(batch_pt[0] if len(batch_pt) == 1 else _cat_batch(batch_pt), vae)
+            for key, latent in zip(chunk, _split_batch(latents)):
+                cache.put(key, {"latent": latent})
+                item_key, _, *duplicates = pending[key]
+                results[item_key] = latent
+                for dup in duplicates:
+                    results[dup] = latent
+    return {item_key: results[item_key] for item_key, _, _ in items}
+
+
+# ====================================================================
+# CLIP Vision エンコード
+# ====================================================================
+clip_vision_cache = TensorCache("clip_vision")
+
+
+def clip_vision_key(image_np, feature_extractor, image_encoder):
+    """画像 (HWC uint8)・前処理設定・画像エンコーダからキャッシュキーを作る"""
+    extractor = _config_repr(feature_extractor) if feature_extractor is not None else ""
+    return content_hash("clip_vision", model_fingerprint(image_encoder), extractor, pixel_digest(image_np))
+
+
+def cached_clip_vision_encode(image_np, feature_extractor, image_encoder, encode_fn,
+                              device=None, load_fn=None, cache=None):
+    """hf_clip_vision_encode をキャッシュ付きで実行し、last_hidden_state を返す。
+
+    Args:
+        image_np: エンコードする画像 (HWC uint8)
+        feature_extractor / image_encoder: hf_clip_vision_encode に渡すもの
+        encode_fn: diffusers_helper.clip_vision.hf_clip_vision_encode
+        device: ヒット時に返すテンソルのデバイス (通常はエンコード時と同じ GPU)
+        load_fn: ミス時のみエンコード前に呼ぶ関数 (画像エンコーダの GPU ロード等)
+        cache: 使用する TensorCache (既定は clip_vision_cache)
+    """
+    cache = clip_vision_cache if cache is None else cache
+    key = clip_vision_key(image_np, feature_extractor, image_encoder)
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"CLIP Vision cache hit: {key[:16]}")
+        hidden = cached["last_hidden_state"]
+        return hidden.to(device=device, copy=True) if device is not None else hidden.to("cpu", copy=True)
+    if load_fn is not None:
+        load_fn()
+    output = encode_fn(image_np, feature_extractor, image_encoder)
+    hidden = output.last_hidden_state
+    del output
+    cache.put(key, {"last_hidden_state": hidden})
+    return hidden
@@ -0,0 +1,525 @@
+"""
+ヘッドレス生成サーバー (ローカル専用のジョブ API)
+
+ブラウザを開かずに生成を流すための小さな HTTP サーバー。
+モデルはプロセスの起動時に一度だけ読み込み、ジョブの間は TransformerManager /
+TextEncoderManager に保持したままにするので、ジョブごとの起動コストがかからない。
+実際の生成は既存の関数 (oneframe_ichi.py の process()) を run_job として渡して呼び出す。
+
+ジョブは投入順に 1 つずつ実行する (GPU は 1 ジョブで専有するため)。
+終了したジョブは FINISHED_JOB_TTL 秒経つか MAX_FINISHED_JOBS 件を超えると古い順に忘れる。
+イベントは JobContext.bus と同じ ('progress' / 'file' / 'seed' / 'end') をそのまま流し、
+最後にサーバー側で 'done' を 1 件付け加えてストリームを閉じる。
+
+エンドポイント (JSON / イベントは 1 行 1 件の NDJSON):
+    GET  /health                     サーバーの状態
+    GET  /jobs                       ジョブの一覧
+    POST /jobs                       ジョブの投入 (本文はパラメータの JSON オブジェクト)
+    GET  /jobs/<id>                  ジョブの状態
+    GET  /jobs/<id>/events           イベントのストリーム (途中から繋いでも履歴を再生する)
+    GET  /jobs/<id>/outputs          出力ファイルの一覧
+    GET  /jobs/<id>/outputs/<name>   出力ファイルの取得 (そのジョブの出力として記録したものだけ)
+    POST /jobs/<id>/cancel           待機中なら取り消し、実行中なら停止を要求
+
+POST は Content-Type: application/json のものだけ受け付ける (ブラウザが確認なしに送れる
+text/plain などのクロスオリジン POST を通さない)。
+TCP は既定で 127.0.0.1 のみで待ち受け、Host ヘッダーがループバックか待ち受けアドレスでなければ
+拒否する (DNS リバインディング対策)。token を指定すると全リクエストに
+Authorization: Bearer <token> を要求する。外部に公開する場合は必ず token を指定すること。
+socket_path を指定すると UNIX ドメインソケットで待ち受ける (Host ヘッダーは確かめない)。
+
+使い方:
+    jobs = HeadlessJobServer(run_job, cancel_job=end_process, validate=validate)
+    # JobContext の on_publish_tap から jobs.publish(item) を呼び、実行中のジョブへ転送する
+    serve(jobs, port=8001, token=token)  # Ctrl+C で終了
+"""
+
+import os
+import hmac
+import json
+import time
+import queue
+import uuid
+import mimetypes
+import threading
+import socketserver
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote
+
+from eichi_utils.resync_core import FanoutQueue, BUS_END_SENTINEL
+
+DEFAULT_PORT = 8001
+# イベントのストリームで何も流れないときに送る生存確認の間隔 (秒)
+HEARTBEAT_INTERVAL = 15.0
+# ジョブごとに保持するイベント履歴 (途中から繋いだクライアントに再生する)
+EVENT_HISTORY = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+# 終了したジョブ (履歴と出力の一覧) を保持する時間 (秒) と件数の上限
+FINISHED_JOB_TTL = 3600.0
+MAX_FINISHED_JOBS = 100
+
+JOB_STATES = ("queued", "running", "done", "cancelled", "error")
+
+# 待ち受けアドレスに関わらず Host ヘッダーとして受け付ける名前
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+# ==============================================================================
+# イベントの JSON 化
+# ==============================================================================
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def event_to_dict(item):
+    """バスの 1 件 (kind, payload) を JSON にできる dict に変換する
+
+    progress のプレビューは PreviewFileEncoder を通したファイルパスのときだけ載せる
+    (履歴の再生分や画像配列のままのものは None)。
+    """
+    try:
+        kind, payload = item
+    except (TypeError, ValueError):
+        return {"type": "unknown", "data": _jsonable(item)}
+    if kind == "progress":
+        try:
+            preview, desc, bar = payload
+        except (TypeError, ValueError):
+            preview, desc, bar = None, None, None
+        return {
+            "type": "progress",
+            "preview": preview if isinstance(preview, str) else None,
+            "desc": desc if isinstance(desc, str) else None,
+            "bar": bar if isinstance(bar, str) else None,
+        }
+    if kind == "file":
+        return {"type": "file", "path": payload if isinstance(payload, str) else None}
+    if kind == "seed":
+        return {"type": "seed", "seed": _jsonable(payload)}
+    if kind == "end":
+        return {"type": "end"}
+    if kind == "done":
+        return dict(payload, type="done")
+    return {"type": str(kind), "data": _jsonable(payload)}
+
+
+# ==============================================================================
+# ジョブ
+# ==============================================================================
+class HeadlessJob:
+    """投入された 1 ジョブ。イベントは bus (FanoutQueue) に流す"""
+
+    def __init__(self, params, job_id=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = "queued"
+        self.error = None
+        self.outputs = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.bus = FanoutQueue(maxlen=EVENT_HISTORY, maxsize=EVENT_HISTORY)
+
+    def publish(self, item):
+        try:
+            kind, payload = item
+        except (TypeError, ValueError):
+            return
+        if kind == "file" and isinstance(payload, str) and payload not in self.outputs:
+            self.outputs.append(payload)
+        self.bus.publish(item)
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self.bus.publish(("done", {"status": status, "error": error, "outputs": list(self.outputs)}))
+        self.bus.close()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "params": self.params,
+            "outputs": list(self.outputs),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class HeadlessJobServer:
+    """ジョブを受け付けて 1 つずつ run_job で実行する
+
+    Args:
+        run_job: fn(params) → None または (status, error)。ジョブを最後まで (停止されたらそこまで)
+            実行する。例外を送出せずに失敗・中断したときは ("error", 理由) / ("cancelled", None) を返す
+        cancel_job: fn() → 任意。実行中のジョブに停止を要求する
+        validate: fn(params) → params。不正なら ValueError を送出する
+        finished_ttl: 終了したジョブを保持する秒数
+        max_finished: 終了したジョブを保持する件数の上限
+    """
+
+    def __init__(self, run_job, cancel_job=None, validate=None,
+                 finished_ttl=FINISHED_JOB_TTL, max_finished=MAX_FINISHED_JOBS):
+        self._run_job = run_job
+        self._cancel_job = cancel_job
+        self._validate = validate
+        self._finished_ttl = finished_ttl
+        self._max_finished = max(0, int(max_finished))
+        self._jobs = {}
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._current = None
+        self._stopping = False
+        self._thread = None
+
+    # ---- 投入と参照 ----
+    def submit(self, params):
+        if not isinstance(params, dict):
+            raise ValueError("job parameters must be a JSON object")
+        if self._validate is not None:
+            params = self._validate(params)
+        job = HeadlessJob(params)
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("server is shutting down")
+            self._evict_finished()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="eichi-headless", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    @property
+    def current(self):
+        return self._current
+
+    def status(self):
+        with self._condition:
+            current = self._current
+            return {
+                "status": "stopping" if self._stopping else "ok",
+                "running": current.id if current is not None else None,
+                "queued": len(self._pending),
+                "jobs": len(self._jobs),
+            }
+
+    def cancel(self, job_id):
+        """待機中なら取り消し、実行中なら停止を要求する。対象が無い/終了済みなら False"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job.status == "queued":
+                self._pending.remove(job)
+                job.finish("cancelled")
+                return True
+            if job.status != "running" or job.cancel_requested:
+                return False
+            job.cancel_requested = True
+        if self._cancel_job is not None:
+            try:
+                self._cancel_job()
+            except Exception as e:
+                print(f"ヘッドレス: 停止要求に失敗しました: {e}")
+        return True
+
+    def _evict_finished(self):
+        # 終了したジョブを TTL と件数の上限で忘れる (self._condition を持って呼ぶ)
+        finished = sorted((j for j in self._jobs.values() if j.finished_at is not None),
+                          key=lambda j: j.finished_at)
+        expires = time.time() - self._finished_ttl
+        excess = len(finished) - self._max_finished
+        for i, job in enumerate(finished):
+            if i < excess or job.finished_at < expires:
+                del self._jobs[job.id]
+
+    def publish(self, item):
+        """バスのイベントを実行中のジョブへ転送する (on_publish_tap として登録する)"""
+        job = self._current
+        if job is not None and item != BUS_END_SENTINEL:
+            job.publish(item)
+
+    # ---- 実行 ----
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    self._thread = None
+                    self._condition.notify_all()
+                    return
+                job = self._pending.popleft()
+                job.status = "running"
+                job.started_at = time.time()
+                self._current = job
+
+            print(f"ヘッドレス: ジョブ {job.id} を開始します")
+            status, error = "done", None
+            try:
+                result = self._run_job(job.params)
+                if result is not None:
+                    status, error = result
+                    if status not in JOB_STATES[2:]:
+                        status, error = "error", f"invalid job status: {status}"
+                # 停止要求で途中終了したものは失敗ではなく取り消しとして扱う
+                if job.cancel_requested:
+                    status, error = "cancelled", None
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+            if status == "error":
+                print(f"ヘッドレス: ジョブ {job.id} でエラーが発生しました: {error}")
+
+            with self._condition:
+                self._current = None
+                job.finish(status, error)
+                self._evict_finished()
+            print(f"ヘッドレス: ジョブ {job.id} を終了しました ({status})")
+
+    def shutdown(self, cancel_running=True, timeout=None):
+        """待機中のジョブを取り消し、実行中のジョブの終了を待つ"""
+        with self._condition:
+            self._stopping = True
+            while self._pending:
+                self._pending.popleft().finish("cancelled")
+            running, thread = self._current, self._thread
+            self._condition.notify_all()
+        if running is not None and cancel_running:
+            self.cancel(running.id)
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+
+# ==============================================================================
+# HTTP
+# ==============================================================================
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FramePack-eichi-headless"
+
+    @property
+    def jobs(self):
+        return self.server.jobs
+
+    # UNIX ソケットでは client_address が空なので既定の表示が使えない
+    def address_string(self):
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def log_message(self, format, *args):
+        # リクエストごとのログは出さない (イベントのストリームで大量に出るため)
+        pass
+
+    def _send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code, message):
+        self._send_json(code, {"error": message})
+
+    def _authorized(self):
+        """Host ヘッダーとトークンを確かめる。拒否したときは応答を送って False を返す"""
+        allowed = getattr(self.server, "allowed_hosts", None)
+        if allowed is not None and _host_name(self.headers.get("Host", "")) not in allowed:
+            self._send_error(403, "invalid Host header")
+            return False
+        token = getattr(self.server, "token", None)
+        if token:
+            given = self.headers.get("Authorization", "")
+            if not hmac.compare_digest(given.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+                self._send_error(401, "missing or invalid token")
+                return False
+        return True
+
+    def _route(self):
+        parts = [unquote(p) for p in urlsplit(self.path).path.split("/") if p]
+        job = None
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                self._send_error(404, f"unknown job: {parts[1]}")
+                return parts, None, True
+        return parts, job, False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, job, handled = self._route()
+        if handled:
+            return
+        if parts == ["health"]:
+            self._send_json(200, self.jobs.status())
+        elif parts == ["jobs"]:
+            self._send_json(200, {"jobs": [j.to_dict() for j in self.jobs.jobs()]})
+        elif job is not None and len(parts) == 2:
+            self._send_json(200, job.to_dict())
+        elif job is not None and parts[2:] == ["events"]:
+            self._stream_events(job)
+        elif job is not None and parts[2:] == ["outputs"]:
+            self._send_json(200, {"outputs": [_output_entry(p) for p in list(job.outputs)]})
+        elif job is not None and len(parts) == 4 and parts[2] == "outputs":
+            self._send_output(job, parts[3])
+        else:
+            self._send_error(404, "not found")
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        ctype = self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+        if ctype != "application/json":
+            self._send_error(415, "Content-Type must be application/json")
+            return
+        parts, job, handled = self._route()
+        if handled:
+            return
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_REQUEST_BYTES:
+                    raise ValueError("request body too large")
+                params = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+                job = self.jobs.submit(params)
+            except (ValueError, UnicodeDecodeError) as e:
+                self._send_error(400, str(e))
+                return
+            except RuntimeError as e:
+                self._send_error(503, str(e))
+                return
+            self._send_json(201, job.to_dict())
+        elif job is not None and parts[2:] == ["cancel"]:
+            cancelled = self.jobs.cancel(job.id)
+            self._send_json(200 if cancelled else 409, {"id": job.id, "cancelled": cancelled, "status": job.status})
+        else:
+            self._send_error(404, "not found")
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        sub = job.bus.subscribe()
+        try:
+            while True:
+                try:
+                    item = sub.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    line = {"type": "heartbeat"}
+                else:
+                    if item == BUS_END_SENTINEL:
+                        break
+                    line = event_to_dict(item)
+                self.wfile.write(json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            job.bus.unsubscribe(sub)
+
+    def _send_output(self, job, name):
+        path = next((p for p in list(job.outputs) if os.path.basename(p) == name), None)
+        if path is None or not os.path.isfile(path):
+            self._send_error(404, f"unknown output: {name}")
+            return
+        ctype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+
+def _host_name(value):
+    """Host ヘッダーからポートを除いたホスト名 (小文字) を返す"""
+    value = value.strip().lower()
+    if value.startswith("["):
+        return value[1:].split("]", 1)[0]
+    if value.count(":") == 1:
+        return value.rsplit(":", 1)[0]
+    return value
+
+
+def _output_entry(path):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = None
+    return {"name": os.path.basename(path), "path": path, "size": size}
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(jobs, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, token=None, allowed_hosts=()):
+    """HTTP サーバーを作る (serve_forever() は呼び出し側で行う)
+
+    Args:
+        token: 指定すると Authorization: Bearer <token> の無いリクエストを 401 で拒否する
+        allowed_hosts: ループバックと待ち受けアドレスのほかに Host ヘッダーとして受け付ける名前
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        httpd = _UnixHTTPServer(socket_path, _Handler)
+        httpd.allowed_hosts = None
+    else:
+        httpd = ThreadingHTTPServer((host, port), _Handler)
+        httpd.daemon_threads = True
+        names = set(LOOPBACK_HOSTS) | {_host_name(h) for h in allowed_hosts}
+        if host not in ("", "0.0.0.0", "::"):
+            names.add(_host_name(host))
+        httpd.allowed_hosts = frozenset(names)
+    httpd.jobs = jobs
+    httpd.token = token or None
+    return httpd
+
+
+def serve(jobs, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, token=None, allowed_hosts=()):
+    """Ctrl+C まで API を提供し、終了時に実行中のジョブを止める"""
+    httpd = create_server(jobs, host, port, socket_path, token=token, allowed_hosts=allowed_hosts)
+    where = f"unix:{socket_path}" if socket_path else f"http://{host}:{httpd.server_address[1]}"
+    print(f"ヘッドレスサーバーを起動しました: {where}")
+    if not socket_path and not token and host not in LOOPBACK_HOSTS:
+        print("ヘッドレス: 警告: ループバック以外で待ち受けていますが token が指定されていません")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("ヘッドレスサーバーを終了します")
+        httpd.server_close()
+        jobs.shutdown(timeout=60)
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,252 @@
+"""
+履歴バッファのディスク退避 (memory-mapped spill)
+
+長尺動画では latent / pixel の履歴がホストRAMを食い尽くすため、
+サンプラーやブレンドで参照されなくなった確定済みチャンクをジョブの出力フォルダ内の
+ファイルへ書き出し、numpy.memmap 経由のテンソルに置き換える。
+memmap のページはファイルに裏付けされたクリーンページなので、OS が必要に応じて追い出せる。
+
+- SpillFile: 追記専用の生バイナリファイル。write() / allocate() が memmap 裏付けのテンソルを返す
+- should_spill: 推定サイズと空きRAMから退避の要否を判定する (EICHI_HISTORY_SPILL)
+- save_safetensors_chunks: dim=2 方向のチャンク列を全体を結合せずに safetensors へ書き出す
+
+使い方:
+    from eichi_utils.history_spill import SpillFile, should_spill
+    spill = SpillFile(os.path.join(outputs_folder, f"{job_id}_pixels.spill"))
+    mapped = spill.write(chunk)   # chunk は RAM から解放してよい
+    spill.close()                 # ファイルを削除
+"""
+
+import json
+import os
+import threading
+
+
+# auto 判定時: 推定サイズが空きRAMのこの割合を超えたら退避する
+_AUTO_SPILL_RAM_FRACTION = 0.5
+
+# safetensors の dtype 名
+_SAFETENSORS_DTYPES = {
+    "torch.float32": "F32",
+    "torch.float16": "F16",
+    "torch.bfloat16": "BF16",
+    "torch.float64": "F64",
+    "torch.int32": "I32",
+    "torch.int64": "I64",
+    "torch.int16": "I16",
+    "torch.uint8": "U8",
+    "torch.int8": "I8",
+    "torch.bool": "BOOL",
+}
+
+
+def should_spill(estimated_bytes, available_bytes=None, mode=None):
+    """履歴をディスクへ退避するかを判定する。
+
+    Args:
+        estimated_bytes: ジョブ全体の履歴の推定サイズ (バイト)
+        available_bytes: 空きRAM (バイト)。None の場合は host_memory から取得
+        mode: "auto" / "on" / "off"。None の場合は環境変数 EICHI_HISTORY_SPILL (既定 auto)
+    """
+    if mode is None:
+        mode = os.environ.get("EICHI_HISTORY_SPILL", "auto")
+    mode = str(mode).strip().lower()
+    if mode in ("1", "on", "true", "yes"):
+        return True
+    if mode in ("0", "off", "false", "no"):
+        return False
+
+    if available_bytes is None:
+        try:
+            from eichi_utils.host_memory import host_mem_available_gb
+            avail_gb = host_mem_available_gb()
+        except Exception:
+            avail_gb = None
+        if avail_gb is None:
+            return False
+        available_bytes = avail_gb * (1024 ** 3)
+    return estimated_bytes > available_bytes * _AUTO_SPILL_RAM_FRACTION
+
+
+# ====================================================================
+# テンソル ⇔ バイト列 (torch / numpy は遅延インポート)
+# ====================================================================
+def _to_numpy(tensor):
+    """CPU の連続した numpy 配列に変換する。bfloat16 は int16 として扱う"""
+    import torch
+    t = tensor.detach().cpu().contiguous()
+    if t.dtype == torch.bfloat16:
+        t = t.view(torch.int16)
+    return t.numpy()
+
+
+def _map_tensor(path, offset, np_dtype, shape, as_bfloat16=False, mode="c"):
+    """ファイルの指定範囲を memmap してテンソルとして返す。
+
+    mode='c' (copy-on-write) は書き込み可能として扱えるため torch の警告が出ず、ファイルは変更されない。
+    mode='r+' は書き込みがファイルに反映される (allocate 用)。
+    """
+    import numpy as np
+    import torch
+    mapped = torch.from_numpy(np.memmap(path, dtype=np_dtype, mode=mode, offset=offset, shape=tuple(shape)))
+    if as_bfloat16:
+        mapped = mapped.view(torch.bfloat16)
+    return mapped
+
+
+def _tensor_bytes(tensor):
+    """バッファプロトコル対応のオブジェクトを返す (ファイルへそのまま書ける)"""
+    return _to_numpy(tensor)
+
+
+def _dtype_name(tensor):
+    name = str(tensor.dtype)
+    if name not in _SAFETENSORS_DTYPES:
+        raise ValueError(f"safetensors に保存できない dtype です: {name}")
+    return _SAFETENSORS_DTYPES[name]
+
+
+def _nbytes(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+# ====================================================================
+# SpillFile
+# ====================================================================
+class SpillFile:
+    """追記専用の退避ファイル。
+
+    write() で書いたチャンクは memmap 裏付けのテンソルとして返す。
+    close() まではファイルを保持し、close(delete=True) で削除する。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fh = open(self.path, "w+b")
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def size(self):
+        """書き込み済みバイト数"""
+        return self._offset
+
+    def write(self, tensor):
+        """チャンクをファイル末尾に書き、同じ内容の memmap テンソルを返す"""
+        data = _to_numpy(tensor)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"SpillFile is closed: {self.path}")
+            offset = self._offset
+            self._fh.seek(offset)
+            self._fh.write(data)
+            self._fh.flush()
+            self._offset += data.nbytes
+        return _map_tensor(self.path, offset, data.dtype, tensor.shape,
+                           as_bfloat16=str(tensor.dtype) == "torch.bfloat16")
+
+    def allocate(self, shape, dtype):
+        """ファイル末尾に領域を確保し、書き込み可能な memmap テンソルとして返す。
+
+        事前確保バッファ (LatentHistory) 用。書き込んだ内容はファイルに反映され、
+        OS がページ単位で書き戻し・追い出しを行う。
+        """
+        import math
+        import torch
+
+        probe = torch.empty(0, dtype=dtype)
+        as_bfloat16 = dtype == torch.bfloat16
+        np_dtype = _to_numpy(probe).dtype
+        nbytes = probe.element_size() * math.prod(shape)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"SpillFile is closed: {self.path}")
+            offset = self._offset
+            self._fh.truncate(offset + nbytes)
+            self._fh.flush()
+            self._offset += nbytes
+        return _map_tensor(self.path, offset, np_dtype, shape, as_bfloat16=as_bfloat16, mode="r+")
+
+    def close(self, delete=True):
+        """ファイルを閉じる。delete=True なら削除する。
+
+        Windows では memmap が残っていると削除できないため、
+        呼び出し側で履歴への参照を切ってから呼ぶこと。
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._fh.close()
+            except Exception:
+                pass
+        if delete:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"退避ファイルを削除できませんでした: {self.path}: {e}")
+
+
+# ====================================================================
+# safetensors への逐次書き出し
+# ====================================================================
+def save_safetensors_chunks(path, name, chunks, extra_tensors=None):
+    """dim=2 方向に並んだチャンク列を 1 つのテンソルとして safetensors に書き出す。
+
+    torch.cat した全体テンソルを作らず、(B, C) ごとに各チャンクのバイト列を順に書くため、
+    memmap 裏付けのチャンクでもページ単位でしか RAM を使わない。
+
+    Args:
+        path: 出力ファイルパス
+        name: テンソル名 (例: "history_latents")
+        chunks: 時間順のテンソル列。各要素は (B, C, T_i, ...) で T_i 以外の次元が一致すること
+        extra_tensors: 追加で保存する {name: tensor} (例: {"metadata": tensor})
+    """
+    chunks = [c for c in chunks if int(c.shape[2]) > 0]
+    if not chunks:
+        raise ValueError("保存するチャンクがありません")
+    first = chunks[0]
+    dtype = _dtype_name(first)
+    b, c = int(first.shape[0]), int(first.shape[1])
+    rest = [int(s) for s in first.shape[3:]]
+    for chunk in chunks:
+        if _dtype_name(chunk) != dtype or [int(s) for s in chunk.shape[:2]] != [b, c] \
+                or [int(s) for s in chunk.shape[3:]] != rest:
+            raise ValueError("チャンクの dtype / 形状が一致しません")
+    total_t = sum(int(chunk.shape[2]) for chunk in chunks)
+    main_bytes = sum(_nbytes(chunk) for chunk in chunks)
+
+    header = {name: {"dtype": dtype, "shape": [b, c, total_t] + rest, "data_offsets": [0, main_bytes]}}
+    extras = list((extra_tensors or {}).items())
+    offset = main_bytes
+    for extra_name, tensor in extras:
+        size = _nbytes(tensor)
+        header[extra_name] = {
+            "dtype": _dtype_name(tensor),
+            "shape": [int(s) for s in tensor.shape],
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # データ先頭を 8 バイト境界に揃える (safetensors の仕様でスペース埋めが許可されている)
+    header_bytes += b" " * ((8 - len(header_bytes) % 8) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        # 連続レイアウト (B, C, T, ...) の順に書く: 各 (b, c) について全チャンクの時間方向を連結
+        for bi in range(b):
+            for ci in range(c):
+                for chunk in chunks:
+                    f.write(_tensor_bytes(chunk[bi, ci]))
+        for _, tensor in extras:
+            f.write(_tensor_bytes(tensor))
+    os.replace(tmp_path, path)
+    return path
@@ -60,6 +60,23 @@ def host_mem_total_gb():
     return None
 
 
+def host_mem_rss_gb():
+    """このプロセスの常駐メモリ (RSS) をGB単位で返す。取得不能なら None。"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 ** 3)
+    except Exception:
+        pass
+
+    # Linux without psutil: /proc/self/statm の 2 列目が常駐ページ数
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 ** 3)
+    except Exception:
+        return None
+
+
 def host_mem_snapshot():
     """利用可能/総RAMのスナップショットを返す。
 
@@ -70,3 +87,28 @@ def host_mem_snapshot():
         "avail_gb": host_mem_available_gb(),
         "total_gb": host_mem_total_gb(),
     }
+
+
+# 空きRAMがこれを下回ったら「逼迫」とみなす既定値 (GB)
+DEFAULT_RESERVE_GB = 4.0
+
+
+def host_mem_reserve_gb():
+    """逼迫とみなす空きRAMの下限 (EICHI_HOST_RAM_RESERVE_GB、既定 DEFAULT_RESERVE_GB)"""
+    try:
+        return max(0.0, float(os.environ.get("EICHI_HOST_RAM_RESERVE_GB", DEFAULT_RESERVE_GB)))
+    except (TypeError, ValueError):
+        return DEFAULT_RESERVE_GB
+
+
+def host_mem_under_pressure(reserve_gb=None):
+    """空きRAMが reserve_gb (省略時は host_mem_reserve_gb()) を下回っていれば True。
+
+    取得できない場合は判断できないので False を返す。
+    """
+    avail = host_mem_available_gb()
+    if avail is None:
+        return False
+    if reserve_gb is None:
+        reserve_gb = host_mem_reserve_gb()
+    return avail < reserve_gb
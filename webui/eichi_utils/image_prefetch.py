@@ -0,0 +1,192 @@
+"""
+イメージキューの先読み
+
+イメージキューでは各バッチの開始時に生成スレッドで画像ファイルを開き、デコードして
+find_nearest_bucket のサイズへリサイズしていた。フォルダに大きな JPEG/PNG が数百枚ある場合、
+その間 GPU が待たされる。
+ImagePrefetcher はキューの次の N 枚をスレッドプールでデコード・リサイズし、
+内容ハッシュ (encode_cache のキャッシュキーに使う) まで計算して上限付きのバッファに置いておく。
+
+- EICHI_IMAGE_PREFETCH: 先読みする枚数 (既定 4、0 で無効)
+- EICHI_IMAGE_PREFETCH_WORKERS: デコードに使うスレッド数 (既定 2)
+
+使い方:
+    from eichi_utils.image_prefetch import ImagePrefetcher
+    prefetcher = ImagePrefetcher(image_queue_files, resolution)
+    item = prefetcher.get(path, resolution)   # 先読み済みなら待たずに返る。対象外なら None
+    if item is not None:
+        img_np, height, width = item.image, item.height, item.width
+    prefetcher.close()
+
+設定キューの準備ステージは prepare_image() で次のジョブの入力画像を読み込んでおき、
+生成スレッドは get_prepared_image() でそれを受け取る。
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 先読み結果 (image はバケットサイズにリサイズ済みの HWC uint8)
+PrefetchedImage = namedtuple("PrefetchedImage", ["path", "image", "height", "width", "digest"])
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def load_image_to_bucket(path, resolution):
+    """画像ファイルを RGB で読み込み、最も近いバケットへリサイズして内容ハッシュを計算する"""
+    import numpy as np
+    from PIL import Image
+    from diffusers_helper.bucket_tools import find_nearest_bucket
+    from diffusers_helper.utils import resize_and_center_crop
+    from eichi_utils.encode_cache import content_hash, remember_pixel_digest
+
+    with Image.open(path) as img:
+        image = np.array(img.convert("RGB"))
+    H, W = image.shape[:2]
+    height, width = find_nearest_bucket(H, W, resolution=resolution)
+    image_np = resize_and_center_crop(image, target_width=width, target_height=height)
+    digest = content_hash(image_np)
+    remember_pixel_digest(image_np, digest)
+    return PrefetchedImage(path, image_np, height, width, digest)
+
+
+class ImagePrefetcher:
+    """キューの画像を順番に先読みする (get した位置から depth 枚先までを保持)"""
+
+    def __init__(self, paths, resolution, depth=None, workers=None, load_fn=None):
+        self.paths = [p for p in paths if isinstance(p, str) and p]
+        self.resolution = resolution
+        self.depth = max(0, _env_int("EICHI_IMAGE_PREFETCH", 4) if depth is None else int(depth))
+        workers = max(1, _env_int("EICHI_IMAGE_PREFETCH_WORKERS", 2) if workers is None else int(workers))
+        self._load = load_fn or load_image_to_bucket
+        # 同じパスが複数回並ぶ場合は最初の位置を使う
+        self._index = {}
+        for i, path in enumerate(self.paths):
+            self._index.setdefault(path, i)
+        self._futures = {}
+        self._last = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error_reported = False
+        # 統計 (ready: 先読み済み / waited: 読み込み中で待った / missed: 先読み範囲外)
+        self.ready = 0
+        self.waited = 0
+        self.missed = 0
+        self._executor = None
+        if self.depth > 0 and self.paths:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eichi-prefetch")
+            with self._lock:
+                self._schedule(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def enabled(self):
+        return self._executor is not None and not self._closed
+
+    def _schedule(self, start):
+        """start から depth 枚を読み込み対象にし、範囲外の先読みは捨てる (ロック内で呼ぶ)"""
+        window = range(start, min(start + self.depth, len(self.paths)))
+        for i in list(self._futures):
+            if i not in window:
+                self._futures.pop(i).cancel()
+        for i in window:
+            if i not in self._futures:
+                self._futures[i] = self._executor.submit(self._load, self.paths[i], self.resolution)
+
+    def get(self, path, resolution=None, timeout=None):
+        """path の先読み結果を返す。キュー外・解像度違い・無効・読み込み失敗なら None"""
+        if not self.enabled or path not in self._index:
+            return None
+        if resolution is not None and resolution != self.resolution:
+            return None
+        with self._lock:
+            last = self._last
+            if last is not None and last.path == path:
+                # 同じ画像を繰り返し使うバッチ
+                self.ready += 1
+                return last
+            i = self._index[path]
+            future = self._futures.pop(i, None)
+            self._schedule(i + 1)
+        try:
+            if future is None:
+                self.missed += 1
+                result = self._load(path, self.resolution)
+            else:
+                if future.done():
+                    self.ready += 1
+                else:
+                    self.waited += 1
+                result = future.result(timeout)
+        except Exception as e:
+            if not self._error_reported:
+                self._error_reported = True
+                print(f"イメージキューの先読みに失敗しました ({os.path.basename(path)}): {e}")
+            return None
+        with self._lock:
+            self._last = result
+        return result
+
+    def close(self):
+        """未使用の先読みを捨ててスレッドプールを止める (何度呼んでもよい)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._last = None
+        for future in futures:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ====================================================================
+# 設定キューの準備ステージからの受け渡し
+# ====================================================================
+# (path, resolution) -> (読み込み前のファイルの (mtime, size), PrefetchedImage)
+_MAX_PREPARED = 2
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def prepare_image(path, resolution, load_fn=None):
+    """画像を読み込んで生成スレッド向けに保持する (読み込んだ PrefetchedImage を返す)"""
+    stamp = _file_stamp(path)
+    item = (load_fn or load_image_to_bucket)(path, resolution)
+    with _prepared_lock:
+        _prepared[(path, resolution)] = (stamp, item)
+        _prepared.move_to_end((path, resolution))
+        while len(_prepared) > _MAX_PREPARED:
+            _prepared.popitem(last=False)
+    return item
+
+
+def get_prepared_image(path, resolution):
+    """prepare_image で読み込んだ画像を返す (未準備・ファイルが変わった場合は None)"""
+    with _prepared_lock:
+        entry = _prepared.get((path, resolution))
+    if entry is None or entry[0] is None or entry[0] != _file_stamp(path):
+        return None
+    return entry[1]
@@ -0,0 +1,174 @@
+"""
+latent 履歴ストア
+
+history_latents を毎セクション torch.cat で作り直す代わりに、予定フレーム数ぶんの
+バッファを最初に確保し、生成した latent をスライス書き込みで追加する。
+セクションごとに履歴全体をコピーしないため、コピー量は O(セクション数²) から O(セクション数) になる。
+real_history_latents / clean latent 窓はバッファのビュー (コピーなし) として返す。
+
+バッファ配置:
+    prepend (endframe): [空き ...][生成済み (新しい順)][初期コンテキスト]   ← 左へ伸びる
+    append  (F1):       [初期コンテキスト][生成済み (古い順)][空き ...]   → 右へ伸びる
+
+初期コンテキスト (zeros や end_frame の latent) は clean latent 窓にのみ現れ、
+real() / save_safetensors() が返す生成済み履歴には含まれない。
+予定より多く追加された場合は容量を倍にして再確保する (償却 O(1))。
+spill (eichi_utils.history_spill.SpillFile) を指定するとバッファ自体を memmap ファイル上に確保する。
+
+使い方:
+    from eichi_utils.latent_history import LatentHistory
+    history = LatentHistory(torch.zeros(1, 16, 19, h, w), direction="prepend", capacity=planned_frames)
+    post, x2, x4 = history.context(19).split([1, 2, 16], dim=2)
+    history.add(generated_latents)
+    history.save_safetensors(path, {"metadata": metadata})
+"""
+
+
+# 1 + 2 + 16: clean_latents_post / 2x / 4x
+DEFAULT_CONTEXT_FRAMES = 1 + 2 + 16
+
+
+def _empty(shape, like):
+    import torch
+    return torch.empty(shape, dtype=like.dtype, device=like.device)
+
+
+def _frames(x):
+    return int(x.shape[2])
+
+
+class LatentHistory:
+    """予定フレーム数ぶん事前確保した latent 履歴。
+
+    Args:
+        initial_context: 初期コンテキスト (B, C, T0, H, W)。生成前の clean latent 窓になる
+        direction: "prepend" (endframe) または "append" (F1)
+        context_frames: サンプラーが参照する窓のフレーム数
+        capacity: 生成予定のフレーム数 (超えた場合は自動で拡張する)
+        spill: バッファの確保先 (eichi_utils.history_spill.SpillFile)。None なら RAM に確保
+    """
+
+    def __init__(self, initial_context, direction="prepend", context_frames=DEFAULT_CONTEXT_FRAMES,
+                 capacity=0, spill=None):
+        if direction not in ("prepend", "append"):
+            raise ValueError(f"direction must be 'prepend' or 'append': {direction}")
+        self.direction = direction
+        self.context_frames = int(context_frames)
+        self._spill = spill
+        self._t0 = _frames(initial_context)
+        self._capacity = max(0, int(capacity))
+        b, c, _, h, w = initial_context.shape
+        self._frame_shape = (b, c, h, w)
+        self._buffer = self._allocate(self._capacity + self._t0, initial_context)
+        if direction == "prepend":
+            # 生成済み領域 [_lo, _hi)、初期コンテキストはその直後
+            self._lo = self._hi = self._capacity
+            self._buffer[:, :, self._hi:self._hi + self._t0] = initial_context
+        else:
+            # 初期コンテキストは先頭、生成済み領域 [_lo, _hi) はその直後
+            self._lo = self._hi = self._t0
+            self._buffer[:, :, :self._t0] = initial_context
+        self.reallocations = 0
+
+    def _allocate(self, frames, like):
+        b, c, h, w = self._frame_shape
+        shape = (b, c, frames, h, w)
+        if self._spill is not None:
+            return self._spill.allocate(shape, like.dtype)
+        return _empty(shape, like)
+
+    # ------------------------------------------------------------------
+    # 属性
+    # ------------------------------------------------------------------
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    @property
+    def device(self):
+        return self._buffer.device
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def num_frames(self):
+        """生成済みフレーム数 (初期コンテキストを除く)"""
+        return self._hi - self._lo
+
+    @property
+    def shape(self):
+        """生成済み履歴の形状 (B, C, T, H, W)"""
+        b, c, h, w = self._frame_shape
+        return (b, c, self.num_frames, h, w)
+
+    # ------------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------------
+    def add(self, latents):
+        """生成したセクションの latent を書き込む (prepend は先頭、append は末尾)"""
+        latents = latents.to(device=self.device, dtype=self.dtype)
+        n = _frames(latents)
+        if self.num_frames + n > self._capacity:
+            self._grow(self.num_frames + n)
+        if self.direction == "prepend":
+            self._buffer[:, :, self._lo - n:self._lo] = latents
+            self._lo -= n
+        else:
+            self._buffer[:, :, self._hi:self._hi + n] = latents
+            self._hi += n
+
+    def _grow(self, required):
+        """容量不足時に倍々で再確保し、有効領域 (生成済み + 初期コンテキスト) を移す"""
+        new_capacity = max(required, self._capacity * 2)
+        new_buffer = self._allocate(new_capacity + self._t0, self._buffer)
+        used = self.num_frames + self._t0
+        if self.direction == "prepend":
+            old_lo = self._lo
+            shift = new_capacity - self._capacity
+            new_buffer[:, :, old_lo + shift:old_lo + shift + used] = self._buffer[:, :, old_lo:old_lo + used]
+            self._lo += shift
+            self._hi += shift
+        else:
+            new_buffer[:, :, :used] = self._buffer[:, :, :used]
+        self._buffer = new_buffer
+        self._capacity = new_capacity
+        self.reallocations += 1
+
+    def write_context(self, start, latents):
+        """clean latent 窓の位置 start から latents を書き込む (end_frame の設定など)。
+
+        prepend では窓の先頭から、append では窓の末尾からの位置として扱う。
+        """
+        count = _frames(latents)
+        if self.direction == "prepend":
+            pos = self._lo + int(start)
+            self._buffer[:, :, pos:pos + count] = latents
+        else:
+            end = self._hi - int(start)
+            self._buffer[:, :, end - count:end] = latents
+
+    # ------------------------------------------------------------------
+    # 参照 (いずれもバッファのビュー)
+    # ------------------------------------------------------------------
+    def context(self, frames=None):
+        """サンプラー用の clean latent 窓 (prepend は先頭、append は末尾の frames 個)"""
+        frames = self.context_frames if frames is None else int(frames)
+        if self.direction == "prepend":
+            return self._buffer[:, :, self._lo:self._lo + frames]
+        return self._buffer[:, :, self._hi - frames:self._hi]
+
+    def real(self, frames=None):
+        """生成済み履歴 (従来の real_history_latents)。frames 指定時は最新側の frames 個"""
+        if frames is None:
+            return self._buffer[:, :, self._lo:self._hi]
+        frames = min(int(frames), self.num_frames)
+        if self.direction == "prepend":
+            return self._buffer[:, :, self._lo:self._lo + frames]
+        return self._buffer[:, :, self._hi - frames:self._hi]
+
+    def save_safetensors(self, path, extra_tensors=None, name="history_latents"):
+        """生成済み履歴をコピーせずに safetensors へ書き出す (save_tensor_data 互換)"""
+        from eichi_utils.history_spill import save_safetensors_chunks
+        return save_safetensors_chunks(path, name, [self.real()], extra_tensors)
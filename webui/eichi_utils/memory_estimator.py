@@ -0,0 +1,418 @@
+"""
+ジョブのVRAM/RAMピークの事前見積もり (プリフライト)
+
+これまでメモリ不足は生成を始めてから気付いていた (oneframe_ichi の
+_ram_guard_maybe_disable_lora_cache / _pre_gc_before_next_lora は LoRA 切り替えの直前に
+MemAvailable とキャッシュファイルのサイズを比べるだけ)。
+MemoryEstimator はジョブの設定 (解像度バケット、latent_window_size、総フレーム数、LoRA の数とランク、
+FP8、high_vram、VAE キャッシュ/タイリング、キューの種類) から VRAM とプロセスの RAM のピークを
+線形モデルで見積もり、ジョブを始める前に
+
+- RAM が足りなければ LoRA のオンメモリキャッシュを無効にし、
+- VRAM が足りなければ VAE のタイリングを有効にし、
+- それでも足りなければジョブを受け付けない。
+
+見積もりと実測は settings/job_memory_log.jsonl に記録し、起動時にその記録で係数を合わせ直す
+(記録が少ないうちは既定の係数に近いまま)。既定の係数は概算なので、実測が
+MIN_RECORDS_TO_REJECT 件たまるまでは設定の変更だけを行い、ジョブは拒否しない。
+
+- EICHI_PREFLIGHT: on (既定) / warn (見積もりと調整のみで拒否しない) / off
+
+使い方:
+    from eichi_utils.memory_estimator import JobProfile, get_estimator, JobMemoryMonitor
+    profile = JobProfile(width=640, height=640, fp8=True, lora_ranks=(32,), lora_cache=True)
+    result = get_estimator().preflight(profile, vram_budget_gb=24, ram_budget_gb=48)
+    if result.action == "reject": ...
+    monitor = JobMemoryMonitor().start()
+    ...
+    get_estimator().record(result.profile, result.estimate, *monitor.stop())
+"""
+
+import json
+import math
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# ジョブの設定 (vram_total_gb / preserved_gb は低VRAMモードで GPU に載る重みの見積もりに使う)
+JobProfile = namedtuple("JobProfile", [
+    "width", "height", "latent_window_size", "total_frames", "lora_ranks", "fp8", "high_vram",
+    "vae_tiling", "vae_cache", "lora_cache", "queue_type", "batch_size", "vram_total_gb", "preserved_gb",
+], defaults=(9, 1, (), False, False, True, False, False, "none", 1, None, 6.0))
+
+# 見積もり (GB)
+MemoryEstimate = namedtuple("MemoryEstimate", ["vram_gb", "ram_gb"])
+
+# プリフライトの結果 (action: "ok" / "adapt" / "reject"、changes: 変更した設定の名前)
+PreflightResult = namedtuple("PreflightResult", ["action", "profile", "estimate", "changes", "reason"])
+
+# transformer の重みのサイズ (GB)
+TRANSFORMER_GB = {"bf16": 25.7, "fp8": 13.5}
+# high_vram で GPU に常駐するテキストエンコーダ・VAE・画像エンコーダ (GB)
+ENCODERS_GB = 16.5
+
+FEATURES = (
+    "bias",
+    "resident_weights_gb",  # GPU に載っている重み
+    "host_weights_gb",  # ホストに置く transformer の重み
+    "mp_window",  # 出力メガピクセル × latent_window_size × バッチ (サンプリングの中間テンソル)
+    "mp_frames",  # 出力メガピクセル × latent フレーム数 (履歴)
+    "mp_frames_untiled",  # 同上、VAE をタイリング・キャッシュなしでデコードする場合
+    "lora_count",
+    "lora_rank_k",  # LoRA のランクの合計 / 1000
+    "lora_cache_gb",  # LoRA 適用済み状態辞書のオンメモリキャッシュ
+    "image_queue",
+)
+
+# 実測の記録がないときの係数 (手元の計測からの概算)
+DEFAULT_VRAM_WEIGHTS = {
+    "bias": 1.0, "resident_weights_gb": 1.0, "host_weights_gb": 0.0, "mp_window": 0.9,
+    "mp_frames": 0.01, "mp_frames_untiled": 0.35, "lora_count": 0.0, "lora_rank_k": 0.0,
+    "lora_cache_gb": 0.0, "image_queue": 0.0,
+}
+DEFAULT_RAM_WEIGHTS = {
+    "bias": 20.0, "resident_weights_gb": 0.0, "host_weights_gb": 1.0, "mp_window": 0.1,
+    "mp_frames": 0.05, "mp_frames_untiled": 0.0, "lora_count": 0.4, "lora_rank_k": 2.0,
+    "lora_cache_gb": 1.0, "image_queue": 0.3,
+}
+
+# 見積もりに足す余裕 (GB)。記録で合わせ直した後は残差の RMS を加える
+BASE_MARGIN_GB = 1.0
+# 係数を既定値に引き寄せる強さ (記録が少ないうちは既定値のまま)
+RIDGE = 2.0
+# 合わせ直しに使う記録の数
+MAX_RECORDS = 500
+# これだけの実測で合わせ直すまではジョブを拒否しない
+MIN_RECORDS_TO_REJECT = 5
+
+
+def preflight_mode():
+    """EICHI_PREFLIGHT の値 (on / warn / off)"""
+    mode = os.environ.get("EICHI_PREFLIGHT", "on").strip().lower()
+    return mode if mode in ("on", "warn", "off") else "on"
+
+
+def default_log_path():
+    webui_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(webui_path, "settings", "job_memory_log.jsonl")
+
+
+# ==============================================================================
+# 特徴量
+# ==============================================================================
+def transformer_gb(fp8):
+    return TRANSFORMER_GB["fp8" if fp8 else "bf16"]
+
+
+def job_features(profile):
+    """JobProfile から FEATURES の順の特徴量を返す"""
+    mp = max(0, int(profile.width)) * max(0, int(profile.height)) / 1e6
+    latent_frames = max(1, (int(profile.total_frames) + 3) // 4)
+    batch = max(1, int(profile.batch_size))
+    host_weights = transformer_gb(profile.fp8)
+    if profile.high_vram:
+        resident = host_weights + ENCODERS_GB
+    elif profile.vram_total_gb is not None:
+        # 低VRAMモードでは gpu_memory_preservation を残すところまで重みが載る
+        resident = max(0.0, float(profile.vram_total_gb) - float(profile.preserved_gb))
+    else:
+        resident = 0.0
+    ranks = [int(r) for r in (profile.lora_ranks or ()) if r]
+    lora_count = len(profile.lora_ranks or ())
+    values = {
+        "bias": 1.0,
+        "resident_weights_gb": resident,
+        "host_weights_gb": host_weights,
+        "mp_window": mp * int(profile.latent_window_size) * batch,
+        "mp_frames": mp * latent_frames,
+        "mp_frames_untiled": 0.0 if (profile.vae_tiling or profile.vae_cache) else mp * latent_frames,
+        "lora_count": float(lora_count),
+        "lora_rank_k": sum(ranks) / 1000.0,
+        "lora_cache_gb": host_weights if (profile.lora_cache and lora_count) else 0.0,
+        "image_queue": 1.0 if profile.queue_type == "image" else 0.0,
+    }
+    return [values[name] for name in FEATURES]
+
+
+def lora_rank(path):
+    """safetensors のヘッダから LoRA のランク (lora_down / lora_A の行数の最大値) を読む。分からなければ None"""
+    try:
+        with open(path, "rb") as f:
+            header_len = struct.unpack("<Q", f.read(8))[0]
+            if header_len > 100 * 1024 * 1024:
+                return None
+            header = json.loads(f.read(header_len))
+    except Exception:
+        return None
+    rank = None
+    for key, info in header.items():
+        if not isinstance(info, dict) or ("lora_down" not in key and "lora_A" not in key):
+            continue
+        shape = info.get("shape") or []
+        if shape:
+            rank = max(rank or 0, int(shape[0]))
+    return rank
+
+
+# ==============================================================================
+# 係数の合わせ直し
+# ==============================================================================
+def _solve(matrix, vector):
+    """連立一次方程式をガウスの消去法で解く (部分ピボット選択)"""
+    n = len(vector)
+    a = [list(row) + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            raise ValueError("singular matrix")
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            if factor:
+                for c in range(col, n + 1):
+                    a[r][c] -= factor * a[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (a[r][n] - sum(a[r][c] * x[c] for c in range(r + 1, n))) / a[r][r]
+    return x
+
+
+def fit_weights(rows, targets, prior, ridge=RIDGE):
+    """係数を既定値 prior に引き寄せながら最小二乗で合わせる
+
+    (XᵀX + λI) w = Xᵀy + λ w0 を解く。記録が少ない・特徴量が偏っている場合でも
+    記録に現れない方向の係数は prior のまま残る。
+    """
+    n = len(prior)
+    xtx = [[ridge if i == j else 0.0 for j in range(n)] for i in range(n)]
+    xty = [ridge * w for w in prior]
+    for x, y in zip(rows, targets):
+        for i in range(n):
+            if x[i] == 0:
+                continue
+            xty[i] += x[i] * y
+            for j in range(n):
+                xtx[i][j] += x[i] * x[j]
+    return _solve(xtx, xty)
+
+
+def _rms(rows, targets, weights):
+    if not rows:
+        return 0.0
+    errors = [(y - sum(w * v for w, v in zip(weights, x))) ** 2 for x, y in zip(rows, targets)]
+    return math.sqrt(sum(errors) / len(errors))
+
+
+class MemoryEstimator:
+    """VRAM と RAM のピークを見積もり、実測を記録して係数を合わせ直す"""
+
+    def __init__(self, log_path=None, vram_weights=None, ram_weights=None):
+        self.log_path = log_path
+        self._prior = {
+            "vram": [(vram_weights or DEFAULT_VRAM_WEIGHTS)[name] for name in FEATURES],
+            "ram": [(ram_weights or DEFAULT_RAM_WEIGHTS)[name] for name in FEATURES],
+        }
+        self.weights = {key: list(value) for key, value in self._prior.items()}
+        self.margin = {"vram": BASE_MARGIN_GB, "ram": BASE_MARGIN_GB}
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def predict(self, profile):
+        x = job_features(profile)
+        with self._lock:
+            vram = sum(w * v for w, v in zip(self.weights["vram"], x))
+            ram = sum(w * v for w, v in zip(self.weights["ram"], x))
+        return MemoryEstimate(max(0.0, vram), max(0.0, ram))
+
+    def _over(self, estimate, vram_budget_gb, ram_budget_gb):
+        vram_over = vram_budget_gb is not None and estimate.vram_gb + self.margin["vram"] > vram_budget_gb
+        ram_over = ram_budget_gb is not None and estimate.ram_gb + self.margin["ram"] > ram_budget_gb
+        return vram_over, ram_over
+
+    def preflight(self, profile, vram_budget_gb=None, ram_budget_gb=None, allow_reject=True):
+        """ジョブを始める前に見積もり、足りなければ設定を変えるか拒否する"""
+        estimate = self.predict(profile)
+        vram_over, ram_over = self._over(estimate, vram_budget_gb, ram_budget_gb)
+        changes = []
+        if ram_over and profile.lora_cache and profile.lora_ranks:
+            profile = profile._replace(lora_cache=False)
+            changes.append("lora_cache")
+        if vram_over and not (profile.vae_tiling or profile.vae_cache):
+            profile = profile._replace(vae_tiling=True)
+            changes.append("vae_tiling")
+        if changes:
+            estimate = self.predict(profile)
+            vram_over, ram_over = self._over(estimate, vram_budget_gb, ram_budget_gb)
+
+        reasons = []
+        if vram_over:
+            reasons.append(f"VRAM {estimate.vram_gb:.1f}GB (+{self.margin['vram']:.1f}) > {vram_budget_gb:.1f}GB")
+        if ram_over:
+            reasons.append(f"RAM {estimate.ram_gb:.1f}GB (+{self.margin['ram']:.1f}) > {ram_budget_gb:.1f}GB")
+        if reasons and allow_reject and self.records >= MIN_RECORDS_TO_REJECT:
+            action = "reject"
+        elif changes:
+            action = "adapt"
+        else:
+            action = "ok"
+        return PreflightResult(action, profile, estimate, tuple(changes), ", ".join(reasons))
+
+    # ---- 記録 ----
+    def _read_records(self):
+        if not self.log_path or not os.path.exists(self.log_path):
+            return []
+        records = []
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            return []
+        return records[-MAX_RECORDS:]
+
+    def refit(self, records=None):
+        """記録 (省略時はログファイル) から係数を合わせ直す。使った記録の数を返す"""
+        if records is None:
+            records = self._read_records()
+        fitted = {}
+        for key in ("vram", "ram"):
+            rows, targets = [], []
+            for record in records:
+                features = record.get("features") or {}
+                actual = (record.get("actual") or {}).get(f"{key}_gb")
+                if actual is None or any(name not in features for name in FEATURES):
+                    continue
+                rows.append([float(features[name]) for name in FEATURES])
+                targets.append(float(actual))
+            weights = fit_weights(rows, targets, self._prior[key]) if rows else list(self._prior[key])
+            fitted[key] = (weights, BASE_MARGIN_GB + _rms(rows, targets, weights), len(rows))
+        with self._lock:
+            for key, (weights, margin, _) in fitted.items():
+                self.weights[key] = weights
+                self.margin[key] = margin
+            self.records = max(count for _, _, count in fitted.values())
+        return self.records
+
+    def record(self, profile, estimate, vram_gb=None, ram_gb=None):
+        """見積もりと実測を記録する (実測が取れなかった値は None)"""
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "profile": {k: (list(v) if isinstance(v, tuple) else v) for k, v in profile._asdict().items()},
+            "features": dict(zip(FEATURES, job_features(profile))),
+            "predicted": {"vram_gb": round(estimate.vram_gb, 3), "ram_gb": round(estimate.ram_gb, 3)},
+            "actual": {"vram_gb": None if vram_gb is None else round(vram_gb, 3),
+                       "ram_gb": None if ram_gb is None else round(ram_gb, 3)},
+        }
+        if not self.log_path:
+            return entry
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with self._lock:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._trim_log()
+        except OSError as e:
+            print(f"メモリ見積もりの記録に失敗しました: {e}")
+        return entry
+
+    def _trim_log(self):
+        """記録が MAX_RECORDS の 2 倍を超えたら古いものを捨てる (ロック内で呼ぶ)"""
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        if len(lines) <= MAX_RECORDS * 2:
+            return
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[-MAX_RECORDS:])
+        os.replace(tmp_path, self.log_path)
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+
+def get_estimator():
+    """settings/job_memory_log.jsonl で合わせ直した MemoryEstimator (プロセスで 1 つ)"""
+    global _estimator
+    with _estimator_lock:
+        if _estimator is None:
+            _estimator = MemoryEstimator(default_log_path())
+            try:
+                count = _estimator.refit()
+                if count:
+                    print(f"メモリ見積もりを {count} 件の実測で調整しました")
+            except Exception as e:
+                print(f"メモリ見積もりの調整に失敗しました: {e}")
+        return _estimator
+
+
+# ==============================================================================
+# 実測
+# ==============================================================================
+def process_rss_gb():
+    """このプロセスの常駐メモリ (GB)。取得できなければ None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 ** 3)
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 ** 3)
+    except Exception:
+        return None
+
+
+class JobMemoryMonitor:
+    """ジョブ中の VRAM (torch の最大確保量) と RSS のピークを測る"""
+
+    def __init__(self, interval=0.5, rss_fn=None):
+        self.interval = interval
+        self._rss = rss_fn or process_rss_gb
+        self._peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._cuda = False
+
+    def _sample(self):
+        value = self._rss()
+        if value is not None and (self._peak_rss is None or value > self._peak_rss):
+            self._peak_rss = value
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.reset_peak_memory_stats()
+                self._cuda = True
+        except Exception:
+            self._cuda = False
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="eichi-memory-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """(VRAM のピーク GB, RSS のピーク GB) を返す (測れなかった値は None)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(1.0, self.interval * 2))
+        self._sample()
+        vram = None
+        if self._cuda:
+            try:
+                import torch
+                vram = torch.cuda.max_memory_allocated() / (1024 ** 3)
+            except Exception:
+                vram = None
+        return vram, self._peak_rss
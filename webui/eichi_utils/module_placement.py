@@ -0,0 +1,199 @@
+"""
+メモリ予約付きのモデル配置計画
+
+diffusers_helper.memory の move_model_to_device_with_memory_preservation /
+offload_model_from_device_for_memory_preservation は model.modules() を順に辿り、
+モジュールを 1 つ動かすたびに get_cuda_free_memory_gb (torch.cuda.memory_stats と mem_get_info)
+を呼んで空き VRAM を確かめていた。
+
+ここでは weight を持つモジュール (m.to で配下ごと動く単位) のバイト数を一度だけ数え、
+モデルのクラスと dtype の構成 (FP8 の重みと scale_weight を含む) ごとにキャッシュする。
+空き VRAM は最初に 1 回だけ取得し、予約量を守るために動かすモジュールを同じ順序・同じ判定で
+先に決めてからまとめて動かす。全て動かせる場合は model.to の 1 回で済ませる。
+
+計画部分 (placement_units / plan_move / plan_offload) は torch に依存しないので、
+合成したサイズで CPU 上でテストできる。
+
+使い方:
+    from eichi_utils.module_placement import move_model_to_device_with_memory_preservation
+    move_model_to_device_with_memory_preservation(transformer, target_device=gpu, preserved_memory_gb=6)
+"""
+
+import threading
+from collections import namedtuple
+
+# m.to(device) で一緒に動くテンソルのまとまり (name は named_modules の名前)
+PlacementUnit = namedtuple("PlacementUnit", ["name", "nbytes"])
+
+_GB = 1024 ** 3
+
+# (クラス, dtype 構成) -> (units, 単位に属さないテンソルのバイト数)
+_units_cache = {}
+_units_lock = threading.Lock()
+
+
+def _own_tensors(module):
+    for table in (module._parameters, module._buffers):
+        for tensor in table.values():
+            if tensor is not None:
+                yield tensor
+
+
+def _has_weight(module):
+    # hasattr は DynamicSwapInstaller 導入済みのモジュールで転送を起こすので辞書を直接見る
+    return ("weight" in module._parameters or "weight" in module._buffers
+            or "weight" in module.__dict__)
+
+
+def _signature(model, modules):
+    """モデルのクラスと、dtype ごとの要素数の合計"""
+    counts = {}
+    for _, module in modules:
+        for tensor in _own_tensors(module):
+            dtype = str(tensor.dtype)
+            counts[dtype] = counts.get(dtype, 0) + tensor.numel()
+    model_class = type(model)
+    return (model_class.__module__, model_class.__qualname__, tuple(sorted(counts.items())))
+
+
+def placement_units(model):
+    """model の配置単位を modules() の順に返す (同じクラス・dtype 構成なら計算済みの結果を使う)
+
+    戻り値は (units, rest_bytes)。rest_bytes はどの単位にも含まれないテンソル
+    (ルート直下の scale_shift_table など) のバイト数。
+    """
+    modules = list(model.named_modules())
+    key = _signature(model, modules)
+    with _units_lock:
+        cached = _units_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # 各モジュールの配下のテンソル (同じテンソルは一度だけ数える)
+    children = {}
+    for name, _ in modules:
+        if name:
+            parent = name.rsplit(".", 1)[0] if "." in name else ""
+            children.setdefault(parent, []).append(name)
+    by_name = dict(modules)
+
+    def subtree(name):
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            yield from _own_tensors(by_name[current])
+            stack.extend(reversed(children.get(current, [])))
+
+    counted = set()
+    units = []
+    for name, module in modules:
+        if not _has_weight(module):
+            continue
+        nbytes = 0
+        for tensor in subtree(name):
+            if id(tensor) not in counted:
+                counted.add(id(tensor))
+                nbytes += tensor.numel() * tensor.element_size()
+        units.append(PlacementUnit(name, nbytes))
+    rest = sum(t.numel() * t.element_size() for _, m in modules for t in _own_tensors(m)
+               if id(t) not in counted)
+    result = (units, rest)
+    with _units_lock:
+        _units_cache[key] = result
+    return result
+
+
+def clear_placement_cache():
+    with _units_lock:
+        _units_cache.clear()
+
+
+def plan_move(units, free_bytes, preserved_bytes, resident=None):
+    """デバイスへ移す単位を決める
+
+    元の実装と同じく、単位を動かす前に空きが予約量以下になっていればそこで止める。
+    resident[i] が True の単位は既にデバイスにあるので空きは減らない。
+    戻り値は (移す単位の番号のリスト, 全ての単位を調べ終えたか)。
+    """
+    selected = []
+    free = free_bytes
+    for i, unit in enumerate(units):
+        if free <= preserved_bytes:
+            return selected, False
+        if resident is not None and resident[i]:
+            continue
+        selected.append(i)
+        free -= unit.nbytes
+    return selected, True
+
+
+def plan_offload(units, free_bytes, preserved_bytes, resident=None):
+    """デバイスから退避する単位を決める (空きが予約量以上になった時点で止める)
+
+    resident が None の場合は全ての単位がデバイスにあるものとする。
+    戻り値は (退避する単位の番号のリスト, 全ての単位を調べ終えたか)。
+    """
+    selected = []
+    free = free_bytes
+    for i, unit in enumerate(units):
+        if free >= preserved_bytes:
+            return selected, False
+        if resident is not None and not resident[i]:
+            continue
+        selected.append(i)
+        free += unit.nbytes
+    return selected, True
+
+
+# ==============================================================================
+# torch モデルへの適用
+# ==============================================================================
+def _is_on(module, device):
+    for tensor in _own_tensors(module):
+        return tensor.device == device
+    return False
+
+
+def _resident(model, units, device):
+    modules = dict(model.named_modules())
+    return modules, [_is_on(modules[unit.name], device) for unit in units]
+
+
+def move_model_to_device_with_memory_preservation(model, target_device, preserved_memory_gb=0):
+    """diffusers_helper.memory の同名関数と同じ配置になるよう、計画してからまとめて移す"""
+    import torch
+    from diffusers_helper.memory import get_cuda_free_memory_gb
+
+    print(f'Moving {model.__class__.__name__} to {target_device} with preserved memory: {preserved_memory_gb} GB')
+    target_device = torch.device(target_device)
+    units, _ = placement_units(model)
+    modules, resident = _resident(model, units, target_device)
+    free_bytes = get_cuda_free_memory_gb(target_device) * _GB
+    selected, complete = plan_move(units, free_bytes, preserved_memory_gb * _GB, resident)
+
+    if complete:
+        model.to(device=target_device)
+    else:
+        for i in selected:
+            modules[units[i].name].to(device=target_device)
+    torch.cuda.empty_cache()
+
+
+def offload_model_from_device_for_memory_preservation(model, target_device, preserved_memory_gb=0):
+    """diffusers_helper.memory の同名関数と同じ配置になるよう、計画してからまとめて CPU へ戻す"""
+    import torch
+    from diffusers_helper.memory import cpu, get_cuda_free_memory_gb
+
+    print(f'Offloading {model.__class__.__name__} from {target_device} to preserve memory: {preserved_memory_gb} GB')
+    target_device = torch.device(target_device)
+    units, _ = placement_units(model)
+    modules, resident = _resident(model, units, target_device)
+    free_bytes = get_cuda_free_memory_gb(target_device) * _GB
+    selected, complete = plan_offload(units, free_bytes, preserved_memory_gb * _GB, resident)
+
+    if complete:
+        model.to(device=cpu)
+    else:
+        for i in selected:
+            modules[units[i].name].to(device=cpu)
+    torch.cuda.empty_cache()
@@ -0,0 +1,216 @@
+"""
+バックグラウンド出力エグゼキュータ
+
+セクション毎の MP4 エンコード・PNG フレーム保存・テンソル保存を
+生成スレッドから切り離し、次セクションのサンプリングと並行して実行する。
+
+- エンコーダレーン: 単一スレッド (投入順に完了するので 'file' イベントの順序が崩れない)
+- PNG レーン: スレッドプール (PIL の zlib 圧縮は GIL を解放する)。
+  EICHI_OUTPUT_PNG_PROCS を指定し、かつ fork が使える環境ではプロセスプールを使う
+- 投入数は max_pending で上限を設け、超えた場合は生成スレッド側で待つ
+  (ピクセル履歴のスナップショットがメモリに溜まり続けないようにする)
+
+投入するデータは呼び出し側で確定済みの CPU スナップショット
+(uint8 の numpy 配列、clone 済みテンソル等) であること。
+
+使い方:
+    from eichi_utils.output_executor import OutputExecutor
+    executor = OutputExecutor(publish=stream.output_queue.push)
+    executor.submit(save_bcthw_as_mp4, pixels, path, fps=30, crf=16, file_event=path)
+    executor.submit_png(frame_uint8, frame_path, metadata)
+    executor.drain()
+"""
+
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 未完了ジョブの上限 (MP4 / テンソル / PNG の合計)
+_DEFAULT_MAX_PENDING = 64
+
+# PNG 保存スレッド数
+_DEFAULT_PNG_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+def _env_int(name: str, default: int) -> int:
+    """環境変数を int で読む。不正値は default。"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def save_png_frame(frame, path, metadata=None):
+    """uint8 の HWC 配列を PNG として保存し、メタデータを埋め込む。
+
+    プロセスプールから呼べるようにモジュールトップレベルに置く。
+    """
+    from PIL import Image
+
+    Image.fromarray(frame).save(path)
+    if metadata:
+        from eichi_utils.png_metadata import embed_metadata_to_png
+        embed_metadata_to_png(path, metadata)
+    return path
+
+
+def _make_png_process_pool(processes: int):
+    """fork が使える場合のみ PNG 用プロセスプールを作る。使えなければ None。
+
+    spawn ではフロントエンドのメインスクリプトが子プロセスで再実行されるため使わない。
+    """
+    if processes <= 0 or sys.platform == "win32":
+        return None
+    try:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        return ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("fork")
+        )
+    except Exception as e:
+        print(f"PNG プロセスプールの作成に失敗したためスレッドで保存します: {e}")
+        return None
+
+
+class OutputExecutor:
+    """ジョブ単位の出力書き出しエグゼキュータ。
+
+    Args:
+        publish: 完了イベントの送出先 (例: stream.output_queue.push / bus.publish)。
+                 submit(..., file_event=path) の完了時に ('file', path) を送る。
+        max_pending: 未完了ジョブ数の上限。超えると submit がブロックする。
+        png_workers: PNG 保存スレッド数
+        png_processes: PNG 保存プロセス数 (0 でスレッドのみ)。
+                       未指定時は環境変数 EICHI_OUTPUT_PNG_PROCS (既定 0)
+    """
+
+    def __init__(self, publish=None, max_pending=None, png_workers=None, png_processes=None):
+        self._publish = publish
+        self._max_pending = max(1, int(max_pending or _env_int("EICHI_OUTPUT_MAX_PENDING", _DEFAULT_MAX_PENDING)))
+        self._slots = threading.BoundedSemaphore(self._max_pending)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._futures = set()
+        self._errors = []
+        self._closed = False
+
+        self._encoder_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eichi-output-enc")
+        if png_processes is None:
+            png_processes = _env_int("EICHI_OUTPUT_PNG_PROCS", 0)
+        self._png_process_pool = _make_png_process_pool(int(png_processes))
+        self._png_pool = None
+        if self._png_process_pool is None:
+            self._png_pool = ThreadPoolExecutor(
+                max_workers=max(1, int(png_workers or _DEFAULT_PNG_WORKERS)),
+                thread_name_prefix="eichi-output-png",
+            )
+
+    # ------------------------------------------------------------------
+    # 投入
+    # ------------------------------------------------------------------
+    def submit(self, func, *args, file_event=None, on_done=None, label=None, **kwargs):
+        """エンコーダレーンにジョブを投入する (投入順に実行・完了)。
+
+        Args:
+            func: 実行する関数 (save_bcthw_as_mp4, sf.save_file 等)
+            file_event: 成功時に ('file', file_event) を publish する
+            on_done: 成功時に func の戻り値を引数に呼ばれるコールバック
+            label: エラーログ用の表示名
+        """
+        return self._submit(self._encoder_pool, func, args, kwargs, file_event, on_done, label)
+
+    def submit_png(self, frame, path, metadata=None):
+        """PNG レーンにフレーム保存を投入する。frame は uint8 の HWC 配列。"""
+        pool = self._png_process_pool or self._png_pool
+        return self._submit(pool, save_png_frame, (frame, path, metadata), {}, None, None,
+                            os.path.basename(path))
+
+    def _submit(self, pool, func, args, kwargs, file_event, on_done, label):
+        if self._closed:
+            raise RuntimeError("OutputExecutor is already shut down")
+        label = label or getattr(func, "__name__", "output")
+        # 上限に達していれば空きが出るまで待つ (バックプレッシャ)
+        self._slots.acquire()
+        try:
+            future = pool.submit(func, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(
+            lambda f: self._on_complete(f, file_event, on_done, label)
+        )
+        return future
+
+    def _on_complete(self, future, file_event, on_done, label):
+        try:
+            error = future.exception()
+            if error is not None:
+                with self._lock:
+                    self._errors.append((label, error))
+                print(f"出力の書き出しに失敗しました ({label}): {error}")
+                traceback.print_exception(type(error), error, error.__traceback__)
+                return
+            if on_done is not None:
+                try:
+                    on_done(future.result())
+                except Exception as e:
+                    print(f"出力完了コールバックでエラー ({label}): {e}")
+            if file_event is not None and self._publish is not None:
+                try:
+                    self._publish(('file', file_event))
+                except Exception as e:
+                    print(f"出力完了イベントの送信に失敗しました ({label}): {e}")
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+                if not self._futures:
+                    self._idle.notify_all()
+            self._slots.release()
+
+    # ------------------------------------------------------------------
+    # 完了待ち / 終了
+    # ------------------------------------------------------------------
+    def pending_count(self) -> int:
+        """未完了ジョブ数"""
+        with self._lock:
+            return len(self._futures)
+
+    def drain(self, timeout=None):
+        """投入済みジョブがすべて完了するまで待つ。
+
+        完了コールバック ('file' イベント送出) の終了まで待つので、
+        drain 後に送る 'end' が 'file' より先に届くことはない。
+
+        Returns:
+            drain までに発生した (label, exception) のリスト (取得後にクリアされる)
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: not self._futures, timeout=timeout)
+            errors, self._errors = self._errors, []
+        return errors
+
+    def shutdown(self, wait_pending=True):
+        """ドレインしてからプールを停止する。二重呼び出しは無視。"""
+        if self._closed:
+            return []
+        errors = self.drain() if wait_pending else []
+        self._closed = True
+        for pool in (self._encoder_pool, self._png_pool, self._png_process_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait_pending)
+        return errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
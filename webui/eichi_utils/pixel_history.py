@@ -0,0 +1,226 @@
+"""
+コンパクトなピクセル履歴ストア
+
+VAE デコード結果 (float, BCTHW) を動画全体ぶん保持する代わりに、
+次セクションとのブレンド (soft_append_bcthw) に必要な末端 blend_frames だけを
+float のまま保持し、ブレンド窓から外れたフレームは一度だけ uint8 に変換して保持する。
+
+uint8 への変換式は save_bcthw_as_mp4 / フレーム画像保存と同じ
+(clamp(-1, 1) * 127.5 + 127.5 の切り捨て) なので、出力される MP4 / PNG は変わらない。
+
+- direction="prepend": endframe_ichi (逆方向生成。新しいセクションを先頭に結合)
+- direction="append":  endframe_ichi_f1 (順方向生成。新しいセクションを末尾に結合)
+
+spill (eichi_utils.history_spill.SpillFile) を指定すると、確定済みチャンクはディスクへ退避し
+memmap 裏付けのテンソルとして保持する。
+
+使い方:
+    from eichi_utils.pixel_history import PixelHistory, save_history_as_mp4
+    history = PixelHistory(direction="prepend", blend_frames=overlapped_frames)
+    history.add_section(current_pixels, overlapped_frames)
+    save_history_as_mp4(history.snapshot(), path, fps=30, crf=16)
+"""
+
+
+# ====================================================================
+# テンソル操作 (torch は遅延インポート)
+# ====================================================================
+def _soft_append(history, current, overlap):
+    from diffusers_helper.utils import soft_append_bcthw
+    return soft_append_bcthw(history, current, overlap)
+
+
+def _cat(tensors):
+    import torch
+    return torch.cat(tensors, dim=2)
+
+
+def _copy(x):
+    """スライス (ビュー) から元の大きなストレージを切り離す"""
+    return x.clone()
+
+
+def _to_uint8(x):
+    """float [-1, 1] → uint8 (save_bcthw_as_mp4 と同じ切り捨て変換)"""
+    import torch
+    return (x.float().clamp(-1.0, 1.0) * 127.5 + 127.5).to(torch.uint8)
+
+
+def _from_uint8(x, dtype):
+    """uint8 → float [-1, 1]。量子化区間の中央値に戻すので再変換しても同じ値になる"""
+    return ((x.float() + 0.5) / 127.5 - 1.0).to(dtype)
+
+
+def _frames(x):
+    return int(x.shape[2])
+
+
+# ====================================================================
+# PixelHistory
+# ====================================================================
+class PixelHistory:
+    """ブレンド窓だけ float で保持するピクセル履歴。
+
+    Args:
+        direction: "prepend" (endframe) または "append" (F1)
+        blend_frames: float のまま保持するフレーム数 (= overlapped_frames)
+        spill: 確定済みチャンクの退避先。None なら RAM に保持
+    """
+
+    def __init__(self, direction="prepend", blend_frames=0, spill=None):
+        if direction not in ("prepend", "append"):
+            raise ValueError(f"direction must be 'prepend' or 'append': {direction}")
+        self.direction = direction
+        self.blend_frames = max(0, int(blend_frames))
+        self._live = None     # ブレンド窓 (float)
+        self._frozen = []     # 確定済みフレーム (uint8) を時間順に保持
+        self._frozen_frames = 0
+        self._spill = spill
+
+    # ------------------------------------------------------------------
+    # 追加
+    # ------------------------------------------------------------------
+    def add_section(self, current_pixels, overlap=0):
+        """デコード済みセクションを結合する。
+
+        overlap は soft_append_bcthw に渡すブレンド長。ブレンド窓より長い場合は窓に合わせる。
+        """
+        if self._live is None:
+            self._live = current_pixels
+        else:
+            overlap = max(0, min(int(overlap), _frames(self._live), _frames(current_pixels)))
+            if self.direction == "prepend":
+                self._live = _soft_append(current_pixels, self._live, overlap)
+            else:
+                self._live = _soft_append(self._live, current_pixels, overlap)
+        self._freeze()
+
+    def _freeze(self):
+        """ブレンド窓から外れたフレームを uint8 に変換して確定させる"""
+        n = _frames(self._live)
+        keep = self.blend_frames
+        if n <= keep:
+            return
+        if self.direction == "prepend":
+            frozen = _to_uint8(self._live[:, :, keep:])
+            self._live = _copy(self._live[:, :, :keep])
+        else:
+            frozen = _to_uint8(self._live[:, :, :n - keep])
+            self._live = _copy(self._live[:, :, n - keep:])
+        if self._spill is not None:
+            frozen = self._spill.write(frozen)
+        if self.direction == "prepend":
+            self._frozen.insert(0, frozen)
+        else:
+            self._frozen.append(frozen)
+        self._frozen_frames += n - keep
+
+    # ------------------------------------------------------------------
+    # 参照
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return self.num_frames
+
+    @property
+    def num_frames(self):
+        live = _frames(self._live) if self._live is not None else 0
+        return self._frozen_frames + live
+
+    @property
+    def shape(self):
+        """history_pixels.shape 互換 (B, C, T, H, W)"""
+        ref = self._live if self._live is not None else (self._frozen[0] if self._frozen else None)
+        if ref is None:
+            return (0, 0, 0, 0, 0)
+        b, c, _, h, w = ref.shape
+        return (b, c, self.num_frames, h, w)
+
+    @property
+    def dtype(self):
+        return self._live.dtype if self._live is not None else None
+
+    def segments(self):
+        """(tensor, is_uint8) を時間順に返す"""
+        frozen = [(t, True) for t in self._frozen]
+        if self._live is None:
+            return frozen
+        live = [(self._live, False)]
+        return live + frozen if self.direction == "prepend" else frozen + live
+
+    def snapshot(self):
+        """現在の内容を共有する不変スナップショットを返す (コピーは発生しない)。
+
+        確定済みチャンクとブレンド窓はどちらも in-place で書き換えないため、
+        バックグラウンドの書き出しに渡しても後続セクションの影響を受けない。
+        """
+        snap = PixelHistory(self.direction, self.blend_frames, spill=self._spill)
+        snap._live = self._live
+        snap._frozen = list(self._frozen)
+        snap._frozen_frames = self._frozen_frames
+        return snap
+
+    def frame_uint8(self, index, batch=0):
+        """指定フレームを uint8 の (C, H, W) テンソルで返す。負のインデックス可。"""
+        total = self.num_frames
+        if index < 0:
+            index += total
+        if not 0 <= index < total:
+            raise IndexError(f"frame index out of range: {index} (frames={total})")
+        for tensor, is_uint8 in self.segments():
+            n = _frames(tensor)
+            if index < n:
+                frame = tensor[batch:batch + 1, :, index:index + 1]
+                if not is_uint8:
+                    frame = _to_uint8(frame)
+                return frame[0, :, 0]
+            index -= n
+        raise IndexError(index)
+
+    def frame_hwc_uint8(self, index, batch=0):
+        """指定フレームを PIL に渡せる uint8 の (H, W, C) numpy 配列で返す"""
+        return self.frame_uint8(index, batch).permute(1, 2, 0).cpu().numpy()
+
+    def to_uint8(self):
+        """全フレームを uint8 の BCTHW テンソルで返す"""
+        parts = [t if is_uint8 else _to_uint8(t) for t, is_uint8 in self.segments()]
+        return parts[0] if len(parts) == 1 else _cat(parts)
+
+    def materialize(self, dtype=None):
+        """全フレームを float の BCTHW テンソルで返す (従来の history_pixels 相当)。
+
+        テンソル結合など float の履歴を必要とする処理向け。確定済み部分は量子化済みの値になる。
+        """
+        dtype = dtype or self.dtype
+        parts = [_from_uint8(t, dtype) if is_uint8 else t for t, is_uint8 in self.segments()]
+        return parts[0] if len(parts) == 1 else _cat(parts)
+
+    def nbytes(self):
+        """保持しているテンソルの合計バイト数"""
+        return sum(t.element_size() * t.nelement() for t, _ in self.segments())
+
+
+# ====================================================================
+# 出力
+# ====================================================================
+def save_history_as_mp4(history, output_filename, fps=30, crf=0):
+    """PixelHistory を MP4 に書き出す (save_bcthw_as_mp4 と同じレイアウト・エンコード設定)。
+
+    float の全履歴を作らず、uint8 のまま書き出す。
+    """
+    import os
+    import torchvision
+
+    x = history.to_uint8().detach().cpu()
+    b, c, t, h, w = x.shape
+    per_row = b
+    for p in [6, 5, 4, 3, 2]:
+        if b % p == 0:
+            per_row = p
+            break
+    rows = b // per_row
+    # '(m n) c t h w -> t (m h) (n w) c'
+    x = x.reshape(rows, per_row, c, t, h, w).permute(3, 0, 4, 1, 5, 2).reshape(t, rows * h, per_row * w, c)
+
+    os.makedirs(os.path.dirname(os.path.abspath(os.path.realpath(output_filename))), exist_ok=True)
+    torchvision.io.write_video(output_filename, x, fps=fps, video_codec='libx264', options={'crf': str(int(crf))})
+    return x
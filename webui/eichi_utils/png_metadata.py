@@ -14,6 +14,7 @@ SEED_KEY = "seed"
 SECTION_PROMPT_KEY = "section_prompt"
 SECTION_NUMBER_KEY = "section_number"
 PARAMETERS_KEY = "parameters"  # SD系との互換性のため
+SEED_BATCH_INDEX_KEY = "seed_batch_index"  # シードバッチ内の番号（1フレーム推論）
 
 def embed_metadata_to_png(image_path, metadata_dict):
     """PNGファイルにメタデータを埋め込む
@@ -39,6 +40,8 @@ def embed_metadata_to_png(image_path, metadata_dict):
                     parameters_text += f"{value}\n"
                 elif key == SEED_KEY:
                     parameters_text += f"Seed: {value}\n"
+                elif key == SEED_BATCH_INDEX_KEY:
+                    parameters_text += f"Seed Batch Index: {value}\n"
                 elif key == SECTION_PROMPT_KEY:
                     parameters_text += f"Section Prompt: {value}\n"
                 elif key == SECTION_NUMBER_KEY:
@@ -83,7 +86,7 @@ def extract_metadata_from_png(image_path_or_object):
         metadata = {}
 
         # 個別のキーを処理
-        for key in [PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY, PARAMETERS_KEY]:
+        for key in [PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY, SEED_BATCH_INDEX_KEY, PARAMETERS_KEY]:
             if key in img.info:
                 value = img.info[key]
                 try:
@@ -111,6 +114,10 @@ def extract_metadata_from_png(image_path_or_object):
                     seed_str = line_stripped.replace("Seed:", "").strip()
                     if seed_str.isdigit():
                         metadata[SEED_KEY] = int(seed_str)
+                elif line_stripped.startswith("Seed Batch Index:"):
+                    batch_index_str = line_stripped.replace("Seed Batch Index:", "").strip()
+                    if batch_index_str.isdigit():
+                        metadata[SEED_BATCH_INDEX_KEY] = int(batch_index_str)
                 elif line_stripped.startswith("Section Number:"):
                     section_num_str = line_stripped.replace("Section Number:", "").strip()
                     if section_num_str.isdigit():
@@ -0,0 +1,170 @@
+"""
+サンプリング中プレビューのバックグラウンド描画
+
+sample_hunyuan のコールバックで毎ステップ行っていた vae_decode_fake → numpy 変換 →
+output_queue への送信をサンプリングスレッドから切り離す。
+
+- submit() は最新の denoised テンソルへの参照を置き換えるだけで、待ちは発生しない
+- 描画は専用スレッドで行い、送信は max_fps (EICHI_PREVIEW_MAX_FPS, 既定 4) までに間引く
+- 描画が追いつかない間に届いた古いステップは捨てる (latest-wins)
+- flush() で保留中の最新プレビューを送り切る。'end' 送信前に呼ぶこと
+
+中断判定 (stream.input_queue の確認など) はコールバック側で同期的に行う。
+
+使い方:
+    from eichi_utils.preview_service import PreviewService, make_latent_preview_renderer
+    previews = PreviewService(make_latent_preview_renderer(vae_decode_fake), push_progress)
+    def callback(d):
+        ...
+        previews.submit(d['denoised'], desc, percentage, hint)
+    previews.flush()
+    previews.close()
+"""
+
+import os
+import threading
+import time
+
+
+# 既定の最大送信レート (回/秒)
+_DEFAULT_MAX_FPS = 4.0
+
+
+def _env_float(name: str, default: float) -> float:
+    """環境変数を float で読む。不正値は default。"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def make_latent_preview_renderer(decode_fake):
+    """latent → プレビュー画像 (uint8 の HWC numpy 配列) の描画関数を作る。
+
+    従来コールバック内で行っていた変換と同じ
+    (vae_decode_fake → *255 → uint8 → 'b c t h w -> (b h) (t w) c')。
+    """
+    def render(latents):
+        import einops
+        import numpy as np
+
+        preview = decode_fake(latents)
+        preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
+        return einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
+
+    return render
+
+
+class PreviewService:
+    """最新のプレビューだけを間引いて描画・送信するサービス。
+
+    Args:
+        render: latent を受け取りプレビュー画像を返す関数
+        publish: publish(preview, *args) で描画結果を送る関数 (push_progress 等)
+        max_fps: 最大送信レート。None なら EICHI_PREVIEW_MAX_FPS、0 以下なら間引かない
+    """
+
+    def __init__(self, render, publish, max_fps=None, name="eichi-preview"):
+        if max_fps is None:
+            max_fps = _env_float("EICHI_PREVIEW_MAX_FPS", _DEFAULT_MAX_FPS)
+        self._interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+        self._render = render
+        self._publish = publish
+        self._cond = threading.Condition()
+        self._pending = None       # (latents, args) 最新の1件のみ
+        self._busy = False
+        self._flushing = 0
+        self._closed = False
+        self._next_time = 0.0
+        self._error_reported = False
+        self.submitted = 0
+        self.published = 0
+        self.skipped = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # サンプリングスレッド側
+    # ------------------------------------------------------------------
+    def submit(self, latents, *args):
+        """最新のプレビュー対象を登録する (待ちなし)。未描画の古い対象は捨てる"""
+        with self._cond:
+            if self._closed:
+                return
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = (latents, args)
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """保留中のプレビューを間引かずに送り切るまで待つ。完了したら True"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._pending is not None or self._busy:
+                    if not self._thread.is_alive():
+                        return False
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing -= 1
+
+    def close(self, flush=True, timeout=None):
+        """サービスを停止する。flush=False なら保留中のプレビューは捨てる (冪等)"""
+        if flush:
+            self.flush(timeout)
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            if not flush and self._pending is not None:
+                self.skipped += 1
+                self._pending = None
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(flush=exc_type is None)
+        return False
+
+    # ------------------------------------------------------------------
+    # 描画スレッド
+    # ------------------------------------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                wait = self._next_time - time.monotonic()
+                if wait > 0 and not self._flushing and not self._closed:
+                    # 間引き待ちの間に新しいステップが来たら、そちらを描画する
+                    self._cond.wait(wait)
+                    continue
+                latents, args = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                preview = self._render(latents)
+                del latents
+                self._publish(preview, *args)
+                self.published += 1
+            except Exception as e:
+                if not self._error_reported:
+                    self._error_reported = True
+                    print(f"プレビューの描画に失敗しました: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._next_time = time.monotonic() + self._interval
+                    self._cond.notify_all()
@@ -6,10 +6,15 @@
 
 保存形式は safetensors (推奨) と pt (レガシー) の2形式に対応。
 読み込みは両形式をフォールバックで試行する。
+
+設定キューの準備ステージは preload() で次のジョブのキャッシュを先にメモリへ読み込み、
+load_from_cache() はディスクより先にそれを使う。
 """
 
 import os
 import hashlib
+import threading
+from collections import OrderedDict
 
 # 保存形式: "safetensors" or "pt"
 _preferred_format = "safetensors"
@@ -91,9 +96,34 @@ def _load_data(path_without_ext):
     return None
 
 
+# 先読み済みのキャッシュ (prompt_hash -> テンソル dict)。古いものから捨てる
+_MAX_PRELOADED = 2
+_preloaded = OrderedDict()
+_preloaded_lock = threading.Lock()
+
+
 # ====================================================================
 # 公開API
 # ====================================================================
+def preload(prompt: str, n_prompt: str) -> bool:
+    """ディスクキャッシュをメモリへ読み込んでおく (見つかれば True)"""
+    cache_hash = prompt_hash(prompt, n_prompt)
+    with _preloaded_lock:
+        if cache_hash in _preloaded:
+            return True
+    try:
+        data = _load_data(os.path.join(get_cache_dir(), cache_hash))
+    except Exception:
+        data = None
+    if data is None:
+        return False
+    with _preloaded_lock:
+        _preloaded[cache_hash] = data
+        while len(_preloaded) > _MAX_PRELOADED:
+            _preloaded.popitem(last=False)
+    return True
+
+
 def load_from_cache(prompt: str, n_prompt: str):
     """Load cached tensors from disk if available (dual format)."""
     cache_hash = prompt_hash(prompt, n_prompt)
@@ -101,6 +131,12 @@ def load_from_cache(prompt: str, n_prompt: str):
 
     print(f"Looking for prompt cache: {cache_hash[:16]}")
 
+    with _preloaded_lock:
+        data = _preloaded.pop(cache_hash, None)
+    if data is not None:
+        print("Prompt cache hit (preloaded)")
+        return data
+
     try:
         data = _load_data(path_no_ext)
         if data is not None:
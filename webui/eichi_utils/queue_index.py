@@ -0,0 +1,309 @@
+# ==============================================================================
+# QUEUE INDEX - SQLITE STORE FOR CONFIG QUEUE STATE
+# ==============================================================================
+"""
+ConfigQueueManager のキュー状態を持つ SQLite (WAL) のインデックス
+
+JSON の設定ファイルは今まで通り configs/ queue/ processing/ completed/ error/ に置き、
+中身 (ペイロード) の正本はファイルのまま。ここには項目ごとの状態・優先度・構成・
+時刻・エラー文を持ち、状態の問い合わせをディレクトリの走査なしで返す。
+
+- 件数は状態ごとの counts テーブルをトリガーで更新するので、キューの長さに関係なく 1 行読むだけ
+- 次の項目は (state, priority, signature, enqueued_ns) のインデックスで 1 行だけ引く
+- 状態の遷移は BEGIN IMMEDIATE のトランザクションの中でファイルの移動と一緒に行う。
+  同じキューを共有する別プロセスとも直列になり、ファイルの rename が失敗したら取り消す
+- UI や手作業でディレクトリに直接置かれたファイルは、ディレクトリの mtime が変わったときだけ
+  走査して取り込む (mtime が今から 2 秒以内のときは粒度の粗いファイルシステムを考えて次回も走査する)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+STATE_CONFIGS = "configs"
+STATE_QUEUED = "queued"
+STATE_PROCESSING = "processing"
+STATE_COMPLETED = "completed"
+STATE_ERROR = "error"
+STATES = (STATE_CONFIGS, STATE_QUEUED, STATE_PROCESSING, STATE_COMPLETED, STATE_ERROR)
+
+# ディレクトリの mtime がこの秒数以内なら、同じ mtime のまま次の変更が入り得るので信用しない
+RACY_WINDOW_NS = 2 * 1000 ** 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    state       TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    priority    INTEGER NOT NULL DEFAULT 0,
+    signature   TEXT,
+    enqueued_ns INTEGER NOT NULL DEFAULT 0,
+    size        INTEGER,
+    updated_at  REAL,
+    started_at  REAL,
+    finished_at REAL,
+    error       TEXT,
+    owner       TEXT,
+    PRIMARY KEY (state, name)
+);
+CREATE INDEX IF NOT EXISTS items_next ON items (state, priority DESC, enqueued_ns, name);
+CREATE INDEX IF NOT EXISTS items_group ON items (state, priority, signature, enqueued_ns, name);
+CREATE INDEX IF NOT EXISTS items_finished ON items (state, finished_at DESC);
+CREATE TABLE IF NOT EXISTS counts (state TEXT PRIMARY KEY, n INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS dir_stamps (state TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL);
+CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN
+    INSERT INTO counts (state, n) VALUES (NEW.state, 1)
+        ON CONFLICT (state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN
+    UPDATE counts SET n = n - 1 WHERE state = OLD.state;
+END;
+"""
+
+
+def signature_key(signature) -> Optional[str]:
+    """transformer_signature() のタプルを比較・保存できる文字列にする"""
+    if signature is None:
+        return None
+    return json.dumps(signature, ensure_ascii=False, separators=(",", ":"))
+
+
+class QueueIndex:
+    """キュー状態の SQLite インデックス (スレッドごとに接続を持つ)
+
+    Args:
+        db_path: データベースファイルのパス
+        directories: 状態 → ディレクトリ
+        reader: fn(state, path) → dict(priority, signature, error)。
+                ディレクトリから取り込むファイルの中身を読む
+    """
+
+    def __init__(self, db_path: str, directories: Dict[str, str], reader=None):
+        self.db_path = db_path
+        self.directories = dict(directories)
+        self._reader = reader
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    # ---- 接続 ----
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション。別プロセスの遷移とも直列になる"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---- ディレクトリとの同期 ----
+    def refresh(self, states=None):
+        """mtime が変わったディレクトリだけを走査して取り込む。走査した状態のリストを返す"""
+        scanned = []
+        for state in states or self.directories:
+            directory = self.directories[state]
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            row = self._conn().execute("SELECT mtime_ns FROM dir_stamps WHERE state = ?", (state,)).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                continue
+            self._sync_dir(state, directory, mtime_ns)
+            scanned.append(state)
+        return scanned
+
+    def invalidate(self, state: str):
+        """次の refresh() で state のディレクトリを走査し直す (ファイルを上書きしたときなど)"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM dir_stamps WHERE state = ?", (state,))
+
+    def _sync_dir(self, state: str, directory: str, mtime_ns: int):
+        try:
+            on_disk = {f[:-5] for f in os.listdir(directory) if f.endswith(".json")}
+        except OSError:
+            return
+        # 中身で並びや表示が変わる状態は、名前が同じでも (mtime, size) が変わったら読み直す
+        check_stamp = state in (STATE_CONFIGS, STATE_QUEUED)
+        with self.transaction() as conn:
+            indexed = {name: (enqueued_ns, size) for name, enqueued_ns, size in conn.execute(
+                "SELECT name, enqueued_ns, size FROM items WHERE state = ?", (state,))}
+            for name in set(indexed) - on_disk:
+                conn.execute("DELETE FROM items WHERE state = ? AND name = ?", (state, name))
+            for name in on_disk:
+                if name in indexed and not check_stamp:
+                    continue
+                path = os.path.join(directory, f"{name}.json")
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if indexed.get(name) == (st.st_mtime_ns, st.st_size):
+                    continue
+                fields = self._read(state, path)
+                if state in (STATE_COMPLETED, STATE_ERROR):
+                    fields.setdefault("finished_at", st.st_mtime)
+                self._upsert(conn, state, name, enqueued_ns=st.st_mtime_ns, size=st.st_size, **fields)
+            now_ns = time.time_ns()
+            stamp = mtime_ns if now_ns - mtime_ns > RACY_WINDOW_NS else -1
+            conn.execute("INSERT INTO dir_stamps (state, mtime_ns) VALUES (?, ?) "
+                         "ON CONFLICT (state) DO UPDATE SET mtime_ns = excluded.mtime_ns", (state, stamp))
+
+    def _read(self, state: str, path: str) -> Dict:
+        if self._reader is None:
+            return {}
+        try:
+            return dict(self._reader(state, path) or {})
+        except Exception as e:
+            return {"error": str(e)}
+
+    # ---- 書き込み ----
+    _FIELDS = ("priority", "signature", "enqueued_ns", "size", "updated_at",
+               "started_at", "finished_at", "error", "owner")
+
+    def _upsert(self, conn, state: str, name: str, **fields):
+        fields = {k: v for k, v in fields.items() if k in self._FIELDS}
+        fields.setdefault("updated_at", time.time())
+        if fields.get("priority") is None:
+            fields["priority"] = 0
+        columns = ["state", "name"] + list(fields)
+        updates = ", ".join(f"{k} = excluded.{k}" for k in fields)
+        conn.execute(
+            f"INSERT INTO items ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (state, name) DO UPDATE SET {updates}",
+            [state, name] + list(fields.values()),
+        )
+
+    def put(self, state: str, name: str, path: Optional[str] = None, conn=None, **fields):
+        """state に name を登録する。path を渡すとファイルの mtime / size と中身も取り込む"""
+        if path is not None:
+            try:
+                st = os.stat(path)
+                fields.setdefault("enqueued_ns", st.st_mtime_ns)
+                fields.setdefault("size", st.st_size)
+            except OSError:
+                pass
+            for key, value in self._read(state, path).items():
+                fields.setdefault(key, value)
+        if conn is not None:
+            self._upsert(conn, state, name, **fields)
+            return
+        with self.transaction() as conn:
+            self._upsert(conn, state, name, **fields)
+
+    def move(self, conn, name: str, from_state: str, to_state: str, **fields):
+        """from_state の行を to_state へ移す (トランザクションの中で呼ぶ)。行が無ければ新しく作る"""
+        row = conn.execute(
+            f"SELECT {', '.join(self._FIELDS)} FROM items WHERE state = ? AND name = ?",
+            (from_state, name)).fetchone()
+        conn.execute("DELETE FROM items WHERE state = ? AND name = ?", (from_state, name))
+        carried = dict(zip(self._FIELDS, row)) if row is not None else {}
+        carried.pop("updated_at", None)
+        carried.update(fields)
+        self._upsert(conn, to_state, name, **carried)
+
+    def remove(self, state: str, name: str, conn=None):
+        if conn is not None:
+            conn.execute("DELETE FROM items WHERE state = ? AND name = ?", (state, name))
+            return
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM items WHERE state = ? AND name = ?", (state, name))
+
+    def set_fields(self, state: str, name: str, **fields) -> bool:
+        fields = {k: v for k, v in fields.items() if k in self._FIELDS}
+        if not fields:
+            return False
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self.transaction() as conn:
+            cur = conn.execute(f"UPDATE items SET {assignments} WHERE state = ? AND name = ?",
+                               list(fields.values()) + [state, name])
+        return cur.rowcount > 0
+
+    # ---- 問い合わせ ----
+    def count(self, state: str) -> int:
+        row = self._conn().execute("SELECT n FROM counts WHERE state = ?", (state,)).fetchone()
+        return row[0] if row else 0
+
+    def names(self, state: str, limit: Optional[int] = None) -> List[str]:
+        """名前順"""
+        sql = "SELECT name FROM items WHERE state = ? ORDER BY name"
+        params = [state]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [name for (name,) in self._conn().execute(sql, params)]
+
+    def recent(self, state: str, limit: int) -> List[str]:
+        """終了が新しい順"""
+        return [name for (name,) in self._conn().execute(
+            "SELECT name FROM items WHERE state = ? ORDER BY finished_at DESC, name LIMIT ?",
+            (state, int(limit)))]
+
+    def queued_fifo(self, exclude: Optional[str] = None) -> List[Tuple[str, int, Optional[str]]]:
+        """キューの (name, priority, signature) を追加順 (ファイルの mtime 順) で返す"""
+        return [tuple(row) for row in self._conn().execute(
+            "SELECT name, priority, signature FROM items WHERE state = ? AND name IS NOT ? "
+            "ORDER BY enqueued_ns, name", (STATE_QUEUED, exclude))]
+
+    def first_fifo(self, exclude: Optional[str] = None) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT name FROM items WHERE state = ? AND name IS NOT ? ORDER BY enqueued_ns, name LIMIT 1",
+            (STATE_QUEUED, exclude)).fetchone()
+        return row[0] if row else None
+
+    def next_grouped(self, active_signature: Optional[str] = None, exclude: Optional[str] = None) -> Optional[str]:
+        """plan_queue_order(...)[0] と同じ項目をインデックスで引く
+
+        最も大きい priority の中で、active_signature の項目があればその最古、
+        無ければその priority の最古の項目。
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT MAX(priority) FROM items WHERE state = ? AND name IS NOT ?",
+            (STATE_QUEUED, exclude)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        top = row[0]
+        if active_signature is not None:
+            row = conn.execute(
+                "SELECT name FROM items WHERE state = ? AND priority = ? AND signature = ? AND name IS NOT ? "
+                "ORDER BY enqueued_ns, name LIMIT 1",
+                (STATE_QUEUED, top, active_signature, exclude)).fetchone()
+            if row is not None:
+                return row[0]
+        row = conn.execute(
+            "SELECT name FROM items WHERE state = ? AND priority = ? AND name IS NOT ? "
+            "ORDER BY enqueued_ns, name LIMIT 1",
+            (STATE_QUEUED, top, exclude)).fetchone()
+        return row[0] if row else None
+
+    def get(self, state: str, name: str) -> Optional[Dict]:
+        row = self._conn().execute(
+            f"SELECT {', '.join(self._FIELDS)} FROM items WHERE state = ? AND name = ?",
+            (state, name)).fetchone()
+        return dict(zip(self._FIELDS, row)) if row is not None else None
+
+    def errors(self, state: str = STATE_CONFIGS) -> List[Tuple[str, str]]:
+        """読み込めなかったファイルの (name, error)"""
+        return [tuple(row) for row in self._conn().execute(
+            "SELECT name, error FROM items WHERE state = ? AND error IS NOT NULL ORDER BY name", (state,))]
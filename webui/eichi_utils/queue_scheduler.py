@@ -0,0 +1,271 @@
+# ==============================================================================
+# MULTI-DEVICE QUEUE SCHEDULER
+# ==============================================================================
+"""
+複数デバイスでキューを並列に処理するスケジューラ
+
+ConfigQueueManager の通常のワーカーは 1 スレッド・1 デバイスで 1 件ずつ処理する。
+ここではデバイスごとにワーカースロットを持ち、各スロットが空いたら次の項目を取る。
+
+- スロットは自分のデバイスと TransformerManager (manager_factory(device) で作る) を持つ
+- 項目の選択は LoRA などの構成 (transformer_signature) の親和性を優先する:
+  自分が読み込み済みの構成の項目 → 他のスロットが読み込んでいない構成の項目 → 残り
+  の順で、priority の大きい項目はいつも先に取る
+- 項目は ConfigQueueManager.claim_queue_item (queue → processing の rename) で取るので、
+  同じキューディレクトリを複数のプロセスで共有しても同じ項目を二重に処理しない
+- 失敗した項目は、まだその項目で失敗していない別のデバイスがあればキューへ戻して
+  そちらで再実行する (max_attempts 回まで)。連続して失敗したスロットは止める
+
+process_function(config_data, slot) は slot.device / slot.manager を使って生成し、
+成功なら True を返す (通常のワーカーの process_function と同じ約束)。
+"""
+
+import threading
+import traceback
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from locales.i18n_extended import translate
+
+from eichi_utils.config_queue_manager import plan_queue_order, transformer_signature
+from eichi_utils.queue_index import signature_key
+
+
+def pick_queue_item(entries, signature=None, other_signatures=(), excluded=()) -> Optional[str]:
+    """FIFO 順の (name, priority, signature) からスロットが次に処理する name を選ぶ
+
+    signature: このスロットが読み込み済みの構成
+    other_signatures: 他のスロットが読み込み済みの構成 (そのグループは後回しにする)
+    excluded: このスロットでは処理しない name (このデバイスで失敗した項目など)
+    """
+    candidates = [entry for entry in entries if entry[0] not in excluded]
+    if not candidates:
+        return None
+    info = {name: (priority, sig) for name, priority, sig in candidates}
+    order = plan_queue_order(candidates, signature)
+    top = info[order[0]][0]
+    others = set(other_signatures)
+    for name in order:
+        priority, sig = info[name]
+        if priority < top:
+            break
+        if sig == signature or sig not in others:
+            return name
+    return order[0]
+
+
+class WorkerSlot:
+    """1 デバイス分のワーカースロット"""
+
+    def __init__(self, slot_id: int, device, manager=None):
+        self.slot_id = slot_id
+        self.device = device
+        self.manager = manager
+        self.signature = None  # 読み込み済みの構成 (失敗後は不明なので None)
+        self.current = None
+        self.processed = 0
+        self.failures = 0  # 連続して失敗した回数
+        self.disabled = False
+        self.thread = None
+
+    @property
+    def device_key(self) -> str:
+        return str(self.device)
+
+    def to_dict(self) -> Dict:
+        return {
+            "slot": self.slot_id,
+            "device": self.device_key,
+            "current": self.current,
+            "processed": self.processed,
+            "failures": self.failures,
+            "disabled": self.disabled,
+        }
+
+
+class MultiDeviceScheduler:
+    """ConfigQueueManager のキューを devices の数のスロットで処理する
+
+    Args:
+        queue_manager: ConfigQueueManager
+        devices: スロットごとのデバイス (torch.device や "cuda:0" など。テストでは任意の値)
+        process_function: fn(config_data, slot) → bool
+        manager_factory: fn(device) → TransformerManager など。スロットのスレッドで 1 回だけ呼ぶ
+        max_attempts: 1 項目を実行する最大回数 (別デバイスでの再実行を含む)
+        max_slot_failures: この回数続けて失敗したスロットは以降の項目を取らない
+        idle_poll: 処理中の項目の結果待ちでキューを見直す間隔 (秒)
+    """
+
+    def __init__(self, queue_manager, devices, process_function, manager_factory=None,
+                 max_attempts: int = 2, max_slot_failures: int = 3, idle_poll: float = 1.0):
+        devices = list(devices)
+        if not devices:
+            raise ValueError("devices must not be empty")
+        self.queue_manager = queue_manager
+        self.slots = [WorkerSlot(i, device) for i, device in enumerate(devices)]
+        self.process_function = process_function
+        self.manager_factory = manager_factory
+        self.max_attempts = max(1, int(max_attempts))
+        self.max_slot_failures = max(1, int(max_slot_failures))
+        self.idle_poll = idle_poll
+        # 項目の選択とクレームはプロセス内で直列に行う
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._failed_devices = {}  # name -> この項目で失敗したデバイスの集合
+        self._stop = False
+        self.processed = 0
+        self.errors = 0
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+
+    def _stopping(self) -> bool:
+        return self._stop or self.queue_manager.stop_processing
+
+    def status(self) -> List[Dict]:
+        return [slot.to_dict() for slot in self.slots]
+
+    def run(self):
+        """全スロットを動かし、キューが空になるか停止されるまで待つ"""
+        self.queue_manager.recover_stale_claims()
+        print(translate("🖥️ Multi-device queue started: {0} slots ({1})").format(
+            len(self.slots), ", ".join(slot.device_key for slot in self.slots)))
+        for slot in self.slots:
+            slot.thread = threading.Thread(target=self._slot_worker, args=(slot,),
+                                           name=f"eichi-queue-slot{slot.slot_id}", daemon=True)
+            slot.thread.start()
+        for slot in self.slots:
+            slot.thread.join()
+        print(translate("✅ Queue processing stopped - Processed: {0}, Errors: {1}").format(self.processed, self.errors))
+        return self.processed, self.errors
+
+    # ---- スロット ----
+    def _slot_worker(self, slot: WorkerSlot):
+
+        try:
+            if self.manager_factory is not None and slot.manager is None:
+                slot.manager = self.manager_factory(slot.device)
+            while True:
+                config_name = self._claim_next(slot)
+                if config_name is None:
+                    break
+                self._run_item(slot, config_name)
+        except Exception as e:
+            print(translate("❌ Slot worker error ({0}): {1}").format(slot.device_key, e))
+            traceback.print_exc()
+        finally:
+            with self._condition:
+                slot.current = None
+                self._condition.notify_all()
+
+    def _pick(self, slot: WorkerSlot, skipped=()) -> Optional[str]:
+
+        qm = self.queue_manager
+        entries = qm._get_queued_entries_fifo()
+        excluded = {name for name, devices in self._failed_devices.items() if slot.device_key in devices}
+        excluded.update(skipped)
+        others = [s.signature for s in self.slots
+                  if s is not slot and not s.disabled and s.signature is not None]
+        return pick_queue_item(entries, slot.signature, others, excluded)
+
+    def _claim_next(self, slot: WorkerSlot) -> Optional[str]:
+
+        skipped = set()
+        with self._condition:
+            while not self._stopping() and not slot.disabled:
+                config_name = self._pick(slot, skipped)
+                if config_name is not None:
+                    owner = {"slot": slot.slot_id, "device": slot.device_key}
+                    signature = self.queue_manager._get_queue_entry(config_name)[2]
+                    if self.queue_manager.claim_queue_item(config_name, owner):
+                        # 他のスロットの選択に使うので、読み込みを待たずにロック内で更新する
+                        slot.signature = signature
+                        self._in_flight += 1
+                        slot.current = config_name
+                        self.queue_manager.current_config = config_name
+                        return config_name
+                    # 他のプロセスが先に取った (または同名の項目を処理中) ので選び直す
+                    skipped.add(config_name)
+                    continue
+                if self._in_flight == 0:
+                    # 処理中の項目が無い = 失敗して戻ってくる項目も無い
+                    return None
+                self._condition.wait(self.idle_poll)
+                skipped.clear()
+            return None
+
+    def _run_item(self, slot: WorkerSlot, config_name: str):
+
+        qm = self.queue_manager
+        try:
+            success, config_data, message = qm.load_config_from_processing(config_name)
+            if not success:
+                print(translate("❌ Failed to load config {0}: {1}").format(config_name, message))
+                self._fail(config_name, message)
+                return
+
+            slot.signature = signature_key(transformer_signature(config_data))
+            print(translate("🎬 Processing config: {0} on {1}").format(config_name, slot.device_key))
+            try:
+                result = self.process_function(config_data, slot)
+                error_msg = None if result else translate("Processing failed")
+            except Exception as e:
+                error_msg = translate("Processing error: {0}").format(str(e))
+                print(translate("❌ Error processing {0}: {1}").format(config_name, e))
+                traceback.print_exc()
+
+            if error_msg is None:
+                qm._move_to_completed(config_name)
+                qm.release_claim(config_name)
+                slot.failures = 0
+                slot.processed += 1
+                with self._condition:
+                    self.processed += 1
+                    self._failed_devices.pop(config_name, None)
+                print(translate("✅ Completed processing: {0}").format(config_name))
+                return
+
+            slot.failures += 1
+            # 失敗後のモデルの状態は分からないので、次の項目では親和性を使わない
+            slot.signature = None
+            if slot.failures >= self.max_slot_failures:
+                slot.disabled = True
+                print(translate("⛔ Worker slot disabled after {0} consecutive failures: {1}").format(
+                    slot.failures, slot.device_key))
+            self._rebalance(slot, config_name, config_data, error_msg)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                slot.current = None
+                self._condition.notify_all()
+
+    def _rebalance(self, slot: WorkerSlot, config_name: str, config_data: Dict, error_msg: str):
+        # まだこの項目で失敗していないデバイスがあればキューへ戻し、無ければ error へ移す
+
+        with self._condition:
+            failed = self._failed_devices.setdefault(config_name, set())
+            failed.add(slot.device_key)
+            candidates = [s for s in self.slots if not s.disabled and s.device_key not in failed]
+        attempts = len(config_data.get('queue_attempts') or []) + 1
+        if attempts < self.max_attempts and candidates and not self._stopping():
+            attempt = {
+                "slot": slot.slot_id,
+                "device": slot.device_key,
+                "error": error_msg,
+                "timestamp": datetime.now().isoformat(),
+            }
+            if self.queue_manager.requeue_processing_item(config_name, attempt):
+                print(translate("🔁 Requeued {0} after failure on {1}").format(config_name, slot.device_key))
+                return
+        self._fail(config_name, error_msg)
+
+    def _fail(self, config_name: str, error_msg: str):
+
+        self.queue_manager._move_to_error(config_name, error_msg)
+        self.queue_manager.release_claim(config_name)
+        with self._condition:
+            self.errors += 1
+            self._failed_devices.pop(config_name, None)
+        print(translate("❌ Failed processing: {0}").format(config_name))
@@ -6,8 +6,11 @@ FanoutQueue (pub-sub with history replay) と JobContext (per-job state)
 
 使い方:
     from eichi_utils.resync_core import FanoutQueue, JobContext, BUS_END_SENTINEL
+    ctx = JobContext(preview_encoder=PreviewFileEncoder(temp_cache_dir))
 """
 
+import asyncio
+import os
 import queue
 import threading
 import uuid
@@ -24,6 +27,198 @@ BUS_END_SENTINEL = (None, None)
 _DEFAULT_GET_TIMEOUT = 60.0
 
 
+# ====================================================================
+# 購読キュー: 順序付きロスレスレーン + progress の最新値スロット
+# ====================================================================
+def _is_progress(item) -> bool:
+    return isinstance(item, tuple) and len(item) == 2 and item[0] == 'progress'
+
+
+def _progress_parts(item):
+    """('progress', (preview, desc, bar_html)) なら payload のタプルを返す。それ以外は None"""
+    payload = item[1]
+    if isinstance(payload, tuple) and len(payload) >= 3:
+        return payload
+    return None
+
+
+class Subscription:
+    """FanoutQueue.subscribe() が返す購読キュー。
+
+    queue.Queue と同じ get / get_nowait / empty / qsize を持ち、空なら queue.Empty を送出する。
+
+    - progress は最新値スロット 1 つに合流する (古い進捗は新しい進捗で上書き)。
+      新しい進捗にプレビューがなければ、上書きされる進捗のプレビューを引き継ぐ。
+    - file / seed / end など progress 以外のイベントとセンチネルは、順序付きのロスレスレーンに入り
+      捨てられることはない。
+    - スロットとレーンは publish の通し番号で並べて取り出すので、
+      file の前に publish された進捗は file より先に届く。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lane = deque()       # (seq, item)
+        self._latest = None        # (seq, item) or None
+        self._seq = 0
+        # 最新値スロットのプレビューファイルを参照登録する先 (PreviewFileEncoder)。FanoutQueue が設定する
+        self._preview_holder = None
+
+    def _hold_preview(self, slot, item) -> None:
+        # self._cond を保持した状態で呼ばれる。未配信 ("latest") と直前に渡した ("delivered")
+        # プレビューファイルを、次のプレビューに置き換わるまで削除させない
+        if self._preview_holder is None:
+            return
+        parts = _progress_parts(item) if item is not None else None
+        self._preview_holder.hold((self, slot), parts[0] if parts is not None else None)
+
+    def _put(self, item) -> None:
+        with self._cond:
+            self._seq += 1
+            if _is_progress(item):
+                if self._latest is not None:
+                    item = self._merge(self._latest[1], item)
+                self._latest = (self._seq, item)
+                self._hold_preview("latest", item)
+            else:
+                self._lane.append((self._seq, item))
+            self._notify()
+
+    def _notify(self) -> None:
+        # self._cond を保持した状態で呼ばれる
+        self._cond.notify()
+
+    @staticmethod
+    def _merge(pending, item):
+        new_parts = _progress_parts(item)
+        old_parts = _progress_parts(pending)
+        if new_parts is None or old_parts is None:
+            return item
+        if new_parts[0] is None and old_parts[0] is not None:
+            return ('progress', (old_parts[0],) + tuple(new_parts[1:]))
+        return item
+
+    def _take(self):
+        # ロック内で呼ぶ。通し番号の小さい方から取り出す
+        if self._latest is not None and (not self._lane or self._latest[0] < self._lane[0][0]):
+            item, self._latest = self._latest[1], None
+            parts = _progress_parts(item)
+            if parts is not None and parts[0] is not None:
+                self._hold_preview("delivered", item)
+            self._hold_preview("latest", None)
+            return item
+        return self._lane.popleft()[1]
+
+    def _ready(self) -> bool:
+        return self._latest is not None or bool(self._lane)
+
+    def get(self, block: bool = True, timeout=None):
+        with self._cond:
+            if not block:
+                if not self._ready():
+                    raise queue.Empty
+            elif not self._cond.wait_for(self._ready, timeout):
+                raise queue.Empty
+            return self._take()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self) -> bool:
+        with self._cond:
+            return not self._ready()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._lane) + (1 if self._latest is not None else 0)
+
+    def _clear(self) -> None:
+        with self._cond:
+            self._lane.clear()
+            self._latest = None
+            self._hold_preview("latest", None)
+            self._hold_preview("delivered", None)
+
+
+class AsyncSubscription(Subscription):
+    """FanoutQueue.subscribe_async() が返す asyncio 用の購読。
+
+    async for で履歴→ライブの順にイベントを受け取り、センチネル (BUS_END_SENTINEL) を
+    最後に返して終わる。購読者ごとにスレッドを使わず、コルーチン 1 つで追随できる。
+
+    publish は worker スレッドから呼ばれるので、loop.call_soon_threadsafe でループ側を起こす。
+    起床の予約は購読者ごとに同時に 1 つまでとし、消費が遅れている間の progress は
+    最新値スロットに合流させる (プレビューの洪水でイベントループを埋めない)。
+    """
+
+    def __init__(self, bus, loop):
+        super().__init__()
+        self._bus = bus
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._wake_pending = False
+        self._detached = False
+        self._finished = False
+
+    def _notify(self) -> None:
+        if self._wake_pending or self._detached:
+            return
+        self._wake_pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # イベントループが閉じられた: 次の publish で購読から外す
+            self._detached = True
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._wake_pending = False
+        self._event.set()
+
+    async def get(self, timeout=None):
+        """次のイベントを待って返す。timeout 秒以内に届かなければ queue.Empty"""
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while True:
+            with self._cond:
+                if self._ready():
+                    return self._take()
+                self._event.clear()
+            if deadline is None:
+                await self._event.wait()
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                raise queue.Empty
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                raise queue.Empty from None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._finished:
+            raise StopAsyncIteration
+        item = await self.get()
+        if item == BUS_END_SENTINEL:
+            self._finished = True
+        return item
+
+    def close(self) -> None:
+        """購読を解除する"""
+        self._detached = True
+        self._bus.unsubscribe(self)
+
+    async def aclose(self) -> None:
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
 # ====================================================================
 # FanoutQueue: 履歴再生付きスレッドセーフpub-sub
 # ====================================================================
@@ -33,17 +228,23 @@ class FanoutQueue:
     publish() で全購読者に配信しつつ履歴に保存。
     subscribe() で既存の履歴を即座に受け取り、以降のリアルタイム配信を受ける。
     ブラウザの再接続時に履歴を再生することで、状態を復元する。
+
+    購読キューは Subscription で、プレビュー付きの進捗が大量に流れても
+    file / seed / end を取りこぼさない。プレビューは publish ごとに preview_encoder で
+    一度だけ変換し、同じオブジェクトを全購読者で共有する。
     """
 
     def __init__(self, maxlen: int = 200, maxsize: int = 200,
-                 on_publish_tap=None):
+                 on_publish_tap=None, preview_encoder=None):
         """
         Args:
             maxlen: 履歴バッファの最大長
-            maxsize: 各購読キューの最大サイズ (maxlen と同じにして
+            maxsize: 履歴再生で購読キューに積む最大件数 (maxlen と同じにして
                      履歴ドロップを防止)
             on_publish_tap: publish時に呼ばれるコールバック。
                             fn(item) → None。last_* グローバル更新等に使用。
+            preview_encoder: progress のプレビューを配信前に一度だけ変換するコールバック。
+                             fn(preview) → 共有する値 (画像ファイルのパスなど)。
         """
         self._history = deque(maxlen=maxlen)
         # BUG-15修正: WeakSet → 通常の set
@@ -54,11 +255,23 @@ class FanoutQueue:
         self._maxsize = maxsize
         self._closed = False
         self._on_publish_tap = on_publish_tap
+        self._preview_encoder = preview_encoder
 
     @property
     def is_closed(self) -> bool:
         return self._closed
 
+    def _encode_preview(self, item):
+        if self._preview_encoder is None or not _is_progress(item):
+            return item
+        parts = _progress_parts(item)
+        if parts is None or parts[0] is None:
+            return item
+        try:
+            return ('progress', (self._preview_encoder(parts[0]),) + tuple(parts[1:]))
+        except Exception:
+            return item
+
     def publish(self, item) -> None:
         """要素を全ての購読者に配信し履歴に保存する。
 
@@ -66,18 +279,20 @@ class FanoutQueue:
         progressイベントのpreview部分をNoneに置換して保存し、メモリ蓄積を防止。
         ライブ購読者にはオリジナル（画像付き）を配信する。
         """
+        if self._closed:
+            return
+        # プレビューの変換はロックの外で一度だけ行い、結果を全購読者で共有する
+        item = self._encode_preview(item)
         with self._lock:
             if self._closed:
                 return
             # 履歴にはプレビュー画像を除外した軽量コピーを保存
             hist_item = item
             try:
-                if (isinstance(item, tuple) and len(item) == 2
-                        and item[0] == 'progress'
-                        and isinstance(item[1], tuple) and len(item[1]) >= 3
-                        and item[1][0] is not None):
+                parts = _progress_parts(item) if _is_progress(item) else None
+                if parts is not None and parts[0] is not None:
                     # ('progress', (preview, desc, bar_html)) → preview=None
-                    hist_item = ('progress', (None, item[1][1], item[1][2]))
+                    hist_item = ('progress', (None, parts[1], parts[2]))
             except Exception:
                 pass
             self._history.append(hist_item)
@@ -89,49 +304,57 @@ class FanoutQueue:
                 except Exception:
                     pass
 
-            # 購読者へ配信（満杯なら古い1件を捨てて最新を入れる）
+            # 購読者へ配信（progress は最新値に合流、それ以外は順序通りに全て届く）
             for q in list(self._subs):
-                try:
-                    q.put_nowait(item)
-                except queue.Full:
-                    try:
-                        _ = q.get_nowait()
-                        q.put_nowait(item)
-                    except Exception:
-                        pass
-
-    def subscribe(self) -> queue.Queue:
+                q._put(item)
+            # イベントループが閉じられた非同期購読を外す
+            detached = [q for q in self._subs if getattr(q, "_detached", False)]
+            self._subs.difference_update(detached)
+
+    def subscribe(self) -> Subscription:
         """キューに購読し既存の履歴を即座に受け取る。
 
-        BUG-16修正: maxsize を maxlen と揃えることで、
+        BUG-16修正: 再生する件数を maxlen と揃えることで、
         遅れて接続したブラウザが seed/file イベントを取りこぼさない。
         """
-        q: queue.Queue = queue.Queue(maxsize=self._maxsize)
+        return self._attach(Subscription())
+
+    def subscribe_async(self, loop=None) -> AsyncSubscription:
+        """asyncio 用に購読する (コルーチン内から呼ぶ)。履歴の再生は subscribe() と同じ。
+
+        使い方:
+            async with ctx.bus.subscribe_async() as sub:
+                async for item in sub:
+                    if item == BUS_END_SENTINEL:
+                        break
+        """
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        return self._attach(AsyncSubscription(self, loop))
+
+    def _attach(self, q):
+        if hasattr(self._preview_encoder, "hold"):
+            q._preview_holder = self._preview_encoder
         with self._lock:
-            for item in list(self._history):
-                try:
-                    q.put_nowait(item)
-                except queue.Full:
-                    break
-            self._subs.add(q)
+            for item in list(self._history)[-self._maxsize:]:
+                q._put(item)
             if self._closed:
-                self._force_sentinel(q)
+                q._put(BUS_END_SENTINEL)
+            else:
+                self._subs.add(q)
         return q
 
-    def unsubscribe(self, q: queue.Queue) -> None:
+    def unsubscribe(self, q: Subscription) -> None:
         with self._lock:
             self._subs.discard(q)
+        q._clear()
 
     def clear(self) -> None:
         """履歴と全ての購読キューをクリアする"""
         with self._lock:
             self._history.clear()
             for q in list(self._subs):
-                while not q.empty():
-                    try:
-                        q.get_nowait()
-                    except queue.Empty:
-                        break
+                q._clear()
 
     def close(self) -> None:
         """全ての購読キューを閉じて削除する。センチネルを必ず送信する。"""
@@ -139,33 +362,89 @@ class FanoutQueue:
             if self._closed:
                 return
             self._closed = True
+            # BUG-17: センチネルはロスレスレーンに入るので満杯で落ちることはない
             for q in list(self._subs):
-                self._force_sentinel(q)
+                q._put(BUS_END_SENTINEL)
             self._subs.clear()
 
-    # BUG-17修正: sentinel配信を最大3回リトライし、
-    # それでも失敗したらキューをフラッシュして強制配信
-    def _force_sentinel(self, q: queue.Queue) -> None:
-        """購読キューにsentinelを確実に配信する (ロック内で呼ぶこと)"""
-        for _ in range(3):
-            try:
-                q.put_nowait(BUS_END_SENTINEL)
-                return  # 成功
-            except queue.Full:
-                try:
-                    q.get_nowait()
-                except queue.Empty:
-                    pass
-        # 最終手段: キューを完全にフラッシュしてからsentinelを入れる
-        while not q.empty():
+
+class PreviewFileEncoder:
+    """プレビュー画像 (numpy 配列 / PIL 画像) を PNG に一度だけ書き出し、そのパスを返す。
+
+    FanoutQueue の preview_encoder に渡すと、複数のタブが同じジョブを見ていても
+    各タブが numpy 配列から画像を作り直さず、同じファイルを参照する。
+    書き出したファイルは直近 keep 件だけ残し、古いものから削除する。
+    ただし hold() で参照中のファイル (未配信の購読スロット・last_preview_image など) は
+    削除を保留し、最後の参照が外れたときに削除する。
+    """
+
+    def __init__(self, directory: str, keep: int = 8, prefix: str = "bus_preview"):
+        self.directory = directory
+        self.keep = max(2, int(keep))
+        self.prefix = prefix
+        self._written = deque()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._held = {}        # 参照元 → パス
+        self._refs = {}        # パス → 参照数
+        self._expired = set()  # keep 件から外れたが参照中で削除を保留しているパス
+
+    def hold(self, owner, value) -> None:
+        """owner が参照するプレビューを value に差し替える (None やパス以外なら参照を外す)。
+
+        owner はハッシュ可能な任意のキー (購読キューや "last_preview_image" など)。
+        """
+        path = value if isinstance(value, str) else None
+        removable = []
+        with self._lock:
+            old = self._held.pop(owner, None)
+            if path is not None:
+                self._held[owner] = path
+                self._refs[path] = self._refs.get(path, 0) + 1
+            if old is not None:
+                count = self._refs.get(old, 0) - 1
+                if count > 0:
+                    self._refs[old] = count
+                else:
+                    self._refs.pop(old, None)
+                    if old in self._expired:
+                        self._expired.discard(old)
+                        removable.append(old)
+        self._remove(removable)
+
+    @staticmethod
+    def _remove(paths) -> None:
+        for old in paths:
             try:
-                q.get_nowait()
-            except queue.Empty:
-                break
-        try:
-            q.put_nowait(BUS_END_SENTINEL)
-        except Exception:
-            pass  # ここまで来たら諦める (理論上到達不可能)
+                os.remove(old)
+            except OSError:
+                pass
+
+    def __call__(self, preview):
+        if preview is None or isinstance(preview, (str, bytes, dict)):
+            return preview
+        if hasattr(preview, "save"):
+            image = preview
+        else:
+            from PIL import Image
+            image = Image.fromarray(preview)
+        with self._lock:
+            self._count += 1
+            path = os.path.join(self.directory, f"{self.prefix}_{os.getpid()}_{self._count}.png")
+        os.makedirs(self.directory, exist_ok=True)
+        # プレビューは頻繁に書き出すので圧縮より速度を優先する
+        image.save(path, compress_level=1)
+        removable = []
+        with self._lock:
+            self._written.append(path)
+            while len(self._written) > self.keep:
+                old = self._written.popleft()
+                if old in self._refs:
+                    self._expired.add(old)
+                else:
+                    removable.append(old)
+        self._remove(removable)
+        return path
 
 
 # ====================================================================
@@ -180,8 +459,8 @@ class JobContext:
     owner_sid: str — 生成を開始したブラウザタブのセッションID
     """
 
-    def __init__(self, on_publish_tap=None):
-        self.bus = FanoutQueue(on_publish_tap=on_publish_tap)
+    def __init__(self, on_publish_tap=None, preview_encoder=None):
+        self.bus = FanoutQueue(on_publish_tap=on_publish_tap, preview_encoder=preview_encoder)
         self.done = threading.Event()
         self.stop_mode = None
         self._stop_lock = threading.Lock()
@@ -0,0 +1,86 @@
+"""
+1フレーム推論のシードバッチ
+
+oneframe の batch_count は通常シードごとに worker() を 1 回ずつ実行し、
+sample_hunyuan もバッチ 1 で呼ばれる。シードバッチでは連続する K 回分の出力を
+1 回の sample_hunyuan 呼び出しのバッチ次元にまとめ、条件付けテンソルは expand
+(コピーなし) で共有する。K は空き VRAM と解像度から決める。
+着せ替え (kisekaeichi) の入力画像×参照画像の組み合わせでは、同じ入力画像の組を
+参照画像ごとにバッチ次元へ並べ、各参照画像は 1 回だけエンコードする。
+
+sample_hunyuan は 1 つの generator から (K, ...) のノイズをまとめて引くため、
+バッチ内 i 番目の出力は「先頭シード + バッチ内番号 i」で再現される。
+i=0 は通常モードの同じシードと一致するが、i>0 は seed+i の単体実行とは一致しない。
+このため既定では無効とし、環境変数 EICHI_SEED_BATCH で有効にする:
+    未設定 / 0 / 1 : 無効
+    auto          : 空き VRAM から K を決める (上限 AUTO_MAX_SEED_BATCH)
+    2 以上の整数  : 空き VRAM から K を決める (上限をその値にする)
+
+使い方:
+    from eichi_utils.seed_batch import choose_seed_batch_size, plan_sample_batches, expand_to_batch
+    k = choose_seed_batch_size(640 * 640, free_bytes)
+    for members in plan_sample_batches(keys, k):
+        ...
+"""
+
+import os
+
+# サンプリング中に出力 1 枚 (1 サンプル) あたり増える VRAM の目安 (出力画素あたりのバイト数)
+# 640x640 で約 1.6 GB。transformer の中間テンソルと VAE デコードを合わせた実測からの概算
+_SAMPLE_BYTES_PER_PIXEL = 4096
+
+# EICHI_SEED_BATCH=auto のときの K の上限
+AUTO_MAX_SEED_BATCH = 8
+
+
+def seed_batch_limit():
+    """EICHI_SEED_BATCH から K の上限を返す (無効なら 1)"""
+    value = os.environ.get("EICHI_SEED_BATCH", "").strip().lower()
+    if value == "auto":
+        return AUTO_MAX_SEED_BATCH
+    try:
+        return max(1, int(value))
+    except ValueError:
+        return 1
+
+
+def choose_seed_batch_size(pixels, free_bytes, limit=None):
+    """出力の画素数と使える VRAM (バイト) から 1 回のサンプリングにまとめる数 K を決める
+
+    free_bytes が分からない (None) 場合やシードバッチが無効な場合は 1 を返す。
+    """
+    if limit is None:
+        limit = seed_batch_limit()
+    if limit <= 1 or free_bytes is None:
+        return 1
+    per_sample = max(1, int(pixels)) * _SAMPLE_BYTES_PER_PIXEL
+    return max(1, min(int(limit), int(free_bytes) // per_sample))
+
+
+def plan_sample_batches(keys, k):
+    """keys[i] が等しいバッチ番号 i を、出現順に k 個までずつ 1 回のサンプリングにまとめる
+
+    keys[i] はバッチ i の入力画像とプロンプトを表すキー。入力画像が同じならバケットサイズと
+    start latent・CLIP Vision 特徴も同じなので、参照画像とシードだけが異なる組として
+    バッチ次元に並べられる。キーが None のバッチはまとめない。
+    戻り値は先頭のバッチ番号の昇順に並んだ [[i0, i1, ...], ...]。
+    """
+    k = max(1, int(k))
+    batches = []
+    open_batches = {}
+    for i, key in enumerate(keys):
+        batch = open_batches.get(key) if key is not None else None
+        if batch is None or len(batch) >= k:
+            batch = []
+            batches.append(batch)
+            if key is not None:
+                open_batches[key] = batch
+        batch.append(i)
+    return batches
+
+
+def expand_to_batch(tensor, k):
+    """バッチ次元 1 のテンソルをコピーせずに k へ広げる (None・k<=1・バッチ済みはそのまま)"""
+    if tensor is None or k <= 1 or tensor.shape[0] != 1:
+        return tensor
+    return tensor.expand(k, *tensor.shape[1:])
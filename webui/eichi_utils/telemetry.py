@@ -0,0 +1,395 @@
+"""
+ジョブ単位のテレメトリ (メモリのサンプリングと処理区間のタイムライン)
+
+これまでメモリの状況は oneframe_ichi.py の _get_mem_snapshot / _format_mem_snapshot、
+TransformerManager の RSS 表示などでそれぞれ print するだけだった。
+ここではジョブの開始から終了までをひとつのタイムラインとして記録する。
+
+- バックグラウンドのスレッドが一定間隔でホストの RSS / 空き RAM と
+  CUDA の allocated / reserved をサンプリングする
+- テキストエンコード、VAE エンコード、サンプリングの各ステップ、VAE デコード、
+  MP4 エンコード、LoRA マージなどを名前付きの区間 (span) として記録する
+- ジョブの終了時に出力フォルダへ JSON または Chrome trace 形式で書き出す
+  (Chrome trace は chrome://tracing や Perfetto でそのまま開ける)
+
+既定では無効で、無効の間は span() などは何もしないので計測コードを残したままでよい。
+
+環境変数:
+- EICHI_TELEMETRY: off (既定) / json / chrome
+- EICHI_TELEMETRY_INTERVAL: サンプリング間隔 秒 (既定 0.5)
+
+使い方:
+    from eichi_utils import telemetry
+    telemetry.start_job(job_id, outputs_folder)
+    with telemetry.span("text encode"):
+        ...
+    telemetry.lap("sampling step", step=i)   # 次の lap / finish まで続く区間
+    executor.submit(telemetry.traced("encode MP4", save_mp4), ...)   # 別スレッドでの処理
+    path = telemetry.finish_job()
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+_GB = 1024 ** 3
+
+TELEMETRY_MODES = ("off", "json", "chrome")
+DEFAULT_INTERVAL = 0.5
+
+
+def telemetry_mode():
+    """EICHI_TELEMETRY の値 (off / json / chrome)。不明な値は off"""
+    value = os.environ.get("EICHI_TELEMETRY", "off").strip().lower()
+    return value if value in TELEMETRY_MODES else "off"
+
+
+def sample_interval():
+    try:
+        return max(0.05, float(os.environ.get("EICHI_TELEMETRY_INTERVAL", DEFAULT_INTERVAL)))
+    except (TypeError, ValueError):
+        return DEFAULT_INTERVAL
+
+
+# ==============================================================================
+# メモリの取得
+# ==============================================================================
+def cuda_mem_info():
+    """CUDA のメモリ情報 (バイト)。取得できない項目は None
+
+    戻り値: dict(free_bytes, total_bytes, allocated_bytes, reserved_bytes)
+    """
+    info = {"free_bytes": None, "total_bytes": None, "allocated_bytes": None, "reserved_bytes": None}
+    try:
+        import torch
+        if torch.cuda.is_available():
+            try:
+                free_b, total_b = torch.cuda.mem_get_info()
+                info["free_bytes"], info["total_bytes"] = int(free_b), int(total_b)
+            except Exception:
+                pass
+            try:
+                dev = torch.cuda.current_device()
+            except Exception:
+                dev = 0
+            try:
+                info["allocated_bytes"] = int(torch.cuda.memory_allocated(device=dev))
+            except Exception:
+                pass
+            try:
+                info["reserved_bytes"] = int(torch.cuda.memory_reserved(device=dev))
+            except Exception:
+                pass
+    except Exception:
+        pass
+    return info
+
+
+def _cuda_allocated_reserved():
+    # サンプラーは頻繁に呼ぶので、torch の読み込みや CUDA の初期化を起こさない
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None, None
+    try:
+        if not torch.cuda.is_initialized():
+            return None, None
+        dev = torch.cuda.current_device()
+        return torch.cuda.memory_allocated(dev) / _GB, torch.cuda.memory_reserved(dev) / _GB
+    except Exception:
+        return None, None
+
+
+def memory_sample():
+    """ホストと CUDA のメモリ使用量 (GB)。取得できない項目は None"""
+    try:
+        from eichi_utils.host_memory import host_mem_available_gb, host_mem_rss_gb
+        rss, avail = host_mem_rss_gb(), host_mem_available_gb()
+    except Exception:
+        rss, avail = None, None
+    allocated, reserved = _cuda_allocated_reserved()
+    return {
+        "host_rss_gb": rss,
+        "host_avail_gb": avail,
+        "cuda_allocated_gb": allocated,
+        "cuda_reserved_gb": reserved,
+    }
+
+
+# ==============================================================================
+# ジョブのタイムライン
+# ==============================================================================
+class JobTelemetry:
+    """1 ジョブ分の区間とメモリのサンプルを記録する
+
+    clock / sample_fn はテスト用に差し替えられる。時刻は start() からの経過秒で持つ。
+    """
+
+    def __init__(self, name, interval=None, sample_fn=None, clock=None):
+        self.name = name
+        self.interval = sample_interval() if interval is None else interval
+        self._sample_fn = sample_fn or memory_sample
+        self._clock = clock or time.perf_counter
+        self._lock = threading.Lock()
+        self._origin = None
+        self.started_at = None
+        self.duration = None
+        self.spans = []      # (name, start, end, thread, args)
+        self.instants = []   # (name, t, thread, args)
+        self.samples = []    # (t, dict)
+        self._open = {}      # token -> (name, start, thread, args)
+        self._next_token = 0
+        self._lap = {}       # lap 名 -> token
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _now(self):
+        return self._clock() - self._origin
+
+    def start(self):
+        self._origin = self._clock()
+        self.started_at = time.time()
+        self.sample()
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="eichi-telemetry", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            values = self._sample_fn()
+        except Exception:
+            return
+        with self._lock:
+            self.samples.append((self._now(), values))
+
+    # ---- 区間 ----
+    def begin(self, name, **args):
+        """区間を開始してトークンを返す (複数行にまたがる処理用、end(token) で閉じる)"""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._open[token] = (name, self._now(), threading.get_ident(), args)
+        return token
+
+    def end(self, token, **args):
+        with self._lock:
+            opened = self._open.pop(token, None)
+            if opened is None:
+                return
+            name, start, thread, start_args = opened
+            if args:
+                start_args = dict(start_args, **args)
+            self.spans.append((name, start, self._now(), thread, start_args))
+
+    @contextmanager
+    def span(self, name, **args):
+        token = self.begin(name, **args)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def lap(self, name, **args):
+        """同じ名前の前の lap を閉じて新しい区間を始める (サンプリングのステップなど)"""
+        previous = self._lap.get(name)
+        if previous is not None:
+            self.end(previous)
+        self._lap[name] = self.begin(name, **args)
+
+    def end_lap(self, name):
+        token = self._lap.pop(name, None)
+        if token is not None:
+            self.end(token)
+
+    def instant(self, name, **args):
+        with self._lock:
+            self.instants.append((name, self._now(), threading.get_ident(), args))
+
+    def stop(self):
+        """サンプラーを止め、開いたままの区間を閉じる"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(1.0, self.interval * 2))
+            self._thread = None
+        self.sample()
+        self._lap.clear()
+        for token in sorted(self._open):
+            self.end(token, unfinished=True)
+        self.duration = self._now()
+        return self
+
+    # ---- 書き出し ----
+    def summary(self):
+        """区間名ごとの回数・合計・最大 (秒) と、メモリ項目ごとの最大値"""
+        totals = {}
+        for name, start, end, _, _ in self.spans:
+            entry = totals.setdefault(name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            entry["count"] += 1
+            entry["total_s"] += end - start
+            entry["max_s"] = max(entry["max_s"], end - start)
+        peaks = {}
+        for _, values in self.samples:
+            for key, value in values.items():
+                if value is not None and (peaks.get(key) is None or value > peaks[key]):
+                    peaks[key] = value
+        return {"spans": totals, "peaks": peaks}
+
+    def to_json(self):
+        return {
+            "job": self.name,
+            "started_at": self.started_at,
+            "duration_s": self.duration,
+            "spans": [
+                {"name": name, "start_s": start, "duration_s": end - start, "thread": thread, "args": args}
+                for name, start, end, thread, args in sorted(self.spans, key=lambda s: (s[1], -s[2]))
+            ],
+            "instants": [
+                {"name": name, "t_s": t, "thread": thread, "args": args}
+                for name, t, thread, args in self.instants
+            ],
+            "samples": [dict(values, t_s=t) for t, values in self.samples],
+            "summary": self.summary(),
+        }
+
+    def to_chrome_trace(self):
+        """Chrome trace event 形式 (区間は X、メモリは C のカウンタ)"""
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"eichi {self.name}"}}]
+        for name, start, end, thread, args in self.spans:
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": thread,
+                           "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args})
+        for name, t, thread, args in self.instants:
+            events.append({"name": name, "ph": "i", "s": "t", "pid": pid, "tid": thread,
+                           "ts": t * 1e6, "args": args})
+        for t, values in self.samples:
+            host = {k: v for k, v in values.items() if k.startswith("host_") and v is not None}
+            cuda = {k: v for k, v in values.items() if k.startswith("cuda_") and v is not None}
+            for counter, counter_args in (("host memory (GB)", host), ("CUDA memory (GB)", cuda)):
+                if counter_args:
+                    events.append({"name": counter, "ph": "C", "pid": pid, "tid": 0,
+                                   "ts": t * 1e6, "args": counter_args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, output_dir, fmt="json"):
+        """output_dir に書き出してパスを返す (json: <job>_telemetry.json / chrome: <job>_trace.json)"""
+        if fmt == "chrome":
+            path = os.path.join(output_dir, f"{self.name}_trace.json")
+            data = self.to_chrome_trace()
+        else:
+            path = os.path.join(output_dir, f"{self.name}_telemetry.json")
+            data = self.to_json()
+        os.makedirs(output_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        return path
+
+
+# ==============================================================================
+# 実行中のジョブ (ジョブは 1 つずつ実行されるのでモジュールで 1 つだけ持つ)
+# ==============================================================================
+_current = None
+_current_output = None
+_current_lock = threading.Lock()
+
+
+def current():
+    return _current
+
+
+def start_job(name, output_dir, mode=None, **kwargs):
+    """ジョブの記録を始める。無効なら何もせず None を返す
+
+    前のジョブが終わっていなければ書き出さずに捨てる。
+    """
+    global _current, _current_output
+    mode = telemetry_mode() if mode is None else mode
+    if mode == "off":
+        return None
+    telemetry = JobTelemetry(str(name), **kwargs)
+    with _current_lock:
+        previous, _current, _current_output = _current, telemetry, (output_dir, mode)
+    if previous is not None:
+        previous.stop()
+    return telemetry.start()
+
+
+def finish_job():
+    """実行中のジョブを終えて書き出し、そのパスを返す (記録していなければ None)"""
+    global _current, _current_output
+    with _current_lock:
+        telemetry, output, _current, _current_output = _current, _current_output, None, None
+    if telemetry is None:
+        return None
+    telemetry.stop()
+    output_dir, mode = output
+    try:
+        path = telemetry.write(output_dir, mode)
+    except Exception as e:
+        print(f"テレメトリの書き出しに失敗しました: {e}")
+        return None
+    print(f"テレメトリを保存しました: {path}")
+    return path
+
+
+@contextmanager
+def span(name, **args):
+    """実行中のジョブに区間を記録する (記録していなければ何もしない)"""
+    telemetry = _current
+    if telemetry is None:
+        yield
+        return
+    with telemetry.span(name, **args):
+        yield
+
+
+def traced(name, func, **args):
+    """func の実行を区間 name として記録する関数を返す (出力エグゼキュータなど別スレッドで実行する処理用)
+
+    記録先は traced() を呼んだ時点のジョブ。記録していなければ func をそのまま返す。
+    """
+    telemetry = _current
+    if telemetry is None:
+        return func
+
+    @functools.wraps(func)
+    def run(*a, **kw):
+        with telemetry.span(name, **args):
+            return func(*a, **kw)
+    return run
+
+
+def begin(name, **args):
+    telemetry = _current
+    return None if telemetry is None else (telemetry, telemetry.begin(name, **args))
+
+
+def end(handle, **args):
+    if handle is not None:
+        telemetry, token = handle
+        telemetry.end(token, **args)
+
+
+def lap(name, **args):
+    telemetry = _current
+    if telemetry is not None:
+        telemetry.lap(name, **args)
+
+
+def end_lap(name):
+    telemetry = _current
+    if telemetry is not None:
+        telemetry.end_lap(name)
+
+
+def instant(name, **args):
+    telemetry = _current
+    if telemetry is not None:
+        telemetry.instant(name, **args)
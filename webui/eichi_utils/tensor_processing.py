@@ -7,11 +7,15 @@ import numpy as np
 from diffusers_helper.hunyuan import vae_decode
 from eichi_utils.vae_cache import vae_decode_cache
 from diffusers_helper.utils import save_bcthw_as_mp4
+from eichi_utils import telemetry
 
 
 def print_tensor_info(tensor: torch.Tensor, name: str = "テンソル") -> None:
     """テンソルの詳細情報を出力する
 
+    GPU メモリは telemetry.cuda_mem_info() から取り、記録中のジョブには
+    テレメトリのイベントとしても残す。
+
     Args:
         tensor (torch.Tensor): 分析対象のテンソル
         name (str, optional): テンソルの名前. デフォルトは"テンソル"
@@ -31,13 +35,17 @@ def print_tensor_info(tensor: torch.Tensor, name: str = "テンソル") -> None:
                 tensor.mean().item(),
             )
         )
-        if torch.cuda.is_available():
+        mem = telemetry.cuda_mem_info()
+        if mem["allocated_bytes"] is not None and mem["total_bytes"]:
             print(
                 translate("  - 使用GPUメモリ: {0:.2f}GB/{1:.2f}GB").format(
-                    torch.cuda.memory_allocated() / 1024**3,
-                    torch.cuda.get_device_properties(0).total_memory / 1024**3,
+                    mem["allocated_bytes"] / 1024**3,
+                    mem["total_bytes"] / 1024**3,
                 )
             )
+        telemetry.instant(
+            "tensor info", name=name, shape=list(tensor.shape), dtype=str(tensor.dtype)
+        )
     except Exception as e:
         print(translate("[警告] テンソル情報の出力に失敗: {0}").format(str(e)))
 
@@ -151,18 +159,8 @@ def process_tensor_chunk(
             )
         )
 
-        # メモリ状態を出力
+        # メモリキャッシュをクリア（GPUメモリは下の print_tensor_info で出力する）
         if torch.cuda.is_available():
-            print(
-                translate(
-                    "[MEMORY] チャンク{0}処理前のGPUメモリ: {1:.2f}GB/{2:.2f}GB"
-                ).format(
-                    chunk_idx + 1,
-                    torch.cuda.memory_allocated() / 1024**3,
-                    torch.cuda.get_device_properties(0).total_memory / 1024**3,
-                )
-            )
-            # メモリキャッシュをクリア
             torch.cuda.empty_cache()
 
         # 各チャンク処理前にGPUメモリを解放
@@ -196,12 +194,13 @@ def process_tensor_chunk(
         # 明示的にデバイスを合わせる
         current_chunk = ensure_tensor_properties(current_chunk, vae.device)
 
-        chunk_pixels = process_latents(
-            current_chunk,
-            vae,
-            use_vae_cache,
-            translate("チャンク"),
-        )
+        with telemetry.span("VAE decode", chunk=chunk_idx + 1):
+            chunk_pixels = process_latents(
+                current_chunk,
+                vae,
+                use_vae_cache,
+                translate("チャンク"),
+            )
         print(
             translate(
                 "チャンク{0}のVAEデコード完了 (フレーム数: {1}, デコード後フレーム: {2})"
@@ -165,13 +165,15 @@ from diffusers_helper.memory import (
     cpu,
     gpu,
     get_cuda_free_memory_gb,
-    move_model_to_device_with_memory_preservation,
-    offload_model_from_device_for_memory_preservation,
     fake_diffusers_current_device,
     DynamicSwapInstaller,
     unload_complete_models,
     load_model_as_complete,
 )
+from eichi_utils.module_placement import (
+    move_model_to_device_with_memory_preservation,
+    offload_model_from_device_for_memory_preservation,
+)
 from diffusers_helper.thread_utils import AsyncStream, async_run
 from diffusers_helper.gradio.progress_bar import make_progress_bar_html
 from transformers import SiglipImageProcessor, SiglipVisionModel
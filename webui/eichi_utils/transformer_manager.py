@@ -7,6 +7,10 @@ from diffusers_helper.models.hunyuan_video_packed import HunyuanVideoTransformer
 from diffusers_helper.memory import DynamicSwapInstaller
 from locales.i18n_extended import translate
 from eichi_utils import lora_state_cache
+from eichi_utils.transformer_prebuild import StatePrebuilder, prebuild_enabled
+from eichi_utils.block_offload import block_offload_enabled, install_block_offload, uninstall_block_offload
+from eichi_utils.host_memory import host_mem_rss_gb
+from eichi_utils import telemetry
 
 class TransformerManager:
     """transformerモデルの状態管理を行うクラス
@@ -18,6 +22,7 @@ class TransformerManager:
     - モデルモード（通常/F1）の管理
     
     設定の変更はすぐには適用されず、次回のリロード時に適用されます。
+    prepare_next() で次の設定の状態辞書を現在のジョブの実行中に組み立てておくこともできます。
     """
 
     # モデルパス定義
@@ -41,6 +46,10 @@ class TransformerManager:
         # 次回のロード時に適用する設定
         self.next_state = self.current_state.copy()
 
+        # 次の設定の状態辞書の先行構築 (prepare_next)
+        self._prebuilder = StatePrebuilder()
+        self._reloading = False
+
         # 仮想デバイスへのtransformerのロード
         self._load_virtual_transformer()
         print(translate("transformerを仮想デバイスにロードしました"))
@@ -58,6 +67,12 @@ class TransformerManager:
             lora_scale: 後方互換性のための単一LoRAスケール
             force_dict_split: 強制的に辞書分割処理を行うかどうか（デフォルトはFalse）
         """
+        self.next_state = self._settings_state(
+            lora_paths, lora_scales, fp8_enabled, high_vram_mode, use_f1_model, lora_path, lora_scale, force_dict_split
+        )
+
+    def _settings_state(self, lora_paths=None, lora_scales=None, fp8_enabled=False, high_vram_mode=False, use_f1_model=None, lora_path=None, lora_scale=None, force_dict_split=False):
+        """set_next_settings の引数を next_state と同じ形の設定にまとめる"""
         # 後方互換性のための処理
         if lora_paths is None and lora_path is not None:
             lora_paths = [lora_path]
@@ -90,7 +105,7 @@ class TransformerManager:
         # F1モデルフラグが指定されていない場合は現在の設定を維持
         actual_use_f1_model = use_f1_model if use_f1_model is not None else self.current_state.get('use_f1_model', False)
 
-        self.next_state = {
+        return {
             'lora_paths': lora_paths if lora_paths else [],
             'lora_scales': lora_scales if lora_scales else [],
             'fp8_enabled': actual_fp8_enabled,
@@ -99,6 +114,90 @@ class TransformerManager:
             'is_loaded': self.current_state['is_loaded'],
             'use_f1_model': actual_use_f1_model
         }
+
+    @staticmethod
+    def _state_dict_key(state):
+        """状態辞書の内容を決める設定のキー (LoRA とスケール・FP8・モデル)"""
+        paths = state.get('lora_paths', []) or []
+        scales = state.get('lora_scales', []) or []
+        loras = tuple(sorted(
+            (os.path.normcase(os.path.abspath(path)), round(float(scale), 4))
+            for path, scale in zip(paths, scales)
+        ))
+        return (loras, bool(state.get('fp8_enabled')), bool(state.get('use_f1_model', False)))
+
+    def prepare_next(self, lora_paths=None, lora_scales=None, fp8_enabled=False, high_vram_mode=False, use_f1_model=None, force_dict_split=False):
+        """次のジョブの設定の状態辞書をバックグラウンドで組み立て始める
+
+        引数は set_next_settings と同じ。現在のジョブの実行中に呼んでおくと、次の
+        _reload_transformer で同じ設定なら組み立て済みの状態辞書を load_state_dict するだけで済む。
+        RAM の予算は transformer_prebuild.StatePrebuilder が管理する。
+
+        Returns:
+            bool: 先行構築を始めた（または同じ設定で構築中・構築済み）なら True
+        """
+        if not prebuild_enabled():
+            return False
+        state = self._settings_state(
+            lora_paths=list(lora_paths) if lora_paths else lora_paths,
+            lora_scales=list(lora_scales) if lora_scales else lora_scales,
+            fp8_enabled=fp8_enabled, high_vram_mode=high_vram_mode,
+            use_f1_model=use_f1_model, force_dict_split=force_dict_split
+        )
+        # from_pretrained で読み込む構成は状態辞書を使わない
+        if not state['lora_paths'] and not state['fp8_enabled'] and not state['force_dict_split']:
+            return False
+        try:
+            if state['fp8_enabled']:
+                from lora_utils.fp8_optimization_utils import check_fp8_support
+                has_e4m3, _, _ = check_fp8_support()
+                if not has_e4m3:
+                    state['fp8_enabled'] = False
+            key = self._state_dict_key(state)
+            if self._is_loaded() and key == self._state_dict_key(self.current_state):
+                return False
+            model_path = self.MODEL_PATH_F1 if state['use_f1_model'] else self.MODEL_PATH_NORMAL
+            model_files = self._find_model_files(model_path)
+            if not model_files:
+                return False
+            # FP8 では線形層の重みが半分になる
+            estimate_gb = sum(os.path.getsize(f) for f in model_files) / (1024 ** 3)
+            if state['fp8_enabled']:
+                estimate_gb *= 0.55
+        except Exception as e:
+            print(translate("transformerの先行構築の準備に失敗しました: {0}").format(e))
+            return False
+
+        lora_paths = list(state['lora_paths'])
+        lora_scales = list(state['lora_scales'])
+        fp8 = state['fp8_enabled']
+
+        def build(throttle):
+            from lora_utils.lora_loader import load_and_apply_lora
+            # サンプリング中の GPU を使わないよう CPU でマージする。
+            # LoRA キャッシュは使わない: オンメモリ側は 1 件しか持たないので現在の設定のエントリを
+            # 追い出してしまい、ディスクへの書き出し (1 件 10-25GB) はサンプリング中の I/O を妨げる
+            return load_and_apply_lora(
+                model_files,
+                lora_paths,
+                lora_scales,
+                fp8,
+                device=torch.device('cpu'),
+                cache_enabled=False,
+                throttle=throttle
+            )
+
+        started = self._prebuilder.start(key, build, estimate_gb, wait_until=lambda: not self._reloading)
+        if started:
+            print(translate("次のtransformer設定の状態辞書をバックグラウンドで構築します (見込み {0:.1f} GB)").format(estimate_gb))
+        return started
+
+    def cancel_prepared(self):
+        """prepare_next で構築中・構築済みの状態辞書を捨てる
+
+        先行構築は LoRA キャッシュに書き込まないので、キャッシュ (現在の設定のエントリ) はそのまま残す。
+        """
+        self._prebuilder.cancel()
     
     def _needs_reload(self):
         """現在の状態と次回の設定を比較し、リロードが必要かどうかを判断"""
@@ -191,6 +290,7 @@ class TransformerManager:
 
     def _reload_transformer(self):
         """next_stateの設定でtransformerをリロード"""
+        self._reloading = True
         try:
             # 既存のtransformerモデルを破棄してメモリを解放
             if self.transformer is not None:
@@ -260,15 +360,26 @@ class TransformerManager:
                 lora_scales = self.next_state.get('lora_scales', []) or []
 
                 try:
-                    from lora_utils.lora_loader import load_and_apply_lora
-                    state_dict = load_and_apply_lora(
-                        model_files,
-                        lora_paths,
-                        lora_scales,
-                        self.next_state['fp8_enabled'],
-                        device=self.device,
-                        cache_enabled=lora_state_cache.cache_enabled
-                    )
+                    # prepare_next で同じ設定の状態辞書を組み立て済みならそれを使う
+                    next_key = self._state_dict_key(self.next_state)
+                    state_dict = None
+                    if self._prebuilder.pending_key == next_key:
+                        state_dict = self._prebuilder.take(next_key)
+                        if state_dict is not None:
+                            print(translate("先行構築済みの状態辞書を使用します"))
+                    else:
+                        self.cancel_prepared()
+                    if state_dict is None:
+                        from lora_utils.lora_loader import load_and_apply_lora
+                        with telemetry.span("LoRA merge", loras=len(lora_paths), fp8=bool(self.next_state['fp8_enabled'])):
+                            state_dict = load_and_apply_lora(
+                                model_files,
+                                lora_paths,
+                                lora_scales,
+                                self.next_state['fp8_enabled'],
+                                device=self.device,
+                                cache_enabled=lora_state_cache.cache_enabled
+                            )
                     if lora_paths:
                         if len(lora_paths) == 1:
                             print(translate("LoRAを直接適用しました (スケール: {0})").format(lora_scales[0]))
@@ -354,7 +465,17 @@ class TransformerManager:
             
             # VRAMモードに応じた設定
             if not self.next_state['high_vram']:
-                DynamicSwapInstaller.install_model(self.transformer, device=self.device)
+                # EICHI_BLOCK_OFFLOAD=1 ならブロック単位のプリフェッチを使い、使えなければ従来の方式にする
+                engine = None
+                if block_offload_enabled():
+                    try:
+                        engine = install_block_offload(self.transformer, device=self.device)
+                    except Exception as e:
+                        print(translate("ブロック単位のプリフェッチを使用できません: {0}").format(e))
+                        uninstall_block_offload(self.transformer)
+                        engine = None
+                if engine is None:
+                    DynamicSwapInstaller.install_model(self.transformer, device=self.device)
             else:
                 self.transformer.to(self.device)
             
@@ -366,13 +487,10 @@ class TransformerManager:
             self.current_state = self.next_state.copy()
 
             # システムメモリの状態を報告（可能な場合）
-            try:
-                import psutil
-                process = psutil.Process()
-                ram_usage = process.memory_info().rss / (1024 * 1024 * 1024)  # GB単位
+            ram_usage = host_mem_rss_gb()
+            if ram_usage is not None:
                 print(translate("現在のRAM使用量: {0:.2f} GB").format(ram_usage))
-            except:
-                # psutilがインストールされていない場合や、その他のエラーが発生した場合は無視
+            else:
                 print(translate("RAM使用量の取得に失敗しました"))
             
             print(translate("transformerのリロードが完了しました"))
@@ -383,6 +501,8 @@ class TransformerManager:
             traceback.print_exc()
             self.current_state['is_loaded'] = False
             return False
+        finally:
+            self._reloading = False
 
     def dispose_transformer(self):
         """Safely move transformer to CPU and reset state."""
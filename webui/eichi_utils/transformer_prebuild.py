@@ -0,0 +1,200 @@
+"""
+transformer 状態辞書の先行構築
+
+設定キューで次の項目の LoRA 構成が今と違う場合、TransformerManager._reload_transformer は
+現在のジョブが終わってから読み込み・LoRA マージ・FP8 量子化を行うため、その間 GPU が遊ぶ。
+StatePrebuilder は次の構成の状態辞書を現在のジョブのサンプリング中にバックグラウンドで (CPU で)
+組み立てておき、ジョブの切り替え時には load_state_dict(assign=True) だけで済むようにする。
+
+- 始める前に、空き RAM から見積もりサイズを引いても host_memory の予備
+  (EICHI_HOST_RAM_RESERVE_GB) が残るかを確認し、残らなければ見送る
+- 構築中はテンソルごとに少し待ち (EICHI_PREBUILD_THROTTLE_MS、既定 1ms)、一定数ごとに
+  host_memory で RAM の逼迫を確認する。逼迫していれば回復するまで待ち、
+  EICHI_PREBUILD_PRESSURE_WAIT 秒 (既定 30) 経っても回復しなければ中止して途中の辞書を捨てる
+- EICHI_PREBUILD=0 で無効
+
+使い方:
+    prebuilder = StatePrebuilder()
+    prebuilder.start(key, lambda throttle: build_state_dict(..., throttle=throttle), estimate_gb)
+    ...
+    state_dict = prebuilder.take(key)   # 同じ key の構築結果 (未構築・失敗なら None)
+"""
+
+import os
+import threading
+import time
+
+
+class PrebuildCancelled(Exception):
+    """先行構築の中止 (throttle から送出され、構築処理を抜ける)"""
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def prebuild_enabled():
+    """EICHI_PREBUILD で先行構築が無効にされていなければ True"""
+    return os.environ.get("EICHI_PREBUILD", "1").strip().lower() not in ("0", "false", "off")
+
+
+def _default_mem_available():
+    from eichi_utils.host_memory import host_mem_available_gb
+    return host_mem_available_gb()
+
+
+def _default_under_pressure(reserve_gb):
+    from eichi_utils.host_memory import host_mem_under_pressure
+    return host_mem_under_pressure(reserve_gb)
+
+
+def _default_reserve_gb():
+    from eichi_utils.host_memory import host_mem_reserve_gb
+    return host_mem_reserve_gb()
+
+
+class _PrebuildJob:
+    def __init__(self, key):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.wanted = threading.Event()  # take() が結果を待っている
+        self.result = None
+        self.error = None
+        self.tensors = 0
+
+
+class StatePrebuilder:
+    """状態辞書を 1 つだけバックグラウンドで組み立てて保持する"""
+
+    def __init__(self, reserve_gb=None, throttle_ms=None, pressure_wait=None, check_every=32,
+                 mem_available_fn=None, sleep_fn=None):
+        self.reserve_gb = _default_reserve_gb() if reserve_gb is None else float(reserve_gb)
+        throttle_ms = _env_float("EICHI_PREBUILD_THROTTLE_MS", 1.0) if throttle_ms is None else throttle_ms
+        self.throttle_s = max(0.0, float(throttle_ms)) / 1000.0
+        self.pressure_wait = max(0.0, _env_float("EICHI_PREBUILD_PRESSURE_WAIT", 30.0)
+                                 if pressure_wait is None else float(pressure_wait))
+        self.check_every = max(1, int(check_every))
+        self._mem_available = mem_available_fn or _default_mem_available
+        # 逼迫の判定は既定では host_memory に任せる (mem_available_fn を渡した場合はそれで判定)
+        self._pressure_fn = None if mem_available_fn is not None else (lambda: _default_under_pressure(self.reserve_gb))
+        self._sleep = sleep_fn or time.sleep
+        self._lock = threading.Lock()
+        self._job = None
+
+    @property
+    def pending_key(self):
+        """構築中または構築済みの key (なければ None)"""
+        job = self._job
+        return job.key if job is not None else None
+
+    def _has_room(self, need_gb):
+        avail = self._mem_available()
+        # 空き RAM が分からない場合は予算を守れないので始めない
+        return avail is not None and avail - need_gb >= self.reserve_gb
+
+    def _under_pressure(self):
+        if self._pressure_fn is not None:
+            return self._pressure_fn()
+        avail = self._mem_available()
+        return avail is not None and avail < self.reserve_gb
+
+    def start(self, key, build_fn, estimate_gb=0.0, wait_until=None):
+        """key の状態辞書の構築を始める (始めた、または同じ key が構築中・構築済みなら True)
+
+        build_fn(throttle) は状態辞書を返す関数。テンソルを 1 つ処理するごとに throttle() を呼ぶ。
+        wait_until が与えられた場合は、それが True を返すまで構築を始めない (他のリロードの終了待ち)。
+        ただし take() で結果を待たれた場合はすぐに始める。
+        """
+        with self._lock:
+            job = self._job
+            if job is not None and job.key == key and job.error is None:
+                return True
+        self.cancel()
+        if not self._has_room(estimate_gb):
+            print(f"空きRAMが足りないため transformer の先行構築を見送ります (必要見込み {estimate_gb:.1f}GB + 予備 {self.reserve_gb:.1f}GB)")
+            return False
+        job = _PrebuildJob(key)
+        with self._lock:
+            self._job = job
+        thread = threading.Thread(
+            target=self._run, args=(job, build_fn, estimate_gb, wait_until),
+            name="eichi-transformer-prebuild", daemon=True,
+        )
+        thread.start()
+        return True
+
+    def _throttle(self, job):
+        if job.cancelled.is_set():
+            raise PrebuildCancelled("キャンセルされました")
+        job.tensors += 1
+        if self.throttle_s > 0 and not job.wanted.is_set():
+            # take() で待たれている間は間引かない
+            self._sleep(self.throttle_s)
+        if job.tensors % self.check_every:
+            return
+        waited = 0.0
+        while self._under_pressure():
+            if job.cancelled.is_set():
+                raise PrebuildCancelled("キャンセルされました")
+            if waited >= self.pressure_wait:
+                raise PrebuildCancelled("空きRAMが回復しません")
+            self._sleep(1.0)
+            waited += 1.0
+
+    def _run(self, job, build_fn, estimate_gb, wait_until):
+        try:
+            if wait_until is not None:
+                while not job.wanted.is_set() and not wait_until():
+                    if job.cancelled.is_set():
+                        raise PrebuildCancelled("キャンセルされました")
+                    self._sleep(0.5)
+                # 待っている間に RAM の状況が変わっているかもしれないので確認し直す
+                if not self._has_room(estimate_gb):
+                    raise PrebuildCancelled("空きRAMが足りません")
+            start_time = time.time()
+            result = build_fn(lambda: self._throttle(job))
+            if job.cancelled.is_set():
+                raise PrebuildCancelled("キャンセルされました")
+            job.result = result
+            print(f"次の transformer 状態辞書を先行構築しました ({time.time() - start_time:.1f}秒)")
+        except PrebuildCancelled as e:
+            job.error = e
+            print(f"transformer の先行構築を中止しました: {e}")
+        except Exception as e:
+            job.error = e
+            print(f"transformer の先行構築に失敗しました: {e}")
+        finally:
+            job.done.set()
+
+    def take(self, key, wait=True, timeout=None):
+        """key の構築結果を取り出す (構築中なら完了を待つ)。別の key・失敗・未構築なら None"""
+        with self._lock:
+            job = self._job
+        if job is None or job.key != key:
+            return None
+        if not job.done.is_set():
+            if not wait:
+                return None
+            print("transformer の先行構築の完了を待っています...")
+            job.wanted.set()
+            if not job.done.wait(timeout):
+                return None
+        with self._lock:
+            if self._job is job:
+                self._job = None
+        result, job.result = job.result, None
+        return result
+
+    def cancel(self):
+        """構築中・構築済みの状態辞書を捨てる (構築スレッドは次の throttle で抜ける)"""
+        with self._lock:
+            job, self._job = self._job, None
+        if job is None:
+            return False
+        job.cancelled.set()
+        job.result = None
+        return True
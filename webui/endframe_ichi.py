@@ -101,6 +101,7 @@ from eichi_utils.notification_utils import play_completion_sound
 # グローバル変数の設定
 vae_cache_enabled = False  # VAEキャッシュのチェックボックス状態を保持
 current_prompt = None      # キューから読み込まれた現在のプロンプト
+job_conditioning_memo = None  # process()のバッチ間で共有する条件付けメモ
 current_seed = None        # キューから読み込まれた現在のシード値
 
 # Generation state flag for resync handling
@@ -121,6 +122,21 @@ from eichi_utils.png_metadata import (
     embed_metadata_to_png, extract_metadata_from_png, extract_metadata_from_numpy_array,
     PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY
 )
+# MP4/PNG/テンソルの書き出しを生成スレッドから切り離す
+from eichi_utils.output_executor import OutputExecutor
+# サンプリング中プレビューの描画をサンプリングスレッドから切り離す
+from eichi_utils.preview_service import PreviewService, make_latent_preview_renderer
+# ピクセル履歴はブレンド窓以外をuint8で保持する
+from eichi_utils.pixel_history import PixelHistory, save_history_as_mp4
+# latent履歴（事前確保バッファ）と長尺動画向けのディスク退避
+from eichi_utils.latent_history import LatentHistory
+from eichi_utils.history_spill import SpillFile, should_spill
+# 同じ画像（リサイズ後）のVAEエンコード結果を再利用する
+from eichi_utils.encode_cache import cached_vae_encode, cached_vae_encode_batch, cached_clip_vision_encode
+# バッチ間で共有するジョブ単位の条件付けメモ
+from eichi_utils.conditioning_memo import ConditioningMemo, image_source_key, memo_key, memoized
+from eichi_utils import telemetry
+from eichi_utils.image_prefetch import ImagePrefetcher
 
 # ログ管理モジュールをインポート
 (
@@ -260,11 +276,13 @@ def _load_diffusers_transformers():
     from diffusers_helper.pipelines.k_diffusion_hunyuan import sample_hunyuan
     from diffusers_helper.memory import (
         cpu, gpu, get_cuda_free_memory_gb,
-        move_model_to_device_with_memory_preservation,
-        offload_model_from_device_for_memory_preservation,
         fake_diffusers_current_device, DynamicSwapInstaller,
         unload_complete_models, load_model_as_complete,
     )
+    from eichi_utils.module_placement import (
+        move_model_to_device_with_memory_preservation,
+        offload_model_from_device_for_memory_preservation,
+    )
     from diffusers_helper.thread_utils import AsyncStream, async_run
     from diffusers_helper.gradio.progress_bar import make_progress_bar_css, make_progress_bar_html
     from transformers import SiglipImageProcessor, SiglipVisionModel
@@ -441,6 +459,7 @@ queue_type = "prompt"  # キューのタイプ（"prompt" または "image"）
 prompt_queue_file_path = None  # プロンプトキューファイルのパス
 vae_cache_enabled = False  # VAEキャッシュの有効/無効フラグ
 image_queue_files = []  # イメージキューのファイルリスト
+image_queue_prefetcher = None  # イメージキューの先読み（process()の実行中のみ）
 input_folder_name_value = "inputs"  # 入力フォルダ名（デフォルト値）
 
 # Resync support - store last progress state
@@ -598,7 +617,7 @@ def set_generation_stopped(stopped=True):
 
 @torch.no_grad()
 @log_and_continue("worker error")
-def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_window_size, steps, cfg, gs, rs, gpu_memory_preservation, use_teacache, mp4_crf=16, all_padding_value=1.0, end_frame=None, end_frame_strength=1.0, frame_size_setting="1秒 (33フレーム)", keep_section_videos=False, lora_files=None, lora_files2=None, lora_files3=None, lora_scales_text="0.8,0.8,0.8", output_dir=None, save_section_frames=False, section_settings=None, use_all_padding=False, use_lora=False, lora_mode=None, lora_dropdown1=None, lora_dropdown2=None, lora_dropdown3=None, save_tensor_data=False, tensor_data_input=None, fp8_optimization=False, resolution=640, batch_index=None, frame_save_mode="保存しない", use_vae_cache=False, use_queue=False, prompt_queue_file=None, alarm_on_completion=False, use_prompt_cache=True):
+def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_window_size, steps, cfg, gs, rs, gpu_memory_preservation, use_teacache, mp4_crf=16, all_padding_value=1.0, end_frame=None, end_frame_strength=1.0, frame_size_setting="1秒 (33フレーム)", keep_section_videos=False, lora_files=None, lora_files2=None, lora_files3=None, lora_scales_text="0.8,0.8,0.8", output_dir=None, save_section_frames=False, section_settings=None, use_all_padding=False, use_lora=False, lora_mode=None, lora_dropdown1=None, lora_dropdown2=None, lora_dropdown3=None, save_tensor_data=False, tensor_data_input=None, fp8_optimization=False, resolution=640, batch_index=None, frame_save_mode="保存しない", use_vae_cache=False, use_queue=False, prompt_queue_file=None, alarm_on_completion=False, use_prompt_cache=True, conditioning_memo=None):
     # グローバル変数を使用
     global vae_cache_enabled, current_prompt, generation_stopped, current_batch_data, transformer_model
     
@@ -915,6 +934,18 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
     push_progress(None, '', 0, '[THEME=yellow]Starting ...')
 
+    # 出力書き出し用エグゼキュータ（セクションNの書き出しとセクションN+1のサンプリングを並行させる）
+    # 'file' イベントは書き出し完了時にエグゼキュータから送られる
+    output_executor = OutputExecutor(publish=stream.output_queue.push)
+    # サンプリング中プレビュー（描画は別スレッド、送信は最新のみを間引いて行う）
+    preview_service = PreviewService(make_latent_preview_renderer(vae_decode_fake), push_progress)
+    # 履歴の退避ファイル（必要な場合のみ作成し、ジョブ終了時に削除する）
+    latent_spill = None
+    pixel_spill = None
+
+    # EICHI_TELEMETRY が有効ならこのジョブのメモリと処理区間を出力フォルダへ記録する
+    telemetry.start_job(job_id, outputs_folder)
+
     try:
         # セクション設定の前処理
         def get_section_settings_map(section_settings):
@@ -1002,9 +1033,10 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
                     try:
                         # プロンプト処理
-                        section_llama_vec, section_clip_l_pooler = encode_prompt_conds(
-                            section_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2
-                        )
+                        with telemetry.span("text encode", section=i_section):
+                            section_llama_vec, section_clip_l_pooler = encode_prompt_conds(
+                                section_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2
+                            )
 
                         # マスクの作成
                         section_llama_vec, section_llama_attention_mask = crop_or_pad_yield_mask(
@@ -1076,9 +1108,17 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
         push_progress(None, '', 0, f'[THEME=cyan]{translate("Text encoding ...")}')
 
-        # プロンプトキャッシュ: ディスクからの読み込みを試行
+        # 同じジョブの前のバッチでエンコード済みならそれを使う
         _prompt_cache_hit = False
-        if use_prompt_cache:
+        _text_memo_key = ("text", current_prompt, n_prompt, cfg == 1)
+        _memo_text = conditioning_memo.get(_text_memo_key) if conditioning_memo is not None else None
+        if _memo_text is not None:
+            llama_vec, llama_vec_n, clip_l_pooler, clip_l_pooler_n, llama_attention_mask, llama_attention_mask_n = _memo_text
+            _prompt_cache_hit = True
+            print(translate("プロンプトのエンコード結果を前のバッチから再利用します"))
+
+        # プロンプトキャッシュ: ディスクからの読み込みを試行
+        if use_prompt_cache and not _prompt_cache_hit:
             try:
                 from eichi_utils import prompt_cache
                 disk_cache = prompt_cache.load_from_cache(current_prompt, n_prompt)
@@ -1101,12 +1141,13 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 fake_diffusers_current_device(text_encoder, gpu)
                 load_model_as_complete(text_encoder_2, target_device=gpu)
 
-            llama_vec, clip_l_pooler = encode_prompt_conds(current_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
+            with telemetry.span("text encode"):
+                llama_vec, clip_l_pooler = encode_prompt_conds(current_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
 
-            if cfg == 1:
-                llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
-            else:
-                llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
+                if cfg == 1:
+                    llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
+                else:
+                    llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
 
             llama_vec, llama_attention_mask = crop_or_pad_yield_mask(llama_vec, length=512)
             llama_vec_n, llama_attention_mask_n = crop_or_pad_yield_mask(llama_vec_n, length=512)
@@ -1126,12 +1167,25 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 except Exception as e:
                     print(translate("プロンプトキャッシュ保存失敗: {0}").format(e))
 
+        if conditioning_memo is not None:
+            conditioning_memo.put(_text_memo_key, (
+                llama_vec, llama_vec_n, clip_l_pooler, clip_l_pooler_n, llama_attention_mask, llama_attention_mask_n,
+            ))
+
         # セクションプロンプトを事前にエンコードしておく
         # (セクション別プロンプトはtext_encoderが必要。キャッシュヒット時でもsection_mapがあれば
         #  text_encoderを使う必要がある)
         section_prompt_embeddings = {}
+        if section_map and conditioning_memo is not None:
+            # 前のバッチでエンコード済みのセクションプロンプトは再利用する
+            for sec_num, (_, sec_prompt) in section_map.items():
+                if sec_prompt and sec_prompt.strip():
+                    memo_embeddings = conditioning_memo.get(("section_text", sec_prompt))
+                    if memo_embeddings is not None:
+                        section_prompt_embeddings[sec_num] = memo_embeddings
         _need_section_encoding = section_map and any(
-            sp and sp.strip() for _, (_, sp) in section_map.items()
+            sp and sp.strip() and sec_num not in section_prompt_embeddings
+            for sec_num, (_, sp) in section_map.items()
         )
         if _need_section_encoding:
             # キャッシュヒット時でもtext_encoderが必要
@@ -1144,10 +1198,11 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
             print(translate("セクションプロンプトを事前にエンコードしています..."))
             for sec_num, (_, sec_prompt) in section_map.items():
-                if sec_prompt and sec_prompt.strip():
+                if sec_prompt and sec_prompt.strip() and sec_num not in section_prompt_embeddings:
                     try:
                         print(translate("セクション{0}の専用プロンプトを事前エンコード: {1}...").format(sec_num, sec_prompt[:30]))
-                        sec_llama_vec, sec_clip_l_pooler = encode_prompt_conds(sec_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
+                        with telemetry.span("text encode", section=sec_num):
+                            sec_llama_vec, sec_clip_l_pooler = encode_prompt_conds(sec_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
                         sec_llama_vec, sec_llama_attention_mask = crop_or_pad_yield_mask(sec_llama_vec, length=512)
 
                         sec_llama_vec = sec_llama_vec.to(dtype=llama_vec.dtype, device=llama_vec.device)
@@ -1155,6 +1210,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                         sec_llama_attention_mask = sec_llama_attention_mask.to(dtype=llama_attention_mask.dtype, device=llama_attention_mask.device)
 
                         section_prompt_embeddings[sec_num] = (sec_llama_vec, sec_clip_l_pooler, sec_llama_attention_mask)
+                        if conditioning_memo is not None:
+                            conditioning_memo.put(("section_text", sec_prompt), section_prompt_embeddings[sec_num])
                         print(translate("セクション{0}のプロンプトエンコード完了").format(sec_num))
                     except Exception as e:
                         print(translate("セクション{0}のプロンプトエンコードに失敗: {1}").format(sec_num, e))
@@ -1221,6 +1278,14 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             if isinstance(img_path_or_array, torch.Tensor):
                 img_path_or_array = img_path_or_array.cpu().numpy()
 
+            # イメージキューの画像は先読み済みのもの（デコード・リサイズ済み）を使う
+            prefetcher = image_queue_prefetcher
+            prefetched = prefetcher.get(img_path_or_array, resolution) if prefetcher is not None and isinstance(img_path_or_array, str) else None
+            if prefetched is not None:
+                img_pt = torch.from_numpy(prefetched.image).float() / 127.5 - 1
+                img_pt = img_pt.permute(2, 0, 1)[None, :, None]
+                return prefetched.image, img_pt, prefetched.height, prefetched.width
+
             # Pathの場合はPILで画像を開く
             if isinstance(img_path_or_array, str) and os.path.exists(img_path_or_array):
                 img = np.array(Image.open(img_path_or_array).convert('RGB'))
@@ -1236,7 +1301,12 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             img_pt = img_pt.permute(2, 0, 1)[None, :, None]
             return img_np, img_pt, height, width
 
-        input_image_np, input_image_pt, height, width = preprocess_image(current_image, resolution=resolution)
+        # 同じジョブの2回目以降のバッチでは、前処理・エンコード結果をconditioning_memoから再利用する
+        input_image_key = image_source_key(current_image, resolution)
+        input_image_np, input_image_pt, height, width = memoized(
+            conditioning_memo, memo_key("pixels", input_image_key),
+            lambda: preprocess_image(current_image, resolution=resolution),
+        )
         Image.fromarray(input_image_np).save(os.path.join(outputs_folder, f'{job_id}.png'))
         # 入力画像にメタデータを埋め込んで保存
         initial_image_path = os.path.join(outputs_folder, f'{job_id}.png')
@@ -1293,33 +1363,62 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             push_progress(None, tensor_info, 10, f'[THEME=orange]{translate("テンソルデータを後方に結合")}')
 
         # 常に入力画像から通常のエンコーディングを行う
-        start_latent = vae_encode(input_image_pt, vae)
+        # （バッチ・キューで同じ画像が続く場合はキャッシュ済みのlatentを使う）
+        telemetry_encode = telemetry.begin("VAE encode")
+        start_latent = memoized(
+            conditioning_memo, memo_key("start_latent", input_image_key),
+            lambda: cached_vae_encode(input_image_np, input_image_pt, vae, vae_encode),
+        )
         # end_frameも同じタイミングでencode
         if end_frame is not None:
-            end_frame_np, end_frame_pt, _, _ = preprocess_image(end_frame, resolution=resolution)
-            end_frame_latent = vae_encode(end_frame_pt, vae)
+            end_frame_key = image_source_key(end_frame, resolution)
+            end_frame_np, end_frame_pt, _, _ = memoized(
+                conditioning_memo, memo_key("pixels", end_frame_key),
+                lambda: preprocess_image(end_frame, resolution=resolution),
+            )
+            end_frame_latent = memoized(
+                conditioning_memo, memo_key("end_frame_latent", end_frame_key),
+                lambda: cached_vae_encode(end_frame_np, end_frame_pt, vae, vae_encode),
+            )
         else:
             end_frame_latent = None
+        telemetry.end(telemetry_encode)
 
         # create section_latents here
         section_latents = None
         if section_map:
-            section_latents = {}
-            for sec_num, (img, prm) in section_map.items():
-                if img is not None:
-                    # 画像をVAE encode
-                    img_np, img_pt, _, _ = preprocess_image(img, resolution=resolution)
-                    section_latents[sec_num] = vae_encode(img_pt, vae)
+            section_image_keys = tuple(
+                (sec_num, image_source_key(img, resolution))
+                for sec_num, (img, prm) in section_map.items() if img is not None
+            )
+
+            def encode_section_latents():
+                section_items = []
+                for sec_num, (img, prm) in section_map.items():
+                    if img is not None:
+                        img_np, img_pt, _, _ = preprocess_image(img, resolution=resolution)
+                        section_items.append((sec_num, img_np, img_pt))
+                # 同じバケットの画像は空きVRAMに収まる枚数ずつまとめてVAE encode
+                free_vram_bytes = get_cuda_free_memory_gb(gpu) * (1024 ** 3) if torch.cuda.is_available() else None
+                return cached_vae_encode_batch(section_items, vae, vae_encode, free_bytes=free_vram_bytes)
+
+            section_latents_key = memo_key("section_latents", section_image_keys) if all(k is not None for _, k in section_image_keys) else None
+            with telemetry.span("VAE encode", sections=len(section_image_keys)):
+                section_latents = dict(memoized(conditioning_memo, section_latents_key, encode_section_latents))
 
         # CLIP Vision
 
         push_progress(None, '', 0, f'[THEME=cyan]{translate("CLIP Vision encoding ...")}')
 
-        if not high_vram:
-            load_model_as_complete(image_encoder, target_device=gpu)
-
-        image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
-        image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
+        # キャッシュヒット時は画像エンコーダをGPUへロードしない
+        with telemetry.span("CLIP Vision encode"):
+            image_encoder_last_hidden_state = memoized(
+                conditioning_memo, memo_key("clip_vision", input_image_key),
+                lambda: cached_clip_vision_encode(
+                    input_image_np, feature_extractor, image_encoder, hf_clip_vision_encode, device=gpu,
+                    load_fn=None if high_vram else (lambda: load_model_as_complete(image_encoder, target_device=gpu)),
+                ),
+            )
 
         # Dtype
 
@@ -1340,8 +1439,26 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
         else:
             num_frames = int(latent_window_size * 4 - 3)
 
-        history_latents = torch.zeros(size=(1, 16, 1 + 2 + 16, height // 8, width // 8), dtype=torch.float32).cpu()
+        # 長尺・高解像度で履歴がRAMに収まらない見込みなら、確定済みの履歴を出力フォルダへ退避する
+        estimated_pixel_frames = int(total_latent_sections * num_frames) + 1
+        estimated_history_bytes = (
+            estimated_pixel_frames * 3 * height * width  # uint8 ピクセル
+            + (estimated_pixel_frames // 4 + 1 + 2 + 16) * 16 * (height // 8) * (width // 8) * 4  # float32 latent
+        )
+        if should_spill(estimated_history_bytes):
+            latent_spill = SpillFile(os.path.join(outputs_folder, f'{job_id}_latents.spill'))
+            pixel_spill = SpillFile(os.path.join(outputs_folder, f'{job_id}_pixels.spill'))
+            print(translate("履歴バッファをディスクへ退避します（推定 {0:.1f} GB）: {1}").format(estimated_history_bytes / 1024 ** 3, outputs_folder))
+
+        # 生成予定のlatentフレーム数ぶんを事前確保し、各セクションはスライス書き込みで先頭に追加する
+        planned_latent_frames = total_latent_sections * (5 if latent_window_size == 4.5 else int(latent_window_size)) + 1
+        history_latents = LatentHistory(
+            torch.zeros(size=(1, 16, 1 + 2 + 16, height // 8, width // 8), dtype=torch.float32).cpu(),
+            direction="prepend", capacity=planned_latent_frames, spill=latent_spill,
+        )
         history_pixels = None
+        # soft_append_bcthwのブレンドに使う先頭フレーム数（この範囲だけfloatで保持する）
+        pixel_blend_frames = 17 if latent_window_size == 4.5 else int(latent_window_size * 4 - 3)
         total_generated_latent_frames = 0
 
         # ここでlatent_paddingsを再定義していたのが原因だったため、再定義を削除します
@@ -1680,7 +1797,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     modified_end_frame_latent = end_frame_latent * end_frame_strength
                     print(translate("EndFrame影響度を{0}に設定（最終フレームの影響が{1}倍）").format(f"{end_frame_strength:.2f}", f"{end_frame_strength:.2f}"))
                     try:
-                        history_latents[:, :, 0:1, :, :] = modified_end_frame_latent
+                        history_latents.write_context(0, modified_end_frame_latent)
                     except RuntimeError as e:
                         # テンソルサイズの不一致エラーを検出して、わかりやすいエラーメッセージを表示
                         error_msg = str(e)
@@ -1704,7 +1821,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 else:
                     # 通常の処理（通常の影響）
                     try:
-                        history_latents[:, :, 0:1, :, :] = end_frame_latent
+                        history_latents.write_context(0, end_frame_latent)
                     except RuntimeError as e:
                         # テンソルサイズの不一致エラーを検出して、わかりやすいエラーメッセージを表示
                         error_msg = str(e)
@@ -1744,8 +1861,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             clean_latent_indices_pre, blank_indices, latent_indices, clean_latent_indices_post, clean_latent_2x_indices, clean_latent_4x_indices = indices.split([1, latent_padding_size, effective_window_size, 1, 2, 16], dim=1)
             clean_latent_indices = torch.cat([clean_latent_indices_pre, clean_latent_indices_post], dim=1)
 
-            clean_latents_pre = current_latent.to(history_latents)
-            clean_latents_post, clean_latents_2x, clean_latents_4x = history_latents[:, :, :1 + 2 + 16, :, :].split([1, 2, 16], dim=2)
+            clean_latents_pre = current_latent.to(device=history_latents.device, dtype=history_latents.dtype)
+            clean_latents_post, clean_latents_2x, clean_latents_4x = history_latents.context(1 + 2 + 16).split([1, 2, 16], dim=2)
             clean_latents = torch.cat([clean_latents_pre, clean_latents_post], dim=2)
 
             if not high_vram:
@@ -1761,12 +1878,6 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 transformer.initialize_teacache(enable_teacache=False)
 
             def callback(d):
-                preview = d['denoised']
-                preview = vae_decode_fake(preview)
-
-                preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
-                preview = einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
-
                 # 中断要求の安全な処理
                 if stream.input_queue.top() == 'end':
                     global batch_stopped
@@ -1778,14 +1889,22 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     stream.input_queue.push('end')
 
                 current_step = d['i'] + 1
+                # ステップの区間を次のステップへ切り替える
+                if current_step < steps:
+                    telemetry.lap("sampling step", section=i_section, step=current_step + 1)
+                else:
+                    telemetry.end_lap("sampling step")
                 percentage = int(100.0 * current_step / steps)
                 hint = translate('Sampling {0}/{1}').format(current_step, steps)
                 # セクション情報を追加（現在のセクション/全セクション）
                 section_info = translate('セクション: {0}/{1}').format(i_section+1, total_sections)
                 desc = f"{section_info} " + translate('生成フレーム数: {total_generated_latent_frames}, 動画長: {video_length:.2f} 秒 (FPS-30). 動画が生成中です ...').format(section_info=section_info, total_generated_latent_frames=int(max(0, total_generated_latent_frames * 4 - 3)), video_length=max(0, (total_generated_latent_frames * 4 - 3) / 30))
-                push_progress(preview, desc, percentage, f'[THEME=blue]{hint}')
+                # プレビューの描画・送信は待たない
+                preview_service.submit(d['denoised'], desc, percentage, f'[THEME=blue]{hint}')
                 return
 
+            telemetry_sampling = telemetry.begin("sampling", section=i_section, steps=steps)
+            telemetry.lap("sampling step", section=i_section, step=1)
             try:
                 generated_latents = sample_hunyuan(
                     transformer=transformer,
@@ -1817,6 +1936,10 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     clean_latent_4x_indices=clean_latent_4x_indices,
                     callback=callback,
                 )
+                telemetry.end_lap("sampling step")
+                telemetry.end(telemetry_sampling)
+                # 後続の進捗表示より古いプレビューが届かないよう送り切る
+                preview_service.flush()
                 # ユーザー中断検出時のメッセージ表示
                 if isinstance(generated_latents, dict) and generated_latents.get('user_interrupt'):
                     print(translate("バッチ内処理を完了します"))
@@ -1829,6 +1952,9 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     torch.cuda.empty_cache()
                     torch.cuda.synchronize()
                 print(translate("生成処理を正常に中断しました"))
+                # 保留中のプレビューは捨て、書き出し中のセクション動画を完了させてから終了通知を送信
+                preview_service.close(flush=False)
+                output_executor.shutdown()
                 # streamに終了通知を送信
                 stream.output_queue.push(('end', None))
                 return None
@@ -1855,9 +1981,9 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 generated_latents = torch.cat([start_latent.to(generated_latents), generated_latents], dim=2)
 
             total_generated_latent_frames += int(generated_latents.shape[2])
-            # Risk-3軽減: generated_latentsをCPUに移動してからcat、直後に参照を切る
-            _gen_cpu = generated_latents.to(history_latents)
-            history_latents = torch.cat([_gen_cpu, history_latents], dim=2)
+            # Risk-3軽減: generated_latentsをCPUに移動してから結合、直後に参照を切る
+            _gen_cpu = generated_latents.to(device=history_latents.device, dtype=history_latents.dtype)
+            history_latents.add(_gen_cpu)
             del _gen_cpu, generated_latents  # 旧テンソルの即時解放を促進
 
             if not high_vram:
@@ -1868,18 +1994,24 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 offload_model_from_device_for_memory_preservation(transformer, target_device=gpu, preserved_memory_gb=preserved_memory_offload)
                 load_model_as_complete(vae, target_device=gpu)
 
-            real_history_latents = history_latents[:, :, :total_generated_latent_frames, :, :]
+            # 事前確保バッファのビュー（コピーなし）
+            real_history_latents = history_latents.real()
 
             # COMMENTED OUT: VAEデコード前のメモリクリア（処理速度向上のため）
 
             if history_pixels is None:
                 # VAEキャッシュ設定に応じてデコード関数を切り替え
+                telemetry_decode = telemetry.begin("VAE decode", section=i_section)
                 if use_vae_cache:
                     print(translate("VAEキャッシュを使用: 履歴フレーム"))
-                    history_pixels = vae_decode_cache(real_history_latents, vae).cpu()
+                    decoded_pixels = vae_decode_cache(real_history_latents, vae).cpu()
                 else:
                     print(translate("Using normal decode: history frame."))
-                    history_pixels = vae_decode(real_history_latents, vae).cpu()
+                    decoded_pixels = vae_decode(real_history_latents, vae).cpu()
+                telemetry.end(telemetry_decode)
+                history_pixels = PixelHistory(direction="prepend", blend_frames=pixel_blend_frames, spill=pixel_spill)
+                history_pixels.add_section(decoded_pixels)
+                del decoded_pixels
                 
                 # 最初のセクションで全フレーム画像を保存
                 # 「全フレーム画像保存」または「最終セクションのみ全フレーム画像保存かつ最終セクション」が有効な場合
@@ -1939,10 +2071,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                         # 各フレームの保存
                         for frame_idx in range(latent_frame_count):
                             # フレームを取得
-                            frame = history_pixels[0, :, frame_idx, :, :]
-                            frame = einops.rearrange(frame, 'c h w -> h w c')
-                            frame = frame.cpu().numpy()
-                            frame = np.clip((frame * 127.5 + 127.5), 0, 255).astype(np.uint8)
+                            frame = history_pixels.frame_hwc_uint8(frame_idx)
                             frame = resize_and_center_crop(frame, target_width=width, target_height=height)
                             
                             # メタデータの準備
@@ -1961,8 +2090,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                             
                             # 画像の保存とメタデータの埋め込み
                             frame_path = os.path.join(frames_folder, f'frame_{frame_idx:03d}.png')
-                            Image.fromarray(frame).save(frame_path)
-                            embed_metadata_to_png(frame_path, frame_metadata)
+                            output_executor.submit_png(frame, frame_path, frame_metadata)
                         
                         # 保存モードに応じたメッセージを表示
                         # グローバル変数ではなく、ローカルのcopyを使用
@@ -1985,15 +2113,17 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     overlapped_frames = int(latent_window_size * 4 - 3)
 
                 # VAEキャッシュ設定に応じてデコード関数を切り替え
+                telemetry_decode = telemetry.begin("VAE decode", section=i_section)
                 if use_vae_cache:
                     print(translate("VAEキャッシュを使用: 現在のセクション"))
                     current_pixels = vae_decode_cache(real_history_latents[:, :, :section_latent_frames], vae).cpu()
                 else:
                     current_pixels = vae_decode(real_history_latents[:, :, :section_latent_frames], vae).cpu()
+                telemetry.end(telemetry_decode)
 
                 if overlapped_frames > history_pixels.shape[2]:
                     overlapped_frames = history_pixels.shape[2]
-                history_pixels = soft_append_bcthw(current_pixels, history_pixels, overlapped_frames)
+                history_pixels.add_section(current_pixels, overlapped_frames)
 
                 # 各セクションで生成された個々のフレームを静止画として保存
                 # 「全フレーム画像保存」または「最終セクションのみ全フレーム画像保存かつ最終セクション」が有効な場合
@@ -2047,9 +2177,6 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                         if history_pixels is not None:
                             source_pixels = history_pixels
                             print(translate("全フレーム画像保存: history_pixelsを使用します"))
-                        elif 'current_pixels' in locals() and current_pixels is not None:
-                            source_pixels = current_pixels
-                            print(translate("全フレーム画像保存: current_pixelsを使用します"))
                         else:
                             print(translate("全フレーム画像保存: 有効なピクセルデータがありません"))
                             return
@@ -2073,10 +2200,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                         # 各フレームの保存
                         for frame_idx in range(latent_frame_count):
                             # フレームを取得
-                            frame = source_pixels[0, :, frame_idx, :, :]
-                            frame = einops.rearrange(frame, 'c h w -> h w c')
-                            frame = frame.cpu().numpy()
-                            frame = np.clip((frame * 127.5 + 127.5), 0, 255).astype(np.uint8)
+                            frame = source_pixels.frame_hwc_uint8(frame_idx)
                             frame = resize_and_center_crop(frame, target_width=width, target_height=height)
                             
                             # メタデータの準備
@@ -2095,8 +2219,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                             
                             # 画像の保存とメタデータの埋め込み
                             frame_path = os.path.join(frames_folder, f'frame_{frame_idx:03d}.png')
-                            Image.fromarray(frame).save(frame_path)
-                            embed_metadata_to_png(frame_path, frame_metadata)
+                            output_executor.submit_png(frame, frame_path, frame_metadata)
                         
                         # 保存モードに応じたメッセージを表示
                         # グローバル変数ではなく、ローカルのcopyを使用
@@ -2117,13 +2240,13 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 try:
                     if i_section == 0 or current_pixels is None:
                         # 最初のセクションは history_pixels の最後
-                        last_frame = history_pixels[0, :, -1, :, :]
+                        last_frame = history_pixels.frame_hwc_uint8(-1)
                     else:
                         # 2セクション目以降は current_pixels の最後
                         last_frame = current_pixels[0, :, -1, :, :]
-                    last_frame = einops.rearrange(last_frame, 'c h w -> h w c')
-                    last_frame = last_frame.cpu().numpy()
-                    last_frame = np.clip((last_frame * 127.5 + 127.5), 0, 255).astype(np.uint8)
+                        last_frame = einops.rearrange(last_frame, 'c h w -> h w c')
+                        last_frame = last_frame.cpu().numpy()
+                        last_frame = np.clip((last_frame * 127.5 + 127.5), 0, 255).astype(np.uint8)
                     last_frame = resize_and_center_crop(last_frame, target_width=width, target_height=height)
 
                     # メタデータを埋め込むための情報を収集
@@ -2142,12 +2265,9 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     # 画像の保存とメタデータの埋め込み
                     if is_first_section and end_frame is None:
                         frame_path = os.path.join(outputs_folder, f'{job_id}_{i_section}_end.png')
-                        Image.fromarray(last_frame).save(frame_path)
-                        embed_metadata_to_png(frame_path, section_metadata)
                     else:
                         frame_path = os.path.join(outputs_folder, f'{job_id}_{i_section}.png')
-                        Image.fromarray(last_frame).save(frame_path)
-                        embed_metadata_to_png(frame_path, section_metadata)
+                    output_executor.submit_png(last_frame, frame_path, section_metadata)
 
                     print(translate("セクション{0}のフレーム画像をメタデータ付きで保存しました").format(i_section))
                 except Exception as e:
@@ -2155,9 +2275,17 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
             output_filename = os.path.join(outputs_folder, f'{job_id}_{total_generated_latent_frames}.mp4')
 
-            save_bcthw_as_mp4(history_pixels, output_filename, fps=30, crf=mp4_crf)
+            # スナップショットは後続セクションの結合の影響を受けないため、そのままバックグラウンドで書き出せる
+            output_executor.submit(
+                telemetry.traced("encode MP4", save_history_as_mp4, section=i_section),
+                history_pixels.snapshot(), output_filename, fps=30, crf=mp4_crf,
+                file_event=output_filename, label=os.path.basename(output_filename),
+            )
+            if is_last_section:
+                # 最終セクションは以降の結合処理がMP4を参照するため書き出し完了を待つ
+                output_executor.drain()
 
-            print(translate('Decoded. Current latent shape {0}; pixel shape {1}').format(real_history_latents.shape, history_pixels.shape))
+            print(translate('Decoded. Current latent shape {0}; pixel shape {1}').format(history_latents.shape, history_pixels.shape))
 
 
             print(translate("■ セクション{0}の処理完了").format(i_section))
@@ -2165,8 +2293,6 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             print(translate("  - レンダリング時間: {0}秒").format(f"{max(0, (total_generated_latent_frames * 4 - 3) / 30):.2f}"))
             print(translate("  - 出力ファイル: {0}").format(output_filename))
 
-            stream.output_queue.push(('file', output_filename))
-
             if is_last_section:
                 combined_output_filename = None
                 # 全セクション処理完了後、テンソルデータを後方に結合
@@ -2185,6 +2311,10 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                             print(translate("テンソルサイズの不一致のため、前方結合をスキップします"))
                             push_progress(None, translate("テンソルサイズの不一致のため、前方結合をスキップしました"), 85, f'[THEME=red]{translate("互換性エラー")}')
                         else:
+                            # テンソル結合はfloatの履歴を前提とするため、ここで全フレームを展開する
+                            if isinstance(history_pixels, PixelHistory):
+                                history_pixels = history_pixels.materialize()
+
                             # 生成データの末尾のフレームとテンソルデータの先頭のフレームを補間するフレームを追加する
                             if use_interpolation_section:
                                 interpolation_latent_size = interpolation_latents.value
@@ -2215,12 +2345,6 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                     Image.fromarray(first_image).save(os.path.join(outputs_folder, f'{job_id}_interpolation_end.png'))
 
                                     def callback_interpolation(d):
-                                        preview = d['denoised']
-                                        preview = vae_decode_fake(preview)
-
-                                        preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
-                                        preview = einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
-
                                         if stream.input_queue.top() == 'end':
                                             global batch_stopped
                                             batch_stopped = True
@@ -2230,7 +2354,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                         percentage = int(100.0 * current_step / steps)
                                         hint = translate('Sampling {0}/{1}').format(current_step, steps)
                                         desc = "補間データを生成中です ..."
-                                        push_progress(preview, desc, percentage, f'[THEME=blue]{hint}')
+                                        preview_service.submit(d['denoised'], desc, percentage, f'[THEME=blue]{hint}')
                                         return
 
                                     uploaded_tensor_size = 1 + 2 + 16
@@ -2253,6 +2377,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                     clean_latents_2 = torch.cat([real_history_last_latent.unsqueeze(2), clean_latents_post_2[:, :, :1, :, :]], dim=2)
 
                                     # 補間フレームを生成
+                                    telemetry_sampling = telemetry.begin("sampling", interpolation=True, steps=steps)
                                     generated_interpolation_latents = sample_hunyuan(
                                         transformer=transformer,
                                         sampler='unipc',
@@ -2283,6 +2408,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                         clean_latent_4x_indices=clean_latent_4x_indices_2,
                                         callback=callback_interpolation,
                                     )
+                                    telemetry.end(telemetry_sampling)
+                                    preview_service.flush()
                                     if isinstance(generated_interpolation_latents, dict) and generated_interpolation_latents.get('user_interrupt'):
                                         print(translate("バッチ内処理を完了します"))
                                     else:
@@ -2297,10 +2424,11 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                     # VAEキャッシュ設定に応じてデコード関数を切り替え
                                     if not high_vram:
                                         load_model_as_complete(vae, target_device=gpu)
-                                    if use_vae_cache:
-                                        interpolation_pixels = vae_decode_cache(generated_interpolation_latents[:, :, :], vae).cpu()
-                                    else:
-                                        interpolation_pixels = vae_decode(generated_interpolation_latents[:, :, :], vae).cpu()
+                                    with telemetry.span("VAE decode", interpolation=True):
+                                        if use_vae_cache:
+                                            interpolation_pixels = vae_decode_cache(generated_interpolation_latents[:, :, :], vae).cpu()
+                                        else:
+                                            interpolation_pixels = vae_decode(generated_interpolation_latents[:, :, :], vae).cpu()
 
                                     # overlapは小さめに固定
                                     interpolation_overlapped_frames = 2
@@ -2312,7 +2440,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
                                     # 補間データをmp4にして出力
                                     interpolation_output_filename = os.path.join(outputs_folder, f'{job_id}_interpolation.mp4')
-                                    save_bcthw_as_mp4(interpolation_pixels, interpolation_output_filename, fps=30, crf=mp4_crf)
+                                    with telemetry.span("encode MP4", output="interpolation"):
+                                        save_bcthw_as_mp4(interpolation_pixels, interpolation_output_filename, fps=30, crf=mp4_crf)
 
                             # デバイスとデータ型を合わせる
                             processed_tensor = uploaded_tensor.clone()
@@ -2323,7 +2452,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
                             # 元の動画を品質を保ちつつ保存
                             original_output_filename = os.path.join(outputs_folder, f'{job_id}_original.mp4')
-                            save_bcthw_as_mp4(history_pixels, original_output_filename, fps=30, crf=mp4_crf)
+                            with telemetry.span("encode MP4", output="original"):
+                                save_bcthw_as_mp4(history_pixels, original_output_filename, fps=30, crf=mp4_crf)
                             print(translate("元の動画を保存しました: {original_output_filename}").format(original_output_filename=original_output_filename))
 
                             # Risk-6修正: cloneせず参照で開始。catで新テンソルが作られるため元は変更されない。
@@ -2366,10 +2496,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                 current_chunk = processed_tensor[:, :, chunk_start:chunk_end, :, :]
                                 print(translate("チャンク{0}/{1}処理中: フレーム {2}-{3}/{4}").format(chunk_idx+1, num_chunks, chunk_start+1, chunk_end, uploaded_frames))
 
-                                # メモリ状態を出力
+                                # メモリキャッシュをクリア（メモリの推移はテレメトリのサンプルで確認する）
                                 if torch.cuda.is_available():
-                                    print(translate("チャンク{0}処理前のGPUメモリ: {1:.2f}GB/{2:.2f}GB").format(chunk_idx+1, torch.cuda.memory_allocated()/1024**3, torch.cuda.get_device_properties(0).total_memory/1024**3))
-                                    # メモリキャッシュをクリア
                                     torch.cuda.empty_cache()
 
                                 try:
@@ -2395,18 +2523,15 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                         current_chunk = current_chunk.to(dtype=torch.float16)
 
                                     # VAEデコード処理 - VAEキャッシュ設定に応じて関数を切り替え
-                                    if use_vae_cache:
-                                        print(translate("VAEキャッシュを使用: チャンク{0}").format(chunk_idx+1))
-                                        chunk_pixels = vae_decode_cache(current_chunk, vae).cpu()
-                                    else:
-                                        print(translate("通常デコード使用: チャンク{0}").format(chunk_idx+1))
-                                        chunk_pixels = vae_decode(current_chunk, vae).cpu()
+                                    with telemetry.span("VAE decode", chunk=chunk_idx + 1):
+                                        if use_vae_cache:
+                                            print(translate("VAEキャッシュを使用: チャンク{0}").format(chunk_idx+1))
+                                            chunk_pixels = vae_decode_cache(current_chunk, vae).cpu()
+                                        else:
+                                            print(translate("通常デコード使用: チャンク{0}").format(chunk_idx+1))
+                                            chunk_pixels = vae_decode(current_chunk, vae).cpu()
                                     print(translate("チャンク{0}のVAEデコード完了 (フレーム数: {1})").format(chunk_idx+1, chunk_frames))
 
-                                    # メモリ使用量を出力
-                                    if torch.cuda.is_available():
-                                        print(translate("チャンク{0}デコード後のGPUメモリ: {1:.2f}GB").format(chunk_idx+1, torch.cuda.memory_allocated()/1024**3))
-
                                     # 結合する
                                     if combined_history_pixels is None:
                                         # 初回のチャンクの場合はそのまま設定
@@ -2438,7 +2563,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                         push_progress(None, translate("中間結果のMP4変換中... (チャンク{0}/{1})").format(chunk_idx+1, num_chunks), int(85 + chunk_progress * 0.1), f'[THEME=green]{translate("MP4保存中")}')
 
                                         # MP4として保存
-                                        save_bcthw_as_mp4(combined_history_pixels, interim_output_filename, fps=30, crf=mp4_crf)
+                                        with telemetry.span("encode MP4", output="combined interim", chunk=chunk_idx + 1):
+                                            save_bcthw_as_mp4(combined_history_pixels, interim_output_filename, fps=30, crf=mp4_crf)
                                         print(translate("中間結果を保存しました: {0}").format(interim_output_filename))
 
                                         # 結合した動画をUIに反映するため、出力フラグを立てる
@@ -2480,7 +2606,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                 combined_output_filename = os.path.join(outputs_folder, f'{job_id}_combined.mp4')
 
                                 # MP4として保存
-                                save_bcthw_as_mp4(combined_history_pixels, combined_output_filename, fps=30, crf=mp4_crf)
+                                with telemetry.span("encode MP4", output="combined"):
+                                    save_bcthw_as_mp4(combined_history_pixels, combined_output_filename, fps=30, crf=mp4_crf)
                                 print(translate("最終結果を保存しました: {0}").format(combined_output_filename))
                                 print(translate("結合動画の保存場所: {0}").format(os.path.abspath(combined_output_filename)))
 
@@ -2581,31 +2708,44 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
                         # 保存するデータを準備
                         print(translate("=== テンソルデータ保存処理開始 ==="))
-                        print(translate("保存対象フレーム数: {frames}").format(frames=real_history_latents.shape[2]))
-
-                        # サイズ制限を完全に撤廃し、全フレームを保存
-                        tensor_to_save = real_history_latents.clone().cpu()
+                        if uploaded_tensor is None:
+                            # 生成履歴のみの場合は、latent履歴のバッファ（退避ファイルを含む）からコピーせずに直接書き出す
+                            tensor_to_save = None
+                            tensor_shape = history_latents.shape
+                            tensor_element_size = real_history_latents.element_size()
+                        else:
+                            # サイズ制限を完全に撤廃し、全フレームを保存
+                            tensor_to_save = real_history_latents.clone().cpu()
+                            tensor_shape = tensor_to_save.shape
+                            tensor_element_size = tensor_to_save.element_size()
+                        tensor_frames = tensor_shape[2]
+                        print(translate("保存対象フレーム数: {frames}").format(frames=tensor_frames))
 
                         # テンソルデータの保存サイズの概算
-                        tensor_size_mb = (tensor_to_save.element_size() * tensor_to_save.nelement()) / (1024 * 1024)
+                        tensor_size_mb = (tensor_element_size * math.prod(tensor_shape)) / (1024 * 1024)
 
-                        print(translate("テンソルデータを保存中... shape: {shape}, フレーム数: {frames}, サイズ: {size:.2f} MB").format(shape=tensor_to_save.shape, frames=tensor_to_save.shape[2], size=tensor_size_mb))
-                        push_progress(None, translate('テンソルデータを保存中... ({frames}フレーム)').format(frames=tensor_to_save.shape[2]), 95, f'[THEME=green]{translate("テンソルデータの保存")}')
+                        print(translate("テンソルデータを保存中... shape: {shape}, フレーム数: {frames}, サイズ: {size:.2f} MB").format(shape=tensor_shape, frames=tensor_frames, size=tensor_size_mb))
+                        push_progress(None, translate('テンソルデータを保存中... ({frames}フレーム)').format(frames=tensor_frames), 95, f'[THEME=green]{translate("テンソルデータの保存")}')
 
                         # メタデータの準備（フレーム数も含める）
-                        metadata = torch.tensor([height, width, tensor_to_save.shape[2]], dtype=torch.int32)
+                        metadata = torch.tensor([height, width, tensor_frames], dtype=torch.int32)
 
-                        # safetensors形式で保存
-                        tensor_dict = {
-                            "history_latents": tensor_to_save,
-                            "metadata": metadata
-                        }
-                        sf.save_file(tensor_dict, tensor_file_path)
+                        # 書き出しはバックグラウンドで行い、その間に結合テンソルの準備を進める
+                        def _on_tensor_saved(_result, tensor_file_path=tensor_file_path, frames=tensor_frames, tensor_size_mb=tensor_size_mb):
+                            print(translate("テンソルデータを保存しました: {path}").format(path=tensor_file_path))
+                            print(translate("保存済みテンソルデータ情報: {frames}フレーム, {size:.2f} MB").format(frames=frames, size=tensor_size_mb))
+                            print(translate("=== テンソルデータ保存処理完了 ==="))
+                            push_progress(None, translate("テンソルデータが保存されました: {path} ({frames}フレーム, {size:.2f} MB)").format(path=os.path.basename(tensor_file_path), frames=frames, size=tensor_size_mb), 100, f'[THEME=green]{translate("処理完了")}')
 
-                        print(translate("テンソルデータを保存しました: {path}").format(path=tensor_file_path))
-                        print(translate("保存済みテンソルデータ情報: {frames}フレーム, {size:.2f} MB").format(frames=tensor_to_save.shape[2], size=tensor_size_mb))
-                        print(translate("=== テンソルデータ保存処理完了 ==="))
-                        push_progress(None, translate("テンソルデータが保存されました: {path} ({frames}フレーム, {size:.2f} MB)").format(path=os.path.basename(tensor_file_path), frames=tensor_to_save.shape[2], size=tensor_size_mb), 100, f'[THEME=green]{translate("処理完了")}')
+                        if tensor_to_save is None:
+                            output_executor.submit(history_latents.save_safetensors, tensor_file_path, {"metadata": metadata}, on_done=_on_tensor_saved, label=os.path.basename(tensor_file_path))
+                        else:
+                            # safetensors形式で保存
+                            tensor_dict = {
+                                "history_latents": tensor_to_save,
+                                "metadata": metadata
+                            }
+                            output_executor.submit(sf.save_file, tensor_dict, tensor_file_path, on_done=_on_tensor_saved, label=os.path.basename(tensor_file_path))
 
                         # アップロードされたテンソルデータがあれば、それも結合したものを保存する
                         if tensor_data_input is not None and uploaded_tensor is not None:
@@ -2642,12 +2782,13 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                                         "history_latents": combined_tensor,
                                         "metadata": combined_metadata
                                     }
-                                    sf.save_file(combined_tensor_dict, tensor_combined_path)
+                                    def _on_combined_saved(_result, tensor_combined_path=tensor_combined_path, combined_frames=combined_frames, generated_frames=tensor_to_save.shape[2], uploaded_frames=uploaded_tensor.shape[2], combined_size_mb=combined_size_mb):
+                                        print(translate("結合テンソルを保存しました: {path}").format(path=tensor_combined_path))
+                                        print(translate("結合テンソル情報: 合計{0}フレーム ({1}+{2}), {3:.2f} MB").format(combined_frames, generated_frames, uploaded_frames, combined_size_mb))
+                                        print(translate("=== テンソルデータ結合処理完了 ==="))
+                                        push_progress(None, translate("テンソルデータ結合が保存されました: 合計{frames}フレーム").format(frames=combined_frames), 100, f'[THEME=green]{translate("結合テンソル保存完了")}')
 
-                                    print(translate("結合テンソルを保存しました: {path}").format(path=tensor_combined_path))
-                                    print(translate("結合テンソル情報: 合計{0}フレーム ({1}+{2}), {3:.2f} MB").format(combined_frames, tensor_to_save.shape[2], uploaded_tensor.shape[2], combined_size_mb))
-                                    print(translate("=== テンソルデータ結合処理完了 ==="))
-                                    push_progress(None, translate("テンソルデータ結合が保存されました: 合計{frames}フレーム").format(frames=combined_frames), 100, f'[THEME=green]{translate("結合テンソル保存完了")}')
+                                    output_executor.submit(sf.save_file, combined_tensor_dict, tensor_combined_path, on_done=_on_combined_saved, label=os.path.basename(tensor_combined_path))
                             except Exception as e:
                                 print(translate("テンソルデータ結合保存エラー: {0}").format(e))
                                 traceback.print_exc()
@@ -2656,6 +2797,11 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                         traceback.print_exc()
                         push_progress(None, translate("テンソルデータの保存中にエラーが発生しました。"), 100, f'[THEME=red]{translate("処理完了")}')
 
+                # バックグラウンドの書き出し（テンソル・フレーム画像）の完了を待ってから完了表示へ進む
+                output_errors = output_executor.drain()
+                if output_errors:
+                    push_progress(None, translate("出力ファイルの書き出しで{0}件のエラーが発生しました").format(len(output_errors)), 100, f'[THEME=red]{translate("処理完了")}')
+
                 # 全体の処理時間を計算
                 process_end_time = time.time()
                 total_process_time = process_end_time - process_start_time
@@ -2733,6 +2879,22 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 )
         except Exception as cleanup_e:
             print(translate("Error occurred during cleanup: {0}").format(str(cleanup_e)))
+    finally:
+        # 途中returnを含むすべての経路で、プレビューと未完了の書き出しを終えてから'end'を送る
+        preview_service.close()
+        output_errors = output_executor.shutdown()
+        if output_errors:
+            print(translate("出力ファイルの書き出しで{0}件のエラーが発生しました").format(len(output_errors)))
+        # バックグラウンドの MP4 書き出しまで記録してから書き出す
+        telemetry.finish_job()
+        # 退避ファイルは書き出し完了後に削除する（Windowsではmemmapへの参照を先に切る必要がある）
+        if latent_spill is not None or pixel_spill is not None:
+            history_latents = history_pixels = real_history_latents = None
+            import gc
+            gc.collect()
+            for spill in (latent_spill, pixel_spill):
+                if spill is not None:
+                    spill.close()
 
     try:
         stream.output_queue.push(('end', None))
@@ -2822,6 +2984,8 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
     global stop_after_current, stop_after_step
     global generation_active
     global last_progress_desc, last_progress_bar, last_preview_image, last_output_filename
+    global job_conditioning_memo
+    global image_queue_prefetcher
 
     # バッチ処理開始時に停止フラグをリセット
     batch_stopped = False
@@ -3104,8 +3268,24 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
         stream = AsyncStream()
         return
 
+    # ジョブ単位の条件付けメモ（前のジョブの残りは破棄し、バッチ間で共有する）
+    if job_conditioning_memo is not None:
+        job_conditioning_memo.clear()
+    job_conditioning_memo = ConditioningMemo()
+
+    # イメージキューの画像を先読みする（前のジョブの先読みは止める）
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
+    if bool(use_queue) and queue_type == "image" and batch_count > 1:
+        if not image_queue_files:
+            get_image_queue_files()
+        image_queue_prefetcher = ImagePrefetcher(image_queue_files, resolution)
+
     # バッチ処理ループの開始
     for batch_index in range(batch_count):
+        # 直前のバッチで使わなかった条件付け（イメージキューの前の画像など）を解放する
+        job_conditioning_memo.start_batch()
         # 停止フラグが設定されている場合は全バッチ処理を中止
         if batch_stopped:
             print(translate("バッチ処理がユーザーによって中止されました"))
@@ -3145,9 +3325,6 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
 
                 # イメージキューの場合
                 elif queue_type == "image":
-                    # グローバル変数からイメージキュー情報を取得
-                    global image_queue_files
-
                     # イメージキューのファイルリストを更新（まだ取得していない場合）
                     if not image_queue_files:
                         get_image_queue_files()
@@ -3366,7 +3543,8 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
             bool(use_queue),  # キュー使用フラグ - 確実にブール値として渡す
             prompt_queue_file,  # プロンプトキューファイル
             actual_alarm_value,  # アラーム設定（値のみ）
-            use_prompt_cache  # プロンプトキャッシュ設定
+            use_prompt_cache,  # プロンプトキャッシュ設定
+            job_conditioning_memo,  # バッチ間で共有する条件付けメモ
         )
 
         # 現在のバッチの出力ファイル名
@@ -3486,6 +3664,13 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
             )
             break
 
+    # ジョブ終了時に条件付けメモを解放し、先読みを止める
+    job_conditioning_memo.clear()
+    job_conditioning_memo = None
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
+
     generation_active = False
     stream = AsyncStream()
 
@@ -1,4 +1,5 @@
 import os
+import threading
 import traceback
 
 # version表記
@@ -94,6 +95,18 @@ from eichi_utils.png_metadata import (
     embed_metadata_to_png, extract_metadata_from_png, extract_metadata_from_numpy_array,
     PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY
 )
+# latent履歴（事前確保バッファ）
+from eichi_utils.latent_history import LatentHistory
+# サンプリング中プレビューの描画をサンプリングスレッドから切り離す
+from eichi_utils.preview_service import PreviewService, make_latent_preview_renderer
+# 同じ画像（リサイズ後）のVAEエンコード結果を再利用する
+from eichi_utils.encode_cache import cached_vae_encode, cached_clip_vision_encode
+from eichi_utils import telemetry
+from eichi_utils.image_prefetch import ImagePrefetcher, prepare_image, get_prepared_image
+# ジョブを始める前の VRAM/RAM の見積もり
+from eichi_utils.memory_estimator import (
+    JobProfile, JobMemoryMonitor, get_estimator, lora_rank, preflight_mode, process_rss_gb,
+)
 
 if 'HF_HOME' not in os.environ:
     os.environ['HF_HOME'] = os.path.abspath(os.path.realpath(os.path.join(os.path.dirname(__file__), './hf_download')))
@@ -231,11 +244,13 @@ def _load_diffusers_transformers_f1():
     from diffusers_helper.pipelines.k_diffusion_hunyuan import sample_hunyuan
     from diffusers_helper.memory import (
         cpu, gpu, get_cuda_free_memory_gb,
-        move_model_to_device_with_memory_preservation,
-        offload_model_from_device_for_memory_preservation,
         fake_diffusers_current_device, DynamicSwapInstaller,
         unload_complete_models, load_model_as_complete,
     )
+    from eichi_utils.module_placement import (
+        move_model_to_device_with_memory_preservation,
+        offload_model_from_device_for_memory_preservation,
+    )
     from diffusers_helper.thread_utils import AsyncStream, async_run
     from diffusers_helper.gradio.progress_bar import make_progress_bar_css, make_progress_bar_html
     from transformers import SiglipImageProcessor, SiglipVisionModel
@@ -337,6 +352,11 @@ current_batch_progress = {"current": 0, "total": 0}  # Batch progress tracking
 queue_ui_settings = None  # Captured UI settings for queue processing
 pending_lora_config_data = None  # For delayed LoRA configuration loading
 stop_after_current = False  # Flag to stop after current generation
+# 次のキュー項目の transformer 状態辞書の先行構築の依頼 (settings, 先に準備を待つ config 名)
+# 生成中の項目の transformer が準備できてから TransformerManager.prepare_next を呼ぶ
+transformer_prebuild_lock = threading.Lock()
+transformer_prebuild_request = None
+transformer_ready_config_name = None
 
 # Configuration constants for queue display
 CONST_queued_shown_count = 5  # Number of queued items shown in status
@@ -477,6 +497,7 @@ queue_enabled = False  # キュー機能の有効/無効フラグ
 queue_type = "prompt"  # キューのタイプ（"prompt" または "image"）
 prompt_queue_file_path = None  # プロンプトキューのファイルパス
 image_queue_files = []  # イメージキューのファイルリスト
+image_queue_prefetcher = None  # イメージキューの先読み（process()の実行中のみ）
 input_folder_name_value = app_settings.get('input_folder', 'inputs')  # 入力フォルダ名の設定値
 
 # 入力フォルダも存在確認（作成はボタン押下時のみ）
@@ -678,7 +699,7 @@ def merged_refresh_handler_standardized():
         available_configs = config_queue_manager.get_available_configs()
         
         # Get enhanced queue status with auto-correction
-        queue_status = config_queue_manager.get_queue_status()
+        queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
         
         # Auto-correction logic (same as before)
         global queue_processing_active
@@ -701,7 +722,7 @@ def merged_refresh_handler_standardized():
             needs_correction = True
         
         if needs_correction:
-            queue_status = config_queue_manager.get_queue_status()
+            queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
         
         # Use the same enhanced formatting function for consistency
         status_text = format_queue_status_with_batch_progress(queue_status)
@@ -732,7 +753,7 @@ def resync_status_handler():
                 gr.update()
             )
 
-        queue_status = config_queue_manager.get_queue_status()
+        queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
         status_text = format_queue_status_with_batch_progress(queue_status)
 
         if queue_status.get('is_processing'):
@@ -804,7 +825,7 @@ def queue_config_handler_with_confirmation(config_dropdown):
         success, message = config_queue_manager.queue_config(config_name)
         
         if success:
-            queue_status = config_queue_manager.get_queue_status()
+            queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
             status_text = format_queue_status_with_batch_progress(queue_status)
             return f"✅ {message}", gr.update(value=status_text), gr.update(visible=False), None
         else:
@@ -825,13 +846,15 @@ def stop_queue_processing_handler_fixed():
     success, message = config_queue_manager.stop_queue_processing()
     
     if success:
+        # 次の項目のために先行構築している transformer の状態辞書は不要になる
+        cancel_transformer_prebuild()
         # Force reset both flags
         queue_processing_active = False
         config_queue_manager.is_processing = False
         config_queue_manager.current_config = None
         print(translate("✅ Queue processing stopped and flags reset"))
         
-    queue_status = config_queue_manager.get_queue_status()
+    queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
     status_text = format_queue_status_with_batch_progress(queue_status)
     
     # Return with visibility restored
@@ -844,7 +867,7 @@ def clear_queue_handler():
     
     success, message = config_queue_manager.clear_queue()
     
-    queue_status = config_queue_manager.get_queue_status()
+    queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
     status_text = format_queue_status_with_batch_progress(queue_status)
     
     return message, gr.update(value=status_text)
@@ -991,7 +1014,7 @@ def perform_save_operation_v3(config_name_input, add_timestamp, input_image, pro
                         current_loaded_config = config
                         break
             
-            queue_status = config_queue_manager.get_queue_status()
+            queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
             status_text = format_queue_status_with_batch_progress(queue_status)
             
             # Format user message with timestamp info - keep it separate from config name
@@ -1173,7 +1196,7 @@ def delete_config_handler_v2(config_dropdown):
     # Check if file actually exists
     if not config_queue_manager.config_exists(config_dropdown):
         available_configs = config_queue_manager.get_available_configs()
-        queue_status = config_queue_manager.get_queue_status()
+        queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
         status_text = format_queue_status_with_batch_progress(queue_status)
         
         return (
@@ -1376,7 +1399,7 @@ def create_enhanced_config_queue_ui():
         
     # Initialize status
     try:
-        initial_status = config_queue_manager.get_queue_status()
+        initial_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
         initial_status_text = format_queue_status_with_batch_progress(initial_status)
         queue_status_display.value = initial_status_text
     except Exception as e:
@@ -1588,7 +1611,7 @@ def setup_periodic_queue_status_check():
                 time.sleep(10)  # Check every 10 seconds (reduced from 30 for better responsiveness)
                 
                 if config_queue_manager and hasattr(config_queue_manager, 'is_processing'):
-                    status = config_queue_manager.get_queue_status()
+                    status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
                     
                     # Check for stuck state
                     if (config_queue_manager.is_processing and 
@@ -1857,7 +1880,7 @@ def start_queue_processing_with_current_ui_values(
         )
         return
     
-    queue_status = config_queue_manager.get_queue_status()
+    queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
     has_items = queue_status.get('queue_count', 0) > 0
     
     if not has_items:
@@ -1913,7 +1936,9 @@ def start_queue_processing_with_current_ui_values(
     print(translate("📋 Queue starting: {0} configs × {1} batches = {2} total videos").format(queue_status['queue_count'], queue_ui_settings['batch_count'], total_expected_videos))
     
     # Start processing with batch-aware processor
-    success, message = config_queue_manager.start_queue_processing(process_config_item_with_batch_support)
+    success, message = config_queue_manager.start_queue_processing(
+        run_prepared_config_item, prepare_function=prepare_config_item
+    )
     
     if not success:
         yield (
@@ -1953,7 +1978,7 @@ def start_queue_processing_with_current_ui_values(
         time.sleep(3.0)
         
         try:
-            status = config_queue_manager.get_queue_status()
+            status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
             current_count = status['queue_count']
             is_processing = status['is_processing']
             current_config = status.get('current_config')
@@ -2219,54 +2244,299 @@ def start_queue_processing_with_current_ui_values(
 #         current_batch_progress = {"current": 0, "total": 0}
 #         return True
 
-def process_config_item_with_batch_support(config_data):
-    global queue_ui_settings, current_processing_config_name, current_batch_progress
-    
-    try:
-        config_name = config_data.get('config_name', 'unknown_config')
-        print(translate("🎬 Processing config: {0}").format(config_name))
+def prepare_config_item(config_data):
+    """設定キューの準備ステージ: GPU を使わない処理を済ませてジョブバンドルを作る
+
+    ConfigQueueManager の準備用スレッドから、前の項目の生成中に呼ばれる。
+    設定の読み込みとパス解決、画像の確認、LoRA 引数の組み立てに加えて、入力画像の
+    デコード・リサイズとプロンプトキャッシュの読み込みを先に行っておく。
+    進捗表示用のグローバル (current_processing_config_name など) は生成中の項目のものなので触らない。
+    準備できなければ None を返す。
+    """
+    global queue_ui_settings
+
+    config_name = config_data.get('config_name', 'unknown_config')
+
+    # FIXED: Use ConfigQueueManager's load_config_for_generation method
+    # This method handles path resolution for both images and LoRA files
+    if config_queue_manager is None:
+        print(translate("❌ Config queue manager not available"))
+        return None
         
-        # FIXED: Use ConfigQueueManager's load_config_for_generation method
-        # This method handles path resolution for both images and LoRA files
-        if config_queue_manager is None:
-            print(translate("❌ Config queue manager not available"))
-            return False
-            
-        # Load config with proper path resolution
-        success, resolved_config_data, message = config_queue_manager.load_config_for_generation(config_name)
+    # Load config with proper path resolution
+    success, resolved_config_data, message = config_queue_manager.load_config_for_generation(config_name)
+    
+    if not success:
+        print(translate("❌ Cannot load config for generation: {0}").format(config_name))
+        print(translate("    Error: {0}").format(message))
+        return None
         
-        if not success:
-            print(translate("❌ Cannot load config for generation: {0}").format(config_name))
-            print(translate("    Error: {0}").format(message))
-            return False
-            
-        # Use the resolved config data instead of the original
-        config_data = resolved_config_data
+    # Use the resolved config data instead of the original
+    config_data = resolved_config_data
+    
+    # Validate that image exists for generation (now with resolved path)
+    image_path = config_data.get('image_path')
+    if not image_path or not os.path.exists(image_path):
+        print(translate("❌ Cannot generate video: Image missing for config {0}").format(config_name))
+        print(translate("    Expected path: {0}").format(image_path))
+        return None
+    
+    print(translate("✅ Image validated: {0}").format(os.path.basename(image_path)))
+
+    # Use the stored UI settings
+    if queue_ui_settings is None:
+        print(translate("❌ No UI settings available - using defaults"))
+        queue_ui_settings = get_current_ui_settings_for_queue()
         
-        # Validate that image exists for generation (now with resolved path)
-        image_path = config_data.get('image_path')
-        if not image_path or not os.path.exists(image_path):
-            print(translate("❌ Cannot generate video: Image missing for config {0}").format(config_name))
-            print(translate("    Expected path: {0}").format(image_path))
-            return False
+    # Get batch count from UI settings with debug logging
+    batch_count_raw = queue_ui_settings.get('batch_count', 1)
+    
+    # Ensure batch_count is definitely an integer
+    if isinstance(batch_count_raw, bool):
+        print(translate("⚠️ Warning: batch_count is boolean ({0}), converting to integer").format(batch_count_raw))
+        batch_count = 1 if batch_count_raw else 1
+    else:
+        try:
+            batch_count = int(batch_count_raw)
+        except (ValueError, TypeError):
+            print(translate("⚠️ Warning: Could not convert batch_count to int: {0} (type: {1})").format(batch_count_raw, type(batch_count_raw)))
+            batch_count = 1
+    
+    batch_count = max(1, min(batch_count, 100))  # Ensure valid range
+    
+    # Extract config data (now using resolved paths)
+    prompt = config_data['prompt']
+    lora_settings = config_data['lora_settings']
+    
+    # Handle LoRA configuration with resolved paths
+    use_lora = lora_settings.get('use_lora', False)
+    lora_mode_key = lora_settings.get('lora_mode_key')
+    if lora_mode_key:
+        lora_mode = get_lora_mode_text(lora_mode_key)
+    else:
+        old_lora_mode = lora_settings.get('lora_mode')
+        if old_lora_mode:
+            if 'ディレクトリ' in old_lora_mode or 'directory' in old_lora_mode.lower() or '目錄' in old_lora_mode:
+                lora_mode = translate("ディレクトリから選択")
+            elif 'ファイル' in old_lora_mode or 'file' in old_lora_mode.lower() or '檔案' in old_lora_mode:
+                lora_mode = translate("ファイルアップロード")
+            else:
+                lora_mode = translate("ディレクトリから選択")
+        else:
+            lora_mode = translate("ディレクトリから選択")
         
-        print(translate("✅ Image validated: {0}").format(os.path.basename(image_path)))
-            
-        # Get batch count from UI settings with debug logging
-        batch_count_raw = queue_ui_settings.get('batch_count', 1)
+    lora_scales_text = lora_settings.get('lora_scales', '0.8,0.8,0.8')
+    
+    # Initialize LoRA parameters
+    lora_files_obj = None
+    lora_files2_obj = None
+    lora_files3_obj = None
+    lora_dropdown1_val = None
+    lora_dropdown2_val = None
+    lora_dropdown3_val = None
+    
+    if use_lora:
+        # LoRA files are now resolved to absolute paths by load_config_for_generation
+        lora_files_list = lora_settings.get('lora_files', [])
         
-        # Ensure batch_count is definitely an integer
-        if isinstance(batch_count_raw, bool):
-            print(translate("⚠️ Warning: batch_count is boolean ({0}), converting to integer").format(batch_count_raw))
-            batch_count = 1 if batch_count_raw else 1
+        if lora_mode == translate("ディレクトリから選択"):
+            lora_dropdown_files = lora_settings.get('lora_dropdown_files')
+            if lora_dropdown_files:
+                # Use the resolved absolute paths, but extract filenames for dropdown values
+                for i, lora_file_path in enumerate(lora_files_list[:3]):
+                    if lora_file_path and os.path.exists(lora_file_path):
+                        filename = os.path.basename(lora_file_path)
+                        if i == 0:
+                            lora_dropdown1_val = filename
+                        elif i == 1:
+                            lora_dropdown2_val = filename
+                        elif i == 2:
+                            lora_dropdown3_val = filename
+            else:
+                # Fallback: extract filenames from resolved paths
+                if lora_files_list:
+                    if len(lora_files_list) > 0 and lora_files_list[0] and os.path.exists(lora_files_list[0]):
+                        lora_dropdown1_val = os.path.basename(lora_files_list[0])
+                    if len(lora_files_list) > 1 and lora_files_list[1] and os.path.exists(lora_files_list[1]):
+                        lora_dropdown2_val = os.path.basename(lora_files_list[1])
+                    if len(lora_files_list) > 2 and lora_files_list[2] and os.path.exists(lora_files_list[2]):
+                        lora_dropdown3_val = os.path.basename(lora_files_list[2])
         else:
-            try:
-                batch_count = int(batch_count_raw)
-            except (ValueError, TypeError):
-                print(translate("⚠️ Warning: Could not convert batch_count to int: {0} (type: {1})").format(batch_count_raw, type(batch_count_raw)))
-                batch_count = 1
-        
-        batch_count = max(1, min(batch_count, 100))  # Ensure valid range
+            # File upload mode - create mock file objects from resolved paths
+            if lora_files_list:
+                if len(lora_files_list) > 0 and os.path.exists(lora_files_list[0]):
+                    lora_files_obj = type('MockFile', (), {'name': lora_files_list[0]})()
+                if len(lora_files_list) > 1 and os.path.exists(lora_files_list[1]):
+                    lora_files2_obj = type('MockFile', (), {'name': lora_files_list[1]})()
+                if len(lora_files_list) > 2 and os.path.exists(lora_files_list[2]):
+                    lora_files3_obj = type('MockFile', (), {'name': lora_files_list[2]})()
+
+    # transformer の状態辞書の先行構築を依頼する (worker() と同じ方法で LoRA パスとスケールを解決)
+    next_lora_paths = []
+    try:
+        if use_lora and has_lora_support:
+            if lora_mode == translate("ディレクトリから選択"):
+                lora_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lora')
+                for dropdown in (lora_dropdown1_val, lora_dropdown2_val, lora_dropdown3_val):
+                    if dropdown and dropdown != translate("なし"):
+                        lora_path = safe_path_join(lora_dir, dropdown)
+                        if os.path.exists(lora_path):
+                            next_lora_paths.append(lora_path)
+            else:
+                next_lora_paths = [f.name for f in (lora_files_obj, lora_files2_obj, lora_files3_obj) if f is not None]
+        try:
+            next_lora_scales = [float(scale.strip()) for scale in lora_scales_text.split(',')] if lora_scales_text.strip() else []
+        except ValueError:
+            next_lora_scales = []
+        request_transformer_prebuild(
+            dict(
+                lora_paths=next_lora_paths,
+                lora_scales=next_lora_scales,
+                fp8_enabled=queue_ui_settings['fp8_optimization'],
+                high_vram_mode=high_vram,
+                force_dict_split=True,  # worker() と同じく常に辞書分割処理
+            ),
+            config_queue_manager.current_config
+        )
+    except Exception as e:
+        print(translate("⚠️ Failed to start transformer prebuild: {0}").format(e))
+
+    # VRAM/RAM が足りない見込みの項目は生成を始めずにエラーにする
+    memory_preflight = preflight_config_item(queue_ui_settings, next_lora_paths)
+    if memory_preflight is not None and memory_preflight.action == "reject":
+        print(translate("❌ Not enough memory expected for config {0}: {1}").format(config_name, memory_preflight.reason))
+        return None
+
+    # 入力画像のデコード・リサイズとプロンプトキャッシュの読み込みを先に済ませておく
+    # (失敗しても生成時に通常どおり読み込むだけなので、ここではジョブを失敗にしない)
+    try:
+        prepare_image(image_path, queue_ui_settings['resolution'])
+    except Exception as e:
+        print(translate("⚠️ Failed to preload image for {0}: {1}").format(config_name, e))
+    try:
+        from eichi_utils import prompt_cache
+        prompt_cache.preload(prompt, queue_ui_settings['n_prompt'])
+    except Exception as e:
+        print(translate("⚠️ Failed to preload prompt cache for {0}: {1}").format(config_name, e))
+
+    return {
+        'config_name': config_name,
+        'image_path': image_path,
+        'prompt': prompt,
+        'batch_count': batch_count,
+        'use_lora': use_lora,
+        'lora_mode': lora_mode,
+        'lora_scales_text': lora_scales_text,
+        'lora_files': (lora_files_obj, lora_files2_obj, lora_files3_obj),
+        'lora_dropdowns': (lora_dropdown1_val, lora_dropdown2_val, lora_dropdown3_val),
+        'memory_preflight': memory_preflight,
+    }
+
+def preflight_config_item(settings, lora_paths):
+    """設定キューの項目の VRAM/RAM のピークを見積もる (EICHI_PREFLIGHT=off や失敗時は None)"""
+    mode = preflight_mode()
+    if mode == "off":
+        return None
+    try:
+        vram_budget = None
+        if torch.cuda.is_available():
+            vram_budget = torch.cuda.get_device_properties(gpu).total_memory / (1024 ** 3)
+        from eichi_utils.host_memory import host_mem_available_gb
+        avail_gb = host_mem_available_gb()
+        rss_gb = process_rss_gb()
+        # RAM はこのプロセスが今使っている分＋空き容量まで使える
+        ram_budget = avail_gb + rss_gb if (avail_gb is not None and rss_gb is not None) else None
+        resolution = int(settings['resolution'])
+        profile = JobProfile(
+            width=resolution, height=resolution,
+            latent_window_size=int(settings['latent_window_size']),
+            total_frames=int(float(settings['total_second_length']) * 30),
+            lora_ranks=tuple(lora_rank(path) or 0 for path in lora_paths),
+            fp8=bool(settings['fp8_optimization']), high_vram=bool(high_vram),
+            vae_tiling=not high_vram, lora_cache=lora_state_cache.is_cache_enabled(),
+            queue_type="config", vram_total_gb=vram_budget,
+            preserved_gb=float(settings['gpu_memory_preservation']),
+        )
+        result = get_estimator().preflight(profile, vram_budget, ram_budget, allow_reject=(mode == "on"))
+    except Exception as e:
+        print(translate("⚠️ Memory estimate failed: {0}").format(e))
+        return None
+    print(translate("📐 Memory estimate: VRAM {0:.1f}GB / RAM {1:.1f}GB").format(result.estimate.vram_gb, result.estimate.ram_gb))
+    return result
+
+def apply_memory_adaptations(memory_preflight):
+    """見積もりに従って LoRA キャッシュを無効化・VAE のタイリングを有効化する (元に戻す関数を返す)"""
+    changes = memory_preflight.changes if memory_preflight is not None else ()
+    prev_cache = None
+    tiling_enabled = False
+    if "lora_cache" in changes:
+        prev_cache = lora_state_cache.is_cache_enabled()
+        lora_state_cache.set_cache_enabled(False)
+        lora_state_cache._inmem_clear()
+        print(translate("⚠️ Disabling the LoRA cache for this job (low RAM expected)"))
+    if "vae_tiling" in changes:
+        vae.enable_tiling()
+        tiling_enabled = True
+        print(translate("⚠️ Enabling VAE tiling for this job (low VRAM expected)"))
+
+    def restore():
+        if prev_cache is not None:
+            lora_state_cache.set_cache_enabled(prev_cache)
+        if tiling_enabled:
+            vae.disable_tiling()
+    return restore
+
+def request_transformer_prebuild(settings, after_config_name):
+    """次の項目の transformer 状態辞書の先行構築を依頼する
+
+    after_config_name (生成中の項目) の transformer が準備済みならすぐに始め、
+    そうでなければ worker() がその準備を終えたとき (notify_transformer_ready) に始める。
+    生成中の項目のリロードと重ならないようにするため。
+    """
+    global transformer_prebuild_request
+    with transformer_prebuild_lock:
+        if after_config_name is not None and transformer_ready_config_name != after_config_name:
+            transformer_prebuild_request = (settings, after_config_name)
+            return
+        transformer_prebuild_request = None
+    if transformer_manager is not None:
+        transformer_manager.prepare_next(**settings)
+
+def notify_transformer_ready(config_name):
+    """worker() で transformer の準備が終わったら呼ぶ (待っている先行構築の依頼を始める)"""
+    global transformer_prebuild_request, transformer_ready_config_name
+    with transformer_prebuild_lock:
+        transformer_ready_config_name = config_name
+        request = transformer_prebuild_request
+        if request is None or config_name is None or request[1] != config_name:
+            return
+        transformer_prebuild_request = None
+    try:
+        transformer_manager.prepare_next(**request[0])
+    except Exception as e:
+        print(translate("⚠️ Failed to start transformer prebuild: {0}").format(e))
+
+def cancel_transformer_prebuild():
+    """先行構築の依頼と構築中・構築済みの状態辞書を捨てる"""
+    global transformer_prebuild_request
+    with transformer_prebuild_lock:
+        transformer_prebuild_request = None
+    if transformer_manager is not None:
+        transformer_manager.cancel_prepared()
+
+def run_prepared_config_item(prepared):
+    """設定キューの GPU ステージ: prepare_config_item の結果で process() を実行する"""
+    global queue_ui_settings, current_processing_config_name, current_batch_progress
+
+    memory_preflight = prepared.get('memory_preflight')
+    restore_memory_settings = apply_memory_adaptations(memory_preflight)
+    memory_monitor = JobMemoryMonitor().start() if memory_preflight is not None else None
+    job_completed = False
+
+    try:
+        config_name = prepared['config_name']
+        batch_count = prepared['batch_count']
+        print(translate("🎬 Processing config: {0}").format(config_name))
         
         # Set the current config name for worker function to use
         current_processing_config_name = config_name
@@ -2284,73 +2554,8 @@ def process_config_item_with_batch_support(config_data):
         
         print(translate("🕒 Using duration from UI: {0}s").format(current_ui_settings['total_second_length']))
         
-        # Extract config data (now using resolved paths)
-        image_path = config_data['image_path']  # Already resolved
-        prompt = config_data['prompt']
-        lora_settings = config_data['lora_settings']
-        
-        # Handle LoRA configuration with resolved paths
-        use_lora = lora_settings.get('use_lora', False)
-        lora_mode_key = lora_settings.get('lora_mode_key')
-        if lora_mode_key:
-            lora_mode = get_lora_mode_text(lora_mode_key)
-        else:
-            old_lora_mode = lora_settings.get('lora_mode')
-            if old_lora_mode:
-                if 'ディレクトリ' in old_lora_mode or 'directory' in old_lora_mode.lower() or '目錄' in old_lora_mode:
-                    lora_mode = translate("ディレクトリから選択")
-                elif 'ファイル' in old_lora_mode or 'file' in old_lora_mode.lower() or '檔案' in old_lora_mode:
-                    lora_mode = translate("ファイルアップロード")
-                else:
-                    lora_mode = translate("ディレクトリから選択")
-            else:
-                lora_mode = translate("ディレクトリから選択")
-            
-        lora_scales_text = lora_settings.get('lora_scales', '0.8,0.8,0.8')
-        
-        # Initialize LoRA parameters
-        lora_files_obj = None
-        lora_files2_obj = None
-        lora_files3_obj = None
-        lora_dropdown1_val = None
-        lora_dropdown2_val = None
-        lora_dropdown3_val = None
-        
-        if use_lora:
-            # LoRA files are now resolved to absolute paths by load_config_for_generation
-            lora_files_list = lora_settings.get('lora_files', [])
-            
-            if lora_mode == translate("ディレクトリから選択"):
-                lora_dropdown_files = lora_settings.get('lora_dropdown_files')
-                if lora_dropdown_files:
-                    # Use the resolved absolute paths, but extract filenames for dropdown values
-                    for i, lora_file_path in enumerate(lora_files_list[:3]):
-                        if lora_file_path and os.path.exists(lora_file_path):
-                            filename = os.path.basename(lora_file_path)
-                            if i == 0:
-                                lora_dropdown1_val = filename
-                            elif i == 1:
-                                lora_dropdown2_val = filename
-                            elif i == 2:
-                                lora_dropdown3_val = filename
-                else:
-                    # Fallback: extract filenames from resolved paths
-                    if lora_files_list:
-                        if len(lora_files_list) > 0 and lora_files_list[0] and os.path.exists(lora_files_list[0]):
-                            lora_dropdown1_val = os.path.basename(lora_files_list[0])
-                        if len(lora_files_list) > 1 and lora_files_list[1] and os.path.exists(lora_files_list[1]):
-                            lora_dropdown2_val = os.path.basename(lora_files_list[1])
-                        if len(lora_files_list) > 2 and lora_files_list[2] and os.path.exists(lora_files_list[2]):
-                            lora_dropdown3_val = os.path.basename(lora_files_list[2])
-            else:
-                # File upload mode - create mock file objects from resolved paths
-                if lora_files_list:
-                    if len(lora_files_list) > 0 and os.path.exists(lora_files_list[0]):
-                        lora_files_obj = type('MockFile', (), {'name': lora_files_list[0]})()
-                    if len(lora_files_list) > 1 and os.path.exists(lora_files_list[1]):
-                        lora_files2_obj = type('MockFile', (), {'name': lora_files_list[1]})()
-                    if len(lora_files_list) > 2 and os.path.exists(lora_files_list[2]):
-                        lora_files3_obj = type('MockFile', (), {'name': lora_files_list[2]})()
+        lora_files_obj, lora_files2_obj, lora_files3_obj = prepared['lora_files']
+        lora_dropdown1_val, lora_dropdown2_val, lora_dropdown3_val = prepared['lora_dropdowns']
         
         print(translate("🎯 Calling process() with config: {0}, batch_count: {1}, duration: {2}s").format(config_name, batch_count, current_ui_settings['total_second_length']))
         
@@ -2372,8 +2577,8 @@ def process_config_item_with_batch_support(config_data):
         
         # Call the enhanced process function with batch tracking
         result_generator = process_with_batch_tracking(
-            image_path,  # input_image (now resolved)
-            prompt,  # prompt
+            prepared['image_path'],  # input_image (now resolved)
+            prepared['prompt'],  # prompt
             current_ui_settings['n_prompt'],  # n_prompt
             current_ui_settings['seed'],  # seed
             current_ui_settings['total_second_length'],  # total_second_length
@@ -2393,12 +2598,12 @@ def process_config_item_with_batch_support(config_data):
             lora_files_obj,  # lora_files
             lora_files2_obj,  # lora_files2
             lora_files3_obj,  # lora_files3
-            lora_scales_text,  # lora_scales_text
+            prepared['lora_scales_text'],  # lora_scales_text
             current_ui_settings['output_dir'],  # output_dir
             current_ui_settings['save_section_frames'],  # save_section_frames
             current_ui_settings['use_all_padding'],  # use_all_padding
-            use_lora,  # use_lora
-            lora_mode,  # lora_mode
+            prepared['use_lora'],  # use_lora
+            prepared['lora_mode'],  # lora_mode
             lora_dropdown1_val,  # lora_dropdown1
             lora_dropdown2_val,  # lora_dropdown2
             lora_dropdown3_val,  # lora_dropdown3
@@ -2419,6 +2624,7 @@ def process_config_item_with_batch_support(config_data):
         step_count = 0
         for result in result_generator:
             step_count += 1
+        job_completed = True
         
         # Reset batch progress when done
         current_batch_progress = {"current": 0, "total": 0}
@@ -2431,11 +2637,28 @@ def process_config_item_with_batch_support(config_data):
         traceback.print_exc()
         return False
     finally:
+        # VRAM/RAM の実測を記録し、見積もりで変えた設定を戻す
+        try:
+            restore_memory_settings()
+            if memory_monitor is not None:
+                vram_gb, ram_gb = memory_monitor.stop()
+                if job_completed:
+                    estimator = get_estimator()
+                    estimator.record(memory_preflight.profile, memory_preflight.estimate, vram_gb, ram_gb)
+        except Exception as e:
+            print(translate("⚠️ Failed to record memory usage: {0}").format(e))
         # Clear the config name when done
         current_processing_config_name = None
         current_batch_progress = {"current": 0, "total": 0}
         return True
 
+def process_config_item_with_batch_support(config_data):
+    """準備と生成を続けて行う (準備ステージを使わない呼び出し用)"""
+    prepared = prepare_config_item(config_data)
+    if prepared is None:
+        return False
+    return run_prepared_config_item(prepared)
+
 # ==============================================================================
 # QUEUE STATUS AND MONITORING
 # ==============================================================================
@@ -2484,8 +2707,8 @@ def format_queue_status_with_batch_progress(status):
         lines.append(translate("⏳ Pending:"))
         for i, config in enumerate(status['queued'][:CONST_queued_shown_count]):
             lines.append(f"   {i+1}. {config}")
-        if len(status['queued']) > CONST_queued_shown_count:
-            lines.append(translate("   ... and {0} more").format(len(status['queued']) - CONST_queued_shown_count))
+        if queue_count > CONST_queued_shown_count:
+            lines.append(translate("   ... and {0} more").format(queue_count - CONST_queued_shown_count))
    
     # Recently completed (newest first)
     if status['completed']:
@@ -2550,7 +2773,7 @@ def confirm_operation_handler_fixed(operation_data):
             success, message = config_queue_manager.queue_config(config_name)
             
             if success:
-                queue_status = config_queue_manager.get_queue_status()
+                queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
                 status_text = format_queue_status_with_batch_progress(queue_status)
                 
                 return (
@@ -2571,7 +2794,7 @@ def confirm_operation_handler_fixed(operation_data):
             
             if success:
                 available_configs = config_queue_manager.get_available_configs()
-                queue_status = config_queue_manager.get_queue_status()
+                queue_status = config_queue_manager.get_queue_status(queued_limit=CONST_queued_shown_count)
                 status_text = format_queue_status_with_batch_progress(queue_status)
                 new_value = available_configs[0] if available_configs else None
                 
@@ -2929,6 +3152,15 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
     # All stream.output_queue.push() calls should now go through the proxy correctly
     stream.output_queue.push(('progress', (None, '', make_progress_bar_html2(0, f'[THEME=yellow]{translate("Starting ...")}'))))
 
+    # サンプリング中プレビュー（描画は別スレッド、送信は最新のみを間引いて行う）
+    preview_service = PreviewService(
+        make_latent_preview_renderer(vae_decode_fake),
+        lambda preview, desc, bar_html: stream.output_queue.push(('progress', (preview, desc, bar_html))),
+    )
+
+    # EICHI_TELEMETRY が有効ならこのジョブのメモリと処理区間を出力フォルダへ記録する
+    telemetry.start_job(job_id, outputs_folder)
+
     try:
         # F1モードのプロンプト処理
         section_map = None
@@ -2993,12 +3225,13 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             print(translate("プロンプト情報: ソース: {0}").format(prompt_source))
             print(translate("プロンプト情報: 内容: {0}").format(actual_prompt))
 
-            llama_vec, clip_l_pooler = encode_prompt_conds(prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
+            with telemetry.span("text encode"):
+                llama_vec, clip_l_pooler = encode_prompt_conds(prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
 
-            if cfg == 1:
-                llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
-            else:
-                llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
+                if cfg == 1:
+                    llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
+                else:
+                    llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tokenizer, tokenizer_2)
 
             llama_vec, llama_attention_mask = crop_or_pad_yield_mask(llama_vec, length=512)
             llama_vec_n, llama_attention_mask_n = crop_or_pad_yield_mask(llama_vec_n, length=512)
@@ -3074,6 +3307,17 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             if isinstance(img_path_or_array, torch.Tensor):
                 img_path_or_array = img_path_or_array.cpu().numpy()
 
+            # イメージキューの画像は先読み済みのもの（デコード・リサイズ済み）を使う
+            prefetcher = image_queue_prefetcher
+            prefetched = prefetcher.get(img_path_or_array, resolution) if prefetcher is not None and isinstance(img_path_or_array, str) else None
+            if prefetched is None and isinstance(img_path_or_array, str):
+                # 設定キューの準備ステージで読み込み済みの画像
+                prefetched = get_prepared_image(img_path_or_array, resolution)
+            if prefetched is not None:
+                img_pt = torch.from_numpy(prefetched.image).float() / 127.5 - 1
+                img_pt = img_pt.permute(2, 0, 1)[None, :, None]
+                return prefetched.image, img_pt, prefetched.height, prefetched.width
+
             # Pathの場合はPILで画像を開く
             if isinstance(img_path_or_array, str) and os.path.exists(img_path_or_array):
                 img = np.array(Image.open(img_path_or_array).convert('RGB'))
@@ -3144,7 +3388,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             stream.output_queue.push(('progress', (None, tensor_info, make_progress_bar_html2(10, f'[THEME=green]{translate("テンソルデータを後方に結合")}'))))
 
         # 常に入力画像から通常のエンコーディングを行う
-        start_latent = vae_encode(input_image_pt, vae)
+        with telemetry.span("VAE encode"):
+            start_latent = cached_vae_encode(input_image_np, input_image_pt, vae, vae_encode)
 
         # 簡略化設計: section_latents機能を削除
 
@@ -3152,11 +3397,12 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
 
         stream.output_queue.push(('progress', (None, '', make_progress_bar_html2(0, f'[THEME=cyan]{translate("CLIP Vision encoding ...")}'))))
 
-        if not high_vram:
-            load_model_as_complete(image_encoder, target_device=gpu)
-
-        image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
-        image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
+        # キャッシュヒット時は画像エンコーダをGPUへロードしない
+        with telemetry.span("CLIP Vision encode"):
+            image_encoder_last_hidden_state = cached_clip_vision_encode(
+                input_image_np, feature_extractor, image_encoder, hf_clip_vision_encode, device=gpu,
+                load_fn=None if high_vram else (lambda: load_model_as_complete(image_encoder, target_device=gpu)),
+            )
 
         # Dtype
 
@@ -3178,11 +3424,16 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             num_frames = int(latent_window_size * 4 - 3)
 
         # 初期フレーム準備
-        history_latents = torch.zeros(size=(1, 16, 16 + 2 + 1, height // 8, width // 8), dtype=torch.float32).cpu()
+        # 生成予定のlatentフレーム数（開始フレーム + 各セクション）ぶんを事前確保し、末尾へスライス書き込みする
+        planned_latent_frames = 1 + total_latent_sections * (5 if latent_window_size == 4.5 else int(latent_window_size))
+        history_latents = LatentHistory(
+            torch.zeros(size=(1, 16, 16 + 2 + 1, height // 8, width // 8), dtype=torch.float32).cpu(),
+            direction="append", capacity=planned_latent_frames,
+        )
         history_pixels = None
 
         # 開始フレームをhistory_latentsに追加
-        history_latents = torch.cat([history_latents, start_latent.to(history_latents)], dim=2)
+        history_latents.add(start_latent)
         total_generated_latent_frames = 1  # 最初のフレームを含むので1から開始
 
         # -------- LoRA 設定 START ---------
@@ -3323,6 +3574,9 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             # 最新のtransformerインスタンスを取得
             transformer = transformer_manager.get_transformer()
             print(translate("transformer状態チェック完了"))
+
+            # 設定キューの次の項目の状態辞書をこのジョブのサンプリング中に組み立てる
+            notify_transformer_ready(current_processing_config_name)
         except Exception as e:
             print(translate("transformer状態チェックエラー: {0}").format(e))
             traceback.print_exc()
@@ -3383,8 +3637,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             clean_latent_indices_start, clean_latent_4x_indices, clean_latent_2x_indices, clean_latent_1x_indices, latent_indices = indices.split([1, 16, 2, 1, effective_window_size], dim=1)
             clean_latent_indices = torch.cat([clean_latent_indices_start, clean_latent_1x_indices], dim=1)
 
-            clean_latents_4x, clean_latents_2x, clean_latents_1x = history_latents[:, :, -sum([16, 2, 1]):, :, :].split([16, 2, 1], dim=2)
-            clean_latents = torch.cat([start_latent.to(history_latents), clean_latents_1x], dim=2)
+            clean_latents_4x, clean_latents_2x, clean_latents_1x = history_latents.context(sum([16, 2, 1])).split([16, 2, 1], dim=2)
+            clean_latents = torch.cat([start_latent.to(device=history_latents.device, dtype=history_latents.dtype), clean_latents_1x], dim=2)
 
             if not high_vram:
                 unload_complete_models()
@@ -3399,23 +3653,25 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 transformer.initialize_teacache(enable_teacache=False)
 
             def callback(d):
-                preview = d['denoised']
-                preview = vae_decode_fake(preview)
-
-                preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
-                preview = einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
-
                 if stream.input_queue.top() == 'end':
+                    # 保留中のプレビューが'end'の後に届かないよう捨ててから通知する
+                    preview_service.close(flush=False)
                     stream.output_queue.push(('end', None))
                     raise KeyboardInterrupt('User ends the task.')
 
                 current_step = d['i'] + 1
+                # ステップの区間を次のステップへ切り替える
+                if current_step < steps:
+                    telemetry.lap("sampling step", section=i_section, step=current_step + 1)
+                else:
+                    telemetry.end_lap("sampling step")
                 percentage = int(100.0 * current_step / steps)
                 hint = translate('Sampling {0}/{1}').format(current_step, steps)
                 # セクション情報を追加（現在のセクション/全セクション）
                 section_info = translate('セクション: {0}/{1}').format(i_section+1, total_sections)
                 desc = f"{section_info} " + translate('生成フレーム数: {total_generated_latent_frames}, 動画長: {video_length:.2f} 秒 (FPS-30). 動画が生成中です ...').format(section_info=section_info, total_generated_latent_frames=int(max(0, total_generated_latent_frames * 4 - 3)), video_length=max(0, (total_generated_latent_frames * 4 - 3) / 30))
-                stream.output_queue.push(('progress', (preview, desc, make_progress_bar_html2(percentage, f'[THEME=blue]{hint}'))))
+                # プレビューの描画・送信は待たない
+                preview_service.submit(d['denoised'], desc, make_progress_bar_html2(percentage, f'[THEME=blue]{hint}'))
                 return
 
             # Image影響度を計算：大きい値ほど始点の影響が強くなるよう変換
@@ -3424,6 +3680,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             print(translate('Image影響度: UI値={0:.2f}（{1:.0f}%）→計算値={2:.4f}（値が小さいほど始点の影響が強い）').format(
                 image_strength, image_strength * 100, strength_value))
 
+            telemetry_sampling = telemetry.begin("sampling", section=i_section, steps=steps)
+            telemetry.lap("sampling step", section=i_section, step=1)
             generated_latents = sample_hunyuan(
                 transformer=transformer,
                 sampler='unipc',
@@ -3456,14 +3714,18 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 strength=strength_value,        # 計算した影響度を使用
                 callback=callback,
             )
+            telemetry.end_lap("sampling step")
+            telemetry.end(telemetry_sampling)
+            # 後続の進捗表示より古いプレビューが届かないよう送り切る
+            preview_service.flush()
 
             # if is_last_section:
             #     generated_latents = torch.cat([start_latent.to(generated_latents), generated_latents], dim=2)
 
             total_generated_latent_frames += int(generated_latents.shape[2])
-            # Risk-3軽減: 後方にフレームを追加。CPU移動後に参照を切って即時解放を促進
-            _gen_cpu = generated_latents.to(history_latents)
-            history_latents = torch.cat([history_latents, _gen_cpu], dim=2)
+            # Risk-3軽減: 後方にフレームを追加（事前確保バッファへのスライス書き込み）。CPU移動後に参照を切って即時解放を促進
+            _gen_cpu = generated_latents.to(device=history_latents.device, dtype=history_latents.dtype)
+            history_latents.add(_gen_cpu)
             del _gen_cpu, generated_latents
 
             if not high_vram:
@@ -3473,8 +3735,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 offload_model_from_device_for_memory_preservation(transformer, target_device=gpu, preserved_memory_gb=preserved_memory_offload)
                 load_model_as_complete(vae, target_device=gpu)
 
-            # 最新フレームは末尾から切り出し
-            real_history_latents = history_latents[:, :, -total_generated_latent_frames:, :, :]
+            # 最新フレームは末尾から切り出し（事前確保バッファのビュー、コピーなし）
+            real_history_latents = history_latents.real()
 
             # COMMENTED OUT: VAEデコード前のメモリクリア（処理速度向上のため）
             # if torch.cuda.is_available():
@@ -3482,6 +3744,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
             #     torch.cuda.empty_cache()
             #     print(translate("VAEデコード前メモリ: {0:.2f}GB").format(torch.cuda.memory_allocated()/1024**3))
 
+            telemetry_decode = telemetry.begin("VAE decode", section=i_section)
             if history_pixels is None:
                 history_pixels = vae_decode(real_history_latents, vae).cpu()
             else:
@@ -3502,6 +3765,7 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                     history_pixels = current_pixels
                 else:
                     history_pixels = soft_append_bcthw(history_pixels, current_pixels, overlapped_frames)
+            telemetry.end(telemetry_decode)
 
             # 各セクションの最終フレームを静止画として保存（セクション番号付き）
             if save_section_frames and history_pixels is not None:
@@ -3649,7 +3913,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
                 history_pixels = torch.clamp(history_pixels, -1.0, 1.0)
 
             # MP4を保存
-            save_bcthw_as_mp4(history_pixels, output_filename, fps=30, crf=mp4_crf)
+            with telemetry.span("encode MP4", section=i_section):
+                save_bcthw_as_mp4(history_pixels, output_filename, fps=30, crf=mp4_crf)
 
             print(translate('Decoded. Current latent shape {0}; pixel shape {1}').format(real_history_latents.shape, history_pixels.shape))
 
@@ -4099,6 +4364,8 @@ def worker(input_image, prompt, n_prompt, seed, total_second_length, latent_wind
     # キュー連続実行時の_INMEM_CACHE蓄積を防止
     cleanup_generation_resources()
 
+    telemetry.finish_job()
+    preview_service.close()
     stream.output_queue.push(('end', None))
     return
 
@@ -4197,6 +4464,7 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
     global stream
     global batch_stopped
     global queue_enabled, queue_type, prompt_queue_file_path, image_queue_files
+    global image_queue_prefetcher
 
     # バッチ処理開始時に停止フラグをリセット
     batch_stopped = False
@@ -4482,6 +4750,14 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
     else:
         print(translate("バッチ処理情報: 合計{0}回").format(batch_count))
         print(translate("キュー機能: 無効"))
+
+    # イメージキューの画像を先読みする（前のジョブの先読みは止める）
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
+    if queue_enabled and queue_type == "image" and len(image_queue_files) > 0 and batch_count > 1:
+        image_queue_prefetcher = ImagePrefetcher(image_queue_files, resolution)
+
     for batch_index in range(batch_count):
         # 停止フラグが設定されている場合は全バッチ処理を中止
         if batch_stopped:
@@ -4749,6 +5025,11 @@ def process(input_image, prompt, n_prompt, seed, total_second_length, latent_win
         if batch_stopped:
             print(translate("バッチ処理ループを中断します"))
             break
+
+    # イメージキューの先読みを止める
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
   
 
 # 既存のQuick Prompts（初期化時にプリセットに変換されるので、互換性のために残す）
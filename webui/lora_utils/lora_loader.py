@@ -17,7 +17,8 @@ def load_and_apply_lora(
     lora_scales=None,
     fp8_enabled=False,
     device=None,
-    cache_enabled=False
+    cache_enabled=False,
+    throttle=None
 ):
     """
     LoRA重みをロードして重みに適用する
@@ -29,6 +30,7 @@ def load_and_apply_lora(
         fp8_enabled: FP8最適化の有効/無効
         device: 計算に使用するデバイス
         cache_enabled: キャッシュが有効な場合、マージ済み状態辞書を保存/再利用
+        throttle: テンソルを1つ処理するごとに呼ぶ関数（バックグラウンド構築の間引き・中止用、Noneの場合は使用しない）
 
     Returns:
         LoRAが適用されたモデルの状態辞書
@@ -66,7 +68,7 @@ def load_and_apply_lora(
     print(_("フォーマット: HunyuanVideo"))
 
     # LoRAをマージ
-    merged_state_dict = merge_lora_to_state_dict(model_files, lora_paths, lora_scales, fp8_enabled, device)
+    merged_state_dict = merge_lora_to_state_dict(model_files, lora_paths, lora_scales, fp8_enabled, device, throttle=throttle)
 
     if cache_enabled and cache_key is not None:
         lora_state_cache.save_to_cache(cache_key, merged_state_dict)
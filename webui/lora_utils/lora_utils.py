@@ -7,10 +7,12 @@ from tqdm import tqdm
 from locales.i18n_extended import translate as _
 
 def merge_lora_to_state_dict(
-    model_files:list[str], lora_files: list[str], multipliers: list[float], fp8_enabled: bool, device: torch.device
+    model_files:list[str], lora_files: list[str], multipliers: list[float], fp8_enabled: bool, device: torch.device,
+    throttle: callable = None
 ) -> dict[str, torch.Tensor]:
     """
     Merge LoRA weights into the state dict of a model.
+    throttle is called once per loaded tensor (used to pace or cancel background builds).
     """
     list_of_lora_sd = []
     for lora_file in lora_files:
@@ -59,9 +61,14 @@ def merge_lora_to_state_dict(
 
     if len(list_of_lora_sd) == 0:
         # no LoRA files found, just load the model
-        return load_safetensors_with_fp8_optimization(model_files, fp8_enabled, device, weight_hook=None)
+        weight_hook = None
+        if throttle is not None:
+            def weight_hook(model_weight_key, model_weight):
+                throttle()
+                return model_weight
+        return load_safetensors_with_fp8_optimization(model_files, fp8_enabled, device, weight_hook=weight_hook)
 
-    return load_safetensors_with_lora_and_fp8(model_files, list_of_lora_sd, multipliers, fp8_enabled, device)
+    return load_safetensors_with_lora_and_fp8(model_files, list_of_lora_sd, multipliers, fp8_enabled, device, throttle=throttle)
 
 
 def convert_from_diffusion_pipe_or_something(lora_sd: dict[str, torch.Tensor], prefix: str) -> dict[str, torch.Tensor]:
@@ -102,6 +109,7 @@ def load_safetensors_with_lora_and_fp8(
     multipliers: list[float],
     fp8_optimization: bool,
     device: torch.device,
+    throttle: callable = None,
 ) -> dict[str, torch.Tensor]:
     """
     Merge LoRA weights into the state dict of a model with fp8 optimization if needed.
@@ -118,6 +126,9 @@ def load_safetensors_with_lora_and_fp8(
     def weight_hook(model_weight_key, model_weight):
         nonlocal list_of_lora_weight_keys, list_of_lora_sd, multipliers
 
+        if throttle is not None:
+            throttle()
+
         if not model_weight_key.endswith(".weight"):
             return model_weight
 
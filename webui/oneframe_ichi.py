@@ -46,6 +46,12 @@ parser.add_argument("--server", type=str, default='127.0.0.1')
 parser.add_argument("--port", type=int, default=8000)
 parser.add_argument("--inbrowser", action='store_true')
 parser.add_argument("--lang", type=str, default='ja', help="Language: ja, zh-tw, en, ru")
+# ヘッドレスモード: Gradio を起動せず、ローカルの API でジョブを受け付ける
+parser.add_argument("--headless", action='store_true', help="Run without the web UI and serve a local job API")
+parser.add_argument("--api-port", type=int, default=8001, help="Port of the headless job API (bound to --server)")
+parser.add_argument("--api-socket", type=str, default=None, help="Serve the headless job API on this UNIX socket instead of TCP")
+parser.add_argument("--api-token", type=str, default=os.environ.get("EICHI_API_TOKEN"),
+                    help="Require 'Authorization: Bearer <token>' on the headless job API (default: $EICHI_API_TOKEN)")
 args = parser.parse_args()
 
 # 翻訳機能の読み込み
@@ -94,6 +100,7 @@ from eichi_utils.notification_utils import play_completion_sound
 
 import queue
 import threading
+import functools
 from typing import Any, Optional  # 型注釈用（_start_job_for_single_taskでAnyを使用）
 from PIL import Image             # 型注釈用（Image.Image）と実処理の両方で使用
 from collections import deque
@@ -126,33 +133,10 @@ def _bytes_to_gb(x: int | float | None) -> float | None:
 
 def _cuda_mem_info():
     """
-    内容: CUDAメモリ情報の取得(可能な環境のみ)
+    内容: CUDAメモリ情報の取得(可能な環境のみ)。実体は eichi_utils.telemetry.cuda_mem_info
     返り値: dict(free_bytes, total_bytes, allocated_bytes, reserved_bytes)
     """
-    info = {"free_bytes": None, "total_bytes": None, "allocated_bytes": None, "reserved_bytes": None}
-    try:
-        import torch
-        if torch.cuda.is_available():
-            try:
-                free_b, total_b = torch.cuda.mem_get_info()
-                info["free_bytes"], info["total_bytes"] = int(free_b), int(total_b)
-            except Exception:
-                pass
-            try:
-                dev = torch.cuda.current_device()
-            except Exception:
-                dev = 0
-            try:
-                info["allocated_bytes"] = int(torch.cuda.memory_allocated(device=dev))
-            except Exception:
-                pass
-            try:
-                info["reserved_bytes"] = int(torch.cuda.memory_reserved(device=dev))
-            except Exception:
-                pass
-    except Exception:
-        pass
-    return info
+    return telemetry.cuda_mem_info()
 
 def _get_mem_snapshot():
     """
@@ -328,7 +312,7 @@ class _UserStop(Exception):
 # --- ブラウザ再接続コア: 共通モジュールから読み込み ---
 import queue as _queue_mod                      # noqa: E402  BUG-5: timeout用
 from eichi_utils.resync_core import (          # noqa: E402
-    FanoutQueue, JobContext, BUS_END_SENTINEL,
+    FanoutQueue, JobContext, BUS_END_SENTINEL, PreviewFileEncoder,
     alloc_ui_session_id as _alloc_ui_session_id_core,
     RESYNC_MIN_INTERVAL_MS, RESYNC_CTX_LINGER_SEC,
     _DEFAULT_GET_TIMEOUT,
@@ -357,7 +341,7 @@ def _snapshot_tap_update(item):
             desc = None
             bar_html = None
         if preview is not None:
-            last_preview_image = preview
+            _set_last_preview(preview)
         if isinstance(desc, str):
             last_progress_desc = desc
         if isinstance(bar_html, str):
@@ -373,6 +357,23 @@ def _snapshot_tap_update(item):
         except Exception:
             pass
 
+    # ヘッドレスサーバーなど、UI 以外の購読先へ転送
+    for _tap in list(_extra_publish_taps):
+        try:
+            _tap(item)
+        except Exception:
+            pass
+
+
+# _snapshot_tap_update から追加で呼ぶコールバック fn(item) (ヘッドレスモードで使用)
+_extra_publish_taps = []
+
+
+def _set_last_preview(preview):
+    """last_preview_image を差し替え、参照中のプレビューファイルを削除されないよう登録する"""
+    global last_preview_image
+    last_preview_image = preview
+    _bus_preview_encoder.hold("last_preview_image", preview)
 
 # ----------------- globals -----------------
 ctx_lock = threading.Lock()
@@ -410,6 +411,7 @@ queue_enabled = False  # キュー機能の有効/無効フラグ
 queue_type = "prompt"  # キューのタイプ（"prompt" または "image"）
 prompt_queue_file_path = None  # プロンプトキューファイルのパス
 image_queue_files = []  # イメージキューのファイルリスト
+image_queue_prefetcher = None  # イメージキューの先読み（process()の実行中のみ）
 input_folder_name_value = "inputs"
 reference_input_folder_name_value = "references"
 reference_queue_files = []
@@ -436,6 +438,8 @@ last_start_options = {}
 # 画像の一時保存先（プロセスを跨いだ再同期に備える）
 temp_cache_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp_cache")
 os.makedirs(temp_cache_dir, exist_ok=True)
+# サンプリング中のプレビューは publish ごとに一度だけ PNG にし、全タブで同じファイルを参照する
+_bus_preview_encoder = PreviewFileEncoder(temp_cache_dir)
 
 # --- Resync/追随の調整値（秒） ---
 # RESYNC_CTX_LINGER_SEC は resync_core からインポート済み（line 333）
@@ -452,8 +456,9 @@ _ACTIVE_RESYNCS: _OrderedDict = _OrderedDict()  # ui_session_id -> last_started_
 
 _LIVE_STREAMING: set = set()         # 今まさにストリーム中の ui_session_id
 
-# BUG-6修正: ロールオーバーループのデッドライン (秒)
-# HANG-H1修正: デッドラインを短縮（120s→30s）しスレッド枯渇リスクを低減
+# BUG-6修正: ロールオーバーの谷間で次の ctx を待つデッドライン (秒)
+# 追随は async ジェネレータでスレッドを占有しないため、ジョブを跨いだ追随全体ではなく
+# 谷間の待ち時間だけを区切る (新しい ctx へ繋ぐたびに延長)
 _ROLLOVER_DEADLINE_SEC = 30.0
 
 
@@ -552,6 +557,122 @@ def _pre_gc_before_next_lora(next_cache_path: "str|None"):
         _cleanup_cuda("LoRA切替前")
 
 
+# ===== ジョブ開始前のメモリ見積もり（プリフライト） =====
+# プリフライトで LoRA キャッシュを無効化した場合の元の値（process() の終了時に戻す）
+_PREFLIGHT_PREV_LORA_CACHE = None
+# プリフライトで VAE のタイリングを有効化した（ジョブの間は high_vram でも setup_vae_if_loaded でタイリングする）
+_preflight_vae_tiling = False
+
+
+def _restore_preflight_settings():
+    """プリフライトで変えた設定（LoRA キャッシュの無効化・VAE のタイリング）を元に戻す"""
+    global _PREFLIGHT_PREV_LORA_CACHE, _preflight_vae_tiling
+    if _PREFLIGHT_PREV_LORA_CACHE is not None:
+        lora_state_cache.set_cache_enabled(_PREFLIGHT_PREV_LORA_CACHE)
+        _PREFLIGHT_PREV_LORA_CACHE = None
+    if _preflight_vae_tiling:
+        _preflight_vae_tiling = False
+        # 低VRAMモードでは元からタイリングしているので戻さない
+        if vae is not None and high_vram:
+            vae.disable_tiling()
+
+
+def _restoring_preflight_settings(process_fn):
+    """process() 用のデコレータ。
+
+    早期 return・ユーザー中断・例外・ジェネレータの破棄のどの経路で終わっても、
+    プリフライトで変えた設定を次のジョブへ持ち越さないように戻す。
+    """
+    @functools.wraps(process_fn)
+    def wrapper(*args, **kwargs):
+        try:
+            yield from process_fn(*args, **kwargs)
+        finally:
+            _restore_preflight_settings()
+    return wrapper
+
+
+def _preflight_lora_paths(use_lora, lora_mode, lora_files, lora_files2, lora_files3, lora_dropdowns):
+    """process() の引数から LoRA ファイルのパスを求める（見積もり用。見つからないファイルは無視する）"""
+    if not _to_bool(use_lora):
+        return []
+    paths = []
+    if lora_mode == translate("ディレクトリから選択"):
+        lora_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lora')
+        for raw in lora_dropdowns:
+            val = raw.value if hasattr(raw, "value") else raw
+            val = (str(val) if val is not None else "").strip()
+            if not val or val == translate("なし"):
+                continue
+            try:
+                path = safe_path_join(lora_dir, os.path.basename(val))
+            except Exception:
+                continue
+            if os.path.isfile(path):
+                paths.append(path)
+    else:
+        for obj in (lora_files, lora_files2, lora_files3):
+            for f in (obj if isinstance(obj, list) else [obj]):
+                if getattr(f, 'name', None):
+                    paths.append(f.name)
+    return paths
+
+
+def _preflight_job(profile):
+    """
+    内容: ジョブを始める前に VRAM/RAM のピークを見積もり、足りなければ設定を変える。
+    - RAM不足見込み: LoRAキャッシュを無効化（process() の終了時に復元）
+    - VRAM不足見込み: VAEのタイリングを有効化
+    戻り値: PreflightResult（EICHI_PREFLIGHT=off や見積もりに失敗した場合は None）
+    """
+    global _PREFLIGHT_PREV_LORA_CACHE, _preflight_vae_tiling
+    _restore_preflight_settings()
+    mode = preflight_mode()
+    if mode == "off":
+        return None
+    try:
+        vram_budget = None
+        if torch.cuda.is_available():
+            vram_budget = torch.cuda.get_device_properties(gpu).total_memory / (1024 ** 3)
+        avail_gb = _host_mem_available_gb()
+        rss_gb = process_rss_gb()
+        # RAM はこのプロセスが今使っている分＋空き容量まで使える
+        ram_budget = avail_gb + rss_gb if (avail_gb is not None and rss_gb is not None) else None
+        profile = profile._replace(vram_total_gb=vram_budget)
+        result = get_estimator().preflight(profile, vram_budget, ram_budget, allow_reject=(mode == "on"))
+    except Exception as e:
+        print(translate("メモリ見積もりに失敗しました: {0}").format(e))
+        return None
+
+    print(translate("メモリ見積もり: VRAM {0:.1f}GB / RAM {1:.1f}GB").format(result.estimate.vram_gb, result.estimate.ram_gb))
+    if result.action == "reject":
+        return result
+    if "lora_cache" in result.changes:
+        _PREFLIGHT_PREV_LORA_CACHE = lora_state_cache.is_cache_enabled()
+        lora_state_cache.set_cache_enabled(False)
+        lora_state_cache._inmem_clear()
+        print(translate("RAM不足の見込みのため、このジョブではLoRAキャッシュを無効化します"))
+    if "vae_tiling" in result.changes:
+        _preflight_vae_tiling = True
+        if vae is not None:
+            vae.enable_tiling()
+        print(translate("VRAM不足の見込みのため、VAEのタイリングを有効化します"))
+    return result
+
+
+def _finish_job_memory(preflight, monitor, profile, completed):
+    """ジョブの VRAM/RAM の実測を止め、完了したジョブなら見積もりと一緒に記録する"""
+    if monitor is None:
+        return
+    try:
+        vram_gb, ram_gb = monitor.stop()
+        if completed and preflight is not None:
+            estimator = get_estimator()
+            estimator.record(profile, estimator.predict(profile), vram_gb, ram_gb)
+    except Exception as e:
+        print(translate("メモリ実測の記録に失敗しました: {0}").format(e))
+
+
 # ===== 
 
 
@@ -618,6 +739,9 @@ def _preview_update(
     - 画像が None の場合でも、force_visible=True ならコンポーネントを可視化する。
     - 画像がある場合は必ず visible=True で表示を確実に切り替える。
     """
+    if isinstance(img, str) and not os.path.exists(img):
+        # 削除済みのプレビューファイルは渡さない (Gradio が存在しないパスでエラーになる)
+        img = None
     if img is None:
         return gr.update(visible=True) if force_visible else gr.update()
     return gr.update(visible=True, value=img)
@@ -824,7 +948,7 @@ def _start_job_for_single_task(*worker_args, owner_sid=None, **worker_kwargs) ->
     F-2修正: owner_sidをパラメータで受け取り、グローバル変数経由の競合を排除。
     """
     global generation_active, cur_job
-    ctx = JobContext(on_publish_tap=_snapshot_tap_update)
+    ctx = JobContext(on_publish_tap=_snapshot_tap_update, preview_encoder=_bus_preview_encoder)
     ctx.owner_sid = owner_sid
 
     # ジョブ専用のstreamとフラグを持たせる
@@ -843,6 +967,171 @@ def _start_job_for_single_task(*worker_args, owner_sid=None, **worker_kwargs) ->
     return ctx
 
 
+def _ui_frame_for_bus_item(ctx: "JobContext", item):
+    """
+    イベントバスの 1 件を UI 9項目のフレームに変換する（同期/非同期の追随ストリームで共通）。
+    返り値: (frame, finished)
+      frame    : _gui_frame_status_all の 9 要素。返すものがなければ None
+      finished : True ならこのジョブの追随を終える
+    """
+    global last_progress_desc, last_progress_bar, last_preview_image
+    global last_output_filename, current_seed, batch_stopped
+    global stop_after_current, stop_after_step, last_stop_mode
+    global progress_ref_idx, progress_ref_total, progress_img_idx, progress_img_total
+
+    # BUG-10修正: 不正な None アイテムの防御
+    if item is None or not isinstance(item, tuple):
+        return None, False
+    if item == BUS_END_SENTINEL:
+        # 完了（まとめの最終フレーム）
+        last_stop_mode = ctx.stop_mode
+        stop_after_current = False
+        stop_after_step = False
+        progress_summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} ,実施予定数 {progress_img_idx}/{progress_img_total}"
+        if batch_stopped:
+            completion_message = translate("バッチ処理が中止されました（{0}/{1}）").format(progress_img_idx, progress_img_total)
+        else:
+            completion_message = translate("バッチ処理が完了しました（{0}/{1}）").format(progress_img_idx, progress_img_total)
+        completion_message = f"{completion_message} - {progress_summary}"
+        last_progress_desc = completion_message
+        last_progress_bar  = ''
+
+        frame = _gui_frame_status_all(
+            _result_update(last_output_filename),
+            _preview_update(last_preview_image),
+            completion_message,
+            '',
+            gr.update(interactive=True,  value=translate("Start Generation")),
+            gr.update(interactive=False, value=translate("End Generation")),
+            gr.update(interactive=False, value=translate("この生成で打ち切り")),
+            gr.update(interactive=False, value=translate("このステップで打ち切り")),
+            (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
+        )
+        return frame, True
+
+    # ==== 通常イベント ====
+    etype, payload = item
+
+    if etype == "file":
+        # 生成途中/完了ファイル通知
+        file_path = payload
+        if file_path:
+            last_output_filename = file_path
+        end_enabled = is_generation_running() and (ctx.stop_mode is None)
+        frame = _gui_frame_status_all(
+            _result_update(last_output_filename),
+            gr.update(),
+            gr.update(),
+            gr.update(),
+            gr.update(interactive=False, value=translate("Start Generation")),
+            gr.update(interactive=end_enabled, value=translate("End Generation")),
+            gr.update(interactive=True),
+            gr.update(interactive=True),
+            (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
+        )
+        return frame, False
+
+    elif etype == "progress":
+        preview, desc_md, bar_html = payload
+        if preview is not None:
+            _set_last_preview(preview)
+        last_progress_desc = desc_md
+        last_progress_bar  = bar_html
+        end_enabled = is_generation_running() and (ctx.stop_mode is None)
+        frame = _gui_frame_status_all(
+            _result_update(last_output_filename),
+            _preview_update(last_preview_image, force_visible=True),
+            last_progress_desc,
+            last_progress_bar,
+            gr.update(interactive=False, value=translate("Start Generation")),
+            gr.update(interactive=end_enabled, value=translate("End Generation")),
+            gr.update(interactive=True),
+            gr.update(interactive=True),
+            (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
+        )
+        return frame, False
+
+    elif etype == "seed":
+        current_seed = payload
+        frame = _gui_frame_status_all(
+            _result_update(last_output_filename),
+            _preview_update(last_preview_image, force_visible=True),
+            gr.update(),
+            gr.update(),
+            gr.update(interactive=False, value=translate("Start Generation")),
+            gr.update(interactive=True,  value=translate("End Generation")),
+            gr.update(interactive=True),
+            gr.update(interactive=True),
+            gr.update(value=current_seed),
+        )
+        return frame, False
+
+    elif etype == "end":
+        # ドライバ側から明示完了
+        # ctx（画像）単位の終了イベント。バッチ継続中は「完了」表現を避ける
+        if is_generation_running():
+            _summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} , 実施予定数 {progress_img_idx}/{progress_img_total}"
+            last_progress_desc = _summary
+            last_progress_bar  = ''
+            frame = _gui_frame_status_all(
+                _result_update(last_output_filename),
+                _preview_update(last_preview_image, force_visible=True),
+                last_progress_desc,
+                last_progress_bar,
+                gr.update(interactive=False, value=translate("Start Generation")),
+                gr.update(interactive=True,  value=translate("End Generation")),
+                gr.update(interactive=True),
+                gr.update(interactive=True),
+                (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
+            )
+            return frame, True
+        last_stop_mode = ctx.stop_mode
+        stop_after_current = False
+        stop_after_step = False
+        progress_summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} ,実施予定数 {progress_img_idx}/{progress_img_total}"
+        if batch_stopped:
+            completion_message = translate("バッチ処理が中断されました（{0}/{1}）").format(progress_img_idx, progress_img_total)
+        else:
+            completion_message = translate("バッチ処理が完了しました（{0}/{1}）").format(progress_img_idx, progress_img_total)
+        completion_message = f"{completion_message} - {progress_summary}"
+        last_progress_desc = completion_message
+        last_progress_bar  = ''
+        frame = _gui_frame_status_all(
+            _result_update(last_output_filename),
+            _preview_update(last_preview_image),
+            completion_message,
+            '',
+            gr.update(interactive=True,  value=translate("Start Generation")),
+            gr.update(interactive=False, value=translate("End Generation")),
+            gr.update(interactive=False, value=translate("この生成で打ち切り")),
+            gr.update(interactive=False, value=translate("このステップで打ち切り")),
+            (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
+        )
+        return frame, True
+
+    # 未知イベントはスキップ（keepalive 等）
+    return None, False
+
+
+def _mark_owner_stream(ctx: "JobContext", owner: bool, connected: bool):
+    """起点タブ（生成開始タブ）の接続フラグを更新する。切断時は切断時刻も記録する。"""
+    if not owner:
+        return
+    import time as _tmod
+    try:
+        ctx.owner_connected = connected
+        if connected:
+            return
+        ctx.owner_disconnected_at = _tmod.monotonic()
+        if is_generation_running():
+            try:
+                print(translate("生成開始クライアントの接続が切断されました。バックグラウンドで継続します。"))
+            except Exception:
+                pass
+    except Exception:
+        pass
+
+
 def _stream_job_to_ui(ctx: "JobContext", owner: bool = False):
     """
     進行中ジョブ ctx のイベントバスを購読し、UI 9項目を逐次更新するジェネレータ。
@@ -857,20 +1146,10 @@ def _stream_job_to_ui(ctx: "JobContext", owner: bool = False):
       6: stop_after_button (update)
       7: stop_step_button  (update)
       8: seed
+    追随するだけのタブは、スレッドを占有しない _stream_job_to_ui_async を使う。
     """
-
-    import time as _tmod
     # 起点タブの接続フラグ（生成開始タブがストリームを張っている間 True）
-    if owner:
-        try:
-            ctx.owner_connected = True
-        except Exception:
-            pass
-
-    global last_progress_desc, last_progress_bar, last_preview_image
-    global last_output_filename, current_seed, batch_stopped
-    global stop_after_current, stop_after_step, last_stop_mode
-    global progress_ref_idx, progress_ref_total, progress_img_idx, progress_img_total
+    _mark_owner_stream(ctx, owner, True)
 
     # ==== ライブ購読開始 ====
     # 購読時点の bus を保持しておく（後で ctx.bus が差し替わっても安全に解除できるように）
@@ -885,153 +1164,50 @@ def _stream_job_to_ui(ctx: "JobContext", owner: bool = False):
             except _queue_mod.Empty:
                 # worker が死亡して bus.close() が呼ばれなかった場合
                 break
-            # BUG-10修正: 不正な None アイテムの防御
-            if item is None or not isinstance(item, tuple):
-                continue
-            if item == BUS_END_SENTINEL:
-                # 完了（まとめの最終フレーム）
-                last_stop_mode = ctx.stop_mode
-                stop_after_current = False
-                stop_after_step = False
-                progress_summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} ,実施予定数 {progress_img_idx}/{progress_img_total}"
-                if batch_stopped:
-                    completion_message = translate("バッチ処理が中止されました（{0}/{1}）").format(progress_img_idx, progress_img_total)
-                else:
-                    completion_message = translate("バッチ処理が完了しました（{0}/{1}）").format(progress_img_idx, progress_img_total)
-                completion_message = f"{completion_message} - {progress_summary}"
-                last_progress_desc = completion_message
-                last_progress_bar  = ''
-
-                yield _gui_frame_status_all(
-                    _result_update(last_output_filename),
-                    _preview_update(last_preview_image),
-                    completion_message,
-                    '',
-                    gr.update(interactive=True,  value=translate("Start Generation")),
-                    gr.update(interactive=False, value=translate("End Generation")),
-                    gr.update(interactive=False, value=translate("この生成で打ち切り")),
-                    gr.update(interactive=False, value=translate("このステップで打ち切り")),
-                    (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
-                )
+            frame, finished = _ui_frame_for_bus_item(ctx, item)
+            if frame is not None:
+                yield frame
+            if finished:
                 break
 
-            # ==== 通常イベント ====
-            etype, payload = item
+    finally:
+        # 所有者（生成開始タブ）の切断検知（UIストリーム終了時）
+        _mark_owner_stream(ctx, owner, False)
+        # --- 解除は購読時点の bus に対して行う（多重/差し替えにも対応させる） ---
+        try:
+            bus_ref.unsubscribe(q)
+        except Exception:
+            pass
 
-            if etype == "file":
-                # 生成途中/完了ファイル通知
-                file_path = payload
-                if file_path:
-                    last_output_filename = file_path
-                end_enabled = is_generation_running() and (ctx.stop_mode is None)
-                yield _gui_frame_status_all(
-                    _result_update(last_output_filename),
-                    gr.update(),
-                    gr.update(),
-                    gr.update(),
-                    gr.update(interactive=False, value=translate("Start Generation")),
-                    gr.update(interactive=end_enabled, value=translate("End Generation")),
-                    gr.update(interactive=True),
-                    gr.update(interactive=True),
-                    (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
-                )
 
-            elif etype == "progress":
-                preview, desc_md, bar_html = payload
-                if preview is not None:
-                    last_preview_image = preview
-                last_progress_desc = desc_md
-                last_progress_bar  = bar_html
-                end_enabled = is_generation_running() and (ctx.stop_mode is None)
-                yield _gui_frame_status_all(
-                    _result_update(last_output_filename),
-                    _preview_update(last_preview_image, force_visible=True),
-                    last_progress_desc,
-                    last_progress_bar,
-                    gr.update(interactive=False, value=translate("Start Generation")),
-                    gr.update(interactive=end_enabled, value=translate("End Generation")),
-                    gr.update(interactive=True),
-                    gr.update(interactive=True),
-                    (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
-                )
+async def _stream_job_to_ui_async(ctx: "JobContext", owner: bool = False):
+    """
+    _stream_job_to_ui の asyncio 版（出力は同じ 9 項目）。
+    FanoutQueue.subscribe_async() で購読し、イベントは loop.call_soon_threadsafe で届くので、
+    追随するタブはスレッドではなくコルーチン 1 つで済む。
+    """
+    _mark_owner_stream(ctx, owner, True)
 
-            elif etype == "seed":
-                current_seed = payload
-                yield _gui_frame_status_all(
-                    _result_update(last_output_filename),
-                    _preview_update(last_preview_image, force_visible=True),
-                    gr.update(),
-                    gr.update(),
-                    gr.update(interactive=False, value=translate("Start Generation")),
-                    gr.update(interactive=True,  value=translate("End Generation")),
-                    gr.update(interactive=True),
-                    gr.update(interactive=True),
-                    gr.update(value=current_seed),
-                )
+    bus_ref = ctx.bus
+    sub = bus_ref.subscribe_async()
 
-            elif etype == "end":
-                # ドライバ側から明示完了
-                # ctx（画像）単位の終了イベント。バッチ継続中は「完了」表現を避ける
-                if is_generation_running():
-                    _summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} , 実施予定数 {progress_img_idx}/{progress_img_total}"
-                    last_progress_desc = _summary
-                    last_progress_bar  = ''
-                    yield _gui_frame_status_all(
-                        _result_update(last_output_filename),
-                        _preview_update(last_preview_image, force_visible=True),
-                        last_progress_desc,
-                        last_progress_bar,
-                        gr.update(interactive=False, value=translate("Start Generation")),
-                        gr.update(interactive=True,  value=translate("End Generation")),
-                        gr.update(interactive=True),
-                        gr.update(interactive=True),
-                        (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
-                    )
-                    break
-                last_stop_mode = ctx.stop_mode
-                stop_after_current = False
-                stop_after_step = False
-                progress_summary = f"参考画像 {progress_ref_idx}/{progress_ref_total} ,実施予定数 {progress_img_idx}/{progress_img_total}"
-                if batch_stopped:
-                    completion_message = translate("バッチ処理が中断されました（{0}/{1}）").format(progress_img_idx, progress_img_total)
-                else:
-                    completion_message = translate("バッチ処理が完了しました（{0}/{1}）").format(progress_img_idx, progress_img_total)
-                completion_message = f"{completion_message} - {progress_summary}"
-                last_progress_desc = completion_message
-                last_progress_bar  = ''
-                yield _gui_frame_status_all(
-                    _result_update(last_output_filename),
-                    _preview_update(last_preview_image),
-                    completion_message,
-                    '',
-                    gr.update(interactive=True,  value=translate("Start Generation")),
-                    gr.update(interactive=False, value=translate("End Generation")),
-                    gr.update(interactive=False, value=translate("この生成で打ち切り")),
-                    gr.update(interactive=False, value=translate("このステップで打ち切り")),
-                    (gr.update(value=current_seed) if current_seed is not None else gr.skip()),
-                )
+    try:
+        while True:
+            try:
+                item = await sub.get(timeout=_DEFAULT_GET_TIMEOUT)
+            except _queue_mod.Empty:
+                # worker が死亡して bus.close() が呼ばれなかった場合
+                break
+            frame, finished = _ui_frame_for_bus_item(ctx, item)
+            if frame is not None:
+                yield frame
+            if finished:
                 break
-
-            else:
-                # 未知イベントはスキップ（keepalive 等）
-                pass
 
     finally:
-        # 所有者（生成開始タブ）の切断検知（UIストリーム終了時）
-        if owner:
-            try:
-                ctx.owner_connected = False
-                ctx.owner_disconnected_at = _tmod.monotonic()
-                if is_generation_running():
-                    try:
-                        print(translate("生成開始クライアントの接続が切断されました。バックグラウンドで継続します。"))
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-        # --- 解除は購読時点の bus に対して行う（多重/差し替えにも対応させる） ---
+        _mark_owner_stream(ctx, owner, False)
         try:
-            bus_ref.unsubscribe(q)
+            sub.close()
         except Exception:
             pass
 
@@ -1052,7 +1228,7 @@ from datetime import datetime, timedelta
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from eichi_utils.png_metadata import (
     embed_metadata_to_png, extract_metadata_from_png,
-    PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY
+    PROMPT_KEY, SEED_KEY, SECTION_PROMPT_KEY, SECTION_NUMBER_KEY, SEED_BATCH_INDEX_KEY
 )
 
 
@@ -1204,6 +1380,15 @@ from eichi_utils import prompt_cache, lora_state_cache
 from eichi_utils.path_utils import safe_path_join, ensure_dir
 from eichi_utils.error_utils import log_and_continue
 from eichi_utils.favorite_settings_manager import load_favorites, save_favorite, delete_favorite
+from eichi_utils.preview_service import PreviewService, make_latent_preview_renderer
+from eichi_utils.encode_cache import cached_vae_encode, cached_clip_vision_encode
+from eichi_utils import telemetry
+from eichi_utils.seed_batch import choose_seed_batch_size, plan_sample_batches, expand_to_batch
+from eichi_utils.conditioning_memo import image_source_key
+from eichi_utils.image_prefetch import ImagePrefetcher
+from eichi_utils.memory_estimator import (
+    JobProfile, JobMemoryMonitor, get_estimator, lora_rank, preflight_mode, process_rss_gb,
+)
 
 
 gr = spinner_while_running(
@@ -1634,8 +1819,8 @@ sample_hunyuan = spinner_while_running(
         importlib.import_module("diffusers_helper.memory").gpu,
         importlib.import_module("diffusers_helper.memory").gpu_complete_modules,
         importlib.import_module("diffusers_helper.memory").get_cuda_free_memory_gb,
-        importlib.import_module("diffusers_helper.memory").move_model_to_device_with_memory_preservation,
-        importlib.import_module("diffusers_helper.memory").offload_model_from_device_for_memory_preservation,
+        importlib.import_module("eichi_utils.module_placement").move_model_to_device_with_memory_preservation,
+        importlib.import_module("eichi_utils.module_placement").offload_model_from_device_for_memory_preservation,
         importlib.import_module("diffusers_helper.memory").fake_diffusers_current_device,
         importlib.import_module("diffusers_helper.memory").DynamicSwapInstaller,
         importlib.import_module("diffusers_helper.memory").unload_complete_models,
@@ -1864,6 +2049,8 @@ def setup_vae_if_loaded():
         if not high_vram:
             vae.enable_slicing()
             vae.enable_tiling()
+        elif _preflight_vae_tiling:
+            vae.enable_tiling()
         vae.to(dtype=torch.float16)
         vae.requires_grad_(False)
         if high_vram:
@@ -1994,7 +2181,8 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
            batch_index=None, use_queue=False, prompt_queue_file=None,
            # Kisekaeichi関連のパラメータ
            use_reference_image=False, reference_image=None,
-           target_index=1, history_index=13, reference_long_edge=False, input_mask=None, reference_mask=None):
+           target_index=1, history_index=13, reference_long_edge=False, input_mask=None, reference_mask=None,
+           seed_batch_size=1, reference_batch=None):
     
     # ローカル参照で tokenizer を退避（swap時の UnboundLocalError を防止）
     tok1, tok2 = tokenizer, tokenizer_2
@@ -2038,6 +2226,9 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
     outputs_folder = ensure_dir(outputs_folder, "outputs")
     os.makedirs(outputs_folder, exist_ok=True)
 
+    # EICHI_TELEMETRY が有効ならこのジョブのメモリと処理区間を出力フォルダへ記録する (worker の finally で書き出す)
+    telemetry.start_job(job_id, outputs_folder)
+
     # 処理時間計測の開始
     process_start_dt = datetime.now()
 
@@ -2526,8 +2717,16 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
         # 入力画像の処理
         push_progress(None, '', 0, '[THEME=cyan]Image processing ...')
         
+        # イメージキューの画像は先読み済みのもの（デコード・リサイズ済み）を使う
+        prefetcher = image_queue_prefetcher
+        prefetched = prefetcher.get(input_image, resolution) if prefetcher is not None and isinstance(input_image, str) else None
+
         # 入力画像がNoneの場合はデフォルトの黒い画像を作成
-        if input_image is None:
+        if prefetched is not None:
+            print(translate("イメージキュー: 先読み済みの画像を使用します: {0}").format(os.path.basename(prefetched.path)))
+            input_image_np = prefetched.image
+            height, width = prefetched.height, prefetched.width
+        elif input_image is None:
             print(translate("入力画像が指定されていないため、黒い画像を生成します"))
             # 指定された解像度の黒い画像を生成（デフォルトは640x640）
             height = width = resolution
@@ -2603,7 +2802,8 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
             with torch.no_grad():  # 明示的にno_gradコンテキストを使用
                 # 効率的な処理のために入力をGPUで処理
                 input_image_gpu = input_image_pt.to(gpu)
-                start_latent = vae_encode(input_image_gpu, vae)
+                with telemetry.span("VAE encode"):
+                    start_latent = cached_vae_encode(input_image_np, input_image_gpu, vae, vae_encode)
                 
                 # 入力をCPUに戻す
                 del input_image_gpu
@@ -2638,62 +2838,85 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
         reference_encoder_output = None
         
         if use_reference_image and reference_image is not None:
-            print(translate("着せ替え参照画像を処理します: {0}").format(reference_image))
-            push_progress(None, '', 33, '[THEME=cyan]Processing reference image ...')
-            
+            # 参照画像バッチ: バッチ内の各サンプルの参照画像（同じ参照画像は1回だけ読み込み・エンコードする）
+            reference_paths = list(reference_batch) if reference_batch else [reference_image]
+            reference_latents = {}
             try:
-                # 参照画像をロード
-                from PIL import Image
-                ref_img = Image.open(reference_image)
-                ref_image_np = np.array(ref_img)
-                if len(ref_image_np.shape) == 2:  # グレースケール画像の場合
-                    ref_image_np = np.stack((ref_image_np,) * 3, axis=-1)
-                elif ref_image_np.shape[2] == 4:  # アルファチャンネル付きの場合
-                    ref_image_np = ref_image_np[:, :, :3]
-                
-                # 同じサイズにリサイズ（入力画像と同じ解像度を使用）
-                if reference_long_edge:
-                    ref_image_np = resize_and_pad_with_edge_color(ref_image_np, target_width=width, target_height=height)
-                else:
-                    ref_image_np = resize_and_center_crop(ref_image_np, target_width=width, target_height=height)
-                ref_image_pt = torch.from_numpy(ref_image_np).float() / 127.5 - 1
-                ref_image_pt = ref_image_pt.permute(2, 0, 1)[None, :, None]
+                for ref_i, ref_path in enumerate(dict.fromkeys(reference_paths)):
+                    print(translate("着せ替え参照画像を処理します: {0}").format(ref_path))
+                    push_progress(None, '', 33, '[THEME=cyan]Processing reference image ...')
+
+                    # 参照画像をロード
+                    from PIL import Image
+                    ref_img = Image.open(ref_path)
+                    ref_image_np = np.array(ref_img)
+                    if len(ref_image_np.shape) == 2:  # グレースケール画像の場合
+                        ref_image_np = np.stack((ref_image_np,) * 3, axis=-1)
+                    elif ref_image_np.shape[2] == 4:  # アルファチャンネル付きの場合
+                        ref_image_np = ref_image_np[:, :, :3]
+                    
+                    # 同じサイズにリサイズ（入力画像と同じ解像度を使用）
+                    if reference_long_edge:
+                        ref_image_np = resize_and_pad_with_edge_color(ref_image_np, target_width=width, target_height=height)
+                    else:
+                        ref_image_np = resize_and_center_crop(ref_image_np, target_width=width, target_height=height)
+                    ref_image_pt = torch.from_numpy(ref_image_np).float() / 127.5 - 1
+                    ref_image_pt = ref_image_pt.permute(2, 0, 1)[None, :, None]
 
-                if save_input_images:
-                    try:
-                        Image.fromarray(ref_image_np).save(os.path.join(outputs_folder, f'{job_id}_input_reference.png'))
-                    except Exception as e:
-                        print(translate("参照画像の保存に失敗しました: {0}").format(e))
-                
-                # VAEエンコード（参照画像）
-                # vae が既にロード済みなら再ロードしない（low-VRAM時のRAM二重使用を回避）
-                if vae is None:
-                    vae = AutoencoderKLHunyuanVideo.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='vae', torch_dtype=torch.float16).cpu()
-                    setup_vae_if_loaded()
-                load_model_as_complete(vae, target_device=gpu)
-                
-                with torch.no_grad():  # 明示的にno_gradコンテキストを使用
-                    ref_image_gpu = ref_image_pt.to(gpu)
-                    reference_latent = vae_encode(ref_image_gpu, vae)
-                    del ref_image_gpu
-                
-                if not high_vram:
-                    vae.to('cpu')
-                
-                # CLIP Visionエンコード（参照画像）
-                if image_encoder is None or not high_vram:
+                    if save_input_images:
+                        try:
+                            ref_suffix = '' if ref_i == 0 else f'_{ref_i}'
+                            Image.fromarray(ref_image_np).save(os.path.join(outputs_folder, f'{job_id}_input_reference{ref_suffix}.png'))
+                        except Exception as e:
+                            print(translate("参照画像の保存に失敗しました: {0}").format(e))
+                    
+                    # VAEエンコード（参照画像）
+                    # vae が既にロード済みなら再ロードしない（low-VRAM時のRAM二重使用を回避）
+                    if vae is None:
+                        vae = AutoencoderKLHunyuanVideo.from_pretrained("hunyuanvideo-community/HunyuanVideo", subfolder='vae', torch_dtype=torch.float16).cpu()
+                        setup_vae_if_loaded()
+                    load_model_as_complete(vae, target_device=gpu)
+                    
+                    with torch.no_grad():  # 明示的にno_gradコンテキストを使用
+                        ref_image_gpu = ref_image_pt.to(gpu)
+                        # バッチごとに同じ参照画像を再エンコードしない
+                        reference_latents[ref_path] = cached_vae_encode(ref_image_np, ref_image_gpu, vae, vae_encode)
+                        del ref_image_gpu
+                    
+                    if not high_vram:
+                        vae.to('cpu')
+                    
+                    # CLIP Visionエンコード（参照画像）
+                    # high_vram でロード済みの画像エンコーダはGPUに常駐しているので載せ直さない
+                    _ref_encoder_resident = image_encoder is not None and high_vram
                     if image_encoder is None:
                         image_encoder = SiglipVisionModel.from_pretrained("lllyasviel/flux_redux_bfl", subfolder='image_encoder', torch_dtype=torch.float16).cpu()
                         setup_image_encoder_if_loaded()
-                    load_model_as_complete(image_encoder, target_device=gpu)
-                
-                _ref_enc_out = hf_clip_vision_encode(ref_image_np, feature_extractor, image_encoder)
-                # OOM-7修正: 全ModelOutputを保持せず、使用有無フラグのみ残す
-                reference_encoder_output = (_ref_enc_out is not None)  # bool
-                del _ref_enc_out
 
-                if not high_vram:
-                    image_encoder.to('cpu')
+                    # キャッシュヒット時は画像エンコーダをGPUへロードしない
+                    _ref_encoder_loaded = []
+
+                    def _load_ref_encoder():
+                        load_model_as_complete(image_encoder, target_device=gpu)
+                        _ref_encoder_loaded.append(True)
+
+                    _ref_enc_out = cached_clip_vision_encode(
+                        ref_image_np, feature_extractor, image_encoder, hf_clip_vision_encode, device=gpu,
+                        load_fn=None if _ref_encoder_resident else _load_ref_encoder,
+                    )
+                    # OOM-7修正: 全ModelOutputを保持せず、使用有無フラグのみ残す
+                    reference_encoder_output = (_ref_enc_out is not None)  # bool
+                    del _ref_enc_out
+
+                    if _ref_encoder_loaded and not high_vram:
+                        image_encoder.to('cpu')
+
+                # サンプルごとの参照画像latentをバッチ次元に並べる（単体なら [1, C, 1, H, W] のまま）
+                if len(reference_paths) > 1:
+                    reference_latent = torch.cat([reference_latents[p] for p in reference_paths], dim=0)
+                else:
+                    reference_latent = reference_latents[reference_paths[0]]
+                del reference_latents
 
                 print(translate("参照画像の処理が完了しました"))
                 
@@ -2720,17 +2943,24 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     image_encoder = SiglipVisionModel.from_pretrained("lllyasviel/flux_redux_bfl", subfolder='image_encoder', torch_dtype=torch.float16).cpu()
                     setup_image_encoder_if_loaded()  # 画像エンコーダの設定を適用
             
-            if not high_vram:
-                print(translate("画像エンコーダをGPUにロード..."))
-                load_model_as_complete(image_encoder, target_device=gpu)
-            
-            # CLIP Vision エンコード実行
-            image_encoder_output = hf_clip_vision_encode(input_image_np, feature_extractor, image_encoder)
-            image_encoder_last_hidden_state = image_encoder_output.last_hidden_state
-            del image_encoder_output  # OOM-2修正: 全ModelOutputを即解放（last_hidden_stateのみ保持）
+            # キャッシュヒット時は画像エンコーダをGPUへロードしない
+            _encoder_loaded = []
+
+            def _load_encoder():
+                if not high_vram:
+                    print(translate("画像エンコーダをGPUにロード..."))
+                    load_model_as_complete(image_encoder, target_device=gpu)
+                _encoder_loaded.append(True)
+
+            # CLIP Vision エンコード実行（OOM-2修正: ModelOutputは保持せずlast_hidden_stateのみ受け取る）
+            with telemetry.span("CLIP Vision encode"):
+                image_encoder_last_hidden_state = cached_clip_vision_encode(
+                    input_image_np, feature_extractor, image_encoder, hf_clip_vision_encode, device=gpu,
+                    load_fn=_load_encoder,
+                )
 
             # ローVRAMモードでは使用後すぐにCPUに戻す
-            if not high_vram:
+            if _encoder_loaded and not high_vram:
                 image_encoder.to('cpu')
                 
                 # メモリ状態をログ
@@ -3028,13 +3258,14 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                 print(translate("プロンプトソース: {0}").format(prompt_source))
                 print(translate("プロンプト全文: {0}").format(full_prompt))
                 print(translate("プロンプトをエンコードしています..."))
-                llama_vec, clip_l_pooler = encode_prompt_conds(full_prompt, text_encoder, text_encoder_2, tok1, tok2)
+                with telemetry.span("text encode"):
+                    llama_vec, clip_l_pooler = encode_prompt_conds(full_prompt, text_encoder, text_encoder_2, tok1, tok2)
 
-                if cfg == 1:
-                    llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
-                else:
-                    print(translate("ネガティブプロンプトをエンコードしています..."))
-                    llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tok1, tok2)
+                    if cfg == 1:
+                        llama_vec_n, clip_l_pooler_n = torch.zeros_like(llama_vec), torch.zeros_like(clip_l_pooler)
+                    else:
+                        print(translate("ネガティブプロンプトをエンコードしています..."))
+                        llama_vec_n, clip_l_pooler_n = encode_prompt_conds(n_prompt, text_encoder, text_encoder_2, tok1, tok2)
 
                 # ローVRAMモードでは使用後すぐにCPUに戻す
                 if not high_vram:
@@ -3373,13 +3604,12 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                 transformer.initialize_teacache(enable_teacache=False)
             
             def callback(d):
-                # プレビュー生成
-                preview = d['denoised']
-                preview = vae_decode_fake(preview)
-                preview = (preview * 255.0).detach().cpu().numpy().clip(0, 255).astype(np.uint8)
-                preview = einops.rearrange(preview, 'b c t h w -> (b h) (t w) c')
-
                 current_step = d['i'] + 1
+                # ステップの区間を次のステップへ切り替える
+                if current_step < steps:
+                    telemetry.lap("sampling step", step=current_step + 1)
+                else:
+                    telemetry.end_lap("sampling step")
                 percentage = int(100.0 * current_step / steps)
                 hint = f'[THEME=blue]Sampling {current_step}/{steps}'
                 desc = translate('1フレームモード: サンプリング中...')
@@ -3389,7 +3619,7 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     ctx.stream.input_queue.push(STREAM_END_SENTINEL)
                     with ctx._stop_lock:
                         ctx._sent_end = True
-                    push_progress(preview, desc, percentage, hint)
+                    preview_service.submit(d['denoised'], desc, percentage, hint)
                     raise _UserStop()
 
                 # 2) グローバル停止（End ボタンなど）→ 例外で中断
@@ -3402,8 +3632,8 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                         user_abort_notified = True
                     raise _UserStop()
 
-                # 継続
-                push_progress(preview, desc, percentage, hint)
+                # 継続（プレビューの描画・送信は待たない）
+                preview_service.submit(d['denoised'], desc, percentage, hint)
             
             # 異常な次元数を持つテンソルを処理
             try:
@@ -3441,6 +3671,9 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     # index 1: 参照画像（特徴転送用）
                     
                     # すでにclean_latents_preが入力画像なので、index 0は変更不要
+                    # 参照画像バッチではサンプルごとに参照画像が異なるため、clean_latentsを実体のあるバッチに複製する
+                    if reference_latent.shape[0] > clean_latents.shape[0]:
+                        clean_latents = clean_latents.repeat(reference_latent.shape[0], 1, 1, 1, 1)
                     # index 1に参照画像を設定
                     clean_latents[:, :, 1] = reference_latent[:, :, 0]
                     
@@ -3679,7 +3912,24 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     0,
                     f"[THEME=blue]Sampling 0/{steps}"
                 )
-                
+
+                # シードバッチ: 条件付けはバッチ内で共通なので expand（コピーなし）でバッチ次元を合わせる
+                # プロンプト埋め込みは sample_hunyuan 内で batch_size に揃えられる
+                if seed_batch_size > 1:
+                    print(translate("シードバッチ: {0}枚を1回のサンプリングで生成します（シード {1}）").format(seed_batch_size, seed))
+                    image_encoder_last_hidden_state = expand_to_batch(image_encoder_last_hidden_state, seed_batch_size)
+                    latent_indices = expand_to_batch(latent_indices, seed_batch_size)
+                    clean_latents = expand_to_batch(clean_latents, seed_batch_size)
+                    clean_latent_indices = expand_to_batch(clean_latent_indices, seed_batch_size)
+                    clean_latents_2x = expand_to_batch(clean_latents_2x, seed_batch_size)
+                    clean_latent_2x_indices = expand_to_batch(clean_latent_2x_indices, seed_batch_size)
+                    clean_latents_4x = expand_to_batch(clean_latents_4x, seed_batch_size)
+                    clean_latent_4x_indices = expand_to_batch(clean_latent_4x_indices, seed_batch_size)
+
+                # サンプリング中プレビュー（描画は別スレッド、送信は最新のみを間引いて行う）
+                preview_service = PreviewService(make_latent_preview_renderer(vae_decode_fake), push_progress)
+                telemetry_sampling = telemetry.begin("sampling", steps=steps)
+                telemetry.lap("sampling step", step=1)
                 try:
                     generated_latents = sample_hunyuan(
                         transformer=transformer,
@@ -3691,6 +3941,7 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                         distilled_guidance_scale=gs,
                         guidance_rescale=rs,
                         num_inference_steps=steps,
+                        batch_size=seed_batch_size,
                         generator=rnd,
                         prompt_embeds=llama_vec,
                         prompt_embeds_mask=llama_attention_mask,
@@ -3714,6 +3965,11 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     if ctx.stream.input_queue.top() != STREAM_END_SENTINEL:
                         ctx.stream.input_queue.push(STREAM_END_SENTINEL)
                     return {'user_interrupt': True}
+                finally:
+                    telemetry.end_lap("sampling step")
+                    telemetry.end(telemetry_sampling)
+                    # 後続の進捗表示より古いプレビューが届かないよう送り切ってから停止する
+                    preview_service.close()
 
                 # コールバックからの戻り値をチェック（コールバック関数が特殊な値を返した場合）
                 if isinstance(generated_latents, dict) and generated_latents.get('user_interrupt'):
@@ -3761,6 +4017,9 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                     raise e
             
             total_generated_latent_frames += int(generated_latents.shape[2])
+            if generated_latents.shape[0] != history_latents.shape[0]:
+                # シードバッチ: 履歴（空のゼロ latent）もバッチ数に合わせる
+                history_latents = history_latents.expand(generated_latents.shape[0], *history_latents.shape[1:])
             history_latents = torch.cat([generated_latents.to(history_latents), history_latents], dim=2)
             del generated_latents  # OOM-1修正: cat後に即解放
 
@@ -3890,7 +4149,8 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                 with torch.no_grad():  # 明示的にno_gradコンテキストを使用
                     # ラテントをCPUではなくGPUに置いて効率的に処理
                     real_history_latents_gpu = real_history_latents.to(gpu)
-                    decoded_image = vae_decode(real_history_latents_gpu, vae).cpu()
+                    with telemetry.span("VAE decode"):
+                        decoded_image = vae_decode(real_history_latents_gpu, vae).cpu()
                     
                     # 不要なGPU上のラテントをすぐに解放
                     del real_history_latents_gpu
@@ -3904,45 +4164,52 @@ def _worker_impl(ctx: JobContext, input_image, prompt, n_prompt, seed, steps, cf
                 # デコード後のメモリを確認
                 free_mem_after_decode = get_cuda_free_memory_gb(gpu)
                 
-                # 単一フレームを抽出
-                frame = decoded_image[0, :, 0, :, :]
-                frame = torch.clamp(frame, -1., 1.) * 127.5 + 127.5
-                frame = frame.detach().cpu().to(torch.uint8)
-                frame = einops.rearrange(frame, 'c h w -> h w c').numpy()
+                # 単一フレームを抽出（シードバッチ時はバッチ内の出力ごと）
+                frames = []
+                for batch_i in range(decoded_image.shape[0]):
+                    frame = decoded_image[batch_i, :, 0, :, :]
+                    frame = torch.clamp(frame, -1., 1.) * 127.5 + 127.5
+                    frame = frame.detach().cpu().to(torch.uint8)
+                    frames.append(einops.rearrange(frame, 'c h w -> h w c').numpy())
                 
                 # デコード結果を解放
                 del decoded_image
                 del real_history_latents
                 torch.cuda.empty_cache()
-                
-                # メタデータを設定
-                metadata = {
-                    PROMPT_KEY: prompt,
-                    SEED_KEY: seed  # intとして保存
-                }
 
                 # 緑の進捗バー 5
                 push_progress(None, translate("Saving image file..."), 80, "[THEME=green]Saving image file...")
 
-                
-                # 画像として保存（メタデータ埋め込み）
                 from PIL import Image
-                output_filename = os.path.join(outputs_folder, f'{job_id}_oneframe.png')
-                pil_img = Image.fromarray(frame)
-                pil_img.save(output_filename)  # 一度保存
-                
-                # メタデータを埋め込み
-                try:
-                    # 関数は2つの引数しか取らないので修正
-                    embed_metadata_to_png(output_filename, metadata)
-                    print(translate("画像メタデータを埋め込みました"))
-                except Exception as e:
-                    print(translate("メタデータ埋め込みエラー: {0}").format(e))
-                
-                print(translate("1フレーム画像を保存しました: {0}").format(output_filename))
+                for batch_i, frame in enumerate(frames):
+                    # メタデータを設定
+                    metadata = {
+                        PROMPT_KEY: prompt,
+                        SEED_KEY: seed  # intとして保存
+                    }
+                    if len(frames) > 1:
+                        # シードバッチの出力は「先頭シード + バッチ内番号」で再現する
+                        metadata[SEED_BATCH_INDEX_KEY] = batch_i
+                        output_filename = os.path.join(outputs_folder, f'{job_id}_oneframe_{batch_i}.png')
+                    else:
+                        output_filename = os.path.join(outputs_folder, f'{job_id}_oneframe.png')
+
+                    # 画像として保存（メタデータ埋め込み）
+                    pil_img = Image.fromarray(frame)
+                    pil_img.save(output_filename)  # 一度保存
+                    
+                    # メタデータを埋め込み
+                    try:
+                        # 関数は2つの引数しか取らないので修正
+                        embed_metadata_to_png(output_filename, metadata)
+                        print(translate("画像メタデータを埋め込みました"))
+                    except Exception as e:
+                        print(translate("メタデータ埋め込みエラー: {0}").format(e))
+                    
+                    print(translate("1フレーム画像を保存しました: {0}").format(output_filename))
 
-                # MP4保存はスキップして、画像ファイルパスを返す
-                bus.publish(('file', output_filename))
+                    # MP4保存はスキップして、画像ファイルパスを返す
+                    bus.publish(('file', output_filename))
                 _cleanup_models()
                 
             except Exception as e:
@@ -3994,6 +4261,10 @@ def worker(ctx: JobContext, *args, **kwargs):
     finally:
         # bus.close と generation_active リセットは何があっても実行する
         # 各ステップを個別try/exceptで保護し、途中で死んでも次のステップを実行
+        try:
+            telemetry.finish_job()
+        except BaseException:
+            pass
         try:
             ctx.bus.publish(('end', None))
         except BaseException:
@@ -4098,6 +4369,73 @@ def check_metadata_on_checkbox_change(should_copy, image_path):
     return update_from_image_metadata(image_path, should_copy)
 
 
+def _resolve_queue_item(batch_index, batch_count, queue_repeat_count, prompt, input_image, verbose=True):
+    """バッチ番号に対応する入力画像とプロンプトをキュー設定から求める
+
+    verbose=False ではログを出さない（シードバッチの計画用に事前に全バッチ分を求める場合）。
+    """
+    log = print if verbose else (lambda *args, **kwargs: None)
+    current_prompt = prompt
+    current_image = input_image
+
+    # キュー機能の処理
+    if queue_enabled:
+        if queue_type == "prompt" and prompt_queue_file_path is not None:
+            # プロンプトキューの処理
+            if os.path.exists(prompt_queue_file_path):
+                try:
+                    with open(prompt_queue_file_path, 'r', encoding='utf-8') as f:
+                        lines = [line.strip() for line in f.readlines() if line.strip()]
+                        if batch_index < len(lines):
+                            # プロンプトキューからプロンプトを取得
+                            current_prompt = lines[batch_index]
+                            log(translate("プロンプトキュー実行中: バッチ {0}/{1}").format(batch_index+1, batch_count))
+                            log(translate("  └ プロンプト: 「{0}...」").format(current_prompt[:50]))
+                        else:
+                            log(translate("プロンプトキュー実行中: バッチ {0}/{1} はプロンプト行数を超えているため元のプロンプトを使用").format(batch_index+1, batch_count))
+                except Exception as e:
+                    log(translate("プロンプトキューファイル読み込みエラー: {0}").format(str(e)))
+
+        elif queue_type == "image" and len(image_queue_files) > 0:
+            # イメージキューの処理
+            if batch_index < queue_repeat_count:
+                # 指定回数までは入力画像を使用
+                log(translate("イメージキュー実行中: バッチ {0}/{1} は入力画像を使用").format(batch_index+1, batch_count))
+            else:
+                # それ以降は各画像をqueue_repeat_count回ずつ処理
+                image_index = (batch_index - queue_repeat_count) // queue_repeat_count
+
+                if image_index < len(image_queue_files):
+                    current_image = image_queue_files[image_index]
+                    if isinstance(current_image, str) and current_image:
+                        image_filename = os.path.basename(current_image)
+                    else:
+                        image_filename = translate("入力画像")
+                    log(translate("イメージキュー実行中: バッチ {0}/{1} の画像「{2}」").format(batch_index+1, batch_count, image_filename))
+                    log(translate("  └ 画像ファイルパス: {0}").format(current_image))
+                        
+                    # 同名のテキストファイルがあるか確認し、あれば内容をプロンプトとして使用
+                    img_basename = os.path.splitext(current_image)[0]
+                    txt_path = f"{img_basename}.txt"
+                    if os.path.exists(txt_path):
+                        try:
+                            with open(txt_path, 'r', encoding='utf-8') as f:
+                                custom_prompt = f.read().strip()
+                            if custom_prompt:
+                                log(translate("イメージキュー: 画像「{0}」用のテキストファイルを読み込みました").format(image_filename))
+                                log(translate("カスタムプロンプト: {0}").format(custom_prompt[:50] + "..." if len(custom_prompt) > 50 else custom_prompt))
+                                # カスタムプロンプトを設定（current_promptを上書き）
+                                current_prompt = custom_prompt
+                        except Exception as e:
+                            log(translate("イメージキュー: テキストファイル読み込みエラー: {0}").format(e))
+                else:
+                    # 画像数が足りない場合は入力画像に戻る
+                    log(translate("イメージキュー実行中: バッチ {0}/{1} は画像数を超えているため入力画像を使用").format(batch_index+1, batch_count))
+
+    return current_image, current_prompt
+
+
+@_restoring_preflight_settings
 def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_preservation, use_teacache, use_prompt_cache,
             lora_files, lora_files2, lora_scales_text, use_lora, fp8_optimization, lora_cache, resolution, output_directory=None,
             save_input_images=False, save_before_input_images=False, batch_count=1, use_random_seed=False, latent_window_size=9, latent_index=0,
@@ -4122,6 +4460,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
     global generation_active
     global last_progress_desc, last_progress_bar, last_preview_image
     global cur_job, current_seed
+    global image_queue_prefetcher
 
     # --- 既存ジョブが走っているなら追随（再同期）して終了 ---
     with ctx_lock:
@@ -4184,7 +4523,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
     last_progress_bar = ""
     current_seed = None
     last_output_filename = None  # DATA-3修正: 前回生成の結果が新規生成のUIに漏れないようリセット
-    last_preview_image = None    # DATA-3修正: 同上
+    _set_last_preview(None)      # DATA-3修正: 同上
 
     # バッチ処理開始メッセージを表示
     print("*" * 50)
@@ -4547,10 +4886,80 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
     progress_img_idx = 0
     prev_reference_idx = -1
 
+    # シードバッチ: 入力画像とプロンプトが同じ組（参照画像・シードだけが異なる組）を
+    # 1回のサンプリングにまとめる（EICHI_SEED_BATCH で有効化、RoPEバッチでは使わない）
+    # 入力画像×参照画像の組み合わせでは、入力画像1枚につき参照画像をまとめて処理する
+    seed_batch_plan = None
+    if total_batches > 1 and not use_rope_batch:
+        # 低VRAMモードでは transformer が gpu_memory_preservation を残して載るため、その分を使える量とする
+        seed_batch_free = get_cuda_free_memory_gb(gpu) if high_vram else float(gpu_memory_preservation)
+        seed_batch_k = choose_seed_batch_size(int(resolution) * int(resolution), int(seed_batch_free * 1024 ** 3))
+        if seed_batch_k > 1:
+            input_image_key = image_source_key(input_image, resolution)
+            sample_keys = []
+            for i in range(total_batches):
+                item_image, item_prompt = _resolve_queue_item(
+                    i % batch_count, batch_count, queue_repeat_count, prompt, input_image, verbose=False)
+                item_key = input_image_key if item_image is input_image else image_source_key(item_image, resolution)
+                # 内容から安定したキーを作れない入力はまとめない
+                sample_keys.append((item_key, item_prompt) if item_key is not None else None)
+            seed_batch_plan = {group[0]: group for group in plan_sample_batches(sample_keys, seed_batch_k)}
+            print(translate("シードバッチ: 最大{0}枚ずつまとめてサンプリングします").format(seed_batch_k))
+
+    # ジョブを始める前に VRAM/RAM を見積もり、足りなければ設定を変えるか開始しない
+    memory_preflight = _preflight_job(JobProfile(
+        width=int(resolution), height=int(resolution),
+        latent_window_size=int(latent_window_size), total_frames=1,
+        lora_ranks=tuple(lora_rank(p) or 0 for p in _preflight_lora_paths(
+            use_lora, lora_mode, lora_files, lora_files2, lora_files3,
+            (lora_dropdown1, lora_dropdown2, lora_dropdown3))),
+        fp8=_to_bool(fp8_optimization), high_vram=bool(high_vram),
+        vae_tiling=not high_vram,
+        lora_cache=lora_state_cache.is_cache_enabled(),
+        queue_type=queue_type if queue_enabled else "none",
+        batch_size=max((len(g) for g in seed_batch_plan.values()), default=1) if seed_batch_plan else 1,
+        preserved_gb=float(gpu_memory_preservation) if gpu_memory_preservation is not None else 6.0,
+    ))
+    if memory_preflight is not None and memory_preflight.action == "reject":
+        message = translate("メモリが足りない見込みのため生成を開始しません: {0}").format(memory_preflight.reason)
+        print(message)
+        yield _gui_frame_status_all(
+            last_output_filename if last_output_filename is not None else gr.skip(),
+            _preview_update(last_preview_image),
+            message,
+            '',
+            gr.update(interactive=True, value=translate("Start Generation")),
+            gr.update(interactive=False, value=translate("End Generation")),
+            gr.update(interactive=False, value=translate("この生成で打ち切り")),
+            gr.update(interactive=False, value=translate("このステップで打ち切り")),
+            gr.update(),
+        )
+        with ctx_lock:
+            generation_active = False
+        return
+    if memory_preflight is not None and "lora_cache" in memory_preflight.changes:
+        lora_cache = False
+
+    # イメージキューの画像を先読みする（前のジョブの先読みは止める）
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
+    if queue_enabled and queue_type == "image" and len(image_queue_files) > 0:
+        image_queue_prefetcher = ImagePrefetcher(image_queue_files, resolution)
+
     for batch_index_total in range(total_batches):
         batch_index = batch_index_total % batch_count
         reference_idx = batch_index_total // batch_count
         reference_image_current = reference_images_list[reference_idx]
+        if seed_batch_plan is not None and batch_index_total not in seed_batch_plan:
+            # 先行するシードバッチで生成済み
+            continue
+        batch_members = seed_batch_plan[batch_index_total] if seed_batch_plan is not None else [batch_index_total]
+        current_seed_batch = len(batch_members)
+        current_reference_batch = None
+        if use_reference_image and current_seed_batch > 1 and reference_image_current is not None:
+            # バッチ内の各サンプルの参照画像（同じ参照画像はworker側で1回だけエンコードされる）
+            current_reference_batch = [reference_images_list[j // batch_count] for j in batch_members]
         # 停止フラグが設定されている場合は全バッチ処理を中止
         if batch_stopped:
             print(translate("バッチ処理がユーザーによって中止されました"))
@@ -4585,69 +4994,15 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
             )
 
         # 今回処理用のプロンプトとイメージを取得（キュー機能対応）
-        current_prompt = prompt
-        current_image = input_image
-
-        # キュー機能の処理
-        if queue_enabled:
-            if queue_type == "prompt" and prompt_queue_file_path is not None:
-                # プロンプトキューの処理
-                if os.path.exists(prompt_queue_file_path):
-                    try:
-                        with open(prompt_queue_file_path, 'r', encoding='utf-8') as f:
-                            lines = [line.strip() for line in f.readlines() if line.strip()]
-                            if batch_index < len(lines):
-                                # プロンプトキューからプロンプトを取得
-                                current_prompt = lines[batch_index]
-                                print(translate("プロンプトキュー実行中: バッチ {0}/{1}").format(batch_index+1, batch_count))
-                                print(translate("  └ プロンプト: 「{0}...」").format(current_prompt[:50]))
-                            else:
-                                print(translate("プロンプトキュー実行中: バッチ {0}/{1} はプロンプト行数を超えているため元のプロンプトを使用").format(batch_index+1, batch_count))
-                    except Exception as e:
-                        print(translate("プロンプトキューファイル読み込みエラー: {0}").format(str(e)))
-
-            elif queue_type == "image" and len(image_queue_files) > 0:
-                # イメージキューの処理
-                if batch_index < queue_repeat_count:
-                    # 指定回数までは入力画像を使用
-                    print(translate("イメージキュー実行中: バッチ {0}/{1} は入力画像を使用").format(batch_index+1, batch_count))
-                else:
-                    # それ以降は各画像をqueue_repeat_count回ずつ処理
-                    image_index = (batch_index - queue_repeat_count) // queue_repeat_count
-
-                    if image_index < len(image_queue_files):
-                        current_image = image_queue_files[image_index]
-                        if isinstance(current_image, str) and current_image:
-                            image_filename = os.path.basename(current_image)
-                        else:
-                            image_filename = translate("入力画像")
-                        print(translate("イメージキュー実行中: バッチ {0}/{1} の画像「{2}」").format(batch_index+1, batch_count, image_filename))
-                        print(translate("  └ 画像ファイルパス: {0}").format(current_image))
-                        
-                        # 同名のテキストファイルがあるか確認し、あれば内容をプロンプトとして使用
-                        img_basename = os.path.splitext(current_image)[0]
-                        txt_path = f"{img_basename}.txt"
-                        if os.path.exists(txt_path):
-                            try:
-                                with open(txt_path, 'r', encoding='utf-8') as f:
-                                    custom_prompt = f.read().strip()
-                                if custom_prompt:
-                                    print(translate("イメージキュー: 画像「{0}」用のテキストファイルを読み込みました").format(image_filename))
-                                    print(translate("カスタムプロンプト: {0}").format(custom_prompt[:50] + "..." if len(custom_prompt) > 50 else custom_prompt))
-                                    # カスタムプロンプトを設定（current_promptを上書き）
-                                    current_prompt = custom_prompt
-                            except Exception as e:
-                                print(translate("イメージキュー: テキストファイル読み込みエラー: {0}").format(e))
-                    else:
-                        # 画像数が足りない場合は入力画像に戻る
-                        print(translate("イメージキュー実行中: バッチ {0}/{1} は画像数を超えているため入力画像を使用").format(batch_index+1, batch_count))
+        current_image, current_prompt = _resolve_queue_item(
+            batch_index, batch_count, queue_repeat_count, prompt, input_image)
 
         # 進捗用グローバル変数を更新
         if reference_idx != prev_reference_idx:
             progress_ref_idx += 1
             progress_img_idx = 0
             prev_reference_idx = reference_idx
-        progress_img_idx += 1
+        progress_img_idx += current_seed_batch
         progress_ref_name = os.path.basename(reference_image_current) if isinstance(reference_image_current, str) and reference_image_current else translate("入力画像")
         progress_img_name = os.path.basename(current_image) if isinstance(current_image, str) and current_image else translate("入力画像")
         last_progress_desc = (
@@ -4692,6 +5047,14 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
         if batch_stopped:
             break
 
+        job_profile = None
+        memory_monitor = None
+        if memory_preflight is not None:
+            job_profile = memory_preflight.profile._replace(
+                latent_window_size=int(current_latent_window_size), batch_size=current_seed_batch)
+            memory_monitor = JobMemoryMonitor().start()
+        job_completed = False
+
         try:
             ctx = _start_job_for_single_task(
                 current_image, current_prompt, n_prompt, current_seed, steps, cfg, gs, rs,
@@ -4703,6 +5066,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
                 # Kisekaeichi関連パラメータを追加
                 use_reference_image, reference_image_current,
                 target_index, history_index, reference_long_edge, input_mask, reference_mask,
+                seed_batch_size=current_seed_batch, reference_batch=current_reference_batch,
                 owner_sid=_owner_sid,  # F-2修正: パラメータ経由でオーナーSIDを渡す
             )
         except Exception:
@@ -4715,6 +5079,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
                 ctx = cur_job
         if ctx is None:
             print(translate("ジョブの初期化に失敗しました"))
+            _finish_job_memory(memory_preflight, memory_monitor, job_profile, False)
             yield _gui_frame_status_all(
                 last_output_filename if last_output_filename is not None else gr.skip(),
                 _preview_update(last_preview_image),
@@ -4746,6 +5111,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
 
             # UI ストリーム本体（呼び出しは1回に統一）
             yield from gen
+            job_completed = not user_abort
 
             # 途中停止フラグ（旧来仕様維持）
             if batch_stopped and last_stop_mode is None:
@@ -4821,7 +5187,7 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
             return
 
         finally:
-            pass
+            _finish_job_memory(memory_preflight, memory_monitor, job_profile, job_completed)
 
 
 
@@ -4835,6 +5201,11 @@ def process(input_image, prompt, n_prompt, seed, steps, cfg, gs, rs, gpu_memory_
             batch_stopped = True
             break
 
+    # イメージキューの先読みを止める
+    if image_queue_prefetcher is not None:
+        image_queue_prefetcher.close()
+        image_queue_prefetcher = None
+
     # すべてのバッチ処理が正常に完了した場合と中断された場合で表示メッセージを分ける
     if batch_stopped:
         if user_abort:
@@ -5128,7 +5499,7 @@ def start_or_follow(ui_session_id, *args):
         yield frame
 
 
-def on_resync_button_clicked(ui_session_id=None):
+async def on_resync_button_clicked(ui_session_id=None):
     """
     再同期（追随）ボタン押下時のハンドラ（queue=True 前提）。
 
@@ -5150,6 +5521,7 @@ def on_resync_button_clicked(ui_session_id=None):
         この関数呼出しの **追随開始～ロールオーバー追随全体** を覆う try/finally で
         add/discard することで「実処理中は常に"占有中"」を保証する。
     返却は常に GUI が期待する 9 要素（_gui_frame_status_all）。
+    追随は async ジェネレータ（_stream_job_to_ui_async）で行い、追随中のタブがスレッドを占有しない。
     """
     import time as _tmod
     import gradio as gr
@@ -5274,14 +5646,15 @@ def on_resync_button_clicked(ui_session_id=None):
                 print(translate(f"[RESYNC] 追随開始（履歴→ライブへアタッチ） sid={ui_session_id} running={running}"))
 
             # --- 現在 ctx の履歴→ライブ追随（画像 1 枚ぶん） ---
-            for _frame in _stream_job_to_ui(ctx, owner=False):
+            async for _frame in _stream_job_to_ui_async(ctx, owner=False):
                 yield _frame  # ※※追随ストリームのフレーム中継（9 要素）※※ (pack し直さない)
 
             # 4) ctx ロールオーバー追随（ジョブ切替の"谷間"に耐える）
             _linger_sec = float(globals().get("RESYNC_CTX_LINGER_SEC", 1.0))
             _linger_until = None
             _last_ctx = ctx
-            # BUG-6修正: ループ全体のデッドライン (generation_active=True スタック防止)
+            # BUG-6修正: 谷間で待つ時間のデッドライン (generation_active=True スタック防止)
+            # 追随はコルーチンなのでスレッドを占有しない。新しい ctx へ繋ぎ直すたびに延長する
             _rollover_deadline = _tmod.monotonic() + _ROLLOVER_DEADLINE_SEC
 
             while True:
@@ -5301,23 +5674,24 @@ def on_resync_button_clicked(ui_session_id=None):
                 if _cur_ctx is not None:
                     if _cur_ctx is _last_ctx:
                         # 同一 ctx → 少し待って再試行（busy loop 回避）
-                        _tmod.sleep(0.05)
+                        await asyncio.sleep(0.05)
                         continue
 
                     # 新しい ctx が現れた → 再アタッチして追随を再開
                     print(translate(f"[RESYNC] ロールオーバー追随: 新ctxへ接続 running={_cur_running}"))
                     try:
-                        for _frame in _stream_job_to_ui(_cur_ctx, owner=False):
+                        async for _frame in _stream_job_to_ui_async(_cur_ctx, owner=False):
                             yield _frame  # ※※追随ストリームのフレーム中継（9 要素）※※ (pack し直さない)
                     finally:
                         _last_ctx = _cur_ctx
                         _linger_until = None  # 次のギャップに備える
+                        _rollover_deadline = _tmod.monotonic() + _ROLLOVER_DEADLINE_SEC
                     continue
 
                 # ここに来た時点で ctx は None
                 if _cur_running:
                     # 生成は続いている（ちょうどジョブ切替の谷間）
-                    _tmod.sleep(0.05)
+                    await asyncio.sleep(0.05)
                     continue
 
                 # running=False / ctx=None → 「本当に終了」か「切替の一瞬」かを猶予で判断
@@ -5340,7 +5714,7 @@ def on_resync_button_clicked(ui_session_id=None):
                     _linger_until = _tmod.monotonic() + _linger_sec
 
                 if _tmod.monotonic() < _linger_until:
-                    _tmod.sleep(0.05)
+                    await asyncio.sleep(0.05)
                     continue
 
                 # 猶予を過ぎても ctx が現れず running も False → 本当に終わったと判断
@@ -5482,6 +5856,97 @@ print("\n------------------------------------------------------------")
 print(f"🆗 {translate('Startup_sequence_complete')}\n")
 # △ 起動シーケンスここまで △
 
+# ==============================================================================
+# ヘッドレスモード (--headless)
+# ==============================================================================
+# 画面の既定値 (保存済み設定が無いとき) と同じ値。reuse_optimized_dict は
+# ジョブ間で最適化済みの Transformer を保持するため既定で有効にする
+_HEADLESS_DEFAULTS = {
+    "n_prompt": "", "seed": 1, "steps": 25, "cfg": 1.0, "gs": 10.0, "rs": 0.0,
+    "gpu_memory_preservation": 6, "use_teacache": True, "use_prompt_cache": True,
+    "lora_files": None, "lora_files2": None, "lora_scales_text": "0.8,0.8,0.8",
+    "use_lora": False, "fp8_optimization": True, "lora_cache": False, "resolution": 640,
+    "alarm_on_completion": False, "reuse_optimized_dict": True,
+}
+# ファイルのパス (またはそのリスト) で受け取る LoRA の引数
+_HEADLESS_FILE_PARAMS = ("lora_files", "lora_files2", "lora_files3")
+
+
+def _headless_validate(params):
+    """API から受け取ったジョブの JSON を process() の引数として検証する
+
+    キーは process() の引数名。画像や LoRA はサーバーから読めるファイルのパスで渡す
+    (LoRA はパスのリストでもよい)。
+    """
+    import inspect
+    names = set(inspect.signature(process).parameters)
+    unknown = sorted(k for k in params if k not in names or k.startswith("_"))
+    if unknown:
+        raise ValueError("unknown parameters: " + ", ".join(unknown))
+    for key in ("input_image", "prompt"):
+        if not params.get(key):
+            raise ValueError(f"missing parameter: {key}")
+    for key in ("input_image", "reference_image", "input_mask", "reference_mask"):
+        value = params.get(key)
+        if value is not None and not (isinstance(value, str) and os.path.isfile(value)):
+            raise ValueError(f"{key}: file not found: {value}")
+    for key in _HEADLESS_FILE_PARAMS:
+        value = params.get(key)
+        for path in (value if isinstance(value, list) else [value] if value is not None else []):
+            if not (isinstance(path, str) and os.path.isfile(path)):
+                raise ValueError(f"{key}: file not found: {path}")
+    return params
+
+
+class _HeadlessFile:
+    """gr.File の代わり。process() は LoRA ファイルの .name をパスとして読む"""
+
+    def __init__(self, path):
+        self.name = path
+
+
+def _headless_files(value):
+    # JSON のパス (文字列またはそのリスト) を gr.File と同じ形に包む
+    if isinstance(value, list):
+        return [_HeadlessFile(p) for p in value]
+    return _HeadlessFile(value) if isinstance(value, str) else value
+
+
+def _headless_run_job(params):
+    """1 ジョブを最後まで実行する。UI 向けの出力は読み捨て、イベントはバス経由で転送される
+
+    process() は開始の拒否 (メモリ見積もり)・初期化の失敗・生成中のエラーを UI への表示で
+    知らせて戻るので、画像が 1 枚も出力されなければ最後に表示した文言を理由に失敗とする。
+    停止要求による途中終了はサーバー側で取り消しとして扱う。
+    """
+    kwargs = dict(_HEADLESS_DEFAULTS, **params)
+    for key in _HEADLESS_FILE_PARAMS:
+        kwargs[key] = _headless_files(kwargs.get(key))
+    job = _headless_jobs.current
+    last_message = None
+    for frame in process(**kwargs):
+        # 9 要素の状態フレーム (_gui_frame_status_all) の 3 番目が状態の文言
+        if isinstance(frame, tuple) and len(frame) == 9 and isinstance(frame[2], str) and frame[2]:
+            last_message = frame[2]
+    if job is not None and not job.outputs:
+        return "error", last_message or translate("画像が出力されませんでした")
+    return None
+
+
+if args.headless:
+    from eichi_utils.headless_server import HeadlessJobServer, serve as _serve_headless
+    _headless_jobs = HeadlessJobServer(
+        _headless_run_job,
+        cancel_job=end_process,
+        validate=_headless_validate,
+    )
+    _extra_publish_taps.append(_headless_jobs.publish)
+    _serve_headless(_headless_jobs, host=args.server, port=args.api_port, socket_path=args.api_socket,
+                    token=args.api_token)
+    # Gradio の画面は構築せずに終了する
+    sys.exit(0)
+
+
 #アプリ全体のワーカー
 # 生成（重い）1本 + 軽量操作（再同期/停止）1本 予備 1本 を同時に通す
 _qargs = {}